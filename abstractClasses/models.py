@@ -169,6 +169,9 @@ class DomainResource(Resource):
     container_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, null=True, blank=True)
     container_id = models.PositiveIntegerField(null=True, blank=True)
     container = GenericForeignKey('container_type', 'container_id')
+
+    # Pre-rendered FHIR document, maintained by core.materialize (JSONB on PostgreSQL)
+    fhir_json = models.JSONField(null=True, blank=True, editable=False)
     
     class Meta:
         abstract = True
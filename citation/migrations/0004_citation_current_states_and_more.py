@@ -0,0 +1,58 @@
+# Generated by Django 5.2.3 on 2026-10-17 05:46
+
+from django.db import migrations, models
+
+
+# (owner model, many-to-many field, former owner foreign key on CodeableConcept)
+CONCEPT_LINKS = [
+    ('citation', 'current_states', 'citation_current_state'),
+    ('citationclassification', 'classifiers', 'citation_classification_classifier'),
+]
+
+
+def copy_concept_links(apps, schema_editor):
+    """Turn the owner foreign keys of CodeableConcept rows into link table rows"""
+    CodeableConcept = apps.get_model('components', 'CodeableConcept')
+    for model_name, field_name, owner_field in CONCEPT_LINKS:
+        field = apps.get_model('citation', model_name)._meta.get_field(field_name)
+        through = field.remote_field.through
+        pairs = CodeableConcept.objects.filter(**{f'{owner_field}__isnull': False}).values_list(f'{owner_field}_id', 'pk')
+        rows = []
+        for owner_pk, concept_pk in pairs.iterator():
+            rows.append(through(**{field.m2m_column_name(): owner_pk, field.m2m_reverse_name(): concept_pk}))
+            if len(rows) >= 1000:
+                through.objects.bulk_create(rows)
+                rows = []
+        through.objects.bulk_create(rows)
+
+
+def copy_owner_keys(apps, schema_editor):
+    """Store the link table rows back in the owner foreign keys, one owner per concept"""
+    CodeableConcept = apps.get_model('components', 'CodeableConcept')
+    for model_name, field_name, owner_field in CONCEPT_LINKS:
+        field = apps.get_model('citation', model_name)._meta.get_field(field_name)
+        through = field.remote_field.through
+        for owner_pk, concept_pk in through.objects.values_list(field.m2m_column_name(), field.m2m_reverse_name()).iterator():
+            CodeableConcept.objects.filter(pk=concept_pk).update(**{f'{owner_field}_id': owner_pk})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citation', '0003_citation_fhir_json'),
+        ('components', '0021_identifier_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='citation',
+            name='current_states',
+            field=models.ManyToManyField(blank=True, related_name='citation_current_states', to='components.codeableconcept'),
+        ),
+        migrations.AddField(
+            model_name='citationclassification',
+            name='classifiers',
+            field=models.ManyToManyField(blank=True, related_name='citation_classification_classifiers', to='components.codeableconcept'),
+        ),
+        migrations.RunPython(copy_concept_links, copy_owner_keys),
+    ]
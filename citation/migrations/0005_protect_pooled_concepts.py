@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citation', '0004_citation_current_states_and_more'),
+        ('components', '0022_concept_pool'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='citationstatusdate',
+            name='activity',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='citation_status_activities', to='components.codeableconcept'),
+        ),
+        migrations.AlterField(
+            model_name='citedartifactstatusdate',
+            name='activity',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='cited_artifact_status_activities', to='components.codeableconcept'),
+        ),
+    ]
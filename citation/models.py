@@ -23,6 +23,8 @@ class CitationClassification(BackboneElement):
     citation = models.ForeignKey('Citation', on_delete=models.CASCADE, related_name='classifications', null=True, blank=True)
     # The kind of classifier (0..1 CodeableConcept)
     type = models.ForeignKey('components.CodeableConcept', null=True, blank=True, on_delete=models.SET_NULL, related_name='citation_classification_types')
+    # The specific classification value (0..* CodeableConcept)
+    classifiers = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='citation_classification_classifiers')
     
     class Meta:
         db_table = 'citation_classification'
@@ -33,7 +35,7 @@ class CitationStatusDate(BackboneElement):
     # Citation this status date belongs to
     citation = models.ForeignKey('Citation', on_delete=models.CASCADE, related_name='status_dates', null=True, blank=True)
     # Classification of the status (1..1 CodeableConcept)
-    activity = models.ForeignKey('components.CodeableConcept', on_delete=models.CASCADE, related_name='citation_status_activities')
+    activity = models.ForeignKey('components.CodeableConcept', on_delete=models.PROTECT, related_name='citation_status_activities')
     # Either occurred or expected (0..1 boolean)
     actual = models.BooleanField(null=True, blank=True)
     # When the status started and/or ended (1..1 Period)
@@ -61,7 +63,7 @@ class CitedArtifactStatusDate(BackboneElement):
     # Cited artifact this status date belongs to
     cited_artifact = models.ForeignKey('CitedArtifact', on_delete=models.CASCADE, related_name='status_dates', null=True, blank=True)
     # Classification of the status (1..1 CodeableConcept)
-    activity = models.ForeignKey('components.CodeableConcept', on_delete=models.CASCADE, related_name='cited_artifact_status_activities')
+    activity = models.ForeignKey('components.CodeableConcept', on_delete=models.PROTECT, related_name='cited_artifact_status_activities')
     # Either occurred or expected (0..1 boolean)
     actual = models.BooleanField(null=True, blank=True)
     # When the status started and/or ended (1..1 Period)
@@ -210,6 +212,8 @@ class Citation(MetadataResource):
     lastReviewDate = models.DateField(null=True, blank=True)
     # When the citation record is expected to be used (0..1 Period)
     effectivePeriod = models.ForeignKey('components.Period', null=True, blank=True, on_delete=models.SET_NULL, related_name='citations')
+    # The status of the citation record (0..* CodeableConcept)
+    current_states = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='citation_current_states')
     
     class Meta:
         db_table = 'citation'
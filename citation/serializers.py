@@ -1,6 +1,9 @@
+from django.db.models import Prefetch
 from fhir.resources import citation
 from components.serializers import (
-    convert_identifier, convert_codeable_concept, convert_period
+    convert_identifier, convert_codeable_concept, convert_period,
+    codeable_concept_prefetch, identifier_prefetch, reference_prefetch,
+    convert_reference, build_fhir_element
 )
 from . import models
 
@@ -67,8 +70,8 @@ def convert_cited_artifact_version(django_version):
         'value': django_version.value
     }
     
-    if django_version.baseCitation:
-        data['baseCitation'] = {'reference': f'Citation/{django_version.baseCitation.fhir_id}'}
+    if django_version.baseCitation_id:
+        data['baseCitation'] = convert_reference(django_version, 'baseCitation')
     
     return data
 
@@ -270,4 +273,56 @@ def convert_citation(django_citation):
     if hasattr(django_citation, 'cited_artifact') and django_citation.cited_artifact:
         data['citedArtifact'] = convert_cited_artifact(django_citation.cited_artifact)
     
-    return citation.Citation(**data)
\ No newline at end of file
+    return build_fhir_element(citation.Citation, data)
+
+
+def prefetch_citation_queryset(queryset):
+    """Load every relation convert_citation walks in a fixed number of queries"""
+    return queryset.select_related('effectivePeriod').prefetch_related(
+        identifier_prefetch('identifiers'),
+        codeable_concept_prefetch('current_states'),
+        Prefetch(
+            'status_dates',
+            queryset=models.CitationStatusDate.objects.select_related('period').prefetch_related(
+                codeable_concept_prefetch('activity')
+            )
+        ),
+        Prefetch(
+            'summaries',
+            queryset=models.CitationSummary.objects.prefetch_related(codeable_concept_prefetch('style'))
+        ),
+        Prefetch(
+            'classifications',
+            queryset=models.CitationClassification.objects.prefetch_related(
+                codeable_concept_prefetch('type'),
+                codeable_concept_prefetch('classifiers'),
+            )
+        ),
+        Prefetch(
+            'cited_artifact',
+            queryset=models.CitedArtifact.objects.select_related('version').prefetch_related(
+                reference_prefetch(models.CitedArtifact, 'version__baseCitation'),
+                identifier_prefetch('identifiers'),
+                identifier_prefetch('related_identifiers'),
+                Prefetch(
+                    'status_dates',
+                    queryset=models.CitedArtifactStatusDate.objects.select_related('period').prefetch_related(
+                        codeable_concept_prefetch('activity')
+                    )
+                ),
+                Prefetch(
+                    'titles',
+                    queryset=models.CitedArtifactTitle.objects.prefetch_related(
+                        codeable_concept_prefetch('language')
+                    )
+                ),
+                Prefetch(
+                    'abstracts',
+                    queryset=models.CitedArtifactAbstract.objects.prefetch_related(
+                        codeable_concept_prefetch('type'),
+                        codeable_concept_prefetch('language'),
+                    )
+                ),
+            )
+        ),
+    )
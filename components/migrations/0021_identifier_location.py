@@ -0,0 +1,20 @@
+# Generated by Django 5.2.3 on 2026-10-17 04:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('components', '0020_address_encounter_attachment_encounter_and_more'),
+        ('location', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='identifier',
+            name='location',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='identifiers', to='location.location'),
+        ),
+    ]
@@ -0,0 +1,117 @@
+# Generated by Django 5.2.3 on 2026-10-17 05:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('components', '0021_identifier_location'),
+        ('citation', '0004_citation_current_states_and_more'),
+        ('endpoint', '0009_endpoint_connection_types_endpoint_environment_types_and_more'),
+        ('healthcareservice', '0005_healthcareservice_categories_and_more'),
+        ('location', '0003_location_characteristics_location_forms_and_more'),
+        ('organization', '0007_organization_org_types'),
+        ('patient', '0003_patientcontact_relationships_and_more'),
+        ('practitioner', '0007_practitionerrole_characteristics_and_more'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='citation_classification_classifier',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='citation_current_state',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='endpoint_connection',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='endpoint_environment',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='endpoint_payload',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='healthcare_service_category',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='healthcare_service_characteristic',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='healthcare_service_communication',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='healthcare_service_program',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='healthcare_service_provision',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='healthcare_service_referral',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='healthcare_service_specialty',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='healthcare_service_type',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='location_characteristic',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='location_form',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='location_type',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='organization_type',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='patient_contact_relationship',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='practitioner_role_characteristic',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='practitioner_role_code',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='practitioner_role_communication',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='practitioner_role_specialty',
+        ),
+        migrations.RemoveField(
+            model_name='codeableconcept',
+            name='related_person_relationship',
+        ),
+        migrations.AddField(
+            model_name='codeableconcept',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64, null=True),
+        ),
+    ]
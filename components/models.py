@@ -56,6 +56,8 @@ class Identifier(Element):
     published_in = models.ForeignKey('citation.CitedArtifactPublicationFormPublishedIn', null=True, blank=True, on_delete=models.CASCADE, related_name='identifiers')
     # Encounter this identifier belongs to (optional)
     encounter = models.ForeignKey('encounter.Encounter', null=True, blank=True, on_delete=models.CASCADE, related_name='identifiers')
+    # Location this identifier belongs to (optional)
+    location = models.ForeignKey('location.Location', null=True, blank=True, on_delete=models.CASCADE, related_name='identifiers')
     
     class Meta:
         db_table = 'identifier'
@@ -65,57 +67,20 @@ class Identifier(Element):
         ]
 
 class CodeableConcept(Element):
-    """Concept - reference to a terminology or just text"""
+    """
+    Concept - reference to a terminology or just text
+
+    Concepts with a content_hash are pooled: every owner holding the same text
+    and codings links to one shared row (see core.concepts), through its own
+    foreign key or many-to-many link table. A pooled concept is never edited in
+    place; owners are pointed at another concept instead.
+    """
     # Code defined by a terminology system (0..* Coding)
     # Note: Coding has reverse FK to CodeableConcept as 'codings'
     # Plain text representation of the concept (0..1 string)
     text = models.CharField(max_length=256, null=True, blank=True)
-    # Organization this type belongs to (optional)
-    organization_type = models.ForeignKey('organization.Organization', null=True, blank=True, on_delete=models.CASCADE, related_name='org_types')
-    # Endpoint connection type (optional)
-    endpoint_connection = models.ForeignKey('endpoint.Endpoint', null=True, blank=True, on_delete=models.CASCADE, related_name='connection_types')
-    # Endpoint environment type (optional)
-    endpoint_environment = models.ForeignKey('endpoint.Endpoint', null=True, blank=True, on_delete=models.CASCADE, related_name='environment_types')
-    # Endpoint payload type (optional)
-    endpoint_payload = models.ForeignKey('endpoint.EndpointPayload', null=True, blank=True, on_delete=models.CASCADE, related_name='payload_types')
-    # Practitioner role code (optional)
-    practitioner_role_code = models.ForeignKey('practitioner.PractitionerRole', null=True, blank=True, on_delete=models.CASCADE, related_name='codes')
-    # Practitioner role specialty (optional)
-    practitioner_role_specialty = models.ForeignKey('practitioner.PractitionerRole', null=True, blank=True, on_delete=models.CASCADE, related_name='specialties')
-    # Practitioner role characteristic (optional)
-    practitioner_role_characteristic = models.ForeignKey('practitioner.PractitionerRole', null=True, blank=True, on_delete=models.CASCADE, related_name='characteristics')
-    # Practitioner role communication (optional)
-    practitioner_role_communication = models.ForeignKey('practitioner.PractitionerRole', null=True, blank=True, on_delete=models.CASCADE, related_name='communications')
-    # Healthcare service category (optional)
-    healthcare_service_category = models.ForeignKey('healthcareservice.HealthcareService', null=True, blank=True, on_delete=models.CASCADE, related_name='categories')
-    # Healthcare service type (optional)
-    healthcare_service_type = models.ForeignKey('healthcareservice.HealthcareService', null=True, blank=True, on_delete=models.CASCADE, related_name='types')
-    # Healthcare service specialty (optional)
-    healthcare_service_specialty = models.ForeignKey('healthcareservice.HealthcareService', null=True, blank=True, on_delete=models.CASCADE, related_name='specialties')
-    # Healthcare service provision code (optional)
-    healthcare_service_provision = models.ForeignKey('healthcareservice.HealthcareService', null=True, blank=True, on_delete=models.CASCADE, related_name='service_provision_codes')
-    # Healthcare service program (optional)
-    healthcare_service_program = models.ForeignKey('healthcareservice.HealthcareService', null=True, blank=True, on_delete=models.CASCADE, related_name='programs')
-    # Healthcare service characteristic (optional)
-    healthcare_service_characteristic = models.ForeignKey('healthcareservice.HealthcareService', null=True, blank=True, on_delete=models.CASCADE, related_name='characteristics')
-    # Healthcare service communication (optional)
-    healthcare_service_communication = models.ForeignKey('healthcareservice.HealthcareService', null=True, blank=True, on_delete=models.CASCADE, related_name='communications')
-    # Healthcare service referral method (optional)
-    healthcare_service_referral = models.ForeignKey('healthcareservice.HealthcareService', null=True, blank=True, on_delete=models.CASCADE, related_name='referral_methods')
-    # Location type (optional)
-    location_type = models.ForeignKey('location.Location', null=True, blank=True, on_delete=models.CASCADE, related_name='types')
-    # Location form (optional)
-    location_form = models.ForeignKey('location.Location', null=True, blank=True, on_delete=models.CASCADE, related_name='forms')
-    # Location characteristic (optional)
-    location_characteristic = models.ForeignKey('location.Location', null=True, blank=True, on_delete=models.CASCADE, related_name='characteristics')
-    # Patient contact relationship (optional)
-    patient_contact_relationship = models.ForeignKey('patient.PatientContact', null=True, blank=True, on_delete=models.CASCADE, related_name='relationships')
-    # RelatedPerson relationship (optional)
-    related_person_relationship = models.ForeignKey('patient.RelatedPerson', null=True, blank=True, on_delete=models.CASCADE, related_name='relationships')
-    # Citation current state (optional)
-    citation_current_state = models.ForeignKey('citation.Citation', null=True, blank=True, on_delete=models.CASCADE, related_name='current_states')
-    # Citation classification classifier (optional)
-    citation_classification_classifier = models.ForeignKey('citation.CitationClassification', null=True, blank=True, on_delete=models.CASCADE, related_name='classifiers')
+    # Hash of id, text and codings (core.concepts.concept_hash), None for concepts outside the pool
+    content_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True, editable=False)
     
     class Meta:
         db_table = 'codeable_concept'
@@ -395,6 +360,14 @@ class Coding(Element):
             models.Index(fields=['code']),
         ]
 
+    def clean(self):
+        # Codes of a code system loaded in core.terminology must exist in it
+        from core.terminology import get_terminology
+        try:
+            get_terminology().check_coding(self.system, self.code)
+        except ValueError as e:
+            raise ValidationError(str(e))
+
 
 
 # -------------------------------------------PERIOD----------------------------------------- #
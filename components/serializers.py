@@ -1,10 +1,87 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models import Prefetch
 from fhir.resources import (
     identifier, codeableconcept, contactpoint, humanname, 
-    address, attachment, period, coding, quantity
+    address, attachment, period, coding, quantity, reference, duration
 )
 from . import models
 
 
+# When set, converters return plain FHIR-shaped dicts instead of fhir.resources models
+_trusted_output = ContextVar('fhir_trusted_output', default=False)
+
+
+@contextmanager
+def trusted_output():
+    """
+    Build plain FHIR dicts instead of fhir.resources models inside this block
+    
+    Skips the pydantic validation that otherwise runs at every nesting level.
+    Only use it for data that was already validated on the way in.
+    """
+    token = _trusted_output.set(True)
+    try:
+        yield
+    finally:
+        _trusted_output.reset(token)
+
+
+def build_fhir_element(fhir_class, data):
+    """Instantiate a fhir.resources element, or return data as-is in trusted mode"""
+    if _trusted_output.get():
+        return data
+    return fhir_class(**data)
+
+
+def convert_reference(instance, field_name):
+    """
+    Render the resource a foreign key points to as a FHIR Reference
+
+    Uses the target when it was prefetched (see reference_prefetch), otherwise
+    queries only the target's fhir_id instead of loading the whole row.
+    """
+    field = instance._meta.get_field(field_name)
+    target_pk = getattr(instance, field.attname)
+    if target_pk is None:
+        return None
+    target_model = field.related_model
+    if field.is_cached(instance):
+        fhir_id = field.get_cached_value(instance).fhir_id
+    else:
+        fhir_id = target_model._default_manager.filter(pk=target_pk).values_list('fhir_id', flat=True).first()
+    return {'reference': f'{target_model.__name__}/{fhir_id}'}
+
+
+def convert_references(manager):
+    """Render the resources of a to-many relation as FHIR References, loading only their fhir_id"""
+    resources = manager.all()
+    if resources._result_cache is None:
+        fhir_ids = resources.values_list('fhir_id', flat=True)
+    else:
+        fhir_ids = [resource.fhir_id for resource in resources]
+    return [{'reference': f'{manager.model.__name__}/{fhir_id}'} for fhir_id in fhir_ids]
+
+
+def convert_reference_element(django_reference):
+    """Convert a Django components.Reference row to FHIR Reference"""
+    if not django_reference:
+        return None
+    
+    data = {}
+    if django_reference.reference:
+        data['reference'] = django_reference.reference
+    if django_reference.type:
+        data['type'] = django_reference.type
+    if django_reference.identifier_id:
+        data['identifier'] = convert_identifier(django_reference.identifier)
+    if django_reference.display:
+        data['display'] = django_reference.display
+    
+    return build_fhir_element(reference.Reference, data)
+
+
 def convert_identifier(django_identifier):
     """Convert Django Identifier to FHIR Identifier"""
     if not django_identifier:
@@ -21,10 +98,10 @@ def convert_identifier(django_identifier):
         data['type'] = convert_codeable_concept(django_identifier.type)
     if django_identifier.period:
         data['period'] = convert_period(django_identifier.period)
-    if django_identifier.assigner:
-        data['assigner'] = {'reference': f'Organization/{django_identifier.assigner.fhir_id}'}
+    if django_identifier.assigner_id:
+        data['assigner'] = convert_reference(django_identifier, 'assigner')
     
-    return identifier.Identifier(**data)
+    return build_fhir_element(identifier.Identifier, data)
 
 
 def convert_codeable_concept(django_cc):
@@ -52,12 +129,12 @@ def convert_codeable_concept(django_cc):
             coding_data['userSelected'] = coding_obj.userSelected
         
         if coding_data:
-            codings.append(coding.Coding(**coding_data))
+            codings.append(build_fhir_element(coding.Coding, coding_data))
     
     if codings:
         data['coding'] = codings
     
-    return codeableconcept.CodeableConcept(**data)
+    return build_fhir_element(codeableconcept.CodeableConcept, data)
 
 
 def convert_contact_point(django_cp):
@@ -77,7 +154,7 @@ def convert_contact_point(django_cp):
     if django_cp.period:
         data['period'] = convert_period(django_cp.period)
     
-    return contactpoint.ContactPoint(**data)
+    return build_fhir_element(contactpoint.ContactPoint, data)
 
 
 def convert_human_name(django_name):
@@ -101,7 +178,7 @@ def convert_human_name(django_name):
     if django_name.period:
         data['period'] = convert_period(django_name.period)
     
-    return humanname.HumanName(**data)
+    return build_fhir_element(humanname.HumanName, data)
 
 
 def convert_address(django_address):
@@ -131,7 +208,7 @@ def convert_address(django_address):
     if django_address.period:
         data['period'] = convert_period(django_address.period)
     
-    return address.Address(**data)
+    return build_fhir_element(address.Address, data)
 
 
 def convert_attachment(django_attachment):
@@ -167,7 +244,7 @@ def convert_attachment(django_attachment):
     if django_attachment.pages:
         data['pages'] = django_attachment.pages
     
-    return attachment.Attachment(**data)
+    return build_fhir_element(attachment.Attachment, data)
 
 
 def convert_period(django_period):
@@ -181,7 +258,7 @@ def convert_period(django_period):
     if django_period.end:
         data['end'] = django_period.end.isoformat()
     
-    return period.Period(**data)
+    return build_fhir_element(period.Period, data)
 
 
 def convert_quantity(django_quantity):
@@ -201,4 +278,84 @@ def convert_quantity(django_quantity):
     if django_quantity.code:
         data['code'] = django_quantity.code
     
-    return quantity.Quantity(**data)
\ No newline at end of file
+    return build_fhir_element(quantity.Quantity, data)
+
+
+def convert_duration(django_duration):
+    """Convert Django Duration to FHIR Duration"""
+    if not django_duration:
+        return None
+    
+    data = {}
+    if django_duration.value is not None:
+        data['value'] = float(django_duration.value)
+    if django_duration.comparator:
+        data['comparator'] = django_duration.comparator
+    if django_duration.unit:
+        data['unit'] = django_duration.unit
+    if django_duration.system:
+        data['system'] = django_duration.system
+    if django_duration.code:
+        data['code'] = django_duration.code
+    
+    return build_fhir_element(duration.Duration, data)
+
+
+def codeable_concept_prefetch(lookup):
+    """Prefetch a CodeableConcept relation together with its codings"""
+    return Prefetch(
+        lookup,
+        queryset=models.CodeableConcept.objects.prefetch_related('codings')
+    )
+
+
+def reference_prefetch(model, lookup):
+    """
+    Prefetch resources that are only rendered as references, loading just their fhir_id
+
+    Args:
+        model: Model the lookup starts from
+        lookup: Relation path to the referenced resources, e.g. 'managingOrganization'
+    """
+    for name in lookup.split('__'):
+        field = model._meta.get_field(name)
+        model = field.related_model
+    fields = ['fhir_id']
+    if field.one_to_many:
+        # Reverse foreign keys are matched to their parents through this column
+        fields.append(field.field.name)
+    return Prefetch(lookup, queryset=model._default_manager.only(*fields))
+
+
+def identifier_prefetch(lookup):
+    """Prefetch an Identifier relation with everything convert_identifier reads"""
+    return Prefetch(
+        lookup,
+        queryset=models.Identifier.objects.select_related('period').prefetch_related(
+            codeable_concept_prefetch('type'),
+            reference_prefetch(models.Identifier, 'assigner'),
+        )
+    )
+
+
+def contact_point_prefetch(lookup):
+    """Prefetch a ContactPoint relation with everything convert_contact_point reads"""
+    return Prefetch(lookup, queryset=models.ContactPoint.objects.select_related('period'))
+
+
+def human_name_prefetch(lookup):
+    """Prefetch a HumanName relation with everything convert_human_name reads"""
+    return Prefetch(lookup, queryset=models.HumanName.objects.select_related('period'))
+
+
+def address_prefetch(lookup):
+    """Prefetch an Address relation with everything convert_address reads"""
+    return Prefetch(lookup, queryset=models.Address.objects.select_related('period'))
+
+
+def reference_element_prefetch(lookup):
+    """Prefetch a components.Reference relation with everything convert_reference_element reads"""
+    return Prefetch(
+        lookup,
+        queryset=models.Reference.objects.prefetch_related(identifier_prefetch('identifier'))
+    )
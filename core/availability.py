@@ -0,0 +1,300 @@
+"""
+Weekly availability index for HealthcareService and PractitionerRole
+The availableTime entries of a resource's Availability rows are flattened into
+AvailabilityWindow rows, one per day and merged opening interval in minutes
+since midnight, and the notAvailableTime periods into AvailabilityException
+rows. "Open on Tuesday at 14:00" is then one range lookup on the
+(resource_type, day, start_minute) index, and "open at this instant" adds a
+NOT EXISTS probe on the exceptions, instead of parsing daysOfWeek per row.
+core.signals schedules the rebuild of a resource's rows when its Availability,
+AvailableTime, NotAvailableTime or exception Period rows change; the work is
+deferred to the end of the transaction like core.search_index.
+"""
+
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch, Q
+from django.utils import timezone
+
+from components.models import Availability, AvailableTime, NotAvailableTime, Period
+from core.models import AvailabilityException, AvailabilityWindow
+from healthcareservice.models import HealthcareService
+from practitioner.models import PractitionerRole
+
+
+# Availability foreign key of each owner model
+AVAILABILITY_MODELS = {
+    HealthcareService: 'healthcare_service',
+    PractitionerRole: 'practitioner_role',
+}
+
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+MINUTES_PER_DAY = 24 * 60
+
+# Resources synchronized per transaction
+AVAILABILITY_CHUNK_SIZE = 500
+
+
+def is_availability_model(model):
+    return model in AVAILABILITY_MODELS
+
+
+def parse_day(value):
+    """
+    Day number of a FHIR days-of-week code, 0 for mon
+
+    Raises:
+        ValueError: If the code is unknown
+    """
+    if value not in DAYS:
+        raise ValueError(f"Unknown day of week: {value}")
+    return DAYS.index(value)
+
+
+def _minute(value, round_up=False):
+    minute = value.hour * 60 + value.minute
+    if round_up and (value.second or value.microsecond):
+        minute += 1
+    return minute
+
+
+def weekly_windows(available_times):
+    """
+    Merged opening intervals of AvailableTime rows
+
+    An entry without daysOfWeek applies every day, allDay or missing times
+    cover the whole day, and a closing time at or before the opening time
+    runs past midnight into the next day (Sunday into Monday).
+
+    Returns:
+        Sorted list of (day, start minute, end minute) with exclusive ends
+    """
+    by_day = defaultdict(list)
+    for available_time in available_times:
+        days = [DAYS.index(day) for day in available_time.daysOfWeek or DAYS if day in DAYS]
+        start, end = 0, MINUTES_PER_DAY
+        if not available_time.allDay:
+            if available_time.availableStartTime is not None:
+                start = _minute(available_time.availableStartTime)
+            if available_time.availableEndTime is not None:
+                end = _minute(available_time.availableEndTime, round_up=True)
+        for day in days:
+            if end > start:
+                by_day[day].append((start, end))
+            else:
+                by_day[day].append((start, MINUTES_PER_DAY))
+                if end:
+                    by_day[(day + 1) % len(DAYS)].append((0, end))
+
+    windows = []
+    for day in sorted(by_day):
+        merged = []
+        for start, end in sorted(by_day[day]):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        windows += [(day, start, end) for start, end in merged]
+    return windows
+
+
+def _owners_rows(model, pks):
+    """(window rows, exception rows) of the owners among pks that still exist"""
+    owner_field = AVAILABILITY_MODELS[model]
+    availabilities = Availability.objects.filter(**{f'{owner_field}_id__in': pks}).prefetch_related(
+        'available_times',
+        Prefetch('not_available_times', queryset=NotAvailableTime.objects.select_related('during')),
+    )
+    available_times, periods = defaultdict(list), defaultdict(list)
+    for availability in availabilities:
+        owner_pk = getattr(availability, f'{owner_field}_id')
+        available_times[owner_pk] += availability.available_times.all()
+        periods[owner_pk] += [
+            not_available.during for not_available in availability.not_available_times.all()
+            if not_available.during is not None
+            and (not_available.during.start is not None or not_available.during.end is not None)
+        ]
+
+    windows, exceptions = [], []
+    for pk in model._default_manager.filter(pk__in=pks).values_list('pk', flat=True):
+        windows += [
+            AvailabilityWindow(
+                resource_type=model.__name__, resource_id=pk, day=day, start_minute=start, end_minute=end,
+            )
+            for day, start, end in weekly_windows(available_times[pk])
+        ]
+        exceptions += [
+            AvailabilityException(resource_type=model.__name__, resource_id=pk, start=period.start, end=period.end)
+            for period in periods[pk]
+        ]
+    return windows, exceptions
+
+
+def sync(resources, batch_size=None):
+    """
+    Rebuild the availability rows of resources, dropping those of deleted resources
+
+    Args:
+        resources: Iterable of (model, primary key) tuples, other models are ignored
+        batch_size: Rows per INSERT statement
+
+    Returns:
+        Number of window rows stored
+    """
+    pks_by_model = defaultdict(set)
+    for model, pk in resources:
+        if is_availability_model(model):
+            pks_by_model[model].add(pk)
+
+    stored = 0
+    for model, pks in pks_by_model.items():
+        pks = sorted(pks)
+        for start in range(0, len(pks), AVAILABILITY_CHUNK_SIZE):
+            chunk = pks[start:start + AVAILABILITY_CHUNK_SIZE]
+            with transaction.atomic():
+                windows, exceptions = _owners_rows(model, chunk)
+                for index_model in (AvailabilityWindow, AvailabilityException):
+                    stale = index_model.objects.filter(resource_type=model.__name__, resource_id__in=chunk)
+                    # Availability rows have no signals or dependents, skip the delete collector
+                    stale._raw_delete(stale.db)
+                AvailabilityWindow.objects.bulk_create(windows, batch_size=batch_size)
+                AvailabilityException.objects.bulk_create(exceptions, batch_size=batch_size)
+            stored += len(windows)
+    return stored
+
+
+class PendingAvailability:
+    """Resources to resynchronize once the transaction they changed in commits"""
+
+    def __init__(self):
+        self.resources = set()
+
+    def __call__(self):
+        sync(self.resources)
+
+
+def schedule(resources):
+    """
+    Resynchronize resources when the current transaction commits, or right away in autocommit mode
+
+    Args:
+        resources: Iterable of (model, primary key) tuples
+    """
+    resources = {(model, pk) for model, pk in resources if is_availability_model(model)}
+    if not resources:
+        return
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        sync(resources)
+        return
+
+    pending = getattr(connection, 'pending_availability', None)
+    # A rolled back transaction or savepoint drops the callback, start over then
+    if pending is None or not any(callback is pending for _, callback, _ in connection.run_on_commit):
+        pending = connection.pending_availability = PendingAvailability()
+        transaction.on_commit(pending)
+    pending.resources |= resources
+
+
+def _availability_owners(availabilities):
+    owners = set()
+    for availability in availabilities:
+        for model, owner_field in AVAILABILITY_MODELS.items():
+            pk = getattr(availability, f'{owner_field}_id')
+            if pk is not None:
+                owners.add((model, pk))
+    return owners
+
+
+def owners(instance):
+    """
+    Resources whose availability depends on a row
+
+    Args:
+        instance: Availability, AvailableTime, NotAvailableTime or Period
+
+    Returns:
+        Set of (model, primary key) tuples
+    """
+    if isinstance(instance, Availability):
+        return _availability_owners([instance])
+    if isinstance(instance, (AvailableTime, NotAvailableTime)):
+        if instance.availability_id is None:
+            return set()
+        return _availability_owners(Availability.objects.filter(pk=instance.availability_id))
+    if isinstance(instance, Period):
+        if instance.pk is None:
+            return set()
+        return _availability_owners(Availability.objects.filter(not_available_times__during=instance.pk))
+    return set()
+
+
+def is_source_model(model):
+    """Whether saves and deletes of model rows can change an availability index"""
+    return model in (Availability, AvailableTime, NotAvailableTime, Period)
+
+
+def weekly_condition(day, minute):
+    """Condition on AvailabilityWindow rows open on a day (0 for mon) at a minute since midnight"""
+    return Q(day=day, start_minute__lte=minute, end_minute__gt=minute)
+
+
+def exception_rows(model, moment):
+    """AvailabilityException rows of model covering an aware datetime"""
+    return AvailabilityException.objects.filter(
+        Q(start__isnull=True) | Q(start__lte=moment), Q(end__isnull=True) | Q(end__gte=moment),
+        resource_type=model.__name__,
+    )
+
+
+def open_condition(model, moment):
+    """
+    Condition on AvailabilityWindow rows of model open at a datetime, exceptions applied
+
+    Opening hours are wall-clock times, so an aware moment is compared in the
+    current time zone; a naive one is taken as already local.
+    """
+    local = timezone.localtime(moment) if timezone.is_aware(moment) else moment
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    exceptions = exception_rows(model, moment).filter(resource_id=OuterRef('resource_id'))
+    return weekly_condition(local.weekday(), local.hour * 60 + local.minute) & ~Q(Exists(exceptions))
+
+
+def window_rows(model, condition):
+    """AvailabilityWindow rows of model matching a weekly_condition() or open_condition()"""
+    return AvailabilityWindow.objects.filter(condition, resource_type=model.__name__)
+
+
+def open_weekly(model, day, at):
+    """
+    Resources of model whose weekly hours are open on a day at a time of day
+
+    Args:
+        model: HealthcareService or PractitionerRole
+        day: FHIR day code, e.g. tue
+        at: datetime.time
+
+    Returns:
+        Queryset of model
+    """
+    rows = window_rows(model, weekly_condition(parse_day(day), at.hour * 60 + at.minute))
+    return model._default_manager.filter(pk__in=rows.values('resource_id'))
+
+
+def open_at(model, moment):
+    """Resources of model open at a datetime, notAvailableTime periods applied, as a queryset"""
+    return model._default_manager.filter(pk__in=window_rows(model, open_condition(model, moment)).values('resource_id'))
+
+
+def rebuild_availability(model, batch_size=None):
+    """
+    Rebuild the availability rows of every resource of a model
+
+    Returns:
+        Number of window rows stored
+    """
+    pks = model._default_manager.values_list('pk', flat=True)
+    return sync(((model, pk) for pk in pks.iterator()), batch_size)
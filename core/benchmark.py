@@ -0,0 +1,155 @@
+"""
+Serialization benchmarks
+Measures throughput, query count and peak memory of the resource converters
+and of the bulk export, and compares result files against a baseline so CI
+can flag regressions.
+"""
+
+import gc
+import platform
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import django
+from django.db import connection
+from django.utils import timezone
+
+from core.export import export_resources
+from fhir_serializers import RESOURCE_MODELS, get_fhir_dict, prefetch_for_serialization
+
+
+DEFAULT_SAMPLE_SIZE = 1000
+
+# Relative slowdown or memory growth tolerated before a result counts as a regression
+DEFAULT_TOLERANCE = 0.2
+
+
+@contextmanager
+def count_queries(counter):
+    """Count the queries run on the default connection into counter['queries']"""
+    def wrapper(execute, sql, params, many, context):
+        counter['queries'] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        yield
+
+
+def measure(func, count):
+    """
+    Run func twice: once for time and queries, once under tracemalloc for peak memory
+
+    Args:
+        func: Callable doing the work
+        count: Number of items func processes, used for the throughput
+
+    Returns:
+        Result dictionary
+    """
+    counter = {'queries': 0}
+    gc.collect()
+    with count_queries(counter):
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'count': count,
+        'seconds': round(seconds, 4),
+        'per_second': round(count / seconds, 1) if seconds else None,
+        'queries': counter['queries'],
+        'peak_memory': peak_memory,
+    }
+
+
+def benchmark_converters(sample_size=DEFAULT_SAMPLE_SIZE):
+    """
+    Benchmark the converter of every supported resource type
+
+    Each type is converted in bulk (prefetched) for up to sample_size rows, both
+    in trusted mode (plain dicts) and with fhir.resources validation, and once
+    per row without the prefetch plan, each relation loaded as the converter
+    reaches it, as the baseline the plan is measured against.
+
+    Returns:
+        Dict of '<ResourceType>.<mode>' -> result dictionary
+    """
+    results = {}
+    for resource_type, model in RESOURCE_MODELS.items():
+        pks = list(model.objects.order_by('pk').values_list('pk', flat=True)[:sample_size])
+        if not pks:
+            continue
+        for mode, trusted, prefetch in (('trusted', True, True), ('validated', False, True), ('per_row', True, False)):
+            def convert():
+                queryset = model.objects.filter(pk__in=pks).order_by('pk')
+                if prefetch:
+                    queryset = prefetch_for_serialization(queryset)
+                for instance in queryset:
+                    get_fhir_dict(instance, trusted=trusted)
+
+            results[f'{resource_type}.{mode}'] = measure(convert, len(pks))
+    return results
+
+
+def benchmark_export(workers=1):
+    """Benchmark a bulk export of every supported resource type into a temporary directory"""
+    total = sum(model.objects.count() for model in RESOURCE_MODELS.values())
+    with tempfile.TemporaryDirectory() as output_dir:
+        return measure(lambda: export_resources(output_dir, workers=workers), total)
+
+
+def run_benchmarks(sample_size=DEFAULT_SAMPLE_SIZE):
+    """
+    Run every benchmark against the current database
+
+    Returns:
+        Results document with 'environment', 'population' and 'results'
+    """
+    results = benchmark_converters(sample_size)
+    results['export'] = benchmark_export()
+    return {
+        'environment': {
+            'timestamp': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'sample_size': sample_size,
+        },
+        'population': {resource_type: model.objects.count() for resource_type, model in RESOURCE_MODELS.items()},
+        'results': results,
+    }
+
+
+def compare_results(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Find regressions of a results document against a baseline
+
+    Throughput and peak memory may vary by tolerance (a fraction); query
+    counts are deterministic and may not grow at all. Benchmarks missing from
+    either side are ignored.
+
+    Returns:
+        List of regression descriptions, empty if there are none
+    """
+    regressions = []
+    for name, result in current['results'].items():
+        reference = baseline['results'].get(name)
+        if reference is None:
+            continue
+        if result['queries'] > reference['queries']:
+            regressions.append(f"{name}: {result['queries']} queries, baseline {reference['queries']}")
+        if reference['per_second'] and result['per_second'] < reference['per_second'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['per_second']}/s, baseline {reference['per_second']}/s")
+        if result['peak_memory'] > reference['peak_memory'] * (1 + tolerance):
+            regressions.append(f"{name}: peak memory {result['peak_memory']} B, baseline {reference['peak_memory']} B")
+    return regressions
@@ -0,0 +1,286 @@
+"""
+Serialized FHIR resource cache
+Sits in front of get_fhir_json with two tiers: an in-process LRU and an optional
+shared Django cache (FHIR_CACHE_ALIAS). Entries are keyed by resource type and
+pk, plus the rendering mode, and carry the MetaElement.versionId they were
+rendered from, so a version bump is never served stale. core.signals
+invalidates entries when the resource or any row it owns changes: right
+away, and again when the transaction commits, dropping what other readers
+cached in between. Until then the resource bypasses the cache on this
+connection, so an uncommitted rendering is never cached and a rollback has
+nothing to undo. Reads of a resource, searchset pages, includes and
+$everything go through get_cached_fhir_jsons(), which checks the versions of
+a batch with one query and loads the relation graph of the misses only. Bulk
+export renders through get_fhir_jsons() directly so it does not evict the
+working set.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from core import registry
+
+
+class LRUCache:
+    """Thread-safe, size-bounded in-process cache with per-entry expiry"""
+
+    def __init__(self, max_size, timeout=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.timeout if self.timeout else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# In-process tier. Entries expire after FHIR_CACHE_LOCAL_TIMEOUT seconds, which
+# bounds staleness for invalidations that happened in other processes.
+local_cache = LRUCache(
+    max_size=getattr(settings, 'FHIR_CACHE_LOCAL_SIZE', 1024),
+    timeout=getattr(settings, 'FHIR_CACHE_LOCAL_TIMEOUT', 30),
+)
+
+
+def is_enabled():
+    return getattr(settings, 'FHIR_CACHE_ENABLED', True)
+
+
+def _shared_cache():
+    """Shared tier, or None when FHIR_CACHE_ALIAS is not configured"""
+    alias = getattr(settings, 'FHIR_CACHE_ALIAS', None)
+    return caches[alias] if alias else None
+
+
+def cache_key(resource_type, pk, trusted=True):
+    """Cache key of a serialized resource, validated and trusted renderings are kept apart"""
+    key = f'fhir:{resource_type}:{pk}'
+    return key if trusted else f'{key}:validated'
+
+
+def _keys(resource_type, pk):
+    return [cache_key(resource_type, pk, trusted) for trusted in (True, False)]
+
+
+class PendingInvalidation:
+    """Cache keys of resources changed in a transaction, dropped again once it commits"""
+
+    def __init__(self):
+        self.keys = set()
+
+    def __call__(self):
+        _delete(self.keys)
+
+
+def _pending(create=False):
+    """Pending invalidation of the current transaction, None outside one or when nothing changed"""
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return None
+    pending = getattr(connection, 'pending_cache_invalidation', None)
+    # A rolled back transaction or savepoint drops the callback, start over then
+    if pending is None or not any(callback is pending for _, callback, _ in connection.run_on_commit):
+        if not create:
+            return None
+        pending = connection.pending_cache_invalidation = PendingInvalidation()
+        transaction.on_commit(pending)
+    return pending
+
+
+def _uncommitted_keys():
+    """Keys of resources changed in the current transaction, which must not be served or cached yet"""
+    pending = _pending()
+    return pending.keys if pending is not None else frozenset()
+
+
+def resource_version(django_instance):
+    """MetaElement.versionId of a resource, or None when it has no meta"""
+    if django_instance.meta_id is None:
+        return None
+    return django_instance.meta.versionId
+
+
+def get_cached_fhir_json(django_instance, trusted=None):
+    """
+    Get FHIR JSON of a Django model instance through the cache
+
+    Args:
+        django_instance: Django model instance
+        trusted: Skip per-element validation when rendering, defaults to FHIR_TRUSTED_OUTPUT
+
+    Returns:
+        JSON string of FHIR resource
+    """
+    from fhir_serializers import get_fhir_json, use_trusted_output
+
+    trusted = use_trusted_output(trusted)
+    key = cache_key(type(django_instance).__name__, django_instance.pk, trusted)
+    if not is_enabled() or key in _uncommitted_keys():
+        return get_fhir_json(django_instance, trusted=trusted)
+
+    version = resource_version(django_instance)
+
+    entry = local_cache.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    shared = _shared_cache()
+    if shared is not None:
+        entry = shared.get(key)
+        if entry is not None and entry[0] == version:
+            local_cache.set(key, entry)
+            return entry[1]
+
+    entry = (version, get_fhir_json(django_instance, trusted=trusted))
+    local_cache.set(key, entry)
+    if shared is not None:
+        shared.set(key, entry)
+    return entry[1]
+
+
+def get_cached_fhir_dict(django_instance, trusted=None):
+    """
+    Get a FHIR dictionary of a Django model instance through the cache
+
+    Args:
+        django_instance: Django model instance
+        trusted: Skip per-element validation when rendering, defaults to FHIR_TRUSTED_OUTPUT
+
+    Returns:
+        Fresh JSON-compatible dictionary, safe to modify
+    """
+    return json.loads(get_cached_fhir_json(django_instance, trusted=trusted))
+
+
+def get_cached_fhir_jsons(model, pks, trusted=None):
+    """
+    Get FHIR JSON of resources of one model through the cache
+
+    The versions of the resources are read with one query. Entries cached for
+    those versions are served as they are, the others are rendered in one
+    batch by get_fhir_jsons, from their materialized documents or relation
+    graph, and cached.
+
+    Args:
+        model: Resource model with a converter
+        pks: Primary keys, those of resources that do not exist are skipped
+        trusted: Skip per-element validation when rendering, defaults to FHIR_TRUSTED_OUTPUT
+
+    Returns:
+        Dict of primary key -> JSON string of the FHIR resource
+    """
+    from fhir_serializers import get_fhir_jsons, use_trusted_output
+
+    if not is_enabled():
+        return get_fhir_jsons(model, pks, trusted=trusted)
+    trusted = use_trusted_output(trusted)
+    resource_type = model.__name__
+    pks = list(pks)
+    uncommitted = _uncommitted_keys()
+    changed = {pk for pk in pks if cache_key(resource_type, pk, trusted) in uncommitted}
+    # Rendered as this transaction sees them, cached once it commits
+    found = get_fhir_jsons(model, changed, trusted=trusted) if changed else {}
+    pks = [pk for pk in pks if pk not in changed]
+    queryset = model._default_manager.filter(pk__in=pks)
+
+    missing = {}
+    for pk, version in queryset.values_list('pk', 'meta__versionId'):
+        entry = local_cache.get(cache_key(resource_type, pk, trusted))
+        if entry is not None and entry[0] == version:
+            found[pk] = entry[1]
+        else:
+            missing[pk] = version
+
+    shared = _shared_cache()
+    if shared is not None and missing:
+        keys = {cache_key(resource_type, pk, trusted): pk for pk in missing}
+        for key, entry in shared.get_many(list(keys)).items():
+            pk = keys[key]
+            if entry[0] == missing[pk]:
+                local_cache.set(key, entry)
+                found[pk] = entry[1]
+                del missing[pk]
+
+    if missing:
+        rendered = {}
+        for pk, text in get_fhir_jsons(model, missing, trusted=trusted).items():
+            entry = (missing[pk], text)
+            rendered[cache_key(resource_type, pk, trusted)] = entry
+            local_cache.set(cache_key(resource_type, pk, trusted), entry)
+            found[pk] = text
+        if shared is not None:
+            shared.set_many(rendered)
+    return found
+
+
+def get_cached_fhir_dicts(model, pks, trusted=None):
+    """Fresh FHIR dictionaries of resources of one model through the cache, keyed by primary key"""
+    return {pk: json.loads(text) for pk, text in get_cached_fhir_jsons(model, pks, trusted=trusted).items()}
+
+
+def get_cached_resource(resource_type, fhir_id, trusted=None):
+    """
+    Read a resource by logical id through the cache
+
+    Returns:
+        FHIR dictionary, or None if no such resource exists
+    """
+    match = registry.resolve([(resource_type, fhir_id)]).get((resource_type, fhir_id))
+    if match is None:
+        return None
+    model, pk = match
+    return get_cached_fhir_dicts(model, [pk], trusted=trusted).get(pk)
+
+
+def _delete(keys):
+    for key in keys:
+        local_cache.delete(key)
+    shared = _shared_cache()
+    if shared is not None:
+        shared.delete_many(list(keys))
+
+
+def invalidate(resource_type, pk):
+    """
+    Drop a resource from both cache tiers, and again when the current
+    transaction commits; until then it bypasses the cache on this connection
+    """
+    keys = _keys(resource_type, pk)
+    _delete(keys)
+    pending = _pending(create=True)
+    if pending is not None:
+        pending.keys.update(keys)
@@ -0,0 +1,237 @@
+"""
+Shared CodeableConcept pool
+Concepts are content-addressed: concept_hash() keys a concept by its id, text
+and codings, and every owner of an equal concept links to one shared row
+instead of keeping its own concept and Coding copies. The bulk importer
+interns concepts as it parses them, intern_concept() does the same for code
+creating rows through the ORM, and deduplicate_concepts() folds the copies
+already stored into the pool. Pooled concepts are shared, so they are never
+edited in place, and owners reference them with SET_NULL or PROTECT rather
+than CASCADE, so deleting a concept can never delete the resources sharing it.
+collect_orphans() deletes the pooled concepts no owner references any more.
+"""
+
+import hashlib
+import json
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, Exists, F, Min, OuterRef, Value, When
+
+from components.models import CodeableConcept, Coding
+
+
+# Concepts hashed or merged per transaction
+CONCEPT_CHUNK_SIZE = 1000
+
+CODING_FIELDS = ('fhir_id', 'system', 'version', 'code', 'display', 'userSelected')
+
+
+def concept_hash(fhir_id, text, codings):
+    """
+    Content hash of a CodeableConcept
+
+    Args:
+        fhir_id: Element id of the concept
+        text: Concept text
+        codings: Codings in order, as Coding instances (saved or not) or
+            dictionaries of CODING_FIELDS
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    coding_values = [
+        [coding.get(name) if isinstance(coding, dict) else getattr(coding, name) for name in CODING_FIELDS]
+        for coding in codings
+    ]
+    content = json.dumps([fhir_id, text, coding_values], separators=(',', ':'))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def intern_concept(text=None, codings=(), fhir_id=None):
+    """
+    Get the pooled concept with this content, creating it if needed
+
+    Args:
+        text: Concept text
+        codings: Dictionaries of Coding fields (CODING_FIELDS)
+        fhir_id: Element id of the concept
+
+    Returns:
+        Saved CodeableConcept
+    """
+    codings = list(codings)
+    content_hash = concept_hash(fhir_id, text, codings)
+    concept = CodeableConcept.objects.filter(content_hash=content_hash).order_by('pk').first()
+    if concept is not None:
+        return concept
+    with transaction.atomic():
+        concept = CodeableConcept.objects.create(fhir_id=fhir_id, text=text, content_hash=content_hash)
+        Coding.objects.bulk_create(Coding(codeable_concept=concept, **coding) for coding in codings)
+    return concept
+
+
+def _poolable_concepts():
+    """Concepts deduplication may touch: their extensions would not survive a merge"""
+    return CodeableConcept.objects.filter(extension__isnull=True).exclude(codings__extension__isnull=False)
+
+
+def hash_concepts():
+    """
+    Compute the content_hash of every poolable concept that has none yet
+
+    Returns:
+        Number of concepts hashed
+    """
+    hashed = 0
+    last_pk = 0
+    while True:
+        concepts = list(
+            _poolable_concepts().filter(content_hash__isnull=True, pk__gt=last_pk)
+            .order_by('pk').prefetch_related('codings')[:CONCEPT_CHUNK_SIZE]
+        )
+        if not concepts:
+            return hashed
+        for concept in concepts:
+            codings = sorted(concept.codings.all(), key=lambda coding: coding.pk)
+            concept.content_hash = concept_hash(concept.fhir_id, concept.text, codings)
+        CodeableConcept.objects.bulk_update(concepts, ['content_hash'])
+        hashed += len(concepts)
+        last_pk = concepts[-1].pk
+
+
+def _concept_relations():
+    """Foreign keys and many-to-many fields through which owners reference concepts"""
+    foreign_keys, many_to_many = [], []
+    for relation in CodeableConcept._meta.related_objects:
+        if relation.many_to_many:
+            many_to_many.append(relation.field)
+        elif relation.related_model is not Coding:
+            foreign_keys.append(relation.field)
+    return foreign_keys, many_to_many
+
+
+def _unreferenced():
+    """Conditions on CodeableConcept rows that hold when no owner references the concept"""
+    foreign_keys, many_to_many = _concept_relations()
+    conditions = [
+        ~Exists(field.model._default_manager.filter(**{field.attname: OuterRef('pk')})) for field in foreign_keys
+    ]
+    for field in many_to_many:
+        through = field.remote_field.through
+        concept_column = through._meta.get_field(field.m2m_reverse_field_name()).attname
+        conditions.append(~Exists(through.objects.filter(**{concept_column: OuterRef('pk')})))
+    return conditions
+
+
+def collect_orphans():
+    """
+    Delete the pooled concepts, and their codings, that no owner references any more
+
+    Owners drop their links when they are deleted or point at another
+    concept, and the pool never deletes a concept on its own.
+
+    Returns:
+        Number of concepts deleted
+    """
+    unreferenced = _unreferenced()
+    collected = 0
+    last_pk = 0
+    while True:
+        chunk = list(
+            CodeableConcept.objects.filter(content_hash__isnull=False, pk__gt=last_pk)
+            .order_by('pk').values_list('pk', flat=True)[:CONCEPT_CHUNK_SIZE]
+        )
+        if not chunk:
+            return collected
+        with transaction.atomic():
+            orphans = list(CodeableConcept.objects.filter(*unreferenced, pk__in=chunk).values_list('pk', flat=True))
+            # Nothing references the orphans, skip the delete collector and its signals
+            codings = Coding.objects.filter(codeable_concept_id__in=orphans)
+            codings._raw_delete(codings.db)
+            concepts = CodeableConcept.objects.filter(pk__in=orphans)
+            concepts._raw_delete(concepts.db)
+        collected += len(orphans)
+        last_pk = chunk[-1]
+
+
+def _repoint(canonical):
+    """
+    Move every reference to a duplicate concept onto its canonical concept
+
+    Args:
+        canonical: Dict of duplicate pk -> canonical pk
+    """
+    foreign_keys, many_to_many = _concept_relations()
+    for field in foreign_keys:
+        rows = field.model._default_manager.filter(**{f'{field.attname}__in': list(canonical)})
+        rows.update(**{field.attname: Case(
+            *[When(**{field.attname: duplicate}, then=Value(target)) for duplicate, target in canonical.items()],
+            default=F(field.attname), output_field=field.target_field,
+        )})
+
+    for field in many_to_many:
+        through = field.remote_field.through
+        owner_column = through._meta.get_field(field.m2m_field_name()).attname
+        concept_column = through._meta.get_field(field.m2m_reverse_field_name()).attname
+        links = list(through.objects.filter(**{f'{concept_column}__in': list(canonical)})
+                     .values_list('pk', owner_column, concept_column))
+        if not links:
+            continue
+        linked = set(through.objects.filter(**{f'{concept_column}__in': set(canonical.values())})
+                     .values_list(owner_column, concept_column))
+        redundant, moved = [], defaultdict(list)
+        for pk, owner_pk, concept_pk in links:
+            key = (owner_pk, canonical[concept_pk])
+            if key in linked:
+                redundant.append((owner_pk, concept_pk))
+            else:
+                linked.add(key)
+                moved[canonical[concept_pk]].append(pk)
+        for target, pks in moved.items():
+            through.objects.filter(pk__in=pks).update(**{concept_column: target})
+        # An owner that listed the concept twice now lists it once, which changes
+        # its serialization: remove() sends the m2m_changed signal that invalidates it
+        for owner_pk, concept_pk in redundant:
+            owner = field.model._default_manager.get(pk=owner_pk)
+            getattr(owner, field.name).remove(concept_pk)
+
+
+def deduplicate_concepts():
+    """
+    Fold stored concept copies into the shared pool
+
+    Hashes the concepts that have no content_hash yet, then merges every group
+    of concepts with the same hash into its oldest row: owners are pointed at
+    it and the copies are deleted with their codings. The copies render like
+    the concept replacing them, so serialized resources stay valid, except
+    that an owner listing equal copies in one to-many field lists the concept
+    once afterwards. Pooled concepts left without owners are collected last.
+
+    Returns:
+        Dict with the number of concepts 'hashed', 'merged' and 'collected'
+    """
+    hashed = hash_concepts()
+    merged = 0
+    groups = (
+        _poolable_concepts().filter(content_hash__isnull=False).values('content_hash')
+        .annotate(copies=Count('pk', distinct=True), first=Min('pk')).filter(copies__gt=1)
+        .values_list('content_hash', 'first')
+    )
+    while True:
+        first_by_hash = dict(groups[:CONCEPT_CHUNK_SIZE])
+        if not first_by_hash:
+            return {'hashed': hashed, 'merged': merged, 'collected': collect_orphans()}
+        with transaction.atomic():
+            duplicates = (
+                _poolable_concepts().filter(content_hash__in=list(first_by_hash))
+                .exclude(pk__in=list(first_by_hash.values())).values_list('pk', 'content_hash')
+            )
+            canonical = {pk: first_by_hash[content_hash] for pk, content_hash in duplicates}
+            _repoint(canonical)
+            # Nothing references the copies any more, skip the delete collector and its signals
+            codings = Coding.objects.filter(codeable_concept_id__in=list(canonical))
+            codings._raw_delete(codings.db)
+            copies = CodeableConcept.objects.filter(pk__in=list(canonical))
+            copies._raw_delete(copies.db)
+        merged += len(canonical)
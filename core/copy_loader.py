@@ -0,0 +1,143 @@
+"""
+COPY-based loader for the component tables
+Streams rows into a temporary staging table with COPY FROM STDIN on
+PostgreSQL, then merges them into the real table with one INSERT ... SELECT.
+Primary keys are reserved from the table's sequence up front, so foreign keys
+to rows of earlier dependency levels are plain column values by the time the
+rows are copied. Other backends fill the staging table with executemany, which
+runs the same staging and merge steps locally.
+"""
+
+import io
+import json
+
+from django.db import connections, router
+from django.db.models import JSONField
+
+from components.models import Address, CodeableConcept, Coding, ContactPoint, HumanName, Identifier, Period
+
+
+# Wide, append-heavy tables loaded with COPY when ingesting with copy=True
+COPY_MODELS = (Identifier, Coding, CodeableConcept, Period, ContactPoint, HumanName, Address)
+
+DEFAULT_COPY_CHUNK_SIZE = 10000
+
+
+def reserve_pks(model, count, connection):
+    """
+    Reserve a block of primary keys for rows inserted with explicit ids
+
+    On PostgreSQL the keys come from the table's sequence, so concurrent writers
+    never collide. Elsewhere they follow the current maximum, which is only safe
+    with a single writer.
+    """
+    table = model._meta.db_table
+    column = model._meta.pk.column
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                [connection.ops.quote_name(table), column, count]
+            )
+            return [pk for pk, in cursor.fetchall()]
+        cursor.execute(
+            f'SELECT MAX({connection.ops.quote_name(column)}) FROM {connection.ops.quote_name(table)}'
+        )
+        start = (cursor.fetchone()[0] or 0) + 1
+    return list(range(start, start + count))
+
+
+def _resolve_foreign_keys(row, fields):
+    """Copy the keys of already saved related rows into the FK columns"""
+    for field in fields:
+        related = field.get_cached_value(row, None)
+        if related is not None and getattr(row, field.attname) is None:
+            setattr(row, field.attname, related.pk)
+
+
+def _db_values(row, fields, connection):
+    values = []
+    for field in fields:
+        value = getattr(row, field.attname)
+        if isinstance(field, JSONField):
+            values.append(None if value is None else json.dumps(value, cls=field.encoder))
+        else:
+            values.append(field.get_db_prep_save(value, connection))
+    return values
+
+
+def _copy_text(value):
+    """Encode one value for COPY ... FROM STDIN in text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (
+        str(value).replace('\\', '\\\\').replace('\t', '\\t')
+        .replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+
+def _copy_into(cursor, table, columns, rows):
+    """Run COPY FROM STDIN with psycopg2 or psycopg 3"""
+    buffer = io.StringIO()
+    for values in rows:
+        buffer.write('\t'.join(map(_copy_text, values)))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    sql = f'COPY {table} ({", ".join(columns)}) FROM STDIN'
+    raw_cursor = cursor.cursor
+    if hasattr(raw_cursor, 'copy_expert'):
+        raw_cursor.copy_expert(sql, buffer)
+    else:
+        with raw_cursor.copy(sql) as copy:
+            copy.write(buffer.getvalue())
+
+
+def copy_rows(model, rows, chunk_size=DEFAULT_COPY_CHUNK_SIZE):
+    """
+    Insert unsaved rows through a staging table, setting their primary keys
+
+    Rows may point to related rows that were saved before (earlier dependency
+    levels); those foreign keys are filled in from the related rows.
+
+    Args:
+        model: Django model of the rows
+        rows: Unsaved model instances
+        chunk_size: Rows streamed into the staging table per COPY/executemany
+    """
+    if not rows:
+        return
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    fields = model._meta.concrete_fields
+    relations = [field for field in fields if field.is_relation]
+    columns = [quote(field.column) for field in fields]
+    table = quote(model._meta.db_table)
+    staging = quote(f'{model._meta.db_table}_staging')
+
+    for row, pk in zip(rows, reserve_pks(model, len(rows), connection)):
+        row.pk = pk
+        _resolve_foreign_keys(row, relations)
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'CREATE TEMP TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP')
+        else:
+            cursor.execute(f'CREATE TEMP TABLE {staging} AS SELECT * FROM {table} WHERE 0 = 1')
+
+        insert = f'INSERT INTO {staging} ({", ".join(columns)}) VALUES ({", ".join(["%s"] * len(columns))})'
+        for start in range(0, len(rows), chunk_size):
+            values = [_db_values(row, fields, connection) for row in rows[start:start + chunk_size]]
+            if connection.vendor == 'postgresql':
+                _copy_into(cursor, staging, columns, values)
+            else:
+                cursor.executemany(insert, values)
+
+        cursor.execute(f'INSERT INTO {table} ({", ".join(columns)}) SELECT {", ".join(columns)} FROM {staging}')
+        cursor.execute(f'DROP TABLE {staging}')
+
+    for row in rows:
+        row._state.adding = False
+        row._state.db = connection.alias
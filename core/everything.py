@@ -0,0 +1,105 @@
+"""
+Patient $everything
+Streams the patient compartment (core.models.CompartmentIndex) as the JSON
+text of a searchset Bundle, one piece at a time: members are rendered
+in chunks per resource type through core.cache and written out straight
+away, followed by the resources they reference, so a large chart is never
+held in memory as a whole.
+"""
+
+import json
+from collections import defaultdict
+
+from django.conf import settings
+
+from core import registry
+from core.cache import get_cached_fhir_jsons
+from core.models import CompartmentIndex, ReferenceIndex
+from fhir_serializers import RESOURCE_MODELS
+
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def _chunks_by_type(keys, chunk_size):
+    """Group (resourceType, primary key) pairs sorted by type into per-type chunks"""
+    resource_type, chunk = None, []
+    for key_type, pk in keys:
+        if chunk and (key_type != resource_type or len(chunk) >= chunk_size):
+            yield resource_type, chunk
+            chunk = []
+        resource_type = key_type
+        chunk.append(pk)
+    if chunk:
+        yield resource_type, chunk
+
+
+def _entries(model, pks, mode, base_url, trusted):
+    """Yield the Bundle entry JSON of resources of one type, rendered as one cache batch"""
+    # Types without a converter cannot be rendered and are left out
+    if model is None or model.__name__ not in RESOURCE_MODELS:
+        return
+    documents = get_cached_fhir_jsons(model, pks, trusted=trusted)
+    fhir_ids = dict(model._default_manager.filter(pk__in=pks).values_list('pk', 'fhir_id')) if base_url else {}
+    for pk in sorted(documents):
+        full_url = ''
+        if base_url:
+            full_url = '"fullUrl":' + json.dumps(f"{base_url.rstrip('/')}/{model.__name__}/{fhir_ids[pk]}") + ','
+        yield '{' + full_url + '"resource":' + documents[pk] + ',"search":{"mode":"' + mode + '"}}'
+
+
+def iter_everything(patient_id, resource_types=None, base_url=None, chunk_size=DEFAULT_CHUNK_SIZE, trusted=True):
+    """
+    Yield the JSON text of the $everything Bundle of a patient, piece by piece
+
+    The Bundle holds the resources of the patient's compartment (search mode
+    'match') and the resources they reference (mode 'include'), each once.
+
+    Args:
+        patient_id: Logical id of the patient
+        resource_types: Optional list of compartment types to return (_type)
+        base_url: Server base of the fullUrl of entries, defaults to FHIR_BASE_URL
+        chunk_size: Resources loaded and prefetched at a time
+        trusted: Skip per-element validation
+
+    Yields:
+        Strings that concatenate to the Bundle JSON
+
+    Raises:
+        ValueError: If the patient does not exist
+    """
+    if not registry.resolve([('Patient', patient_id)]):
+        raise ValueError(f"Patient/{patient_id} not found")
+    if base_url is None:
+        base_url = getattr(settings, 'FHIR_BASE_URL', '')
+    models = registry.resource_models()
+
+    members = CompartmentIndex.objects.filter(compartment_type='Patient', compartment_id=patient_id)
+    if resource_types:
+        members = members.filter(resource_type__in=resource_types)
+    members = members.order_by('resource_type', 'resource_id').values_list('resource_type', 'resource_id')
+
+    yield '{"resourceType":"Bundle","type":"searchset","entry":['
+    separator = ''
+    emitted = set()
+    referenced = set()
+    for resource_type, pks in _chunks_by_type(members.iterator(chunk_size=chunk_size), chunk_size):
+        for entry in _entries(models.get(resource_type), pks, 'match', base_url, trusted):
+            yield separator + entry
+            separator = ','
+        emitted.update((resource_type, pk) for pk in pks)
+        referenced.update(ReferenceIndex.objects.filter(
+            resource_type=resource_type, resource_id__in=pks
+        ).values_list('target_type', 'target_id'))
+
+    included = defaultdict(list)
+    for model, pk in registry.resolve(referenced).values():
+        if (model.__name__, pk) not in emitted:
+            included[model.__name__].append(pk)
+    for resource_type in sorted(included):
+        pks = sorted(included[resource_type])
+        for start in range(0, len(pks), chunk_size):
+            for entry in _entries(models[resource_type], pks[start:start + chunk_size], 'include', base_url, trusted):
+                yield separator + entry
+                separator = ','
+    yield ']}'
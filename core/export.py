@@ -0,0 +1,200 @@
+"""
+Streaming bulk export of FHIR resources
+Writes one gzip-compressed NDJSON file per resource type, in the style of
+the FHIR Bulk Data $export operation
+"""
+
+import gzip
+import json
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+from django.db import connections
+from django.utils import timezone
+
+from fhir_serializers import RESOURCE_MODELS, get_fhir_jsons
+
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def iter_ndjson_lines(model, chunk_size=DEFAULT_CHUNK_SIZE, trusted=True, queryset=None):
+    """
+    Yield one FHIR JSON line per row of a resource table
+
+    Primary keys are streamed in chunks (server-side cursor on PostgreSQL) and
+    each chunk is rendered as a batch by get_fhir_jsons, from the materialized
+    documents when there are some, so memory stays flat however big the table.
+
+    Args:
+        model: Django resource model
+        chunk_size: Number of rows fetched and prefetched at a time
+        trusted: Skip per-element validation
+        queryset: Optional queryset of model to export instead of all rows
+
+    Yields:
+        FHIR JSON string for each resource, without trailing newline
+    """
+    if queryset is None:
+        queryset = model.objects.all()
+    pks = queryset.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=chunk_size)
+    while chunk := list(islice(pks, chunk_size)):
+        documents = get_fhir_jsons(model, chunk, trusted=trusted)
+        for pk in chunk:
+            if pk in documents:
+                yield documents[pk]
+
+
+def write_ndjson_gz(lines, path):
+    """
+    Write lines to a gzip-compressed NDJSON file
+
+    Args:
+        lines: Iterable of JSON strings
+        path: Destination file path
+
+    Returns:
+        Number of lines written
+    """
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8') as output:
+        for line in lines:
+            output.write(line)
+            output.write('\n')
+            count += 1
+    return count
+
+
+def pk_ranges(queryset, shards):
+    """
+    Split a queryset into contiguous primary key ranges of roughly equal size
+
+    Args:
+        queryset: Queryset to split
+        shards: Maximum number of ranges
+
+    Returns:
+        List of half-open (low, high) pk bounds in pk order, high is None for the last range
+    """
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    total = pks.count()
+    if total == 0:
+        return []
+    shards = max(1, min(shards, total))
+    starts = [pks[total * i // shards] for i in range(shards)]
+    return list(zip(starts, starts[1:] + [None]))
+
+
+def _init_worker():
+    """Set Django up in a freshly spawned worker process"""
+    import django
+
+    django.setup()
+
+
+def _export_shard(resource_type, low, high, path, chunk_size, trusted):
+    """Write one pk range of a resource table to its own NDJSON part file"""
+    model = RESOURCE_MODELS[resource_type]
+    queryset = model.objects.filter(pk__gte=low)
+    if high is not None:
+        queryset = queryset.filter(pk__lt=high)
+    try:
+        return write_ndjson_gz(iter_ndjson_lines(model, chunk_size, trusted, queryset=queryset), path)
+    finally:
+        connections.close_all()
+
+
+def _export_parallel(output_dir, resource_types, chunk_size, trusted, workers):
+    """
+    Export resource tables with a process pool, one job per pk range
+
+    Every table is split into `workers` ranges and all ranges of all tables go
+    to the same pool. Each worker opens its own database connection. Part files
+    are gzip members, so they are merged in pk order by plain concatenation.
+
+    Returns:
+        Dict of resource type -> number of resources written
+    """
+    shards = {
+        resource_type: pk_ranges(RESOURCE_MODELS[resource_type].objects.all(), workers)
+        for resource_type in resource_types
+    }
+    # Forked workers must not share the parent's connections
+    connections.close_all()
+
+    jobs = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for resource_type, ranges in shards.items():
+            jobs[resource_type] = []
+            for index, (low, high) in enumerate(ranges):
+                part_path = output_dir / f'{resource_type}.ndjson.gz.part{index}'
+                future = pool.submit(_export_shard, resource_type, low, high, part_path, chunk_size, trusted)
+                jobs[resource_type].append((part_path, future))
+
+        counts = {}
+        for resource_type, parts in jobs.items():
+            counts[resource_type] = 0
+            if not parts:
+                write_ndjson_gz([], output_dir / f'{resource_type}.ndjson.gz')
+                continue
+            with open(output_dir / f'{resource_type}.ndjson.gz', 'wb') as output:
+                for part_path, future in parts:
+                    counts[resource_type] += future.result()
+                    with open(part_path, 'rb') as part:
+                        shutil.copyfileobj(part, output)
+                    part_path.unlink()
+    return counts
+
+
+def export_resources(output_dir, resource_types=None, chunk_size=DEFAULT_CHUNK_SIZE, trusted=True, workers=1):
+    """
+    Export resource tables to <output_dir>/<ResourceType>.ndjson.gz
+
+    Args:
+        output_dir: Directory the files (and manifest.json) are written to
+        resource_types: resourceType names to export, defaults to all supported types
+        chunk_size: Number of rows fetched and prefetched at a time
+        trusted: Skip per-element validation
+        workers: Number of worker processes, tables are sharded by pk range when above 1
+
+    Returns:
+        Export manifest dictionary, also written to manifest.json
+
+    Raises:
+        ValueError: If a resource type is not supported
+    """
+    if resource_types is None:
+        resource_types = list(RESOURCE_MODELS)
+    unknown = [name for name in resource_types if name not in RESOURCE_MODELS]
+    if unknown:
+        raise ValueError(f"Unsupported resource types: {', '.join(unknown)}")
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    manifest = {
+        'transactionTime': timezone.now().isoformat(),
+        'requiresAccessToken': False,
+        'output': [],
+        'error': [],
+    }
+    if workers > 1:
+        counts = _export_parallel(output_dir, resource_types, chunk_size, trusted, workers)
+    else:
+        counts = {
+            resource_type: write_ndjson_gz(
+                iter_ndjson_lines(RESOURCE_MODELS[resource_type], chunk_size=chunk_size, trusted=trusted),
+                output_dir / f'{resource_type}.ndjson.gz',
+            )
+            for resource_type in resource_types
+        }
+    for resource_type in resource_types:
+        manifest['output'].append({
+            'type': resource_type, 'url': f'{resource_type}.ndjson.gz', 'count': counts[resource_type],
+        })
+
+    with open(output_dir / 'manifest.json', 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return manifest
@@ -0,0 +1,178 @@
+"""
+Geohash index and near search for LocationPosition
+Every position stores the geohash of its coordinates, an indexed string whose
+prefixes are ever smaller grid cells. A near search covers its circle with the
+3x3 block of cells of the finest precision still as wide as the radius,
+selects the candidate positions with one index range scan per cell, and keeps
+those within the distance by the haversine formula evaluated in the database.
+Cell ranges use plain string comparisons and the haversine is built from
+Django's math functions, so the search runs on SQLite and PostgreSQL without
+spatial extensions.
+"""
+
+import math
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cast, Cos, Least, Power, Radians, Sin, Sqrt
+
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Characters stored per position, 12 is well below a centimetre
+GEOHASH_PRECISION = 12
+
+# Mean Earth radius
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Distance of a near search that gives none
+DEFAULT_NEAR_DISTANCE_KM = 10
+
+# UCUM units accepted in near searches, in kilometres
+DISTANCE_UNITS = {
+    'km': 1.0,
+    'm': 0.001,
+    '[mi_i]': 1.609344,
+    'mi': 1.609344,
+}
+
+LOCATION_DISTANCE_URL = 'http://hl7.org/fhir/StructureDefinition/location-distance'
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Geohash of a WGS84 coordinate"""
+    latitude, longitude = float(latitude), float(longitude)
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, longitude first
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(latitude degrees, longitude degrees) spanned by a cell of precision characters"""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """
+    Geohash cells whose union covers a circle
+
+    Returns:
+        Sorted cell prefixes, or None when the circle is too large (or too close
+        to a pole) for any cell to narrow the search
+    """
+    latitude, longitude = float(latitude), float(longitude)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_degrees, lon_degrees = cell_size(precision)
+        height = lat_degrees * KM_PER_DEGREE
+        width = lon_degrees * KM_PER_DEGREE * math.cos(math.radians(latitude))
+        # The circle's centre lies in the middle cell, so the block reaches at least one cell further out
+        if min(height, width) >= radius_km:
+            break
+    else:
+        return None
+
+    cells = set()
+    for lat_step in (-1, 0, 1):
+        cell_latitude = min(max(latitude + lat_step * lat_degrees, -90.0), 90.0)
+        for lon_step in (-1, 0, 1):
+            cell_longitude = (longitude + lon_step * lon_degrees + 180.0) % 360.0 - 180.0
+            cells.add(encode_geohash(cell_latitude, cell_longitude, precision))
+    return sorted(cells)
+
+
+def _next_prefix(prefix):
+    """Smallest geohash string after every string starting with prefix, None if there is none"""
+    stripped = prefix.rstrip(BASE32[-1])
+    if not stripped:
+        return None
+    return stripped[:-1] + BASE32[BASE32.index(stripped[-1]) + 1]
+
+
+def cell_condition(cells, field='geohash'):
+    """Rows whose geohash lies in one of the cells, as index range conditions rather than LIKE"""
+    condition = Q()
+    for cell in cells:
+        upper = _next_prefix(cell)
+        cell_range = Q(**{f'{field}__gte': cell})
+        if upper is not None:
+            cell_range &= Q(**{f'{field}__lt': upper})
+        condition |= cell_range
+    return condition
+
+
+def distance_expression(latitude, longitude, prefix=''):
+    """Haversine distance in kilometres from a coordinate to the position at prefix (e.g. position__)"""
+    lat1, lon1 = math.radians(float(latitude)), math.radians(float(longitude))
+    lat2 = Radians(Cast(F(f'{prefix}latitude'), FloatField()))
+    lon2 = Radians(Cast(F(f'{prefix}longitude'), FloatField()))
+    half_chord = (
+        Power(Sin((lat2 - Value(lat1)) / 2), 2)
+        + Value(math.cos(lat1)) * Cos(lat2) * Power(Sin((lon2 - Value(lon1)) / 2), 2)
+    )
+    # Rounding can push the chord of antipodal points past 1, outside ASIN's domain
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Least(Sqrt(half_chord), Value(1.0)))
+
+
+def parse_near(value):
+    """
+    Parse a near search value, latitude|longitude|distance|units
+
+    Returns:
+        (latitude, longitude, distance in kilometres)
+
+    Raises:
+        ValueError: If the value is malformed or the units unknown
+    """
+    parts = value.split('|')
+    if len(parts) < 2 or len(parts) > 4:
+        raise ValueError(f"Invalid near value, expected latitude|longitude|distance|units: {value}")
+    try:
+        latitude, longitude = float(parts[0]), float(parts[1])
+        distance = float(parts[2]) if len(parts) > 2 and parts[2] else None
+    except ValueError:
+        raise ValueError(f"Invalid near value: {value}")
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        raise ValueError(f"Invalid near coordinates: {value}")
+    units = parts[3] if len(parts) > 3 and parts[3] else 'km'
+    if units not in DISTANCE_UNITS:
+        raise ValueError(f"Unsupported near units: {units}")
+    if distance is None:
+        return latitude, longitude, DEFAULT_NEAR_DISTANCE_KM
+    if distance < 0:
+        raise ValueError(f"Invalid near distance: {value}")
+    return latitude, longitude, distance * DISTANCE_UNITS[units]
+
+
+def near_positions(queryset, latitude, longitude, radius_km):
+    """LocationPositions of queryset within radius_km of a coordinate, annotated with their distance"""
+    cells = covering_cells(latitude, longitude, radius_km)
+    if cells is not None:
+        queryset = queryset.filter(cell_condition(cells))
+    return queryset.annotate(distance=distance_expression(latitude, longitude)).filter(distance__lte=radius_km)
+
+
+def distance_extension(distance_km):
+    """Bundle.entry.search extension carrying the distance of a near match"""
+    return {
+        'url': LOCATION_DISTANCE_URL,
+        'valueDistance': {
+            'value': round(distance_km, 3), 'unit': 'km', 'system': 'http://unitsofmeasure.org', 'code': 'km',
+        },
+    }
@@ -0,0 +1,127 @@
+"""
+Relation graph of the serialized resources
+Derived from the prefetch plans in fhir_serializers, so it always matches what
+the converters actually read. Used to find which resources embed a given row.
+"""
+
+from functools import lru_cache
+
+from django.db.models import Prefetch
+
+
+def _relation_fields(queryset):
+    """
+    List the relations loaded by a queryset's select_related/prefetch_related
+
+    Returns:
+        List of relation fields, forward fields and reverse relation objects alike
+    """
+    fields = []
+
+    def walk(model, parts):
+        for part in parts:
+            field = model._meta.get_field(part)
+            fields.append(field)
+            model = field.related_model
+        return model
+
+    def walk_select_related(model, tree):
+        for name, subtree in tree.items():
+            walk_select_related(walk(model, [name]), subtree)
+
+    if isinstance(queryset.query.select_related, dict):
+        walk_select_related(queryset.model, queryset.query.select_related)
+
+    for lookup in queryset._prefetch_related_lookups:
+        through = lookup.prefetch_through if isinstance(lookup, Prefetch) else lookup
+        walk(queryset.model, through.split('__'))
+        if isinstance(lookup, Prefetch) and lookup.queryset is not None:
+            fields.extend(_relation_fields(lookup.queryset))
+
+    return fields
+
+
+@lru_cache(maxsize=None)
+def dependency_edges():
+    """
+    Map every model in the serialized graph to the relations that embed it
+
+    Returns:
+        Dict of child model -> set of relation fields whose .model is the parent
+    """
+    from fhir_serializers import PREFETCH_PLANS
+
+    edges = {}
+    for resource_model, plan in PREFETCH_PLANS.items():
+        for field in _relation_fields(plan(resource_model.objects.all())):
+            edges.setdefault(field.related_model, set()).add(field)
+    return edges
+
+
+def is_resource_model(model):
+    """Whether model is a serialized resource type"""
+    from fhir_serializers import PREFETCH_PLANS
+
+    return model in PREFETCH_PLANS
+
+
+def is_tracked_model(model):
+    """Whether rows of model appear in any serialized resource"""
+    return is_resource_model(model) or model in dependency_edges()
+
+
+def _dependents(instance, seen):
+    """Resources reached by walking the graph upwards from instance"""
+    key = (type(instance), instance.pk)
+    if key in seen:
+        return set()
+    seen.add(key)
+
+    resources = set()
+    for field in dependency_edges().get(type(instance), ()):
+        parent_model = field.model
+        if (field.one_to_many or field.one_to_one) and not field.concrete:
+            # Reverse FK/O2O: the link to the parent lives on the instance itself
+            parent_pk = getattr(instance, field.field.attname)
+            if parent_pk is None:
+                continue
+            if is_resource_model(parent_model):
+                resources.add((parent_model, parent_pk))
+                continue
+            parents = parent_model._default_manager.filter(pk=parent_pk)
+        else:
+            parents = parent_model._default_manager.filter(**{field.name: instance.pk})
+            if is_resource_model(parent_model):
+                resources.update((parent_model, pk) for pk in parents.values_list('pk', flat=True))
+                continue
+        for parent in parents:
+            resources |= _dependents(parent, seen)
+    return resources
+
+
+def embedding_resources(instance):
+    """
+    Find the resources whose serialized form includes a row
+
+    Args:
+        instance: Any Django model instance
+
+    Returns:
+        Set of (resource model, pk) tuples, just instance itself if it is a resource
+    """
+    if is_resource_model(type(instance)):
+        return {(type(instance), instance.pk)}
+    return _dependents(instance, set())
+
+
+def referencing_resources(instance):
+    """
+    Find the resources that render a reference to a resource instance
+
+    Args:
+        instance: Resource model instance
+
+    Returns:
+        Set of (resource model, pk) tuples
+    """
+    return _dependents(instance, set())
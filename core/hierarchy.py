@@ -0,0 +1,199 @@
+"""
+partOf hierarchy closure tables
+Organization, Location and Encounter form trees through their partOf
+self-reference. HierarchyClosure holds one row per ancestor-descendant pair of
+each tree with the number of links between them, so descendants, ancestors and
+depth are each one indexed query instead of a recursive walk. core.signals
+keeps the rows in step with every save and delete, and the bulk importer calls
+sync() for the resources it writes.
+"""
+
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Max
+
+from core.models import HierarchyClosure
+from encounter.models import Encounter
+from location.models import Location
+from organization.models import Organization
+
+
+HIERARCHY_MODELS = {
+    'Organization': Organization,
+    'Location': Location,
+    'Encounter': Encounter,
+}
+
+# Self-reference every hierarchy is built from
+PARENT_FIELD = 'partOf'
+
+# Resources synchronized per transaction
+HIERARCHY_CHUNK_SIZE = 1000
+
+
+def is_hierarchy_model(model):
+    return HIERARCHY_MODELS.get(model.__name__) is model
+
+
+def _paths(model):
+    return HierarchyClosure.objects.filter(resource_type=model.__name__)
+
+
+def _subtree(model, pk):
+    """(descendant pk, depth below pk) of a node and everything under it"""
+    return list(_paths(model).filter(ancestor_id=pk).values_list('descendant_id', 'depth'))
+
+
+def descendants(model, pk, max_depth=None):
+    """
+    Resources under a node, the node itself excluded
+
+    Args:
+        model: Hierarchy model
+        pk: Primary key of the node
+        max_depth: Deepest level returned, 1 for the direct children
+
+    Returns:
+        Queryset of model
+    """
+    paths = _paths(model).filter(ancestor_id=pk, depth__gte=1)
+    if max_depth is not None:
+        paths = paths.filter(depth__lte=max_depth)
+    return model._default_manager.filter(pk__in=paths.values('descendant_id'))
+
+
+def ancestors(model, pk):
+    """Resources above a node, the node itself excluded, as a queryset of model"""
+    paths = _paths(model).filter(descendant_id=pk, depth__gte=1)
+    return model._default_manager.filter(pk__in=paths.values('ancestor_id'))
+
+
+def ancestor_pks(model, pk):
+    """Primary keys of the resources above a node, nearest first"""
+    paths = _paths(model).filter(descendant_id=pk, depth__gte=1).order_by('depth')
+    return list(paths.values_list('ancestor_id', flat=True))
+
+
+def depth(model, pk):
+    """Number of partOf links from a node up to its root, None for a resource not in the tree"""
+    return _paths(model).filter(descendant_id=pk).aggregate(depth=Max('depth'))['depth']
+
+
+def check_parent(instance):
+    """
+    Refuse a partOf that would put a resource under itself
+
+    Raises:
+        ValueError: If the parent is the resource or one of its descendants
+    """
+    model = type(instance)
+    parent_pk = getattr(instance, f'{PARENT_FIELD}_id')
+    if parent_pk is None or instance.pk is None:
+        return
+    if parent_pk == instance.pk or _paths(model).filter(ancestor_id=instance.pk, descendant_id=parent_pk).exists():
+        raise ValueError(f"{model.__name__}/{instance.fhir_id} cannot be part of its own descendant")
+
+
+def move(model, pk, parent_pk):
+    """
+    Hang a node and its subtree under a new parent, or make it a root
+
+    Returns:
+        False when the parent lies in the subtree, which is left unchanged
+    """
+    subtree = _subtree(model, pk)
+    subtree_pks = [descendant for descendant, _ in subtree]
+    if parent_pk in subtree_pks:
+        return False
+
+    # Detach: drop the paths from the node's former ancestors into the subtree
+    _paths(model).filter(descendant_id__in=subtree_pks).exclude(ancestor_id__in=subtree_pks).delete()
+    if parent_pk is not None:
+        above = _paths(model).filter(descendant_id=parent_pk).values_list('ancestor_id', 'depth')
+        HierarchyClosure.objects.bulk_create([
+            HierarchyClosure(
+                resource_type=model.__name__, ancestor_id=ancestor, descendant_id=descendant,
+                depth=ancestor_depth + descendant_depth + 1,
+            )
+            for ancestor, ancestor_depth in above
+            for descendant, descendant_depth in subtree
+        ])
+    return True
+
+
+def remove(model, pk):
+    """Drop a deleted node; its children become roots of their own trees"""
+    above = _paths(model).filter(descendant_id=pk).values_list('ancestor_id', flat=True)
+    subtree = _paths(model).filter(ancestor_id=pk).values_list('descendant_id', flat=True)
+    _paths(model).filter(ancestor_id__in=list(above), descendant_id__in=list(subtree)).delete()
+
+
+def sync(resources):
+    """
+    Bring the closure rows of resources in line with their partOf
+
+    Adds the resources missing from their tree and moves those whose parent
+    changed; resources that no longer exist are removed. A partOf loop, which
+    signals refuse but bulk writes may store, leaves its last node a root.
+
+    Args:
+        resources: Iterable of (model, primary key) tuples, other models are ignored
+    """
+    pks_by_model = defaultdict(set)
+    for model, pk in resources:
+        if is_hierarchy_model(model):
+            pks_by_model[model].add(pk)
+
+    for model, pks in pks_by_model.items():
+        pks = sorted(pks)
+        for start in range(0, len(pks), HIERARCHY_CHUNK_SIZE):
+            chunk = pks[start:start + HIERARCHY_CHUNK_SIZE]
+            with transaction.atomic():
+                parents = dict(
+                    model._default_manager.filter(pk__in=chunk).values_list('pk', f'{PARENT_FIELD}_id')
+                )
+                HierarchyClosure.objects.bulk_create(
+                    [HierarchyClosure(resource_type=model.__name__, ancestor_id=pk, descendant_id=pk, depth=0)
+                     for pk in parents],
+                    ignore_conflicts=True,
+                )
+                current = dict(
+                    _paths(model).filter(descendant_id__in=chunk, depth=1).values_list('descendant_id', 'ancestor_id')
+                )
+                for pk, parent_pk in parents.items():
+                    if current.get(pk) != parent_pk:
+                        move(model, pk, parent_pk)
+                for pk in set(chunk) - parents.keys():
+                    remove(model, pk)
+
+
+def rebuild_hierarchy(model, batch_size=None):
+    """
+    Recompute the closure rows of every resource of a hierarchy model
+
+    A partOf loop, which only bulk writes can store, is cut where the walk up
+    from a resource reaches a node a second time.
+
+    Returns:
+        Number of closure rows stored
+    """
+    parents = dict(model._default_manager.values_list('pk', f'{PARENT_FIELD}_id').iterator())
+    with transaction.atomic():
+        stale = _paths(model)
+        # Closure rows have no signals or dependents, skip the delete collector
+        stale._raw_delete(stale.db)
+        stored, rows = 0, []
+        for pk in parents:
+            node, level, seen = pk, 0, set()
+            while node is not None and node not in seen:
+                seen.add(node)
+                rows.append(HierarchyClosure(
+                    resource_type=model.__name__, ancestor_id=node, descendant_id=pk, depth=level,
+                ))
+                node, level = parents.get(node), level + 1
+            if len(rows) >= HIERARCHY_CHUNK_SIZE:
+                HierarchyClosure.objects.bulk_create(rows, batch_size=batch_size)
+                stored, rows = stored + len(rows), []
+        HierarchyClosure.objects.bulk_create(rows, batch_size=batch_size)
+    return stored + len(rows)
@@ -0,0 +1,323 @@
+"""
+Resource history
+With FHIR_RESOURCE_HISTORY enabled, every change to how a resource renders
+appends a version to ResourceHistory: the resource as rendered then, with
+its meta.versionId and meta.lastUpdated, plus those two values on the meta
+row of resources that have one. No meta row is created for the others, so
+their current reads carry no meta.versionId and disagree with a vread of
+their latest version; only the version documents hold it.
+Versions are never rewritten; a delete appends a version without content.
+vread is one lookup on the unique (resource_type, fhir_id, version) key and
+_history pages walk that key, the (resource_type, id) index or the primary
+key newest first behind a signed cursor. The versions live in their own
+table, which reads of current resources never touch, so a growing history
+does not slow them down. core.signals schedules the resources a write
+changes and they are recorded when the transaction commits, like
+core.materialize; bulk writes that bypass signals call schedule() themselves.
+"""
+
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core import signing
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+
+from components.models import MetaElement
+from core import search_index
+from core.models import ResourceHistory
+from core.search import parse_date_range, parse_query
+from core.searchset import page_size
+from fhir_serializers import PREFETCH_PLANS, prefetch_for_serialization, serialize_to_fhir_dict
+
+
+# Resources loaded and recorded per transaction
+HISTORY_CHUNK_SIZE = 500
+
+# Tries at a chunk whose next versions a concurrent transaction recorded first
+RECORD_ATTEMPTS = 3
+
+CURSOR_SALT = 'core.history.cursor'
+
+HISTORY_PARAMETERS = frozenset({'_count', '_since', '_cursor'})
+
+RESPONSE_STATUS = {'POST': '201 Created', 'PUT': '200 OK', 'DELETE': '204 No Content'}
+
+
+def is_enabled():
+    return getattr(settings, 'FHIR_RESOURCE_HISTORY', False)
+
+
+def is_history_model(model):
+    """Whether versions of a model are recorded: it has a converter and the setting is on"""
+    return is_enabled() and model in PREFETCH_PLANS
+
+
+def _group(resources):
+    pks_by_model = defaultdict(set)
+    for model, pk in resources:
+        if is_history_model(model):
+            pks_by_model[model].add(pk)
+    return pks_by_model
+
+
+def _latest_versions(resource_type, fhir_ids):
+    rows = (
+        ResourceHistory.objects.filter(resource_type=resource_type, fhir_id__in=fhir_ids)
+        .values('fhir_id').annotate(latest=Max('version')).values_list('fhir_id', 'latest')
+    )
+    return dict(rows)
+
+
+def _next_version(meta, latest):
+    """Version after the latest recorded one; a first version keeps a numeric versionId it was stored with"""
+    if latest is not None:
+        return latest + 1
+    if meta is not None and meta.versionId and meta.versionId.isdigit():
+        return max(int(meta.versionId), 1)
+    return 1
+
+
+def _record_chunk(model, chunk, deleted, batch_size):
+    resource_type = model.__name__
+    # Contained resources and resources without a logical id have no history of their own
+    instances = list(prefetch_for_serialization(
+        model._default_manager.filter(pk__in=chunk, container_id__isnull=True).exclude(fhir_id__isnull=True).exclude(fhir_id='')
+    ))
+    tombstones = {pk: deleted[(model, pk)] for pk in set(chunk) - {instance.pk for instance in instances}
+                  if deleted.get((model, pk))}
+    latest = _latest_versions(resource_type, [instance.fhir_id for instance in instances] + list(tombstones.values()))
+    now = timezone.now()
+
+    rows, metas = [], []
+    for instance in instances:
+        previous = latest.get(instance.fhir_id)
+        version = _next_version(instance.meta, previous)
+        # A stored meta follows the history; none is created, the version document carries both values
+        if instance.meta is not None:
+            instance.meta.versionId, instance.meta.lastUpdated = str(version), now
+            metas.append(instance.meta)
+        document = serialize_to_fhir_dict(instance)
+        document['meta'] = {**document.get('meta', {}), 'versionId': str(version), 'lastUpdated': now.isoformat()}
+        rows.append(ResourceHistory(
+            resource_type=resource_type, fhir_id=instance.fhir_id, resource_id=instance.pk, version=version,
+            method='POST' if previous is None and version == 1 else 'PUT', last_updated=now, resource=document,
+        ))
+    for pk, fhir_id in tombstones.items():
+        rows.append(ResourceHistory(
+            resource_type=resource_type, fhir_id=fhir_id, resource_id=pk,
+            version=_next_version(None, latest.get(fhir_id)), method='DELETE', last_updated=now,
+        ))
+
+    # A bulk update sends no signals, which would schedule the resources again
+    MetaElement.objects.bulk_update(metas, ['versionId', 'lastUpdated'], batch_size=batch_size)
+    ResourceHistory.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def _record_retrying(model, chunk, deleted, batch_size):
+    """
+    Record a chunk, reading the latest versions again when another
+    transaction took a version number between that read and the insert
+    """
+    for attempt in range(1, RECORD_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                return _record_chunk(model, chunk, deleted, batch_size)
+        except IntegrityError:
+            if attempt == RECORD_ATTEMPTS:
+                raise
+
+
+def record(resources, deleted=None, batch_size=None):
+    """
+    Append a version for each resource, a delete version for the deleted ones
+
+    Args:
+        resources: Iterable of (model, primary key) tuples, models without
+            history are ignored
+        deleted: Dict of (model, primary key) -> logical id of deleted resources
+        batch_size: Rows per INSERT and UPDATE statement
+
+    Returns:
+        Number of versions recorded
+    """
+    deleted = deleted or {}
+    recorded = 0
+    for model, pks in _group(list(resources) + list(deleted)).items():
+        pks = sorted(pks)
+        for start in range(0, len(pks), HISTORY_CHUNK_SIZE):
+            recorded += _record_retrying(model, pks[start:start + HISTORY_CHUNK_SIZE], deleted, batch_size)
+    return recorded
+
+
+class PendingHistory:
+    """Resources to record once the transaction they changed in commits"""
+
+    def __init__(self):
+        self.resources = set()
+        self.deleted = {}
+
+    def __call__(self):
+        # The search index runs this ahead of itself, the on_commit call that follows has nothing left
+        resources, deleted = self.resources, self.deleted
+        self.resources, self.deleted = set(), {}
+        if resources or deleted:
+            record(resources, deleted)
+
+
+def _pending():
+    connection = transaction.get_connection()
+    pending = getattr(connection, 'pending_history', None)
+    # A rolled back transaction or savepoint drops the callback, start over then
+    if pending is None or not any(callback is pending for _, callback, _ in connection.run_on_commit):
+        pending = connection.pending_history = PendingHistory()
+        transaction.on_commit(pending)
+    # The index reads meta.lastUpdated, recorded here, whatever order the callbacks were registered in
+    search_index.run_before(pending)
+    return pending
+
+
+def schedule(resources):
+    """
+    Record a version of resources when the current transaction commits, or right away in autocommit mode
+
+    Args:
+        resources: Iterable of (model, primary key) tuples
+    """
+    resources = {(model, pk) for model, pk in resources if is_history_model(model)}
+    if not resources:
+        return
+    if not transaction.get_connection().in_atomic_block:
+        record(resources)
+        return
+    _pending().resources |= resources
+
+
+def schedule_delete(instance):
+    """Record the delete of a resource when the current transaction commits"""
+    model = type(instance)
+    if not is_history_model(model) or not instance.fhir_id or instance.container_id is not None:
+        return
+    deleted = {(model, instance.pk): instance.fhir_id}
+    if not transaction.get_connection().in_atomic_block:
+        record((), deleted)
+        return
+    _pending().deleted.update(deleted)
+
+
+def record_missing(model, batch_size=None):
+    """
+    Record a first version of every resource of a model that has none yet, e.g. after enabling history
+
+    Returns:
+        Number of versions recorded
+    """
+    recorded = ResourceHistory.objects.filter(resource_type=model.__name__, fhir_id=OuterRef('fhir_id'))
+    pks = model._default_manager.filter(~Exists(recorded)).values_list('pk', flat=True)
+    return record(((model, pk) for pk in pks.iterator()), batch_size=batch_size)
+
+
+def vread(resource_type, fhir_id, version):
+    """
+    One version of a resource
+
+    Returns:
+        ResourceHistory, whose resource is None for a delete, or None when the
+        version does not exist
+    """
+    try:
+        version = int(version)
+    except (TypeError, ValueError):
+        return None
+    return ResourceHistory.objects.filter(resource_type=resource_type, fhir_id=fhir_id, version=version).first()
+
+
+def encode_cursor(last_key):
+    return signing.dumps(last_key, salt=CURSOR_SALT)
+
+
+def decode_cursor(cursor):
+    """
+    Raises:
+        ValueError: If the cursor was not issued by encode_cursor
+    """
+    try:
+        return int(signing.loads(cursor, salt=CURSOR_SALT))
+    except (signing.BadSignature, TypeError, ValueError):
+        raise ValueError("Invalid history cursor")
+
+
+def _url(base_url, path, pairs=None):
+    url = f"{base_url.rstrip('/')}/{path}" if base_url else path
+    return f"{url}?{urlencode(pairs)}" if pairs else url
+
+
+def _entry(row, base_url):
+    path = f'{row.resource_type}/{row.fhir_id}'
+    entry = {'fullUrl': _url(base_url, path)}
+    if row.resource is not None:
+        entry['resource'] = row.resource
+    entry['request'] = {'method': row.method, 'url': row.resource_type if row.method == 'POST' else path}
+    entry['response'] = {
+        'status': RESPONSE_STATUS[row.method],
+        'etag': f'W/"{row.version}"',
+        'lastModified': row.last_updated.isoformat(),
+    }
+    return entry
+
+
+def history_bundle(resource_type=None, fhir_id=None, query=None, base_url=None):
+    """
+    Build one page of a history Bundle, newest version first
+
+    Args:
+        resource_type: Resource type, None for the history of the whole system
+        fhir_id: Logical id, None for the history of every resource of the type
+        query: _count, _since and the _cursor of a next link, as accepted by
+            core.search.parse_query
+        base_url: Server base of the fullUrl and link URLs, defaults to FHIR_BASE_URL
+
+    Raises:
+        ValueError: If a parameter or the cursor is not valid
+    """
+    if base_url is None:
+        base_url = getattr(settings, 'FHIR_BASE_URL', '')
+    pairs = parse_query(query or [])
+    unsupported = sorted({name for name, _ in pairs} - HISTORY_PARAMETERS)
+    if unsupported:
+        raise ValueError(f"Unsupported _history parameter: {', '.join(unsupported)}")
+    options = dict(pairs)
+    size = page_size(options.get('_count'))
+
+    rows = ResourceHistory.objects.all()
+    path = '_history'
+    if resource_type is not None:
+        rows = rows.filter(resource_type=resource_type)
+        path = f'{resource_type}/_history'
+    # One logical id walks the unique version key, wider histories the primary key
+    key = 'pk'
+    if fhir_id is not None:
+        rows = rows.filter(fhir_id=fhir_id)
+        path = f'{resource_type}/{fhir_id}/_history'
+        key = 'version'
+    if options.get('_since'):
+        rows = rows.filter(last_updated__gte=parse_date_range(options['_since'])[0])
+    if options.get('_cursor'):
+        rows = rows.filter(**{f'{key}__lt': decode_cursor(options['_cursor'])})
+    rows = list(rows.order_by(f'-{key}')[:size + 1])
+
+    links = [{'relation': 'self', 'url': _url(base_url, path, pairs)}]
+    if len(rows) > size:
+        rows = rows[:size]
+        next_pairs = [(name, value) for name, value in pairs if name != '_cursor']
+        next_pairs.append(('_cursor', encode_cursor(getattr(rows[-1], key))))
+        links.append({'relation': 'next', 'url': _url(base_url, path, next_pairs)})
+    return {
+        'resourceType': 'Bundle',
+        'type': 'history',
+        'link': links,
+        'entry': [_entry(row, base_url) for row in rows],
+    }
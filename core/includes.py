@@ -0,0 +1,125 @@
+"""
+_include / _revinclude resolution
+Finds the resources a page of search results references (_include) or is
+referenced by (_revinclude) through the reference index of core.search_index,
+which covers FK references and Reference.reference strings alike, and loads
+them with one query batch per resource type.
+"""
+
+from collections import defaultdict, namedtuple
+
+from django.db.models import Q
+
+from core import registry
+from core.models import ReferenceIndex
+from core.search_params import REFERENCE, SEARCH_MODELS, get_parameters
+
+
+# SourceType:param[:TargetType], param '*' for every reference parameter
+Include = namedtuple('Include', 'source_type param target_type')
+
+
+def parse_include(value):
+    """
+    Parse an _include or _revinclude value, e.g. PractitionerRole:organization
+
+    Raises:
+        ValueError: If the source type or parameter is not searchable
+    """
+    parts = value.split(':')
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Invalid include: {value}")
+    source_type, param = parts[:2]
+    target_type = parts[2] if len(parts) == 3 else None
+    if param != '*':
+        parameter = get_parameters(source_type).get(param)
+        if parameter is None or parameter.type != REFERENCE:
+            raise ValueError(f"Unknown reference search parameter: {source_type}.{param}")
+    elif source_type not in SEARCH_MODELS:
+        raise ValueError(f"Unsupported resource type: {source_type}")
+    return Include(source_type, param, target_type)
+
+
+def _condition(include):
+    condition = Q(resource_type=include.source_type)
+    if include.param != '*':
+        condition &= Q(param=include.param)
+    return condition
+
+
+def included_resources(resource_type, resources, includes):
+    """
+    Resources referenced from resources through _include parameters
+
+    Args:
+        resource_type: Type of the search results
+        resources: Result rows of resource_type
+        includes: Parsed _include values, their source type must be resource_type
+
+    Returns:
+        Set of (model, primary key) tuples
+    """
+    condition = Q()
+    for include in includes:
+        if include.source_type != resource_type:
+            raise ValueError(f"_include source type must be {resource_type}: {include.source_type}")
+        include_condition = _condition(include)
+        if include.target_type:
+            include_condition &= Q(target_type=include.target_type)
+        condition |= include_condition
+    if not includes or not resources:
+        return set()
+
+    keys = ReferenceIndex.objects.filter(
+        condition, resource_id__in=[resource.pk for resource in resources]
+    ).values_list('target_type', 'target_id').distinct()
+    return set(registry.resolve(keys).values())
+
+
+def revincluded_resources(resource_type, resources, revincludes):
+    """
+    Resources referencing resources through _revinclude parameters
+
+    Args:
+        resource_type: Type of the search results
+        resources: Result rows of resource_type
+        revincludes: Parsed _revinclude values
+
+    Returns:
+        Set of (model, primary key) tuples
+    """
+    revincludes = [
+        revinclude for revinclude in revincludes
+        if revinclude.target_type in (None, resource_type)
+    ]
+    if not revincludes or not resources:
+        return set()
+    condition = Q()
+    for revinclude in revincludes:
+        condition |= _condition(revinclude)
+
+    rows = ReferenceIndex.objects.filter(
+        condition, target_type=resource_type,
+        target_id__in=[resource.fhir_id for resource in resources if resource.fhir_id],
+    ).values_list('resource_type', 'resource_id').distinct()
+    return {(SEARCH_MODELS[source_type], pk) for source_type, pk in rows}
+
+
+def load_resources(keys, queryset_plan):
+    """
+    Load resources with one query batch per type
+
+    Args:
+        keys: Iterable of (model, primary key) tuples
+        queryset_plan: Callable applied to each type's queryset, e.g. prefetch_for_serialization
+
+    Returns:
+        List of model instances, grouped by type and in primary-key order
+    """
+    pks_by_model = defaultdict(set)
+    for model, pk in keys:
+        pks_by_model[model].add(pk)
+    instances = []
+    for model, pks in pks_by_model.items():
+        instances += queryset_plan(model._default_manager.filter(pk__in=pks).order_by('pk'))
+    return instances
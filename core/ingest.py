@@ -0,0 +1,497 @@
+"""
+Bulk ingestion of FHIR resources
+Reads NDJSON or Bundle files into the Django models. Each batch of resources
+is parsed (core.parsers) into a graph of unsaved rows and written with one
+bulk_create per table and dependency level, instead of several queries per
+element. References are resolved by logical id against the batch and then
+the database; those whose target is not imported yet are retried at the end
+of the run, so files can be loaded in any order.
+"""
+
+import gzip
+import json
+import uuid
+from collections import Counter, defaultdict, namedtuple
+from itertools import islice
+from pathlib import Path
+
+from django.db import connections, router, transaction
+from django.db.models import ForeignObjectRel, Max, Model
+
+from components.models import CodeableConcept
+from core import cache, hierarchy, history, materialize, registry, search_index
+from core.concepts import concept_hash
+from core.copy_loader import COPY_MODELS, copy_rows
+from core.graph import referencing_resources
+from core.parsers import RESOURCE_PARSERS, parse_reference
+from core.terminology import get_terminology
+from fhir_serializers import validate_fhir_dict
+
+
+DEFAULT_BATCH_SIZE = 1000
+
+FK, M2M = 'fk', 'm2m'
+
+# A relation to store once both ends exist: source.<field_name> = target, or
+# source.<field_name>.add(target) for M2M. Each end is a row of the batch or
+# a (resourceType, id) key.
+Link = namedtuple('Link', 'kind source field_name target')
+
+
+def iter_resources(path):
+    """
+    Yield the resources of a FHIR file
+
+    Args:
+        path: NDJSON file (.ndjson, optionally .gz), Bundle or single resource JSON file
+
+    Yields:
+        Resource dictionaries
+    """
+    path = Path(path)
+    opener = gzip.open if path.suffix == '.gz' else open
+    with opener(path, 'rt', encoding='utf-8') as source:
+        if '.ndjson' in path.suffixes:
+            for line in source:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+            return
+
+        data = json.load(source)
+        if data.get('resourceType') == 'Bundle':
+            for entry in data.get('entry', []):
+                if entry.get('resource'):
+                    yield entry['resource']
+        else:
+            yield data
+
+
+def lookup_resources(keys):
+    """
+    Find resources already in the database by logical id, through core.registry
+
+    Args:
+        keys: Iterable of (resourceType, id) tuples of supported types
+
+    Returns:
+        Dict of (resourceType, id) -> primary key for the keys that exist
+    """
+    return {key: pk for key, (_, pk) in registry.resolve(keys).items()}
+
+
+def insert_order(rows):
+    """
+    Group rows so every row is inserted after the unsaved rows it points to
+
+    Returns:
+        List of (model, rows) in insertion order
+    """
+    depths = {}
+
+    def depth(row):
+        if id(row) not in depths:
+            depths[id(row)] = 0
+            targets = (field.get_cached_value(row, None) for field in row._meta.concrete_fields if field.is_relation)
+            depths[id(row)] = max(
+                (depth(target) + 1 for target in targets if target is not None and target.pk is None), default=0
+            )
+        return depths[id(row)]
+
+    groups = defaultdict(list)
+    for row in rows:
+        groups[(depth(row), type(row))].append(row)
+    return [(model, group) for (_, model), group in sorted(groups.items(), key=lambda item: item[0][0])]
+
+
+def insert_rows(model, rows, batch_size=None, copy=False):
+    """Insert rows, setting their primary keys; copy loads component tables through COPY"""
+    connection = connections[router.db_for_write(model)]
+    if copy and model in COPY_MODELS:
+        copy_rows(model, rows)
+    elif connection.features.can_return_rows_from_bulk_insert:
+        model._default_manager.bulk_create(rows, batch_size=batch_size)
+    else:
+        # Children need the keys, which bulk_create cannot return on this backend
+        for row in rows:
+            row.save(force_insert=True)
+
+
+def _end_model(end):
+    return type(end) if isinstance(end, Model) else RESOURCE_PARSERS[end[0]][0]
+
+
+def apply_links(links, known, baseline, batch_size=None):
+    """
+    Store links whose ends are all saved
+
+    Args:
+        links: Links to apply
+        known: Dict of (resourceType, id) -> primary key
+        baseline: Dict of resource model -> highest primary key before the import
+        batch_size: Rows per UPDATE/INSERT statement
+
+    Returns:
+        Links with an end that is not in known, left untouched
+    """
+    def pk(end):
+        return end.pk if isinstance(end, Model) else known.get(end)
+
+    unresolved = []
+    updates = defaultdict(dict)
+    through_rows = defaultdict(list)
+    touched, linked = set(), set()
+    for link in links:
+        source_pk, target_pk = pk(link.source), pk(link.target)
+        if source_pk is None or target_pk is None:
+            unresolved.append(link)
+            continue
+        model = _end_model(link.source)
+        field = model._meta.get_field(link.field_name)
+        if link.kind == FK:
+            updates[(model, field)][source_pk] = target_pk
+        else:
+            through = field.remote_field.through
+            through_rows[through].append(through(**{
+                through._meta.get_field(field.m2m_field_name()).attname: source_pk,
+                through._meta.get_field(field.m2m_reverse_field_name()).attname: target_pk,
+            }))
+        for end, end_pk in ((link.source, source_pk), (link.target, target_pk)):
+            end_model = _end_model(end)
+            if end_model in baseline:
+                linked.add((end_model, end_pk))
+                if end_pk <= baseline[end_model]:
+                    touched.add((end_model, end_pk))
+
+    # Resources that existed before the import are rendered differently now
+    stale = set(touched)
+    for model, pks in _group_pks(touched).items():
+        for instance in model.objects.filter(pk__in=pks):
+            stale |= referencing_resources(instance)
+
+    for (model, field), values in updates.items():
+        rows = [model(pk=source_pk, **{field.attname: target_pk}) for source_pk, target_pk in values.items()]
+        model._default_manager.bulk_update(rows, [field.name], batch_size=batch_size)
+    hierarchy.sync((model, source_pk) for (model, _), values in updates.items() for source_pk in values)
+    for through, rows in through_rows.items():
+        through._default_manager.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+
+    for model, pk_value in stale:
+        cache.invalidate(model.__name__, pk_value)
+    # Resources of earlier batches were indexed and rendered without the links stored now
+    history.schedule(stale | linked)
+    search_index.schedule(stale | linked)
+    materialize.schedule(stale | linked)
+    return unresolved
+
+
+def _group_pks(keys):
+    grouped = defaultdict(list)
+    for model, pk in keys:
+        grouped[model].append(pk)
+    return grouped
+
+
+def describe_reference(end):
+    """Human readable target of an unresolved link end"""
+    return '/'.join(end) if isinstance(end, tuple) else repr(end)
+
+
+class IngestBatch:
+    """
+    Unsaved rows of a batch of resources and the links between them
+
+    Parsers add rows with add() and record references with reference() and m2m();
+    write() then inserts everything in dependency order. CodeableConcepts go
+    through concept(), which shares one row per distinct concept across the
+    batch and with the pool already in the database (core.concepts).
+    """
+
+    def __init__(self):
+        self.rows = {}        # (resourceType, id) -> rows parsed for that resource
+        self.links = {}       # (resourceType, id) -> links recorded for that resource
+        self.resources = {}   # (resourceType, id) -> resource row
+        self.data = {}        # (resourceType, id) -> FHIR dictionary
+        self.postponed = {}   # (resourceType, id) -> (FHIR dictionary, reason), for resources not written
+        self.concepts = {}    # content hash -> (pooled concept, its codings)
+        self.unresolved = []
+        self._rows = self._links = None
+
+    def parse(self, data):
+        """
+        Parse one resource into the batch
+
+        Raises:
+            MissingElementError: If the resource lacks an element its model requires
+        """
+        self._rows, self._links = [], []
+        resource = RESOURCE_PARSERS[data['resourceType']][1](self, data)
+        key = (data['resourceType'], resource.fhir_id)
+        self.rows[key], self.links[key], self.resources[key] = self._rows, self._links, resource
+        self.data[key] = data
+        return resource
+
+    def add(self, row):
+        """Add an unsaved row, FKs to other unsaved rows may be set directly"""
+        self._rows.append(row)
+        return row
+
+    def concept(self, concept, codings):
+        """
+        Intern an unsaved CodeableConcept with its unsaved codings
+
+        Returns:
+            The batch's row for this content, concept itself if it is the first
+        """
+        content_hash = concept_hash(concept.fhir_id, concept.text, codings)
+        if content_hash not in self.concepts:
+            concept.content_hash = content_hash
+            for coding in codings:
+                coding.codeable_concept = concept
+            self.concepts[content_hash] = (concept, codings)
+        return self.concepts[content_hash][0]
+
+    def _pool_rows(self):
+        """Rows of the batch's concepts missing from the pool; the others take the stored row's key"""
+        hashes = list(self.concepts)
+        stored = {}
+        for start in range(0, len(hashes), DEFAULT_BATCH_SIZE):
+            # Oldest row first if concurrent writers pooled the same content twice
+            stored.update(
+                CodeableConcept.objects.filter(content_hash__in=hashes[start:start + DEFAULT_BATCH_SIZE])
+                .order_by('-pk').values_list('content_hash', 'pk')
+            )
+        rows = []
+        for content_hash, (concept, codings) in self.concepts.items():
+            if content_hash in stored:
+                concept.pk = stored[content_hash]
+                concept._state.adding = False
+            else:
+                rows += [concept] + codings
+        return rows
+
+    def m2m(self, row, field_name, target):
+        """Add target, an unsaved row, to a many-to-many field of row"""
+        if target is not None:
+            self._links.append(Link(M2M, row, field_name, target))
+
+    def reference(self, row, name, reference):
+        """
+        Record a reference from row to another resource
+
+        Args:
+            row: Row of this batch
+            name: Relation on row's model: FK, many-to-many, or the reverse accessor
+                of an FK/many-to-many on the target model
+            reference: FHIR Reference dictionary
+        """
+        if not reference:
+            return
+        field = row._meta.get_field(name)
+        key = parse_reference(reference)
+        if key is None or key[0] != field.related_model.__name__ or key[0] not in RESOURCE_PARSERS:
+            self.unresolved_reference(reference)
+            return
+
+        kind = M2M if field.many_to_many else FK
+        if isinstance(field, ForeignObjectRel):
+            self._links.append(Link(kind, key, field.field.name, row))
+        else:
+            self._links.append(Link(kind, row, name, key))
+
+    def unresolved_reference(self, reference):
+        """Record a reference that cannot be stored"""
+        self.unresolved.append(reference.get('reference') or reference.get('display') or str(reference))
+
+    def _postpone_incomplete(self, existing):
+        """Take out resources with a required reference to a resource that does not exist yet"""
+        changed = True
+        while changed:
+            changed = False
+            for key, links in self.links.items():
+                if key in self.postponed:
+                    continue
+                for link in links:
+                    if link.kind != FK or not isinstance(link.source, Model):
+                        continue
+                    if link.source._meta.get_field(link.field_name).null:
+                        continue
+                    if link.target in existing or (link.target in self.resources and link.target not in self.postponed):
+                        continue
+                    reason = f"required reference {describe_reference(link.target)} not found"
+                    self.postponed[key] = (self.data[key], reason)
+                    changed = True
+                    break
+        for key in self.postponed:
+            del self.rows[key], self.links[key], self.resources[key]
+
+    def write(self, baseline, batch_size=None, copy=False):
+        """
+        Insert the batch and store the links it can resolve
+
+        Args:
+            baseline: Dict of resource model -> highest primary key before the import
+            batch_size: Rows per INSERT statement
+            copy: Load the component tables with core.copy_loader
+
+        Resources with a required reference to a resource that is not in the
+        database yet are not written; they are left in postponed.
+
+        Returns:
+            Links to resources that are not in the database yet
+        """
+        keys = {
+            end for links in self.links.values() for link in links
+            for end in (link.source, link.target) if isinstance(end, tuple)
+        }
+        existing = lookup_resources(keys - self.resources.keys())
+        self._postpone_incomplete(existing)
+
+        after_insert = []
+        for links in self.links.values():
+            for link in links:
+                if link.kind == FK and isinstance(link.source, Model):
+                    field = link.source._meta.get_field(link.field_name)
+                    if link.target in existing:
+                        setattr(link.source, field.attname, existing[link.target])
+                        continue
+                    if link.target in self.resources and not field.null:
+                        setattr(link.source, link.field_name, self.resources[link.target])
+                        continue
+                # Nullable links within the batch are stored after the insert, so
+                # resources may reference each other in cycles
+                after_insert.append(link)
+
+        rows = [row for rows in self.rows.values() for row in rows] + self._pool_rows()
+        for model, group in insert_order(rows):
+            insert_rows(model, group, batch_size, copy)
+        registry.register(self.resources.values(), batch_size)
+        written = [(type(resource), resource.pk) for resource in self.resources.values()]
+        hierarchy.sync(written)
+        history.schedule(written)
+        search_index.schedule(written)
+        materialize.schedule(written)
+
+        known = dict(existing)
+        known.update((key, resource.pk) for key, resource in self.resources.items())
+        return apply_links(after_insert, known, baseline, batch_size)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _ingest_chunk(chunk, result, baseline, batch_size, validate, copy):
+    """
+    Parse and write one batch of resources, counting the outcome into result
+
+    Returns:
+        (links to resources not in the database yet, postponed resources)
+    """
+    candidates = {}
+    for data in chunk:
+        resource_type = data.get('resourceType')
+        if resource_type not in RESOURCE_PARSERS:
+            result['skipped'][resource_type or 'unknown'] += 1
+            continue
+        if not data.get('id'):
+            data['id'] = str(uuid.uuid4())
+        key = (resource_type, data['id'])
+        if key in candidates:
+            result['skipped'][resource_type] += 1
+            continue
+        candidates[key] = data
+
+    existing = lookup_resources(candidates)
+    batch = IngestBatch()
+    for key, data in candidates.items():
+        if key in existing:
+            result['skipped'][key[0]] += 1
+            continue
+        try:
+            if validate:
+                validate_fhir_dict(data)
+                get_terminology().check_codings(data)
+            batch.parse(data)
+        except (ValueError, TypeError) as e:
+            result['errors'].append(f"{'/'.join(key)}: {e}")
+
+    with transaction.atomic():
+        pending = batch.write(baseline, batch_size, copy)
+    result['created'].update(key[0] for key in batch.resources)
+    result['unresolved'] += batch.unresolved
+    return pending, batch.postponed
+
+
+def ingest_resources(resources, batch_size=DEFAULT_BATCH_SIZE, validate=False, copy=False):
+    """
+    Write FHIR resources into the Django models
+
+    Resources whose logical id already exists are skipped, as are unsupported
+    resource types. Resources without an id are given a random UUID.
+
+    Args:
+        resources: Iterable of FHIR resource dictionaries
+        batch_size: Resources parsed and written per transaction
+        validate: Run full fhir.resources validation on every resource first,
+            and check its codings against the loaded terminology (core.terminology)
+        copy: Load the component tables with COPY through staging tables
+
+    Returns:
+        Dict with 'created' and 'skipped' counts per resource type, 'errors'
+        and 'unresolved' (references that could not be stored)
+    """
+    result = {'created': Counter(), 'skipped': Counter(), 'errors': [], 'unresolved': []}
+    baseline = {
+        model: model.objects.aggregate(max_pk=Max('pk'))['max_pk'] or 0
+        for model, _ in RESOURCE_PARSERS.values()
+    }
+
+    pending, postponed = [], {}
+    for chunk in _chunks(resources, batch_size):
+        links, waiting = _ingest_chunk(chunk, result, baseline, batch_size, validate, copy)
+        pending += links
+        postponed.update(waiting)
+
+    # Resources whose required references came later in the input
+    while postponed:
+        waiting_before, postponed = postponed, {}
+        for chunk in _chunks([data for data, _ in waiting_before.values()], batch_size):
+            links, waiting = _ingest_chunk(chunk, result, baseline, batch_size, validate, copy)
+            pending += links
+            postponed.update(waiting)
+        if len(postponed) == len(waiting_before):
+            result['errors'] += [f"{'/'.join(key)}: {reason}" for key, (_, reason) in postponed.items()]
+            break
+
+    if pending:
+        known = lookup_resources({
+            end for link in pending for end in (link.source, link.target) if isinstance(end, tuple)
+        })
+        with transaction.atomic():
+            pending = apply_links(pending, known, baseline, batch_size)
+        result['unresolved'] += [
+            describe_reference(link.target if isinstance(link.source, Model) else link.source) for link in pending
+        ]
+
+    result['created'], result['skipped'] = dict(result['created']), dict(result['skipped'])
+    return result
+
+
+def ingest_files(paths, batch_size=DEFAULT_BATCH_SIZE, validate=False, copy=False):
+    """
+    Write the resources of FHIR files into the Django models
+
+    Args:
+        paths: NDJSON, Bundle or single resource files
+        batch_size: Resources parsed and written per transaction
+        validate: Run full fhir.resources validation on every resource first
+        copy: Load the component tables with COPY through staging tables
+
+    Returns:
+        Result dictionary as returned by ingest_resources
+    """
+    resources = (resource for path in paths for resource in iter_resources(path))
+    return ingest_resources(resources, batch_size=batch_size, validate=validate, copy=copy)
@@ -0,0 +1,102 @@
+"""
+Interval lookups on the date search index
+DateIndex holds every date, dateTime and Period value as a half-open range
+[low, high) next to its resource type and parameter. The FHIR date prefixes
+reduce to two tests against the range of the search value: overlap (ap, gt,
+lt, ge, le) and containment (eq, ne, sa, eb). On PostgreSQL both are range
+operators served by one GiST index over (resource_type, param,
+tstzrange(low, high)). Other backends only have B-trees, which bound one
+column at a time, so every row also stores span, the power-of-SPAN_BASE
+bucket of its length: an overlap then reads, per bucket, only the rows
+starting at most one bucket width before the search range, and containment
+seeks on low or high.
+"""
+
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import BooleanField, DateTimeField, F, Func, Q, Value
+
+from core.search_params import DATETIME_PRECISION, MIN_DATETIME
+
+
+SPAN_BASE = 4
+
+# Bucket SPAN_LEVELS - 1 holds lengths up to SPAN_BASE ** 20 seconds, past MAX_DATETIME - MIN_DATETIME
+SPAN_LEVELS = 21
+
+RANGE_INDEX = 'search_date_range'
+
+
+def span_level(low, high):
+    """Smallest bucket whose width, SPAN_BASE ** level seconds, is at least the length of [low, high)"""
+    seconds = (high - low).total_seconds()
+    level = 0
+    while level < SPAN_LEVELS - 1 and SPAN_BASE ** level < seconds:
+        level += 1
+    return level
+
+
+def date_row_values(low, high):
+    """(low, high, span) stored for a range, an inverted range narrowed to the instant at its low end"""
+    # An empty range would be contained in every search range on PostgreSQL
+    high = max(high, low + DATETIME_PRECISION)
+    return low, high, span_level(low, high)
+
+
+class RangeTest(Func):
+    """tstzrange(low, high) compared to a search range with a PostgreSQL range operator, None bounds left open"""
+    output_field = BooleanField()
+
+    def __init__(self, operator, lower, upper):
+        self.operator = operator
+        super().__init__(
+            F('low'), F('high'),
+            Value(lower, output_field=DateTimeField()), Value(upper, output_field=DateTimeField()),
+        )
+
+    def as_sql(self, compiler, connection, **extra_context):
+        (low, low_params), (high, high_params), (lower, lower_params), (upper, upper_params) = (
+            compiler.compile(expression) for expression in self.get_source_expressions()
+        )
+        # Same expression as the RANGE_INDEX definition, or PostgreSQL will not use the index
+        sql = (
+            f"tstzrange({low}, {high}, '[)') {self.operator} "
+            f"tstzrange({lower}::timestamptz, {upper}::timestamptz, '[)')"
+        )
+        return sql, (*low_params, *high_params, *lower_params, *upper_params)
+
+
+def overlaps(lower, upper):
+    """Condition on DateIndex rows sharing an instant with [lower, upper), None for an open bound"""
+    if connection.vendor == 'postgresql':
+        return Q(RangeTest('&&', lower, upper))
+    if lower is None:
+        return Q(low__lt=upper) if upper is not None else Q()
+    if upper is None:
+        return Q(high__gt=lower)
+    buckets = Q()
+    for level in range(SPAN_LEVELS):
+        width = timedelta(seconds=SPAN_BASE ** level)
+        bucket = Q(span=level, low__lt=upper, high__gt=lower)
+        # A row of this bucket ending after lower starts less than one width before it
+        if lower - MIN_DATETIME > width:
+            bucket &= Q(low__gt=lower - width)
+        buckets |= bucket
+    # Repeated outside the buckets so a planner without statistics still bounds its scan
+    # on low and rejects most rows before weighing the buckets
+    return Q(low__lt=upper, high__gt=lower) & buckets
+
+
+def contained_by(lower, upper):
+    """Condition on DateIndex rows lying within [lower, upper), None for an open bound"""
+    if connection.vendor == 'postgresql':
+        return Q(RangeTest('<@', lower, upper))
+    condition = Q()
+    if lower is not None:
+        condition &= Q(low__gte=lower)
+    if upper is not None:
+        # low <= upper follows from high <= upper and bounds the seek on low
+        condition &= Q(low__lte=upper, high__lte=upper)
+    return condition
+
@@ -0,0 +1,94 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.benchmark import DEFAULT_SAMPLE_SIZE, DEFAULT_TOLERANCE, compare_results, run_benchmarks
+from core.synthetic import populate
+
+
+class Command(BaseCommand):
+    help = "Benchmark FHIR serialization and bulk export on a generated population"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--patients', type=int, default=1000,
+            help="Patients to generate, the other resource types are scaled from it"
+        )
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the data generator")
+        parser.add_argument(
+            '--encounters-per-patient', type=int, default=2,
+            help="Encounters generated per patient"
+        )
+        parser.add_argument(
+            '--sample-size', type=int, default=DEFAULT_SAMPLE_SIZE,
+            help="Resources of each type converted per converter benchmark"
+        )
+        parser.add_argument(
+            '--existing', action='store_true',
+            help="Benchmark the configured database as it is instead of a generated test database"
+        )
+        parser.add_argument('--output', help="File the JSON results are written to")
+        parser.add_argument('--baseline', help="JSON results to compare against, regressions fail the command")
+        parser.add_argument(
+            '--tolerance', type=float, default=DEFAULT_TOLERANCE,
+            help="Fraction by which throughput and peak memory may be worse than the baseline"
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as baseline_file:
+                    baseline = json.load(baseline_file)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read baseline {options['baseline']}: {e}")
+
+        if options['existing']:
+            document = run_benchmarks(options['sample_size'])
+        else:
+            document = self.benchmark_generated(options)
+
+        for name, result in document['results'].items():
+            self.stdout.write(
+                f"{name:<32} {result['count']:>8} in {result['seconds']:>8.3f}s "
+                f"{result['per_second'] or 0:>10.1f}/s {result['queries']:>6} queries "
+                f"{result['peak_memory'] / 2 ** 20:>8.1f} MiB"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(document, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            regressions = compare_results(document, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError("Regressions against baseline:\n" + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against baseline"))
+
+    def benchmark_generated(self, options):
+        """Generate the population in a throwaway test database and benchmark it"""
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            start = time.perf_counter()
+            result = populate(
+                options['patients'], seed=options['seed'],
+                encounters_per_patient=options['encounters_per_patient'],
+            )
+            self.stdout.write(
+                f"Generated {sum(result['created'].values())} resources in {time.perf_counter() - start:.1f}s"
+            )
+            for error in result['errors']:
+                self.stderr.write(error)
+
+            document = run_benchmarks(options['sample_size'])
+            document['environment'].update(
+                seed=options['seed'], patients=options['patients'],
+                encounters_per_patient=options['encounters_per_patient'],
+            )
+            return document
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.concepts import deduplicate_concepts
+
+
+class Command(BaseCommand):
+    help = "Fold stored CodeableConcept copies into the shared concept pool and delete orphaned ones"
+
+    def handle(self, *args, **options):
+        counts = deduplicate_concepts()
+        self.stdout.write(
+            f"{counts['hashed']} concepts hashed, {counts['merged']} copies merged, "
+            f"{counts['collected']} orphaned concepts deleted"
+        )
+        self.stdout.write(self.style.SUCCESS("Concept pool deduplicated"))
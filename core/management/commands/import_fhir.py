@@ -0,0 +1,54 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.ingest import DEFAULT_BATCH_SIZE, ingest_files
+
+
+class Command(BaseCommand):
+    help = "Import FHIR resources from NDJSON (optionally gzip-compressed) or Bundle files"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='+',
+            help="Files to import; directories are expanded to the .ndjson, .ndjson.gz and .json files they hold"
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help="Resources parsed and written per transaction"
+        )
+        parser.add_argument(
+            '--validate', action='store_true',
+            help="Validate every resource with fhir.resources before writing it"
+        )
+        parser.add_argument(
+            '--copy', action='store_true',
+            help="Load the component tables with COPY through staging tables (PostgreSQL)"
+        )
+
+    def handle(self, *args, **options):
+        files = []
+        for path in map(Path, options['paths']):
+            if path.is_dir():
+                files += sorted(
+                    child for child in path.iterdir()
+                    if child.name.endswith(('.ndjson', '.ndjson.gz', '.json')) and child.name != 'manifest.json'
+                )
+            elif path.is_file():
+                files.append(path)
+            else:
+                raise CommandError(f"No such file or directory: {path}")
+
+        result = ingest_files(
+            files, batch_size=options['batch_size'], validate=options['validate'], copy=options['copy']
+        )
+
+        for resource_type, count in sorted(result['created'].items()):
+            self.stdout.write(f"{resource_type}: {count} created")
+        for resource_type, count in sorted(result['skipped'].items()):
+            self.stdout.write(f"{resource_type}: {count} skipped (existing, duplicate or unsupported)")
+        for error in result['errors']:
+            self.stderr.write(error)
+        if result['unresolved']:
+            self.stderr.write(f"{len(result['unresolved'])} references could not be resolved")
+        self.stdout.write(self.style.SUCCESS(f"Imported {sum(result['created'].values())} resources"))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.terminology_loader import DEFAULT_CHUNK_SIZE, FORMATS, load_release
+
+
+class Command(BaseCommand):
+    help = "Bulk-load a code system release (CSV, LOINC or SNOMED CT RF2) into the code system table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('system', help="Code system URL, e.g. http://loinc.org")
+        parser.add_argument(
+            'paths', nargs='+',
+            help="Release files (optionally gzip-compressed); RF2 also takes Snapshot or Delta directories"
+        )
+        parser.add_argument(
+            '--format', dest='file_format', choices=FORMATS, default='csv',
+            help="Release format: csv (code, display, active columns), loinc (Loinc.csv) or rf2"
+        )
+        parser.add_argument('--release', dest='version', help="Release version recorded on the changed concepts")
+        parser.add_argument('--code-column', default='code', help="Code column of a csv release")
+        parser.add_argument('--display-column', default='display', help="Display column of a csv release")
+        parser.add_argument('--active-column', default='active', help="Optional status column of a csv release")
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_CHUNK_SIZE,
+            help="Rows compared and written per transaction"
+        )
+
+    def handle(self, *args, **options):
+        csv_columns = {}
+        if options['file_format'] == 'csv':
+            csv_columns = {
+                'code_column': options['code_column'],
+                'display_column': options['display_column'],
+                'active_column': options['active_column'],
+            }
+        try:
+            result = load_release(
+                options['system'], options['paths'], file_format=options['file_format'],
+                version=options['version'], chunk_size=options['batch_size'], **csv_columns
+            )
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(str(e))
+
+        for path, counts in result.items():
+            self.stdout.write(f"{path}: {counts['read']} rows read, {counts['written']} concepts written")
+        written = sum(counts['written'] for counts in result.values())
+        self.stdout.write(self.style.SUCCESS(f"Loaded {options['system']}: {written} rows written"))
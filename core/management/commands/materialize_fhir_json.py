@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.materialize import is_enabled, rebuild_materialized
+from fhir_serializers import RESOURCE_MODELS
+
+
+class Command(BaseCommand):
+    help = "Render the materialized FHIR document (fhir_json) of every resource"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--type', dest='resource_types', action='append',
+            help="Resource type to render (repeatable), defaults to all supported types"
+        )
+        parser.add_argument(
+            '--missing', action='store_true',
+            help="Only render resources without a stored document"
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Rows per UPDATE statement"
+        )
+
+    def handle(self, *args, **options):
+        if not is_enabled():
+            raise CommandError("FHIR_MATERIALIZED_JSON is not enabled")
+        resource_types = options['resource_types'] or list(RESOURCE_MODELS)
+        unknown = [resource_type for resource_type in resource_types if resource_type not in RESOURCE_MODELS]
+        if unknown:
+            raise CommandError(f"Unsupported resource type: {', '.join(unknown)}")
+
+        for resource_type in resource_types:
+            count = rebuild_materialized(
+                RESOURCE_MODELS[resource_type], missing_only=options['missing'], batch_size=options['batch_size']
+            )
+            self.stdout.write(f"{resource_type}: {count} documents stored")
+        self.stdout.write(self.style.SUCCESS("Materialized documents rebuilt"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.availability import AVAILABILITY_MODELS, rebuild_availability
+
+
+class Command(BaseCommand):
+    help = "Rebuild the weekly availability index of HealthcareService and PractitionerRole"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--type', dest='resource_types', action='append',
+            help="Resource type to rebuild (repeatable), defaults to every type with availability"
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Index rows per INSERT statement"
+        )
+
+    def handle(self, *args, **options):
+        models = {model.__name__: model for model in AVAILABILITY_MODELS}
+        resource_types = options['resource_types'] or list(models)
+        unknown = [resource_type for resource_type in resource_types if resource_type not in models]
+        if unknown:
+            raise CommandError(f"Unsupported resource type: {', '.join(unknown)}")
+
+        for resource_type in resource_types:
+            count = rebuild_availability(models[resource_type], batch_size=options['batch_size'])
+            self.stdout.write(f"{resource_type}: {count} availability windows stored")
+        self.stdout.write(self.style.SUCCESS("Availability index rebuilt"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.hierarchy import HIERARCHY_MODELS, rebuild_hierarchy
+
+
+class Command(BaseCommand):
+    help = "Rebuild the partOf closure tables of Organization, Location and Encounter"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--type', dest='resource_types', action='append',
+            help="Resource type to rebuild (repeatable), defaults to every hierarchy"
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Closure rows per INSERT statement"
+        )
+
+    def handle(self, *args, **options):
+        resource_types = options['resource_types'] or list(HIERARCHY_MODELS)
+        unknown = [resource_type for resource_type in resource_types if resource_type not in HIERARCHY_MODELS]
+        if unknown:
+            raise CommandError(f"Unsupported resource type: {', '.join(unknown)}")
+
+        for resource_type in resource_types:
+            count = rebuild_hierarchy(HIERARCHY_MODELS[resource_type], batch_size=options['batch_size'])
+            self.stdout.write(f"{resource_type}: {count} closure rows stored")
+        self.stdout.write(self.style.SUCCESS("Hierarchy closure tables rebuilt"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.search_index import rebuild_index
+from core.search_params import SEARCH_MODELS
+
+
+class Command(BaseCommand):
+    help = "Rebuild the FHIR search-parameter index tables from the resource tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--type', dest='resource_types', action='append',
+            help="Resource type to reindex (repeatable), defaults to all searchable types"
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Index rows per INSERT statement"
+        )
+
+    def handle(self, *args, **options):
+        resource_types = options['resource_types'] or list(SEARCH_MODELS)
+        unknown = [resource_type for resource_type in resource_types if resource_type not in SEARCH_MODELS]
+        if unknown:
+            raise CommandError(f"Unsupported resource type: {', '.join(unknown)}")
+
+        for resource_type in resource_types:
+            count = rebuild_index(SEARCH_MODELS[resource_type], batch_size=options['batch_size'])
+            self.stdout.write(f"{resource_type}: {count} resources indexed")
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
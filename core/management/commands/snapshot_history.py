@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.history import is_enabled, record_missing
+from fhir_serializers import RESOURCE_MODELS
+
+
+class Command(BaseCommand):
+    help = "Record a first history version of every resource that has none, e.g. after enabling history"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--type', dest='resource_types', action='append',
+            help="Resource type to snapshot (repeatable), defaults to all supported types"
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Rows per INSERT and UPDATE statement"
+        )
+
+    def handle(self, *args, **options):
+        if not is_enabled():
+            raise CommandError("FHIR_RESOURCE_HISTORY is not enabled")
+        resource_types = options['resource_types'] or list(RESOURCE_MODELS)
+        unknown = [resource_type for resource_type in resource_types if resource_type not in RESOURCE_MODELS]
+        if unknown:
+            raise CommandError(f"Unsupported resource type: {', '.join(unknown)}")
+
+        for resource_type in resource_types:
+            count = record_missing(RESOURCE_MODELS[resource_type], batch_size=options['batch_size'])
+            self.stdout.write(f"{resource_type}: {count} versions recorded")
+        self.stdout.write(self.style.SUCCESS("Resource history snapshot recorded"))
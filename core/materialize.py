@@ -0,0 +1,125 @@
+"""
+Materialized FHIR documents
+Keeps DomainResource.fhir_json, the resource's FHIR JSON as rendered by
+fhir_serializers, in step with its relational rows when FHIR_MATERIALIZED_JSON
+is enabled, so reading a resource is a single-row fetch instead of a walk over
+its relation graph. core.signals schedules every resource whose serialization
+changes: its document is cleared inside the writing transaction, so a stale
+one is never served, and rendered again in prefetched batches once the
+transaction commits. Bulk writes that bypass signals call schedule()
+themselves; rebuild_materialized() renders documents missing after a bulk load.
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from fhir_serializers import PREFETCH_PLANS, prefetch_for_serialization, serialize_to_fhir_dict
+
+
+# Resources loaded and rendered per transaction
+MATERIALIZE_CHUNK_SIZE = 500
+
+
+def is_enabled():
+    return getattr(settings, 'FHIR_MATERIALIZED_JSON', False)
+
+
+def is_materialized_model(model):
+    """Whether documents of a model are maintained: it has a converter and the setting is on"""
+    return is_enabled() and model in PREFETCH_PLANS
+
+
+def _group(resources):
+    pks_by_model = defaultdict(set)
+    for model, pk in resources:
+        if is_materialized_model(model):
+            pks_by_model[model].add(pk)
+    return pks_by_model
+
+
+def materialize_resources(resources, batch_size=None):
+    """
+    Render and store the documents of resources, skipping deleted ones
+
+    Args:
+        resources: Iterable of (model, primary key) tuples, models that are
+            not materialized are ignored
+        batch_size: Rows per UPDATE statement
+
+    Returns:
+        Number of documents stored
+    """
+    materialized = 0
+    for model, pks in _group(resources).items():
+        pks = sorted(pks)
+        for start in range(0, len(pks), MATERIALIZE_CHUNK_SIZE):
+            chunk = pks[start:start + MATERIALIZE_CHUNK_SIZE]
+            with transaction.atomic():
+                instances = list(prefetch_for_serialization(model._default_manager.filter(pk__in=chunk)))
+                for instance in instances:
+                    instance.fhir_json = serialize_to_fhir_dict(instance)
+                # bulk_update sends no signals, which would schedule the resources again
+                model._default_manager.bulk_update(instances, ['fhir_json'], batch_size=batch_size)
+            materialized += len(instances)
+    return materialized
+
+
+def clear(resources):
+    """Drop the stored documents of resources, reads render them until they are stored again"""
+    for model, pks in _group(resources).items():
+        model._default_manager.filter(pk__in=pks, fhir_json__isnull=False).update(fhir_json=None)
+
+
+class PendingMaterialization:
+    """Resources to render once the transaction they changed in commits"""
+
+    def __init__(self):
+        self.resources = set()
+
+    def __call__(self):
+        materialize_resources(self.resources)
+
+
+def schedule(resources):
+    """
+    Clear the documents of resources now and render them when the current
+    transaction commits, or right away in autocommit mode
+
+    Args:
+        resources: Iterable of (model, primary key) tuples
+    """
+    resources = {(model, pk) for model, pk in resources if is_materialized_model(model)}
+    if not resources:
+        return
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        materialize_resources(resources)
+        return
+
+    clear(resources)
+    pending = getattr(connection, 'pending_materialization', None)
+    # A rolled back transaction or savepoint drops the callback, start over then
+    if pending is None or not any(callback is pending for _, callback, _ in connection.run_on_commit):
+        pending = connection.pending_materialization = PendingMaterialization()
+        transaction.on_commit(pending)
+    pending.resources |= resources
+
+
+def rebuild_materialized(model, missing_only=False, batch_size=None):
+    """
+    Render the documents of every resource of a model
+
+    Args:
+        model: Resource model
+        missing_only: Only render resources without a stored document
+
+    Returns:
+        Number of documents stored
+    """
+    pks = model._default_manager.all()
+    if missing_only:
+        pks = pks.filter(fhir_json__isnull=True)
+    pks = pks.values_list('pk', flat=True)
+    return materialize_resources(((model, pk) for pk in pks.iterator()), batch_size)
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.3 on 2026-10-17 04:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceId',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(max_length=64)),
+                ('fhir_id', models.CharField(max_length=64)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'db_table': 'resource_id',
+                'constraints': [models.UniqueConstraint(fields=('resource_type', 'fhir_id'), name='unique_resource_logical_id'), models.UniqueConstraint(fields=('content_type', 'object_id'), name='unique_resource_row')],
+            },
+        ),
+    ]
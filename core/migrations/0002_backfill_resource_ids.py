@@ -0,0 +1,53 @@
+from django.db import migrations
+
+
+RESOURCE_MODELS = [
+    ('citation', 'Citation'),
+    ('encounter', 'Encounter'),
+    ('endpoint', 'Endpoint'),
+    ('healthcareservice', 'HealthcareService'),
+    ('location', 'Location'),
+    ('organization', 'Organization'),
+    ('patient', 'Patient'),
+    ('patient', 'RelatedPerson'),
+    ('practitioner', 'Practitioner'),
+    ('practitioner', 'PractitionerRole'),
+]
+
+
+def backfill_resource_ids(apps, schema_editor):
+    """Register the logical ids of existing resources, the lowest pk wins on duplicates"""
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    ResourceId = apps.get_model('core', 'ResourceId')
+    for app_label, model_name in RESOURCE_MODELS:
+        model = apps.get_model(app_label, model_name)
+        rows = model.objects.exclude(fhir_id__isnull=True).exclude(fhir_id='').order_by('pk')
+        if not rows.exists():
+            continue
+        content_type, _ = ContentType.objects.get_or_create(app_label=app_label, model=model_name.lower())
+        ResourceId.objects.bulk_create(
+            (
+                ResourceId(resource_type=model_name, fhir_id=fhir_id, content_type=content_type, object_id=pk)
+                for pk, fhir_id in rows.values_list('pk', 'fhir_id').iterator()
+            ),
+            batch_size=1000, ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+        ('citation', '0002_initial'),
+        ('encounter', '0001_initial'),
+        ('endpoint', '0007_endpoint_healthcare_service'),
+        ('healthcareservice', '0003_healthcareservice_coveragearea_and_more'),
+        ('location', '0001_initial'),
+        ('organization', '0005_remove_organization_endpoint'),
+        ('patient', '0001_initial'),
+        ('practitioner', '0005_practitionerrole_endpoint_practitionerrole_location'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_resource_ids, migrations.RunPython.noop),
+    ]
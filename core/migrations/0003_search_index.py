@@ -0,0 +1,103 @@
+# Generated by Django 5.2.3 on 2026-10-17 05:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_backfill_resource_ids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DateIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(max_length=64)),
+                ('resource_id', models.PositiveBigIntegerField()),
+                ('param', models.CharField(max_length=64)),
+                ('low', models.DateTimeField()),
+                ('high', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'search_date',
+                'indexes': [models.Index(fields=['resource_type', 'param', 'low', 'high'], name='search_date_value'), models.Index(fields=['resource_type', 'resource_id'], name='search_date_resource')],
+            },
+        ),
+        migrations.CreateModel(
+            name='QuantityIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(max_length=64)),
+                ('resource_id', models.PositiveBigIntegerField()),
+                ('param', models.CharField(max_length=64)),
+                ('value', models.DecimalField(decimal_places=6, max_digits=18)),
+                ('system', models.CharField(blank=True, max_length=512, null=True)),
+                ('code', models.CharField(blank=True, max_length=64, null=True)),
+            ],
+            options={
+                'db_table': 'search_quantity',
+                'indexes': [models.Index(fields=['resource_type', 'param', 'value'], name='search_quantity_value'), models.Index(fields=['resource_type', 'resource_id'], name='search_quantity_resource')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ReferenceIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(max_length=64)),
+                ('resource_id', models.PositiveBigIntegerField()),
+                ('param', models.CharField(max_length=64)),
+                ('target_type', models.CharField(max_length=64)),
+                ('target_id', models.CharField(max_length=64)),
+            ],
+            options={
+                'db_table': 'search_reference',
+                'indexes': [models.Index(fields=['resource_type', 'param', 'target_id', 'target_type'], name='search_reference_value'), models.Index(fields=['target_type', 'target_id'], name='search_reference_target'), models.Index(fields=['resource_type', 'resource_id'], name='search_reference_resource')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StringIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(max_length=64)),
+                ('resource_id', models.PositiveBigIntegerField()),
+                ('param', models.CharField(max_length=64)),
+                ('value', models.CharField(max_length=256)),
+                ('exact', models.CharField(max_length=256)),
+            ],
+            options={
+                'db_table': 'search_string',
+                'indexes': [models.Index(fields=['resource_type', 'param', 'value'], name='search_string_value', opclasses=['varchar_pattern_ops', 'varchar_pattern_ops', 'varchar_pattern_ops']), models.Index(fields=['resource_type', 'resource_id'], name='search_string_resource')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TokenIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(max_length=64)),
+                ('resource_id', models.PositiveBigIntegerField()),
+                ('param', models.CharField(max_length=64)),
+                ('system', models.CharField(blank=True, max_length=512, null=True)),
+                ('code', models.CharField(blank=True, max_length=256, null=True)),
+            ],
+            options={
+                'db_table': 'search_token',
+                'indexes': [models.Index(fields=['resource_type', 'param', 'code', 'system'], name='search_token_value'), models.Index(fields=['resource_type', 'resource_id'], name='search_token_resource')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UriIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(max_length=64)),
+                ('resource_id', models.PositiveBigIntegerField()),
+                ('param', models.CharField(max_length=64)),
+                ('value', models.CharField(max_length=512)),
+            ],
+            options={
+                'db_table': 'search_uri',
+                'indexes': [models.Index(fields=['resource_type', 'param', 'value'], name='search_uri_value'), models.Index(fields=['resource_type', 'resource_id'], name='search_uri_resource')],
+            },
+        ),
+    ]
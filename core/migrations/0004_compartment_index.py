@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-17 05:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompartmentIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('compartment_type', models.CharField(max_length=64)),
+                ('compartment_id', models.CharField(max_length=64)),
+                ('resource_type', models.CharField(max_length=64)),
+                ('resource_id', models.PositiveBigIntegerField()),
+            ],
+            options={
+                'db_table': 'search_compartment',
+                'indexes': [models.Index(fields=['compartment_type', 'compartment_id', 'resource_type', 'resource_id'], name='search_compartment_member'), models.Index(fields=['resource_type', 'resource_id'], name='search_compartment_resource')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-17 06:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_compartment_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodeSystemConcept',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('system', models.CharField(max_length=512)),
+                ('code', models.CharField(max_length=64)),
+                ('display', models.TextField(blank=True, null=True)),
+                ('active', models.BooleanField(default=True)),
+                ('version', models.CharField(blank=True, max_length=64, null=True)),
+            ],
+            options={
+                'db_table': 'code_system_concept',
+                'constraints': [models.UniqueConstraint(fields=('system', 'code'), name='unique_code_system_concept')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-17 06:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_code_system_concept'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HierarchyClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(max_length=64)),
+                ('ancestor_id', models.PositiveBigIntegerField()),
+                ('descendant_id', models.PositiveBigIntegerField()),
+                ('depth', models.PositiveIntegerField()),
+            ],
+            options={
+                'db_table': 'hierarchy_closure',
+                'indexes': [models.Index(fields=['resource_type', 'descendant_id', 'depth'], name='hierarchy_closure_ancestors')],
+                'constraints': [models.UniqueConstraint(fields=('resource_type', 'ancestor_id', 'descendant_id'), name='unique_hierarchy_path')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.3 on 2026-10-17 06:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_hierarchy_closure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvailabilityException',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(max_length=64)),
+                ('resource_id', models.PositiveBigIntegerField()),
+                ('start', models.DateTimeField(blank=True, null=True)),
+                ('end', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'availability_exception',
+                'indexes': [models.Index(fields=['resource_type', 'resource_id', 'start'], name='availability_exception_owner')],
+            },
+        ),
+        migrations.CreateModel(
+            name='AvailabilityWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(max_length=64)),
+                ('resource_id', models.PositiveBigIntegerField()),
+                ('day', models.PositiveSmallIntegerField()),
+                ('start_minute', models.PositiveSmallIntegerField()),
+                ('end_minute', models.PositiveSmallIntegerField()),
+            ],
+            options={
+                'db_table': 'availability_window',
+                'indexes': [models.Index(fields=['resource_type', 'day', 'start_minute', 'end_minute', 'resource_id'], name='availability_window_open'), models.Index(fields=['resource_type', 'resource_id'], name='availability_window_owner')],
+            },
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.3 on 2026-10-17 06:22
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+# Frozen copies of core.intervals as of this migration, later changes there must not alter it
+SPAN_BASE = 4
+SPAN_LEVELS = 21
+RANGE_INDEX = 'search_date_range'
+DATETIME_PRECISION = timedelta(seconds=1)
+
+
+def span_level(low, high):
+    seconds = (high - low).total_seconds()
+    level = 0
+    while level < SPAN_LEVELS - 1 and SPAN_BASE ** level < seconds:
+        level += 1
+    return level
+
+
+def fill_spans(apps, schema_editor):
+    """Bucket the existing date rows, narrowing inverted ranges the range index cannot hold to an instant"""
+    DateIndex = apps.get_model('core', 'DateIndex')
+    last_pk = 0
+    while True:
+        rows = list(DateIndex.objects.filter(pk__gt=last_pk).order_by('pk').only('low', 'high')[:5000])
+        if not rows:
+            return
+        for row in rows:
+            row.high = max(row.high, row.low + DATETIME_PRECISION)
+            row.span = span_level(row.low, row.high)
+        DateIndex.objects.bulk_update(rows, ['high', 'span'])
+        last_pk = rows[-1].pk
+
+
+def add_range_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {RANGE_INDEX} ON search_date "
+        f"USING gist (resource_type, param, tstzrange(low, high, '[)'))"
+    )
+
+
+def remove_range_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {RANGE_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_availability_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dateindex',
+            name='span',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_spans, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='dateindex',
+            index=models.Index(fields=['resource_type', 'param', 'high', 'low'], name='search_date_high'),
+        ),
+        migrations.AddIndex(
+            model_name='dateindex',
+            index=models.Index(fields=['resource_type', 'param', 'span', 'low', 'high'], name='search_date_span'),
+        ),
+        migrations.RunPython(add_range_index, remove_range_index),
+    ]
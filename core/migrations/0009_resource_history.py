@@ -0,0 +1,31 @@
+# Generated by Django 5.2.3 on 2026-10-17 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_date_interval_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_type', models.CharField(max_length=64)),
+                ('fhir_id', models.CharField(max_length=64)),
+                ('resource_id', models.PositiveBigIntegerField()),
+                ('version', models.PositiveIntegerField()),
+                ('method', models.CharField(max_length=8)),
+                ('last_updated', models.DateTimeField()),
+                ('resource', models.JSONField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'resource_history',
+                'indexes': [models.Index(fields=['resource_type', 'id'], name='resource_history_type')],
+                'constraints': [models.UniqueConstraint(fields=('resource_type', 'fhir_id', 'version'), name='unique_resource_version')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-17 06:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_resource_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodeSystemRelease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('system', models.CharField(max_length=512, unique=True)),
+                ('version', models.CharField(max_length=64)),
+                ('loaded_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'code_system_release',
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_code_system_release'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValueSetExpansion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=512, unique=True)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('staged_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'value_set_expansion',
+            },
+        ),
+        migrations.CreateModel(
+            name='ValueSetMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value_set', models.CharField(max_length=512)),
+                ('system', models.CharField(blank=True, max_length=512, null=True)),
+                ('code', models.CharField(max_length=256)),
+            ],
+            options={
+                'db_table': 'value_set_member',
+                'constraints': [models.UniqueConstraint(fields=('value_set', 'code', 'system'), name='unique_value_set_member')],
+            },
+        ),
+    ]
@@ -1,3 +1,288 @@
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
 from django.db import models
 
-# Create your models here.
+
+class ResourceId(models.Model):
+    """Registry entry mapping a logical id (resourceType/id) to the row holding the resource"""
+    # FHIR resource type, e.g. Patient
+    resource_type = models.CharField(max_length=64)
+    # Logical id of the resource (Resource.id)
+    fhir_id = models.CharField(max_length=64)
+    # Table and primary key of the resource row
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveBigIntegerField()
+    resource = GenericForeignKey('content_type', 'object_id')
+
+    class Meta:
+        db_table = 'resource_id'
+        constraints = [
+            models.UniqueConstraint(fields=['resource_type', 'fhir_id'], name='unique_resource_logical_id'),
+            models.UniqueConstraint(fields=['content_type', 'object_id'], name='unique_resource_row'),
+        ]
+
+    def __str__(self):
+        return f"{self.resource_type}/{self.fhir_id}"
+
+
+class SearchIndex(models.Model):
+    """Common columns of the search-parameter index tables, one row per value of a parameter"""
+    # FHIR resource type and primary key of the indexed resource
+    resource_type = models.CharField(max_length=64)
+    resource_id = models.PositiveBigIntegerField()
+    # Search parameter code, e.g. birthdate
+    param = models.CharField(max_length=64)
+
+    class Meta:
+        abstract = True
+
+
+class TokenIndex(SearchIndex):
+    """Values of token parameters: codes, identifiers, booleans and contact points"""
+    system = models.CharField(max_length=512, null=True, blank=True)
+    code = models.CharField(max_length=256, null=True, blank=True)
+
+    class Meta:
+        db_table = 'search_token'
+        indexes = [
+            models.Index(fields=['resource_type', 'param', 'code', 'system'], name='search_token_value'),
+            models.Index(fields=['resource_type', 'resource_id'], name='search_token_resource'),
+        ]
+
+
+class StringIndex(SearchIndex):
+    """Values of string parameters"""
+    # Lowercased value without accents, matched by prefix
+    value = models.CharField(max_length=256)
+    # Value as written, for the :exact modifier
+    exact = models.CharField(max_length=256)
+
+    class Meta:
+        db_table = 'search_string'
+        indexes = [
+            # Pattern ops let PostgreSQL use the index for LIKE 'prefix%' in any collation
+            models.Index(fields=['resource_type', 'param', 'value'], name='search_string_value',
+                         opclasses=['varchar_pattern_ops', 'varchar_pattern_ops', 'varchar_pattern_ops']),
+            models.Index(fields=['resource_type', 'resource_id'], name='search_string_resource'),
+        ]
+
+
+class DateIndex(SearchIndex):
+    """Values of date parameters as half-open ranges [low, high), see core.intervals"""
+    low = models.DateTimeField()
+    high = models.DateTimeField()
+    # Length bucket of the range (core.intervals.span_level)
+    span = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        db_table = 'search_date'
+        indexes = [
+            models.Index(fields=['resource_type', 'param', 'low', 'high'], name='search_date_value'),
+            models.Index(fields=['resource_type', 'param', 'high', 'low'], name='search_date_high'),
+            models.Index(fields=['resource_type', 'param', 'span', 'low', 'high'], name='search_date_span'),
+            models.Index(fields=['resource_type', 'resource_id'], name='search_date_resource'),
+        ]
+
+
+class ReferenceIndex(SearchIndex):
+    """Values of reference parameters: the logical id of the target"""
+    target_type = models.CharField(max_length=64)
+    target_id = models.CharField(max_length=64)
+
+    class Meta:
+        db_table = 'search_reference'
+        indexes = [
+            models.Index(fields=['resource_type', 'param', 'target_id', 'target_type'], name='search_reference_value'),
+            # Resources pointing at a given target, for reverse lookups
+            models.Index(fields=['target_type', 'target_id'], name='search_reference_target'),
+            models.Index(fields=['resource_type', 'resource_id'], name='search_reference_resource'),
+        ]
+
+
+class QuantityIndex(SearchIndex):
+    """Values of quantity parameters"""
+    value = models.DecimalField(max_digits=18, decimal_places=6)
+    system = models.CharField(max_length=512, null=True, blank=True)
+    # Quantity.code, or Quantity.unit when there is no code
+    code = models.CharField(max_length=64, null=True, blank=True)
+
+    class Meta:
+        db_table = 'search_quantity'
+        indexes = [
+            models.Index(fields=['resource_type', 'param', 'value'], name='search_quantity_value'),
+            models.Index(fields=['resource_type', 'resource_id'], name='search_quantity_resource'),
+        ]
+
+
+class UriIndex(SearchIndex):
+    """Values of uri parameters"""
+    value = models.CharField(max_length=512)
+
+    class Meta:
+        db_table = 'search_uri'
+        indexes = [
+            models.Index(fields=['resource_type', 'param', 'value'], name='search_uri_value'),
+            models.Index(fields=['resource_type', 'resource_id'], name='search_uri_resource'),
+        ]
+
+
+class CompartmentIndex(models.Model):
+    """Membership of a resource in a compartment, e.g. an Encounter in the compartment of its patient"""
+    # Type and logical id of the compartment's focal resource, e.g. Patient/123
+    compartment_type = models.CharField(max_length=64)
+    compartment_id = models.CharField(max_length=64)
+    # FHIR resource type and primary key of the member resource
+    resource_type = models.CharField(max_length=64)
+    resource_id = models.PositiveBigIntegerField()
+
+    class Meta:
+        db_table = 'search_compartment'
+        indexes = [
+            models.Index(fields=['compartment_type', 'compartment_id', 'resource_type', 'resource_id'], name='search_compartment_member'),
+            models.Index(fields=['resource_type', 'resource_id'], name='search_compartment_resource'),
+        ]
+
+
+class CodeSystemConcept(models.Model):
+    """Concept of a code system release bulk-loaded by core.terminology_loader"""
+    # Canonical URL of the code system, e.g. http://loinc.org
+    system = models.CharField(max_length=512)
+    code = models.CharField(max_length=64)
+    display = models.TextField(null=True, blank=True)
+    active = models.BooleanField(default=True)
+    # Release that last changed the concept
+    version = models.CharField(max_length=64, null=True, blank=True)
+
+    class Meta:
+        db_table = 'code_system_concept'
+        constraints = [
+            models.UniqueConstraint(fields=['system', 'code'], name='unique_code_system_concept'),
+        ]
+
+    def __str__(self):
+        return f"{self.system}|{self.code}"
+
+
+class CodeSystemRelease(models.Model):
+    """Release of a code system last bulk-loaded into CodeSystemConcept"""
+    system = models.CharField(max_length=512, unique=True)
+    version = models.CharField(max_length=64)
+    loaded_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'code_system_release'
+
+    def __str__(self):
+        return f"{self.system}|{self.version}"
+
+
+class ValueSetExpansion(models.Model):
+    """Expansion of a value set staged in ValueSetMember (core.terminology), identified by its content"""
+    url = models.CharField(max_length=512, unique=True)
+    # Hash of the member codes, a different expansion replaces the staged rows
+    fingerprint = models.CharField(max_length=64)
+    staged_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'value_set_expansion'
+
+    def __str__(self):
+        return self.url
+
+
+class ValueSetMember(models.Model):
+    """Code of a staged value set expansion, joined by token :in and :not-in searches"""
+    value_set = models.CharField(max_length=512)
+    # Code system of the code, None for an expansion entry without one, which matches any system
+    system = models.CharField(max_length=512, null=True, blank=True)
+    code = models.CharField(max_length=256)
+
+    class Meta:
+        db_table = 'value_set_member'
+        constraints = [
+            models.UniqueConstraint(fields=['value_set', 'code', 'system'], name='unique_value_set_member'),
+        ]
+
+    def __str__(self):
+        return f"{self.value_set}: {self.system}|{self.code}"
+
+
+class HierarchyClosure(models.Model):
+    """Ancestor-descendant pair of a partOf tree (core.hierarchy), each resource being its own ancestor at depth 0"""
+    # FHIR resource type of the tree, e.g. Location
+    resource_type = models.CharField(max_length=64)
+    # Primary keys of the ancestor and descendant resources
+    ancestor_id = models.PositiveBigIntegerField()
+    descendant_id = models.PositiveBigIntegerField()
+    # Number of partOf links between them
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        db_table = 'hierarchy_closure'
+        constraints = [
+            models.UniqueConstraint(fields=['resource_type', 'ancestor_id', 'descendant_id'], name='unique_hierarchy_path'),
+        ]
+        indexes = [
+            models.Index(fields=['resource_type', 'descendant_id', 'depth'], name='hierarchy_closure_ancestors'),
+        ]
+
+
+class AvailabilityWindow(models.Model):
+    """Weekly opening hours of a resource on one day (core.availability), as minutes since midnight"""
+    # FHIR resource type of the owner, e.g. HealthcareService
+    resource_type = models.CharField(max_length=64)
+    resource_id = models.PositiveBigIntegerField()
+    # 0 for Monday through 6 for Sunday
+    day = models.PositiveSmallIntegerField()
+    # Opening minute, inclusive, and closing minute, exclusive, 1440 for midnight
+    start_minute = models.PositiveSmallIntegerField()
+    end_minute = models.PositiveSmallIntegerField()
+
+    class Meta:
+        db_table = 'availability_window'
+        indexes = [
+            models.Index(fields=['resource_type', 'day', 'start_minute', 'end_minute', 'resource_id'],
+                         name='availability_window_open'),
+            models.Index(fields=['resource_type', 'resource_id'], name='availability_window_owner'),
+        ]
+
+
+class AvailabilityException(models.Model):
+    """Period a resource is not available (NotAvailableTime.during), open ends left null"""
+    resource_type = models.CharField(max_length=64)
+    resource_id = models.PositiveBigIntegerField()
+    start = models.DateTimeField(null=True, blank=True)
+    end = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'availability_exception'
+        indexes = [
+            models.Index(fields=['resource_type', 'resource_id', 'start'], name='availability_exception_owner'),
+        ]
+
+
+class ResourceHistory(models.Model):
+    """Append-only version of a resource (core.history), a delete being a version without content"""
+    # FHIR resource type and logical id the version was recorded under
+    resource_type = models.CharField(max_length=64)
+    fhir_id = models.CharField(max_length=64)
+    # Primary key of the resource row
+    resource_id = models.PositiveBigIntegerField()
+    version = models.PositiveIntegerField()
+    # POST for the first version, PUT for updates, DELETE for deletes
+    method = models.CharField(max_length=8)
+    last_updated = models.DateTimeField()
+    # Resource as rendered when the version was recorded, null for a delete (JSONB on PostgreSQL)
+    resource = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'resource_history'
+        constraints = [
+            models.UniqueConstraint(fields=['resource_type', 'fhir_id', 'version'], name='unique_resource_version'),
+        ]
+        indexes = [
+            models.Index(fields=['resource_type', 'id'], name='resource_history_type'),
+        ]
+
+    def __str__(self):
+        return f"{self.resource_type}/{self.fhir_id}/_history/{self.version}"
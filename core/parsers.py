@@ -0,0 +1,687 @@
+"""
+FHIR JSON -> Django model rows
+The inverse of the convert_* serializers. Parsers build unsaved model instances
+and hand them to an ingest batch (core.ingest.IngestBatch), which orders and
+writes them. References to other resources are recorded on the batch by
+relation name, forward or reverse, and resolved by logical id on write.
+"""
+
+from datetime import date, datetime, time, timezone as dt_timezone
+from decimal import Decimal
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from components.models import (
+    Address, Attachment, CodeableConcept, Coding, ContactDetail, ContactPoint,
+    ExtendedContactDetail, HumanName, Identifier, MetaElement, Narrative, Period, Reference
+)
+from core.geo import encode_geohash
+from encounter.models import (
+    Encounter, EncounterAdmission, EncounterDiagnosis, EncounterLocation, EncounterParticipant, EncounterReason
+)
+from endpoint.models import Endpoint, EndpointPayload
+from healthcareservice.models import HealthcareService, HealthcareServiceEligibility
+from location.models import Location, LocationPosition
+from organization.models import Organization, OrganizationQualification
+from patient.models import (
+    Patient, PatientCommunication, PatientContact, PatientLink, RelatedPerson, RelatedPersonCommunication
+)
+from practitioner.models import Practitioner, PractitionerCommunication, PractitionerQualification, PractitionerRole
+
+
+class MissingElementError(ValueError):
+    """A resource lacks an element its Django model requires"""
+
+
+def parse_reference(reference):
+    """
+    Extract the target of a FHIR Reference
+
+    Args:
+        reference: Reference dictionary, e.g. {'reference': 'Patient/123'}
+
+    Returns:
+        (resourceType, id) tuple, or None for contained, logical or malformed references
+    """
+    value = (reference or {}).get('reference')
+    if not value or value.startswith('#'):
+        return None
+    parts = value.split('/_history/')[0].rstrip('/').split('/')
+    if len(parts) < 2 or not parts[-2] or not parts[-1]:
+        return None
+    return parts[-2], parts[-1]
+
+
+def parse_fhir_date(value):
+    """Parse a FHIR date, padding partial dates (YYYY, YYYY-MM) to the first day"""
+    if not value:
+        return None
+    parts = value[:10].split('-')
+    return date(int(parts[0]), int(parts[1]) if len(parts) > 1 else 1, int(parts[2]) if len(parts) > 2 else 1)
+
+
+def parse_fhir_datetime(value):
+    """Parse a FHIR dateTime/instant into an aware datetime, partial dates start at midnight UTC"""
+    if not value:
+        return None
+    if len(value) <= 10:
+        return datetime.combine(parse_fhir_date(value), time.min, tzinfo=dt_timezone.utc)
+    result = parse_datetime(value)
+    if result is not None and timezone.is_naive(result):
+        result = timezone.make_aware(result, dt_timezone.utc)
+    return result
+
+
+def parse_period(batch, data):
+    """Parse a FHIR Period"""
+    if not data:
+        return None
+    return batch.add(Period(
+        fhir_id=data.get('id'),
+        start=parse_fhir_datetime(data.get('start')),
+        end=parse_fhir_datetime(data.get('end')),
+    ))
+
+
+def coding_row(data, **owner):
+    """Unsaved Coding of a FHIR Coding"""
+    return Coding(
+        fhir_id=data.get('id'),
+        system=data.get('system'),
+        version=data.get('version'),
+        code=data.get('code'),
+        display=data.get('display'),
+        userSelected=data.get('userSelected'),
+        **owner
+    )
+
+
+def parse_coding(batch, data, **owner):
+    """Parse a FHIR Coding"""
+    if not data:
+        return None
+    return batch.add(coding_row(data, **owner))
+
+
+def parse_codeable_concept(batch, data):
+    """Parse a FHIR CodeableConcept into the shared concept pool (core.concepts)"""
+    if not data:
+        return None
+    codings = [coding_row(coding_data) for coding_data in data.get('coding', []) if coding_data]
+    return batch.concept(CodeableConcept(fhir_id=data.get('id'), text=data.get('text')), codings)
+
+
+def parse_identifier(batch, data, **owner):
+    """Parse a FHIR Identifier"""
+    if not data:
+        return None
+    identifier = batch.add(Identifier(
+        fhir_id=data.get('id'),
+        use=data.get('use'),
+        type=parse_codeable_concept(batch, data.get('type')),
+        system=data.get('system'),
+        value=data.get('value'),
+        period=parse_period(batch, data.get('period')),
+        **owner
+    ))
+    batch.reference(identifier, 'assigner', data.get('assigner'))
+    return identifier
+
+
+def parse_contact_point(batch, data, **owner):
+    """Parse a FHIR ContactPoint"""
+    if not data:
+        return None
+    return batch.add(ContactPoint(
+        fhir_id=data.get('id'),
+        system=data.get('system'),
+        value=data.get('value'),
+        use=data.get('use'),
+        rank=data.get('rank'),
+        period=parse_period(batch, data.get('period')),
+        **owner
+    ))
+
+
+def parse_human_name(batch, data, **owner):
+    """Parse a FHIR HumanName"""
+    if not data:
+        return None
+    return batch.add(HumanName(
+        fhir_id=data.get('id'),
+        use=data.get('use'),
+        text=data.get('text'),
+        family=data.get('family'),
+        given=data.get('given'),
+        prefix=data.get('prefix'),
+        suffix=data.get('suffix'),
+        period=parse_period(batch, data.get('period')),
+        **owner
+    ))
+
+
+def parse_address(batch, data, **owner):
+    """Parse a FHIR Address"""
+    if not data:
+        return None
+    return batch.add(Address(
+        fhir_id=data.get('id'),
+        use=data.get('use'),
+        type=data.get('type'),
+        text=data.get('text'),
+        line=data.get('line'),
+        city=data.get('city'),
+        district=data.get('district'),
+        state=data.get('state'),
+        postalCode=data.get('postalCode'),
+        country=data.get('country'),
+        period=parse_period(batch, data.get('period')),
+        **owner
+    ))
+
+
+def parse_attachment(batch, data, **owner):
+    """Parse a FHIR Attachment"""
+    if not data:
+        return None
+    duration = data.get('duration')
+    return batch.add(Attachment(
+        fhir_id=data.get('id'),
+        contentType=data.get('contentType'),
+        language=data.get('language'),
+        data=data.get('data'),
+        url=data.get('url'),
+        size=data.get('size'),
+        hash=data.get('hash'),
+        title=data.get('title'),
+        creation=parse_fhir_datetime(data.get('creation')),
+        height=data.get('height'),
+        width=data.get('width'),
+        frames=data.get('frames'),
+        duration=Decimal(str(duration)) if duration is not None else None,
+        pages=data.get('pages'),
+        **owner
+    ))
+
+
+def parse_extended_contact_detail(batch, data, **owner):
+    """Parse a FHIR ExtendedContactDetail"""
+    if not data:
+        return None
+    contact = batch.add(ExtendedContactDetail(
+        fhir_id=data.get('id'),
+        purpose=parse_codeable_concept(batch, data.get('purpose')),
+        address=parse_address(batch, data.get('address')),
+        period=parse_period(batch, data.get('period')),
+        **owner
+    ))
+    batch.reference(contact, 'organization', data.get('organization'))
+    names = data.get('name') or []
+    for name_data in names if isinstance(names, list) else [names]:
+        parse_human_name(batch, name_data, extended_contact_detail=contact)
+    for telecom_data in data.get('telecom', []):
+        parse_contact_point(batch, telecom_data, extended_contact_detail=contact)
+    return contact
+
+
+def parse_reference_row(batch, data):
+    """Store a FHIR Reference as a components.Reference row, for targets outside this project"""
+    if not data:
+        return None
+    return batch.add(Reference(
+        fhir_id=data.get('id'),
+        reference=data.get('reference'),
+        type=data.get('type'),
+        identifier=parse_identifier(batch, data.get('identifier')),
+        display=data.get('display'),
+    ))
+
+
+def resource_row(batch, model, data, **fields):
+    """Build the row of a resource with the Resource/DomainResource elements set"""
+    meta = data.get('meta')
+    if meta:
+        meta = batch.add(MetaElement(
+            fhir_id=meta.get('id'),
+            versionId=meta.get('versionId'),
+            lastUpdated=parse_fhir_datetime(meta.get('lastUpdated')),
+            source=meta.get('source'),
+            profile=meta.get('profile'),
+        ))
+    text = data.get('text')
+    if text:
+        text = batch.add(Narrative(fhir_id=text.get('id'), status=text.get('status', 'generated'), div=text.get('div', '')))
+    return batch.add(model(
+        fhir_id=data['id'],
+        meta=meta or None,
+        implicitRules=data.get('implicitRules'),
+        language=data.get('language'),
+        text=text or None,
+        **fields
+    ))
+
+
+def parse_organization(batch, data):
+    """Parse a FHIR Organization"""
+    org = resource_row(
+        batch, Organization, data,
+        active=data.get('active'),
+        name=data.get('name'),
+        alias=data.get('alias'),
+        description=data.get('description'),
+    )
+    for identifier_data in data.get('identifier', []):
+        parse_identifier(batch, identifier_data, organization=org)
+    for type_data in data.get('type', []):
+        batch.m2m(org, 'org_types', parse_codeable_concept(batch, type_data))
+    for contact_data in data.get('contact', []):
+        parse_extended_contact_detail(batch, contact_data, organization_contact=org)
+    for qualification_data in data.get('qualification', []):
+        qualification = batch.add(OrganizationQualification(
+            fhir_id=qualification_data.get('id'),
+            organization=org,
+            code=parse_codeable_concept(batch, qualification_data.get('code')),
+            period=parse_period(batch, qualification_data.get('period')),
+        ))
+        batch.reference(qualification, 'issuer', qualification_data.get('issuer'))
+        for identifier_data in qualification_data.get('identifier', []):
+            parse_identifier(batch, identifier_data, qualification=qualification)
+    batch.reference(org, 'partOf', data.get('partOf'))
+    for endpoint_ref in data.get('endpoint', []):
+        batch.reference(org, 'endpoints', endpoint_ref)
+    return org
+
+
+def parse_endpoint(batch, data):
+    """Parse a FHIR Endpoint"""
+    endpoint = resource_row(
+        batch, Endpoint, data,
+        status=data.get('status'),
+        name=data.get('name'),
+        description=data.get('description'),
+        address=data.get('address'),
+        header=data.get('header'),
+        period=parse_period(batch, data.get('period')),
+    )
+    for identifier_data in data.get('identifier', []):
+        parse_identifier(batch, identifier_data, endpoint=endpoint)
+    for type_data in data.get('connectionType', []):
+        batch.m2m(endpoint, 'connection_types', parse_codeable_concept(batch, type_data))
+    for type_data in data.get('environmentType', []):
+        batch.m2m(endpoint, 'environment_types', parse_codeable_concept(batch, type_data))
+    batch.reference(endpoint, 'managingOrganization', data.get('managingOrganization'))
+    for contact_data in data.get('contact', []):
+        # Endpoint.contact is a list of ContactPoints, stored as one ContactDetail each
+        contact = batch.add(ContactDetail(name=contact_data.get('name'), endpoint=endpoint))
+        for telecom_data in contact_data.get('telecom', [contact_data] if 'value' in contact_data else []):
+            parse_contact_point(batch, telecom_data, contact_detail=contact)
+    for payload_data in data.get('payload', []):
+        payload = batch.add(EndpointPayload(
+            fhir_id=payload_data.get('id'), endpoint=endpoint, mimeType=payload_data.get('mimeType')
+        ))
+        for type_data in payload_data.get('type', []):
+            batch.m2m(payload, 'payload_types', parse_codeable_concept(batch, type_data))
+    return endpoint
+
+
+def parse_practitioner(batch, data):
+    """Parse a FHIR Practitioner"""
+    practitioner = resource_row(
+        batch, Practitioner, data,
+        active=data.get('active'),
+        gender=data.get('gender'),
+        birthDate=parse_fhir_date(data.get('birthDate')),
+        deceasedBoolean=data.get('deceasedBoolean'),
+        deceasedDateTime=parse_fhir_datetime(data.get('deceasedDateTime')),
+        photo=data.get('photo'),
+    )
+    for identifier_data in data.get('identifier', []):
+        parse_identifier(batch, identifier_data, practitioner=practitioner)
+    for name_data in data.get('name', []):
+        parse_human_name(batch, name_data, practitioner=practitioner)
+    for telecom_data in data.get('telecom', []):
+        parse_contact_point(batch, telecom_data, practitioner=practitioner)
+    for address_data in data.get('address', []):
+        parse_address(batch, address_data, practitioner=practitioner)
+    for qualification_data in data.get('qualification', []):
+        qualification = batch.add(PractitionerQualification(
+            fhir_id=qualification_data.get('id'),
+            practitioner=practitioner,
+            code=parse_codeable_concept(batch, qualification_data.get('code')),
+            period=parse_period(batch, qualification_data.get('period')),
+        ))
+        batch.reference(qualification, 'issuer', qualification_data.get('issuer'))
+        for identifier_data in qualification_data.get('identifier', []):
+            parse_identifier(batch, identifier_data, practitioner_qualification=qualification)
+    for communication_data in data.get('communication', []):
+        language = parse_codeable_concept(batch, communication_data.get('language'))
+        if language is not None:
+            batch.add(PractitionerCommunication(
+                fhir_id=communication_data.get('id'),
+                practitioner=practitioner,
+                language=language,
+                preferred=communication_data.get('preferred'),
+            ))
+    return practitioner
+
+
+def parse_practitioner_role(batch, data):
+    """Parse a FHIR PractitionerRole"""
+    role = resource_row(
+        batch, PractitionerRole, data,
+        active=data.get('active'),
+        period=parse_period(batch, data.get('period')),
+    )
+    batch.reference(role, 'practitioner', data.get('practitioner'))
+    batch.reference(role, 'organization', data.get('organization'))
+    for identifier_data in data.get('identifier', []):
+        parse_identifier(batch, identifier_data, practitioner_role=role)
+    for code_data in data.get('code', []):
+        batch.m2m(role, 'codes', parse_codeable_concept(batch, code_data))
+    for specialty_data in data.get('specialty', []):
+        batch.m2m(role, 'specialties', parse_codeable_concept(batch, specialty_data))
+    for characteristic_data in data.get('characteristic', []):
+        batch.m2m(role, 'characteristics', parse_codeable_concept(batch, characteristic_data))
+    for communication_data in data.get('communication', []):
+        batch.m2m(role, 'communications', parse_codeable_concept(batch, communication_data))
+    for location_ref in data.get('location', []):
+        batch.reference(role, 'location', location_ref)
+    for service_ref in data.get('healthcareService', []):
+        batch.reference(role, 'healthcare_services', service_ref)
+    for endpoint_ref in data.get('endpoint', []):
+        batch.reference(role, 'endpoint', endpoint_ref)
+    return role
+
+
+def parse_location(batch, data):
+    """Parse a FHIR Location"""
+    location = resource_row(
+        batch, Location, data,
+        status=data.get('status'),
+        operationalStatus=parse_coding(batch, data.get('operationalStatus')),
+        name=data.get('name'),
+        alias=data.get('alias'),
+        description=data.get('description'),
+        mode=data.get('mode'),
+        address=parse_address(batch, data.get('address')),
+    )
+    for identifier_data in data.get('identifier', []):
+        parse_identifier(batch, identifier_data, location=location)
+    for type_data in data.get('type', []):
+        batch.m2m(location, 'types', parse_codeable_concept(batch, type_data))
+    form = data.get('form')
+    for form_data in form if isinstance(form, list) else [form] if form else []:
+        batch.m2m(location, 'forms', parse_codeable_concept(batch, form_data))
+    for characteristic_data in data.get('characteristic', []):
+        batch.m2m(location, 'characteristics', parse_codeable_concept(batch, characteristic_data))
+    position = data.get('position')
+    if position and position.get('latitude') is not None and position.get('longitude') is not None:
+        altitude = position.get('altitude')
+        batch.add(LocationPosition(
+            location=location,
+            latitude=Decimal(str(position['latitude'])),
+            longitude=Decimal(str(position['longitude'])),
+            altitude=Decimal(str(altitude)) if altitude is not None else None,
+            geohash=encode_geohash(position['latitude'], position['longitude']),
+        ))
+    batch.reference(location, 'managingOrganization', data.get('managingOrganization'))
+    batch.reference(location, 'partOf', data.get('partOf'))
+    for endpoint_ref in data.get('endpoint', []):
+        batch.reference(location, 'endpoint', endpoint_ref)
+    return location
+
+
+def parse_healthcare_service(batch, data):
+    """Parse a FHIR HealthcareService"""
+    service = resource_row(
+        batch, HealthcareService, data,
+        active=data.get('active'),
+        name=data.get('name'),
+        comment=data.get('comment'),
+        extraDetails=data.get('extraDetails'),
+        appointmentRequired=data.get('appointmentRequired'),
+        photo=parse_attachment(batch, data.get('photo')),
+    )
+    batch.reference(service, 'providedBy', data.get('providedBy'))
+    for identifier_data in data.get('identifier', []):
+        parse_identifier(batch, identifier_data, healthcare_service=service)
+    concept_fields = {
+        'category': 'categories',
+        'type': 'types',
+        'specialty': 'specialties',
+        'serviceProvisionCode': 'service_provision_codes',
+        'program': 'programs',
+        'characteristic': 'characteristics',
+        'communication': 'communications',
+        'referralMethod': 'referral_methods',
+    }
+    for element, field_name in concept_fields.items():
+        for concept_data in data.get(element, []):
+            batch.m2m(service, field_name, parse_codeable_concept(batch, concept_data))
+    for contact_data in data.get('contact', []):
+        parse_extended_contact_detail(batch, contact_data, healthcare_service_contact=service)
+    for eligibility_data in data.get('eligibility', []):
+        batch.add(HealthcareServiceEligibility(
+            fhir_id=eligibility_data.get('id'),
+            healthcare_service=service,
+            code=parse_codeable_concept(batch, eligibility_data.get('code')),
+            comment=eligibility_data.get('comment'),
+        ))
+    for location_ref in data.get('location', []):
+        batch.reference(service, 'location', location_ref)
+    for location_ref in data.get('coverageArea', []):
+        batch.reference(service, 'coverageArea', location_ref)
+    for endpoint_ref in data.get('endpoint', []):
+        batch.reference(service, 'endpoint', endpoint_ref)
+    for service_ref in data.get('offeredIn', []):
+        batch.reference(service, 'offeredIn', service_ref)
+    return service
+
+
+def parse_patient(batch, data):
+    """Parse a FHIR Patient"""
+    patient = resource_row(
+        batch, Patient, data,
+        active=data.get('active'),
+        gender=data.get('gender'),
+        birthDate=parse_fhir_date(data.get('birthDate')),
+        deceasedBoolean=data.get('deceasedBoolean'),
+        deceasedDateTime=parse_fhir_datetime(data.get('deceasedDateTime')),
+        multipleBirthBoolean=data.get('multipleBirthBoolean'),
+        multipleBirthInteger=data.get('multipleBirthInteger'),
+        maritalStatus=parse_codeable_concept(batch, data.get('maritalStatus')),
+    )
+    batch.reference(patient, 'managingOrganization', data.get('managingOrganization'))
+    for identifier_data in data.get('identifier', []):
+        parse_identifier(batch, identifier_data, patient=patient)
+    for name_data in data.get('name', []):
+        parse_human_name(batch, name_data, patient=patient)
+    for telecom_data in data.get('telecom', []):
+        parse_contact_point(batch, telecom_data, patient=patient)
+    for address_data in data.get('address', []):
+        parse_address(batch, address_data, patient=patient)
+    for photo_data in data.get('photo', []):
+        parse_attachment(batch, photo_data, patient=patient)
+    for contact_data in data.get('contact', []):
+        contact = batch.add(PatientContact(
+            fhir_id=contact_data.get('id'),
+            patient=patient,
+            name=parse_human_name(batch, contact_data.get('name')),
+            address=parse_address(batch, contact_data.get('address')),
+            gender=contact_data.get('gender'),
+            period=parse_period(batch, contact_data.get('period')),
+        ))
+        batch.reference(contact, 'organization', contact_data.get('organization'))
+        for relationship_data in contact_data.get('relationship', []):
+            batch.m2m(contact, 'relationships', parse_codeable_concept(batch, relationship_data))
+        for telecom_data in contact_data.get('telecom', []):
+            parse_contact_point(batch, telecom_data, patient_contact=contact)
+    for communication_data in data.get('communication', []):
+        language = parse_codeable_concept(batch, communication_data.get('language'))
+        if language is not None:
+            batch.add(PatientCommunication(
+                fhir_id=communication_data.get('id'),
+                patient=patient,
+                language=language,
+                preferred=communication_data.get('preferred'),
+            ))
+    general_practitioner_fields = {
+        'Practitioner': 'generalPractitioner',
+        'PractitionerRole': 'generalPractitionerRole',
+        'Organization': 'generalPractitionerOrg',
+    }
+    for practitioner_ref in data.get('generalPractitioner', []):
+        target = parse_reference(practitioner_ref)
+        field_name = general_practitioner_fields.get(target and target[0], 'generalPractitioner')
+        batch.reference(patient, field_name, practitioner_ref)
+    for link_data in data.get('link', []):
+        link = batch.add(PatientLink(fhir_id=link_data.get('id'), patient=patient, type=link_data.get('type')))
+        target = parse_reference(link_data.get('other'))
+        field_name = 'other_related_person' if target and target[0] == 'RelatedPerson' else 'other_patient'
+        batch.reference(link, field_name, link_data.get('other'))
+    return patient
+
+
+def parse_related_person(batch, data):
+    """Parse a FHIR RelatedPerson"""
+    related_person = resource_row(
+        batch, RelatedPerson, data,
+        active=data.get('active'),
+        gender=data.get('gender'),
+        birthDate=parse_fhir_date(data.get('birthDate')),
+        period=parse_period(batch, data.get('period')),
+    )
+    batch.reference(related_person, 'patient', data.get('patient'))
+    for identifier_data in data.get('identifier', []):
+        parse_identifier(batch, identifier_data, related_person=related_person)
+    for relationship_data in data.get('relationship', []):
+        batch.m2m(related_person, 'relationships', parse_codeable_concept(batch, relationship_data))
+    for name_data in data.get('name', []):
+        parse_human_name(batch, name_data, related_person=related_person)
+    for telecom_data in data.get('telecom', []):
+        parse_contact_point(batch, telecom_data, related_person=related_person)
+    for address_data in data.get('address', []):
+        parse_address(batch, address_data, related_person=related_person)
+    for photo_data in data.get('photo', []):
+        parse_attachment(batch, photo_data, related_person=related_person)
+    for communication_data in data.get('communication', []):
+        language = parse_codeable_concept(batch, communication_data.get('language'))
+        if language is not None:
+            batch.add(RelatedPersonCommunication(
+                fhir_id=communication_data.get('id'),
+                related_person=related_person,
+                language=language,
+                preferred=communication_data.get('preferred'),
+            ))
+    return related_person
+
+
+def _codeable_reference_concepts(values):
+    """CodeableConcepts of a list of CodeableReferences (R5) or CodeableConcepts (R4)"""
+    return [value.get('concept', value) for value in values or [] if value.get('concept', value)]
+
+
+def parse_encounter(batch, data):
+    """Parse a FHIR Encounter"""
+    classes = data.get('class')
+    classes = classes if isinstance(classes, list) else [classes] if classes else []
+    if not classes:
+        raise MissingElementError("Encounter.class is required")
+
+    encounter = resource_row(
+        batch, Encounter, data,
+        status=data.get('status'),
+        class_field=parse_codeable_concept(batch, classes[0]),
+        priority=parse_codeable_concept(batch, data.get('priority')),
+        subject=parse_reference_row(batch, data.get('subject')),
+        subjectStatus=parse_codeable_concept(batch, data.get('subjectStatus')),
+        serviceProvider=parse_reference_row(batch, data.get('serviceProvider')),
+        actualPeriod=parse_period(batch, data.get('actualPeriod')),
+        period=parse_period(batch, data.get('period')),
+        plannedStartDate=parse_fhir_datetime(data.get('plannedStartDate')),
+        plannedEndDate=parse_fhir_datetime(data.get('plannedEndDate')),
+    )
+    batch.reference(encounter, 'partOf', data.get('partOf'))
+    for identifier_data in data.get('identifier', []):
+        parse_identifier(batch, identifier_data, encounter=encounter)
+    for element, field_name in (('type', 'type'), ('dietPreference', 'dietPreference'),
+                                ('specialArrangement', 'specialArrangement'), ('specialCourtesy', 'specialCourtesy')):
+        for concept_data in data.get(element, []):
+            batch.m2m(encounter, field_name, parse_codeable_concept(batch, concept_data))
+    for concept_data in _codeable_reference_concepts(data.get('serviceType')):
+        batch.m2m(encounter, 'serviceType', parse_codeable_concept(batch, concept_data))
+    for element in ('episodeOfCare', 'basedOn', 'careTeam', 'appointment', 'account'):
+        for reference_data in data.get(element, []):
+            batch.m2m(encounter, element, parse_reference_row(batch, reference_data))
+
+    for participant_data in data.get('participant', []):
+        participant = batch.add(EncounterParticipant(
+            fhir_id=participant_data.get('id'),
+            encounter=encounter,
+            period=parse_period(batch, participant_data.get('period')),
+            actor=parse_reference_row(batch, participant_data.get('actor') or participant_data.get('individual')),
+        ))
+        for type_data in participant_data.get('type', []):
+            batch.m2m(participant, 'type', parse_codeable_concept(batch, type_data))
+    for reason_data in data.get('reason', []):
+        reason = batch.add(EncounterReason(fhir_id=reason_data.get('id'), encounter=encounter))
+        for use_data in reason_data.get('use', []):
+            batch.m2m(reason, 'use', parse_codeable_concept(batch, use_data))
+        for value_data in _codeable_reference_concepts(reason_data.get('value')):
+            batch.m2m(reason, 'value', parse_codeable_concept(batch, value_data))
+    for diagnosis_data in data.get('diagnosis', []):
+        condition = diagnosis_data.get('condition')
+        # R5: list of CodeableReferences, R4: a single Reference
+        condition = condition[0] if isinstance(condition, list) and condition else condition
+        if condition and isinstance(condition.get('reference'), dict):
+            condition = condition['reference']
+        if not condition:
+            continue
+        diagnosis = batch.add(EncounterDiagnosis(
+            fhir_id=diagnosis_data.get('id'), encounter=encounter, condition=parse_reference_row(batch, condition)
+        ))
+        uses = diagnosis_data.get('use')
+        for use_data in uses if isinstance(uses, list) else [uses] if uses else []:
+            batch.m2m(diagnosis, 'use', parse_codeable_concept(batch, use_data))
+    for location_data in data.get('location', []):
+        if not location_data.get('location'):
+            continue
+        batch.add(EncounterLocation(
+            fhir_id=location_data.get('id'),
+            encounter=encounter,
+            location=parse_reference_row(batch, location_data['location']),
+            status=location_data.get('status'),
+            form=parse_codeable_concept(batch, location_data.get('form') or location_data.get('physicalType')),
+            period=parse_period(batch, location_data.get('period')),
+        ))
+    admission_data = data.get('admission') or data.get('hospitalization')
+    if admission_data:
+        admission = batch.add(EncounterAdmission(
+            fhir_id=admission_data.get('id'),
+            encounter=encounter,
+            preAdmissionIdentifier=parse_identifier(batch, admission_data.get('preAdmissionIdentifier')),
+            origin=parse_reference_row(batch, admission_data.get('origin')),
+            admitSource=parse_codeable_concept(batch, admission_data.get('admitSource')),
+            reAdmission=parse_codeable_concept(batch, admission_data.get('reAdmission')),
+            destination=parse_reference_row(batch, admission_data.get('destination')),
+            dischargeDisposition=parse_codeable_concept(batch, admission_data.get('dischargeDisposition')),
+        ))
+        for element in ('dietPreference', 'specialCourtesy', 'specialArrangement'):
+            for concept_data in admission_data.get(element, []):
+                batch.m2m(admission, element, parse_codeable_concept(batch, concept_data))
+    return encounter
+
+
+# resourceType -> (Django model, parser)
+RESOURCE_PARSERS = {
+    'Organization': (Organization, parse_organization),
+    'Endpoint': (Endpoint, parse_endpoint),
+    'Practitioner': (Practitioner, parse_practitioner),
+    'PractitionerRole': (PractitionerRole, parse_practitioner_role),
+    'Location': (Location, parse_location),
+    'HealthcareService': (HealthcareService, parse_healthcare_service),
+    'Patient': (Patient, parse_patient),
+    'RelatedPerson': (RelatedPerson, parse_related_person),
+    'Encounter': (Encounter, parse_encounter),
+}
@@ -0,0 +1,165 @@
+"""
+Logical-id registry
+Maps every (resourceType, id) pair to the table and primary key of the
+resource row through the unique, indexed ResourceId table, so references are
+resolved without scanning the unindexed Resource.fhir_id columns. The signal
+handlers in core.signals keep the registry in sync with saves and deletes;
+bulk writes that bypass signals call register() themselves.
+"""
+
+from collections import defaultdict
+from functools import lru_cache
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+
+from abstractClasses.models import Resource
+from core.models import ResourceId
+
+
+# Largest number of (type, id) pairs resolved per query, safe for SQLite
+RESOLVE_CHUNK_SIZE = 400
+
+
+@lru_cache(maxsize=None)
+def resource_models():
+    """Dict of resourceType -> concrete resource model"""
+    return {
+        model.__name__: model for model in apps.get_models()
+        if issubclass(model, Resource)
+    }
+
+
+def is_registered_model(model):
+    """Whether rows of model are kept in the registry"""
+    return resource_models().get(model.__name__) is model
+
+
+def _entry(instance):
+    return ResourceId(
+        resource_type=type(instance).__name__,
+        fhir_id=instance.fhir_id,
+        content_type=ContentType.objects.get_for_model(type(instance)),
+        object_id=instance.pk,
+    )
+
+
+def check_available(instance):
+    """
+    Make sure no other row holds the logical id of instance
+
+    Returns:
+        Whether the registry already maps the logical id to instance
+
+    Raises:
+        ValueError: If another resource of the same type has the id
+    """
+    if not instance.fhir_id:
+        return False
+    entry = ResourceId.objects.filter(
+        resource_type=type(instance).__name__, fhir_id=instance.fhir_id
+    ).values_list('content_type_id', 'object_id').first()
+    if entry is None:
+        return False
+    if instance.pk is None or entry != (ContentType.objects.get_for_model(type(instance)).pk, instance.pk):
+        raise ValueError(f"{type(instance).__name__}/{instance.fhir_id} already exists")
+    return True
+
+
+def sync(instance):
+    """Point the registry entry of a saved resource at its current logical id"""
+    content_type = ContentType.objects.get_for_model(type(instance))
+    if not instance.fhir_id:
+        unregister(instance)
+        return
+    ResourceId.objects.update_or_create(
+        content_type=content_type, object_id=instance.pk,
+        defaults={'resource_type': type(instance).__name__, 'fhir_id': instance.fhir_id},
+    )
+
+
+def unregister(instance):
+    """Drop the registry entry of a resource row"""
+    ResourceId.objects.filter(
+        content_type=ContentType.objects.get_for_model(type(instance)), object_id=instance.pk
+    ).delete()
+
+
+def register(instances, batch_size=None):
+    """
+    Add registry entries for newly inserted resources in bulk
+
+    Args:
+        instances: Saved resource instances, ones without a logical id are ignored
+        batch_size: Rows per INSERT statement
+
+    Raises:
+        IntegrityError: If a logical id is already registered
+    """
+    entries = [_entry(instance) for instance in instances if instance.fhir_id]
+    ResourceId.objects.bulk_create(entries, batch_size=batch_size)
+
+
+def resolve(keys):
+    """
+    Resolve logical ids to resource rows, one query per RESOLVE_CHUNK_SIZE keys
+
+    Args:
+        keys: Iterable of (resourceType, id) tuples
+
+    Returns:
+        Dict of (resourceType, id) -> (model, primary key) for the keys that exist
+    """
+    keys = list(dict.fromkeys(keys))
+    found = {}
+    for start in range(0, len(keys), RESOLVE_CHUNK_SIZE):
+        ids_by_type = defaultdict(list)
+        for resource_type, fhir_id in keys[start:start + RESOLVE_CHUNK_SIZE]:
+            ids_by_type[resource_type].append(fhir_id)
+        condition = Q()
+        for resource_type, ids in ids_by_type.items():
+            condition |= Q(resource_type=resource_type, fhir_id__in=ids)
+        entries = ResourceId.objects.filter(condition).values_list(
+            'resource_type', 'fhir_id', 'content_type_id', 'object_id'
+        )
+        for resource_type, fhir_id, content_type_id, pk in entries:
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            found[(resource_type, fhir_id)] = (model, pk)
+    return found
+
+
+def get_resource(resource_type, fhir_id, queryset=None):
+    """
+    Load a resource by logical id
+
+    Args:
+        resource_type: FHIR resource type, e.g. Patient
+        fhir_id: Logical id
+        queryset: Optional queryset of the resource model to load from,
+            e.g. with prefetch_for_serialization applied
+
+    Returns:
+        Model instance, or None if no such resource exists
+    """
+    match = resolve([(resource_type, fhir_id)]).get((resource_type, fhir_id))
+    if match is None:
+        return None
+    model, pk = match
+    if queryset is None:
+        queryset = model._default_manager.all()
+    return queryset.filter(pk=pk).first()
+
+
+def missing_references(references):
+    """
+    Find references that point to resources not in the database
+
+    Args:
+        references: Iterable of (resourceType, id) tuples
+
+    Returns:
+        Set of the (resourceType, id) tuples that do not resolve
+    """
+    references = set(references)
+    return references - resolve(references).keys()
@@ -0,0 +1,483 @@
+"""
+FHIR search
+Compiles search queries such as Patient?identifier=sys|val&birthdate=ge1980&name=ada
+into querysets of the resource model. Every parameter becomes a semi-join
+against its typed index table (core.search_index) on the (resource_type,
+param, value) index, instead of walking the component tables. Chained
+(subject:Patient.name) and reverse chained (_has) parameters nest a search
+of the other resource type inside a semi-join on the reference index.
+Date prefixes test ranges on the interval index (core.intervals).
+Token :in and :not-in join the ValueSet expansion core.terminology stages,
+reference :below and :above walk the partOf closure tables (core.hierarchy),
+Location near narrows positions by geohash cells (core.geo) and
+HealthcareService and PractitionerRole available looks up the weekly
+availability index (core.availability).
+Repeated parameters are ANDed, comma separated values ORed, as in FHIR.
+"""
+
+import json
+import re
+from collections import namedtuple
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+from urllib.parse import parse_qsl
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections
+from django.db.models import Exists, OuterRef, Q
+
+from core.availability import AVAILABILITY_MODELS, open_condition, parse_day, weekly_condition, window_rows
+from core.geo import near_positions, parse_near
+from core.hierarchy import HIERARCHY_MODELS
+from core.intervals import contained_by, overlaps
+from core.models import HierarchyClosure, ReferenceIndex, ResourceId, ValueSetMember
+from core.parsers import parse_reference
+from core.search_index import INDEX_MODELS, normalize_string
+from core.search_params import DATE, QUANTITY, REFERENCE, SEARCH_MODELS, STRING, TOKEN, URI, get_parameters
+from core.terminology import get_terminology
+from location.models import LocationPosition
+
+
+# Result parameters, which do not filter and are left to the caller
+RESULT_PARAMETERS = frozenset({
+    '_count', '_sort', '_total', '_cursor', '_include', '_revinclude', '_summary', '_elements',
+    '_contained', '_containedType', '_format', '_pretty',
+})
+
+# Estimated matches up to which a clause is evaluated once up front (see plan_clauses)
+DRIVER_THRESHOLD = 10000
+
+# Index rows matching one parameter, joined to the searched table on
+# rows.<inner_field> = <table>.<outer_field>; a negated clause matches the
+# resources without such rows
+Clause = namedtuple('Clause', 'rows inner_field outer_field negated')
+
+PREFIXES = ('eq', 'ne', 'gt', 'lt', 'ge', 'le', 'sa', 'eb', 'ap')
+
+MODIFIERS = {
+    TOKEN: {None, 'not', 'in', 'not-in'},
+    STRING: {None, 'exact', 'contains'},
+    DATE: {None},
+    REFERENCE: {None, 'below', 'above'},
+    QUANTITY: {None},
+    URI: {None, 'below', 'above'},
+}
+
+DATE_PATTERN = re.compile(
+    r'^(?P<year>\d{4})(-(?P<month>\d{2})(-(?P<day>\d{2})'
+    r'(T(?P<hour>\d{2}):(?P<minute>\d{2})(:(?P<second>\d{2})(?P<fraction>\.\d+)?)?'
+    r'(?P<tz>Z|[+-]\d{2}:\d{2})?)?)?)?$'
+)
+
+
+def parse_query(query):
+    """
+    Normalize a search query to a list of (name, value) pairs
+
+    Args:
+        query: Query string ('a=1&b=2'), dict of name -> value or list of values
+            (e.g. QueryDict.lists()), or iterable of (name, value) pairs
+    """
+    if isinstance(query, str):
+        return parse_qsl(query.lstrip('?'))
+    if hasattr(query, 'lists'):
+        query = dict(query.lists())
+    if isinstance(query, dict):
+        query = query.items()
+    pairs = []
+    for name, value in query:
+        values = value if isinstance(value, (list, tuple)) else [value]
+        pairs += [(name, item) for item in values]
+    return pairs
+
+
+def _split(value, separator, maxsplit=0):
+    """Split on separators not escaped with a backslash, then drop the escapes"""
+    parts = re.split(r'(?<!\\)' + re.escape(separator), value, maxsplit=maxsplit)
+    return [re.sub(r'\\(.)', r'\1', part) for part in parts]
+
+
+def _prefix(value):
+    """Split a date or quantity value into its comparison prefix and the rest"""
+    if value[:2] in PREFIXES and (value[2:3].isdigit() or value[2:3] == '-'):
+        return value[:2], value[2:]
+    return 'eq', value
+
+
+def parse_date_range(value):
+    """
+    Parse a FHIR search date into the range its precision implies
+
+    Dates without a timezone are taken as UTC, like core.parsers does.
+
+    Returns:
+        (low, high) half-open range of aware datetimes
+
+    Raises:
+        ValueError: If the value is not a FHIR date, dateTime or instant
+    """
+    match = DATE_PATTERN.match(value)
+    if match is None:
+        raise ValueError(f"Invalid date search value: {value}")
+    parts = match.groupdict()
+    tz = dt_timezone.utc
+    if parts['tz'] and parts['tz'] != 'Z':
+        sign = 1 if parts['tz'][0] == '+' else -1
+        hours, minutes = parts['tz'][1:].split(':')
+        tz = dt_timezone(sign * timedelta(hours=int(hours), minutes=int(minutes)))
+
+    year = int(parts['year'])
+    if parts['month'] is None:
+        return datetime(year, 1, 1, tzinfo=tz), datetime(year + 1, 1, 1, tzinfo=tz)
+    month = int(parts['month'])
+    if parts['day'] is None:
+        low = datetime(year, month, 1, tzinfo=tz)
+        return low, datetime(year + month // 12, month % 12 + 1, 1, tzinfo=tz)
+    low = datetime(year, month, int(parts['day']), tzinfo=tz)
+    if parts['hour'] is None:
+        return low, low + timedelta(days=1)
+    low = low.replace(hour=int(parts['hour']), minute=int(parts['minute']))
+    if parts['second'] is None:
+        return low, low + timedelta(minutes=1)
+    low = low.replace(second=int(parts['second']))
+    if parts['fraction'] is None:
+        return low, low + timedelta(seconds=1)
+    digits = min(len(parts['fraction']) - 1, 6)
+    low = low.replace(microsecond=int(parts['fraction'][1:digits + 1].ljust(6, '0')))
+    return low, low + timedelta(microseconds=10 ** (6 - digits))
+
+
+def _value_set_condition(url):
+    """Codes of a value set loaded in core.terminology, as a semi-join on its staged members"""
+    members = ValueSetMember.objects.filter(value_set=get_terminology().stage_value_set(url), code=OuterRef('code'))
+    # A member without a system matches the code in any system
+    return Q(Exists(members.filter(Q(system=OuterRef('system')) | Q(system__isnull=True))))
+
+
+def _token_condition(modifier, value):
+    if modifier in ('in', 'not-in'):
+        return _value_set_condition(value)
+    parts = _split(value, '|', 1)
+    if len(parts) == 1:
+        return Q(code=parts[0])
+    system, code = parts
+    if not system:
+        return Q(system__isnull=True, code=code)
+    if not code:
+        return Q(system=system)
+    return Q(system=system, code=code)
+
+
+def _string_condition(modifier, value):
+    normalized = normalize_string(value)[:256]
+    if modifier == 'exact':
+        return Q(value=normalized, exact=value)
+    if modifier == 'contains':
+        return Q(value__contains=normalized)
+    return Q(value__startswith=normalized)
+
+
+def _date_condition(value):
+    """Date prefix as a range test of the indexed values against the range of the search value (core.intervals)"""
+    prefix, value = _prefix(value)
+    low, high = parse_date_range(value)
+    contained = contained_by(low, high)
+    return {
+        'eq': contained,
+        'ne': ~contained,
+        'gt': overlaps(high, None),
+        'lt': overlaps(None, low),
+        'ge': overlaps(high, None) | contained,
+        'le': overlaps(None, low) | contained,
+        'sa': contained_by(high, None),
+        'eb': contained_by(None, low),
+        'ap': overlaps(low, high),
+    }[prefix]
+
+
+def _hierarchy_condition(modifier, value):
+    """References to a partOf tree node and the nodes below (or above) it, via core.hierarchy"""
+    if '/' in value:
+        key = parse_reference({'reference': value})
+        if key is None or key[0] not in HIERARCHY_MODELS:
+            raise ValueError(f"Invalid :{modifier} reference, expected one of {', '.join(HIERARCHY_MODELS)}: {value}")
+        resource_type, fhir_id = key
+        resource_types = [resource_type]
+    else:
+        resource_types, fhir_id = list(HIERARCHY_MODELS), value
+
+    condition = Q()
+    for resource_type in resource_types:
+        model = HIERARCHY_MODELS[resource_type]
+        start, related = ('ancestor_id', 'descendant_id') if modifier == 'below' else ('descendant_id', 'ancestor_id')
+        # The anchor is resolved on the unique (resource_type, fhir_id) key of the logical-id registry
+        anchor = ResourceId.objects.filter(resource_type=resource_type, fhir_id=fhir_id).values('object_id')
+        paths = HierarchyClosure.objects.filter(**{'resource_type': resource_type, f'{start}__in': anchor})
+        related_ids = model._default_manager.filter(pk__in=paths.values(related)).values('fhir_id')
+        condition |= Q(target_type=resource_type, target_id__in=related_ids)
+    return condition
+
+
+def _reference_condition(modifier, value):
+    if modifier in ('below', 'above'):
+        return _hierarchy_condition(modifier, value)
+    if modifier is not None:
+        # Type modifier, e.g. subject:Patient=123
+        return Q(target_type=modifier, target_id=value)
+    if '/' in value:
+        key = parse_reference({'reference': value})
+        if key is None:
+            raise ValueError(f"Invalid reference search value: {value}")
+        return Q(target_type=key[0], target_id=key[1])
+    return Q(target_id=value)
+
+
+def _quantity_condition(value):
+    prefix, value = _prefix(value)
+    number, system, code = (_split(value, '|', 2) + [None, None])[:3]
+    try:
+        number = Decimal(number)
+    except InvalidOperation:
+        raise ValueError(f"Invalid quantity search value: {value}")
+
+    # The implicit range of a number is half a unit of its last significant digit
+    half = Decimal(5).scaleb(number.as_tuple().exponent - 1)
+    approximate = abs(number) / 10
+    condition = {
+        'eq': Q(value__gte=number - half, value__lt=number + half),
+        'ne': ~Q(value__gte=number - half, value__lt=number + half),
+        'gt': Q(value__gt=number),
+        'lt': Q(value__lt=number),
+        'ge': Q(value__gte=number),
+        'le': Q(value__lte=number),
+        'sa': Q(value__gt=number),
+        'eb': Q(value__lt=number),
+        'ap': Q(value__gte=number - approximate, value__lte=number + approximate),
+    }[prefix]
+    if system:
+        condition &= Q(system=system)
+    if code:
+        condition &= Q(code=code)
+    return condition
+
+
+def _uri_condition(modifier, value):
+    if modifier == 'below':
+        return Q(value__startswith=value)
+    if modifier == 'above':
+        parts = value.split('/')
+        return Q(value__in=['/'.join(parts[:end]) for end in range(1, len(parts) + 1)])
+    return Q(value=value)
+
+
+def value_condition(parameter_type, modifier, value):
+    """
+    Condition on the index table of parameter_type matching one search value
+
+    Raises:
+        ValueError: If the value cannot be parsed
+    """
+    if parameter_type == TOKEN:
+        return _token_condition(modifier, value)
+    if parameter_type == STRING:
+        return _string_condition(modifier, value)
+    if parameter_type == DATE:
+        return _date_condition(value)
+    if parameter_type == REFERENCE:
+        return _reference_condition(modifier, value)
+    if parameter_type == QUANTITY:
+        return _quantity_condition(value)
+    return _uri_condition(modifier, value)
+
+
+def _availability_condition(model, value):
+    """Availability window condition of a dateTime, or of day|time (e.g. tue|14:00) in the weekly hours"""
+    if '|' in value:
+        day, _, at = value.partition('|')
+        try:
+            at = time.fromisoformat(at)
+        except ValueError:
+            raise ValueError(f"Invalid available time: {value}")
+        return weekly_condition(parse_day(day), at.hour * 60 + at.minute)
+    if 'T' not in value:
+        raise ValueError(f"Invalid available value, expected a dateTime or day|time: {value}")
+    moment, _ = parse_date_range(value)
+    return open_condition(model, moment)
+
+
+def _parameter(resource_type, code, parameter_type=None):
+    parameter = get_parameters(resource_type).get(code)
+    if parameter is None or parameter_type not in (None, parameter.type):
+        kind = f"{parameter_type} " if parameter_type else ''
+        raise ValueError(f"Unknown {kind}search parameter: {resource_type}.{code}")
+    return parameter
+
+
+def _chain_clause(resource_type, name, value):
+    """Clause of a chained parameter, e.g. subject:Patient.name=smith"""
+    head, _, chained = name.partition('.')
+    code, _, target_type = head.partition(':')
+    _parameter(resource_type, code, REFERENCE)
+    if target_type:
+        get_parameters(target_type)
+        target_types = [target_type]
+    else:
+        chained_code = chained.split('.')[0].split(':')[0]
+        target_types = [
+            candidate for candidate in SEARCH_MODELS
+            if chained_code in ('_id', '_has') or chained_code in get_parameters(candidate)
+        ]
+        if not target_types:
+            raise ValueError(f"Unknown search parameter: {chained_code}")
+
+    # Resolve the chain from its end: target ids matching the rest, then references to them
+    condition = Q()
+    for target in target_types:
+        targets = search(target, [(chained, value)])
+        condition |= Q(target_type=target, target_id__in=targets.values('fhir_id'))
+    rows = ReferenceIndex.objects.filter(condition, resource_type=resource_type, param=code)
+    return Clause(rows, 'resource_id', 'pk', False)
+
+
+def _has_clause(resource_type, name, value):
+    """Clause of a reverse chain, e.g. _has:Encounter:subject:status=in-progress"""
+    parts = name.split(':', 3)
+    if len(parts) != 4:
+        raise ValueError(f"Invalid _has parameter: {name}")
+    _, source_type, code, chained = parts
+    _parameter(source_type, code, REFERENCE)
+
+    sources = search(source_type, [(chained, value)])
+    references = ReferenceIndex.objects.filter(
+        resource_type=source_type, param=code, target_type=resource_type, resource_id__in=sources.values('pk')
+    )
+    # Go through the registry, whose (content_type, object_id) index the resource tables' fhir_id lacks
+    rows = ResourceId.objects.filter(
+        content_type=ContentType.objects.get_for_model(SEARCH_MODELS[resource_type]),
+        fhir_id__in=references.values('target_id'),
+    )
+    return Clause(rows, 'object_id', 'pk', False)
+
+
+def parameter_clause(resource_type, name, value):
+    """
+    Compile one search parameter into a semi-join clause
+
+    Args:
+        resource_type: FHIR resource type searched, e.g. Patient
+        name: Parameter name, optionally with a modifier (name:exact), a chain
+            (subject:Patient.name) or a reverse chain (_has:Encounter:subject:status)
+        value: Raw parameter value, comma separated alternatives allowed
+
+    Returns:
+        Clause
+
+    Raises:
+        ValueError: If the parameter, modifier or value is not supported
+    """
+    if name.startswith('_has:'):
+        return _has_clause(resource_type, name, value)
+    if '.' in name:
+        return _chain_clause(resource_type, name, value)
+
+    code, _, modifier = name.partition(':')
+    modifier = modifier or None
+    if code == '_id':
+        rows = ResourceId.objects.filter(resource_type=resource_type, fhir_id__in=_split(value, ','))
+        return Clause(rows, 'object_id', 'pk', False)
+
+    if code == 'near' and resource_type == 'Location':
+        if modifier is not None:
+            raise ValueError(f"Unsupported modifier: near:{modifier}")
+        latitude, longitude, radius_km = parse_near(value)
+        rows = near_positions(LocationPosition.objects.all(), latitude, longitude, radius_km)
+        return Clause(rows, 'location_id', 'pk', False)
+
+    if code == 'available' and SEARCH_MODELS.get(resource_type) in AVAILABILITY_MODELS:
+        if modifier is not None:
+            raise ValueError(f"Unsupported modifier: available:{modifier}")
+        model = SEARCH_MODELS[resource_type]
+        condition = Q()
+        for alternative in _split(value, ','):
+            condition |= _availability_condition(model, alternative)
+        return Clause(window_rows(model, condition), 'resource_id', 'pk', False)
+
+    parameter = _parameter(resource_type, code)
+    rows = INDEX_MODELS[parameter.type].objects.filter(resource_type=resource_type, param=code)
+    if modifier == 'missing':
+        if value not in ('true', 'false'):
+            raise ValueError(f"Invalid :missing value: {value}")
+        return Clause(rows, 'resource_id', 'pk', value == 'true')
+    type_modifier = parameter.type == REFERENCE and modifier in SEARCH_MODELS
+    if modifier not in MODIFIERS[parameter.type] and not type_modifier:
+        raise ValueError(f"Unsupported modifier: {code}:{modifier}")
+
+    condition = Q()
+    for alternative in _split(value, ','):
+        condition |= value_condition(parameter.type, modifier, alternative)
+    return Clause(rows.filter(condition), 'resource_id', 'pk', modifier in ('not', 'not-in'))
+
+
+def estimate_count(queryset, limit=None):
+    """
+    Row count of a queryset as estimated by the PostgreSQL planner
+
+    Other backends have no estimate to read, they count exactly, stopping at
+    limit rows when one is given.
+    """
+    if connections[queryset.db].vendor == 'postgresql':
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+    if limit is not None:
+        queryset = queryset[:limit]
+    return queryset.count()
+
+
+def plan_clauses(queryset, clauses):
+    """
+    Apply clauses to a queryset in the order of their estimated cardinality
+
+    The most selective clause, if it matches at most DRIVER_THRESHOLD rows,
+    becomes an uncorrelated pk IN (...) that the database evaluates once and
+    drives the query from. The others follow as correlated EXISTS probes,
+    most selective first, then the negated ones. A large driver set would
+    defeat a plan that walks the primary key for the first page, so without
+    a selective clause every clause stays an EXISTS.
+    """
+    positive = [clause for clause in clauses if not clause.negated]
+    negated = [clause for clause in clauses if clause.negated]
+    driver = None
+    if positive:
+        estimates = [estimate_count(clause.rows, DRIVER_THRESHOLD + 1) for clause in positive]
+        positive = [clause for _, _, clause in sorted(zip(estimates, range(len(positive)), positive))]
+        if min(estimates) <= DRIVER_THRESHOLD:
+            driver = positive.pop(0)
+            queryset = queryset.filter(**{f'{driver.outer_field}__in': driver.rows.values(driver.inner_field)})
+
+    for clause in positive + negated:
+        exists = Exists(clause.rows.filter(**{clause.inner_field: OuterRef(clause.outer_field)}))
+        queryset = queryset.filter(~exists if clause.negated else exists)
+    return queryset
+
+
+def search(resource_type, query):
+    """
+    Find the resources matching a FHIR search query
+
+    Args:
+        resource_type: FHIR resource type, e.g. Patient
+        query: Search parameters, see parse_query; result parameters such as
+            _count and _sort are ignored
+
+    Returns:
+        Queryset of the resource model
+
+    Raises:
+        ValueError: If the resource type, a parameter, modifier or value is not supported
+    """
+    get_parameters(resource_type)
+    clauses = [
+        parameter_clause(resource_type, name, value)
+        for name, value in parse_query(query) if name not in RESULT_PARAMETERS
+    ]
+    return plan_clauses(SEARCH_MODELS[resource_type]._default_manager.all(), clauses)
@@ -0,0 +1,214 @@
+"""
+Search-parameter index maintenance
+Extracts the values of every search parameter (core.search_params) of a
+resource into the typed index tables, and its compartment memberships into
+CompartmentIndex, replacing the rows of its previous version.
+core.signals schedules reindexing whenever a resource or a row in its
+relation graph changes; the work is deferred to the end of the transaction
+so a resource assembled over many saves is indexed once, after the history
+that records meta.lastUpdated. Bulk writes that bypass signals call
+schedule() themselves.
+"""
+
+import unicodedata
+from collections import defaultdict
+
+from django.db import transaction
+
+from core.intervals import date_row_values
+from core.models import CompartmentIndex, DateIndex, QuantityIndex, ReferenceIndex, StringIndex, TokenIndex, UriIndex
+from core.search_params import (
+    COMPARTMENTS, DATE, QUANTITY, REFERENCE, SEARCH_PLANS, STRING, TOKEN, URI, prefetch_for_indexing
+)
+
+
+# Resources loaded and indexed per transaction
+INDEX_CHUNK_SIZE = 500
+
+INDEX_MODELS = {
+    TOKEN: TokenIndex,
+    STRING: StringIndex,
+    DATE: DateIndex,
+    REFERENCE: ReferenceIndex,
+    QUANTITY: QuantityIndex,
+    URI: UriIndex,
+}
+
+# Every table holding rows derived from a resource
+INDEX_TABLES = tuple(INDEX_MODELS.values()) + (CompartmentIndex,)
+
+
+def normalize_string(value):
+    """Case and accent insensitive form of a string, as stored in StringIndex.value"""
+    decomposed = unicodedata.normalize('NFKD', value)
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
+def _index_row(parameter_type, value):
+    if parameter_type == TOKEN:
+        system, code = value
+        return TokenIndex(system=system, code=code)
+    if parameter_type == STRING:
+        return StringIndex(value=normalize_string(value)[:256], exact=value[:256])
+    if parameter_type == DATE:
+        low, high, span = date_row_values(*value)
+        return DateIndex(low=low, high=high, span=span)
+    if parameter_type == REFERENCE:
+        target_type, target_id = value
+        return ReferenceIndex(target_type=target_type, target_id=target_id)
+    if parameter_type == QUANTITY:
+        number, system, code = value
+        return QuantityIndex(value=number, system=system, code=code)
+    return UriIndex(value=value)
+
+
+def index_rows(instance):
+    """
+    Build the index rows of a resource
+
+    Returns:
+        List of unsaved index model instances
+    """
+    resource_type = type(instance).__name__
+    rows = []
+    for param, parameter in SEARCH_PLANS[type(instance)][1].items():
+        for value in dict.fromkeys(parameter.extract(instance)):
+            row = _index_row(parameter.type, value)
+            row.resource_type, row.resource_id, row.param = resource_type, instance.pk, param
+            rows.append(row)
+    return rows + compartment_rows(instance, rows)
+
+
+def compartment_rows(instance, rows):
+    """
+    Build the compartment memberships of a resource from its reference index rows
+
+    Returns:
+        List of unsaved CompartmentIndex instances
+    """
+    resource_type = type(instance).__name__
+    compartments = set()
+    for compartment_type, members in COMPARTMENTS.items():
+        if resource_type == compartment_type and instance.fhir_id:
+            compartments.add((compartment_type, instance.fhir_id))
+        params = members.get(resource_type, ())
+        compartments |= {
+            (compartment_type, row.target_id) for row in rows
+            if isinstance(row, ReferenceIndex) and row.param in params and row.target_type == compartment_type
+        }
+    return [
+        CompartmentIndex(
+            compartment_type=compartment_type, compartment_id=compartment_id,
+            resource_type=resource_type, resource_id=instance.pk,
+        )
+        for compartment_type, compartment_id in sorted(compartments)
+    ]
+
+
+def is_indexed_model(model):
+    """Whether rows of model are searchable"""
+    return model in SEARCH_PLANS
+
+
+def index_resources(resources, batch_size=None):
+    """
+    Rebuild the index rows of resources, dropping those of deleted resources
+
+    Args:
+        resources: Iterable of (model, primary key) tuples, models that are
+            not indexed are ignored
+        batch_size: Rows per INSERT statement
+
+    Returns:
+        Number of resources indexed
+    """
+    pks_by_model = defaultdict(set)
+    for model, pk in resources:
+        if is_indexed_model(model):
+            pks_by_model[model].add(pk)
+
+    indexed = 0
+    for model, pks in pks_by_model.items():
+        pks = sorted(pks)
+        for start in range(0, len(pks), INDEX_CHUNK_SIZE):
+            chunk = pks[start:start + INDEX_CHUNK_SIZE]
+            with transaction.atomic():
+                rows = defaultdict(list)
+                for instance in prefetch_for_indexing(model._default_manager.filter(pk__in=chunk)):
+                    for row in index_rows(instance):
+                        rows[type(row)].append(row)
+                    indexed += 1
+                for index_model in INDEX_TABLES:
+                    stale = index_model.objects.filter(resource_type=model.__name__, resource_id__in=chunk)
+                    # Index rows have no signals or dependents, skip the delete collector
+                    stale._raw_delete(stale.db)
+                for index_model, group in rows.items():
+                    index_model.objects.bulk_create(group, batch_size=batch_size)
+    return indexed
+
+
+class PendingIndex:
+    """Resources to reindex once the transaction they changed in commits, after the work the index reads"""
+
+    def __init__(self):
+        self.resources = set()
+        self.prerequisites = []
+
+    def __call__(self):
+        for prerequisite in self.prerequisites:
+            prerequisite()
+        index_resources(self.resources)
+
+
+def _pending():
+    connection = transaction.get_connection()
+    pending = getattr(connection, 'pending_search_index', None)
+    # A rolled back transaction or savepoint drops the callback, start over then
+    if pending is None or not any(callback is pending for _, callback, _ in connection.run_on_commit):
+        pending = connection.pending_search_index = PendingIndex()
+        transaction.on_commit(pending)
+    return pending
+
+
+def schedule(resources):
+    """
+    Reindex resources when the current transaction commits, or right away in autocommit mode
+
+    Args:
+        resources: Iterable of (model, primary key) tuples
+    """
+    resources = {(model, pk) for model, pk in resources if is_indexed_model(model)}
+    if not resources:
+        return
+    if not transaction.get_connection().in_atomic_block:
+        index_resources(resources)
+        return
+    _pending().resources |= resources
+
+
+def run_before(callback):
+    """
+    Run a commit callback of the current transaction ahead of its reindex,
+    whichever of the two was registered first
+
+    The owner registers the callback with on_commit too, so it must do
+    nothing when it runs a second time. Outside a transaction callers run
+    their work in the order they call it.
+    """
+    if not transaction.get_connection().in_atomic_block:
+        return
+    pending = _pending()
+    if not any(prerequisite is callback for prerequisite in pending.prerequisites):
+        pending.prerequisites.append(callback)
+
+
+def rebuild_index(model, batch_size=None):
+    """
+    Reindex every resource of a model
+
+    Returns:
+        Number of resources indexed
+    """
+    pks = model._default_manager.values_list('pk', flat=True)
+    return index_resources(((model, pk) for pk in pks.iterator()), batch_size)
@@ -0,0 +1,484 @@
+"""
+FHIR search parameters
+Declares the search parameters of every indexed resource type and how their
+values are extracted from a model instance. core.search_index stores the
+values in the typed index tables, core.search compiles queries against them.
+"""
+
+from collections import namedtuple
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.db.models import Prefetch
+
+from citation.models import Citation
+from components.models import ExtendedContactDetail
+from components.serializers import codeable_concept_prefetch, reference_prefetch
+from core.parsers import parse_reference
+from encounter.models import Encounter, EncounterLocation, EncounterParticipant, EncounterReason
+from endpoint.models import Endpoint, EndpointPayload
+from healthcareservice.models import HealthcareService
+from location.models import Location
+from organization.models import Organization
+from patient.models import Patient, PatientCommunication, PatientLink, RelatedPerson
+from practitioner.models import Practitioner, PractitionerCommunication, PractitionerRole
+
+
+TOKEN, STRING, DATE, REFERENCE, QUANTITY, URI = 'token', 'string', 'date', 'reference', 'quantity', 'uri'
+
+# type: one of the constants above
+# extract: callable(instance) -> iterable of values, per type:
+#   token (system, code), string str, date (low, high) half-open range,
+#   reference (resourceType, id), quantity (value, system, code), uri str
+SearchParameter = namedtuple('SearchParameter', 'type extract')
+
+# Open ends of ranges, e.g. a Period without an end
+MIN_DATETIME = datetime(1, 1, 1, tzinfo=dt_timezone.utc)
+MAX_DATETIME = datetime(9999, 12, 31, tzinfo=dt_timezone.utc)
+
+# Stored dateTimes are precise to the second
+DATETIME_PRECISION = timedelta(seconds=1)
+
+
+# -----------------------------------------EXTRACTORS----------------------------------------- #
+
+def code_tokens(*values):
+    """Tokens of plain codes and booleans"""
+    return [(None, str(value).lower() if isinstance(value, bool) else value) for value in values if value not in (None, '')]
+
+
+def identifier_tokens(identifiers):
+    return [(identifier.system, identifier.value) for identifier in identifiers if identifier.value]
+
+
+def coding_tokens(codings):
+    return [(coding.system, coding.code) for coding in codings if coding is not None and coding.code]
+
+
+def concept_tokens(concepts):
+    """Tokens of the codings of CodeableConcepts, prefetched with codeable_concept_prefetch"""
+    return [token for concept in concepts if concept is not None for token in coding_tokens(concept.codings.all())]
+
+
+def contact_tokens(points, system=None):
+    """Tokens of ContactPoint values, optionally only of one ContactPoint.system (phone, email)"""
+    return [
+        (point.use, point.value) for point in points
+        if point.value and (system is None or point.system == system)
+    ]
+
+
+def name_strings(names, part=None):
+    """
+    Strings of HumanNames
+
+    Args:
+        names: HumanName rows
+        part: 'family' or 'given' for that part only, default every part and the text
+    """
+    values = []
+    for name in names:
+        if part in (None, 'family'):
+            values.append(name.family)
+        if part in (None, 'given'):
+            values += name.given or []
+        if part is None:
+            values += (name.prefix or []) + (name.suffix or []) + [name.text]
+    return [value for value in values if value]
+
+
+ADDRESS_PARTS = {
+    'address-city': 'city',
+    'address-state': 'state',
+    'address-postalcode': 'postalCode',
+    'address-country': 'country',
+}
+
+
+def address_strings(addresses, part=None):
+    """Strings of Addresses, every part and the text unless part names one attribute"""
+    values = []
+    for address in addresses:
+        if address is None:
+            continue
+        if part is not None:
+            values.append(getattr(address, part))
+            continue
+        values += (address.line or []) + [
+            address.city, address.district, address.state, address.postalCode, address.country, address.text
+        ]
+    return [value for value in values if value]
+
+
+def date_range(value):
+    """Range of a date: the whole day, in UTC like core.parsers"""
+    if value is None:
+        return []
+    low = datetime.combine(value, time.min, tzinfo=dt_timezone.utc)
+    return [(low, low + timedelta(days=1))]
+
+
+def datetime_range(value):
+    if value is None:
+        return []
+    return [(value, value + DATETIME_PRECISION)]
+
+
+def period_range(period):
+    """Range of a Period, open ends reach MIN_DATETIME/MAX_DATETIME"""
+    if period is None or (period.start is None and period.end is None):
+        return []
+    return [(
+        period.start or MIN_DATETIME,
+        period.end + DATETIME_PRECISION if period.end else MAX_DATETIME,
+    )]
+
+
+def reference_keys(instance, field_name):
+    """Target of a foreign key to a resource, prefetched with reference_prefetch"""
+    target = getattr(instance, field_name)
+    if target is None or not target.fhir_id:
+        return []
+    return [(type(target).__name__, target.fhir_id)]
+
+
+def references_keys(manager):
+    """Targets of a to-many relation to resources, prefetched with reference_prefetch"""
+    return [(manager.model.__name__, target.fhir_id) for target in manager.all() if target.fhir_id]
+
+
+def reference_row_keys(references, resource_type=None):
+    """Targets of components.Reference rows with a literal reference, optionally of one type only"""
+    keys = (parse_reference({'reference': reference.reference}) for reference in references if reference is not None)
+    return [key for key in keys if key and (resource_type is None or key[0] == resource_type)]
+
+
+def quantity_values(quantity):
+    if quantity is None or quantity.value is None:
+        return []
+    return [(quantity.value, quantity.system, quantity.code or quantity.unit)]
+
+
+def meta_parameters():
+    """Parameters every resource type supports through its MetaElement"""
+    return {
+        '_lastUpdated': SearchParameter(DATE, lambda r: datetime_range(r.meta.lastUpdated) if r.meta else []),
+        '_profile': SearchParameter(URI, lambda r: (r.meta.profile or []) if r.meta else []),
+        '_tag': SearchParameter(TOKEN, lambda r: coding_tokens(r.meta.tag.all()) if r.meta else []),
+        '_security': SearchParameter(TOKEN, lambda r: coding_tokens(r.meta.security.all()) if r.meta else []),
+    }
+
+
+def person_parameters():
+    """Name, address and telecom parameters shared by Patient, Practitioner and RelatedPerson"""
+    parameters = {
+        'name': SearchParameter(STRING, lambda r: name_strings(r.names.all())),
+        'family': SearchParameter(STRING, lambda r: name_strings(r.names.all(), 'family')),
+        'given': SearchParameter(STRING, lambda r: name_strings(r.names.all(), 'given')),
+        'address': SearchParameter(STRING, lambda r: address_strings(r.addresses.all())),
+        'telecom': SearchParameter(TOKEN, lambda r: contact_tokens(r.telecom_points.all())),
+        'phone': SearchParameter(TOKEN, lambda r: contact_tokens(r.telecom_points.all(), 'phone')),
+        'email': SearchParameter(TOKEN, lambda r: contact_tokens(r.telecom_points.all(), 'email')),
+        'gender': SearchParameter(TOKEN, lambda r: code_tokens(r.gender)),
+        'active': SearchParameter(TOKEN, lambda r: code_tokens(r.active)),
+        'identifier': SearchParameter(TOKEN, lambda r: identifier_tokens(r.identifiers.all())),
+    }
+    for name, part in ADDRESS_PARTS.items():
+        parameters[name] = SearchParameter(STRING, lambda r, part=part: address_strings(r.addresses.all(), part))
+    return parameters
+
+
+# ------------------------------------------PREFETCH------------------------------------------ #
+
+def _meta_lookups():
+    return ['meta__tag', 'meta__security']
+
+
+def _person_lookups():
+    return _meta_lookups() + ['identifiers', 'names', 'telecom_points', 'addresses']
+
+
+def _communication_prefetch(model):
+    return Prefetch('communications', queryset=model.objects.prefetch_related(codeable_concept_prefetch('language')))
+
+
+def _address_prefetch(lookup):
+    return Prefetch(lookup, queryset=ExtendedContactDetail.objects.select_related('address'))
+
+
+# Per resource model: (extra prefetch lookups, parameters). The meta row is always
+# joined in; every lookup the extractors walk is prefetched so indexing a batch
+# costs a fixed number of queries.
+SEARCH_PLANS = {
+    Patient: (
+        _person_lookups() + [
+            _communication_prefetch(PatientCommunication),
+            Prefetch('links', queryset=PatientLink.objects.prefetch_related(
+                reference_prefetch(PatientLink, 'other_patient'),
+                reference_prefetch(PatientLink, 'other_related_person'),
+            )),
+            reference_prefetch(Patient, 'managingOrganization'),
+            reference_prefetch(Patient, 'generalPractitioner'),
+            reference_prefetch(Patient, 'generalPractitionerRole'),
+            reference_prefetch(Patient, 'generalPractitionerOrg'),
+        ],
+        dict(
+            person_parameters(),
+            **{
+                'birthdate': SearchParameter(DATE, lambda r: date_range(r.birthDate)),
+                'death-date': SearchParameter(DATE, lambda r: datetime_range(r.deceasedDateTime)),
+                'deceased': SearchParameter(
+                    TOKEN, lambda r: code_tokens(bool(r.deceasedBoolean or r.deceasedDateTime))
+                ),
+                'language': SearchParameter(TOKEN, lambda r: concept_tokens(c.language for c in r.communications.all())),
+                'organization': SearchParameter(REFERENCE, lambda r: reference_keys(r, 'managingOrganization')),
+                'link': SearchParameter(REFERENCE, lambda r: [
+                    key for link in r.links.all()
+                    for key in reference_keys(link, 'other_patient') + reference_keys(link, 'other_related_person')
+                ]),
+                'general-practitioner': SearchParameter(REFERENCE, lambda r: (
+                    references_keys(r.generalPractitioner)
+                    + references_keys(r.generalPractitionerRole)
+                    + references_keys(r.generalPractitionerOrg)
+                )),
+            }
+        ),
+    ),
+    Practitioner: (
+        _person_lookups() + [_communication_prefetch(PractitionerCommunication)],
+        dict(
+            person_parameters(),
+            **{
+                'communication': SearchParameter(
+                    TOKEN, lambda r: concept_tokens(c.language for c in r.communications.all())
+                ),
+            }
+        ),
+    ),
+    RelatedPerson: (
+        _person_lookups() + [
+            codeable_concept_prefetch('relationships'),
+            reference_prefetch(RelatedPerson, 'patient'),
+        ],
+        dict(
+            person_parameters(),
+            **{
+                'birthdate': SearchParameter(DATE, lambda r: date_range(r.birthDate)),
+                'relationship': SearchParameter(TOKEN, lambda r: concept_tokens(r.relationships.all())),
+                'patient': SearchParameter(REFERENCE, lambda r: reference_keys(r, 'patient')),
+            }
+        ),
+    ),
+    PractitionerRole: (
+        _meta_lookups() + [
+            'identifiers', 'period',
+            codeable_concept_prefetch('codes'),
+            codeable_concept_prefetch('specialties'),
+            reference_prefetch(PractitionerRole, 'practitioner'),
+            reference_prefetch(PractitionerRole, 'organization'),
+            reference_prefetch(PractitionerRole, 'location'),
+            reference_prefetch(PractitionerRole, 'healthcare_services'),
+            reference_prefetch(PractitionerRole, 'endpoint'),
+        ],
+        {
+            'identifier': SearchParameter(TOKEN, lambda r: identifier_tokens(r.identifiers.all())),
+            'active': SearchParameter(TOKEN, lambda r: code_tokens(r.active)),
+            'date': SearchParameter(DATE, lambda r: period_range(r.period)),
+            'role': SearchParameter(TOKEN, lambda r: concept_tokens(r.codes.all())),
+            'specialty': SearchParameter(TOKEN, lambda r: concept_tokens(r.specialties.all())),
+            'practitioner': SearchParameter(REFERENCE, lambda r: reference_keys(r, 'practitioner')),
+            'organization': SearchParameter(REFERENCE, lambda r: reference_keys(r, 'organization')),
+            'location': SearchParameter(REFERENCE, lambda r: references_keys(r.location)),
+            'service': SearchParameter(REFERENCE, lambda r: references_keys(r.healthcare_services)),
+            'endpoint': SearchParameter(REFERENCE, lambda r: references_keys(r.endpoint)),
+        },
+    ),
+    Organization: (
+        _meta_lookups() + [
+            'identifiers',
+            codeable_concept_prefetch('org_types'),
+            _address_prefetch('extended_contact_details'),
+            reference_prefetch(Organization, 'partOf'),
+            reference_prefetch(Organization, 'endpoints'),
+        ],
+        dict(
+            {
+                'identifier': SearchParameter(TOKEN, lambda r: identifier_tokens(r.identifiers.all())),
+                'active': SearchParameter(TOKEN, lambda r: code_tokens(r.active)),
+                'name': SearchParameter(STRING, lambda r: [value for value in [r.name] + (r.alias or []) if value]),
+                'type': SearchParameter(TOKEN, lambda r: concept_tokens(r.org_types.all())),
+                'partof': SearchParameter(REFERENCE, lambda r: reference_keys(r, 'partOf')),
+                'endpoint': SearchParameter(REFERENCE, lambda r: references_keys(r.endpoints)),
+                'address': SearchParameter(STRING, lambda r: address_strings(
+                    contact.address for contact in r.extended_contact_details.all()
+                )),
+            },
+            **{
+                name: SearchParameter(STRING, lambda r, part=part: address_strings(
+                    (contact.address for contact in r.extended_contact_details.all()), part
+                ))
+                for name, part in ADDRESS_PARTS.items()
+            }
+        ),
+    ),
+    Location: (
+        _meta_lookups() + [
+            'identifiers', 'address', 'operationalStatus',
+            codeable_concept_prefetch('types'),
+            reference_prefetch(Location, 'managingOrganization'),
+            reference_prefetch(Location, 'partOf'),
+            reference_prefetch(Location, 'endpoint'),
+        ],
+        dict(
+            {
+                'identifier': SearchParameter(TOKEN, lambda r: identifier_tokens(r.identifiers.all())),
+                'name': SearchParameter(STRING, lambda r: [value for value in [r.name] + (r.alias or []) if value]),
+                'status': SearchParameter(TOKEN, lambda r: code_tokens(r.status)),
+                'operational-status': SearchParameter(TOKEN, lambda r: coding_tokens([r.operationalStatus])),
+                'type': SearchParameter(TOKEN, lambda r: concept_tokens(r.types.all())),
+                'address': SearchParameter(STRING, lambda r: address_strings([r.address])),
+                'organization': SearchParameter(REFERENCE, lambda r: reference_keys(r, 'managingOrganization')),
+                'partof': SearchParameter(REFERENCE, lambda r: reference_keys(r, 'partOf')),
+                'endpoint': SearchParameter(REFERENCE, lambda r: references_keys(r.endpoint)),
+            },
+            **{
+                name: SearchParameter(STRING, lambda r, part=part: address_strings([r.address], part))
+                for name, part in ADDRESS_PARTS.items()
+            }
+        ),
+    ),
+    HealthcareService: (
+        _meta_lookups() + [
+            'identifiers',
+            codeable_concept_prefetch('categories'),
+            codeable_concept_prefetch('types'),
+            codeable_concept_prefetch('specialties'),
+            codeable_concept_prefetch('characteristics'),
+            codeable_concept_prefetch('programs'),
+            reference_prefetch(HealthcareService, 'providedBy'),
+            reference_prefetch(HealthcareService, 'location'),
+            reference_prefetch(HealthcareService, 'coverageArea'),
+            reference_prefetch(HealthcareService, 'endpoint'),
+            reference_prefetch(HealthcareService, 'offeredIn'),
+        ],
+        {
+            'identifier': SearchParameter(TOKEN, lambda r: identifier_tokens(r.identifiers.all())),
+            'active': SearchParameter(TOKEN, lambda r: code_tokens(r.active)),
+            'name': SearchParameter(STRING, lambda r: [r.name] if r.name else []),
+            'service-category': SearchParameter(TOKEN, lambda r: concept_tokens(r.categories.all())),
+            'service-type': SearchParameter(TOKEN, lambda r: concept_tokens(r.types.all())),
+            'specialty': SearchParameter(TOKEN, lambda r: concept_tokens(r.specialties.all())),
+            'characteristic': SearchParameter(TOKEN, lambda r: concept_tokens(r.characteristics.all())),
+            'program': SearchParameter(TOKEN, lambda r: concept_tokens(r.programs.all())),
+            'organization': SearchParameter(REFERENCE, lambda r: reference_keys(r, 'providedBy')),
+            'location': SearchParameter(REFERENCE, lambda r: references_keys(r.location)),
+            'coverage-area': SearchParameter(REFERENCE, lambda r: references_keys(r.coverageArea)),
+            'endpoint': SearchParameter(REFERENCE, lambda r: references_keys(r.endpoint)),
+            'offered-in': SearchParameter(REFERENCE, lambda r: references_keys(r.offeredIn)),
+        },
+    ),
+    Endpoint: (
+        _meta_lookups() + [
+            'identifiers',
+            codeable_concept_prefetch('connection_types'),
+            Prefetch('payloads', queryset=EndpointPayload.objects.prefetch_related(
+                codeable_concept_prefetch('payload_types')
+            )),
+            reference_prefetch(Endpoint, 'managingOrganization'),
+        ],
+        {
+            'identifier': SearchParameter(TOKEN, lambda r: identifier_tokens(r.identifiers.all())),
+            'status': SearchParameter(TOKEN, lambda r: code_tokens(r.status)),
+            'name': SearchParameter(STRING, lambda r: [r.name] if r.name else []),
+            'connection-type': SearchParameter(TOKEN, lambda r: concept_tokens(r.connection_types.all())),
+            'payload-type': SearchParameter(TOKEN, lambda r: concept_tokens(
+                concept for payload in r.payloads.all() for concept in payload.payload_types.all()
+            )),
+            'organization': SearchParameter(REFERENCE, lambda r: reference_keys(r, 'managingOrganization')),
+        },
+    ),
+    Encounter: (
+        _meta_lookups() + [
+            'identifiers', 'subject', 'serviceProvider', 'actualPeriod', 'length',
+            codeable_concept_prefetch('class_field'),
+            codeable_concept_prefetch('type'),
+            reference_prefetch(Encounter, 'partOf'),
+            Prefetch('participants', queryset=EncounterParticipant.objects.select_related('actor')),
+            Prefetch('reasons', queryset=EncounterReason.objects.prefetch_related(codeable_concept_prefetch('value'))),
+            Prefetch('locations', queryset=EncounterLocation.objects.select_related('location')),
+        ],
+        {
+            'identifier': SearchParameter(TOKEN, lambda r: identifier_tokens(r.identifiers.all())),
+            'status': SearchParameter(TOKEN, lambda r: code_tokens(r.status)),
+            'class': SearchParameter(TOKEN, lambda r: concept_tokens([r.class_field])),
+            'type': SearchParameter(TOKEN, lambda r: concept_tokens(r.type.all())),
+            'reason-code': SearchParameter(TOKEN, lambda r: concept_tokens(
+                concept for reason in r.reasons.all() for concept in reason.value.all()
+            )),
+            'date': SearchParameter(DATE, lambda r: period_range(r.actualPeriod)),
+            'length': SearchParameter(QUANTITY, lambda r: quantity_values(r.length)),
+            'subject': SearchParameter(REFERENCE, lambda r: reference_row_keys([r.subject])),
+            'patient': SearchParameter(REFERENCE, lambda r: reference_row_keys([r.subject], 'Patient')),
+            'service-provider': SearchParameter(REFERENCE, lambda r: reference_row_keys([r.serviceProvider])),
+            'part-of': SearchParameter(REFERENCE, lambda r: reference_keys(r, 'partOf')),
+            'participant': SearchParameter(REFERENCE, lambda r: reference_row_keys(
+                participant.actor for participant in r.participants.all()
+            )),
+            'practitioner': SearchParameter(REFERENCE, lambda r: reference_row_keys(
+                (participant.actor for participant in r.participants.all()), 'Practitioner'
+            )),
+            'location': SearchParameter(REFERENCE, lambda r: reference_row_keys(
+                location.location for location in r.locations.all()
+            )),
+        },
+    ),
+    Citation: (
+        _meta_lookups() + ['identifiers', 'effectivePeriod'],
+        {
+            'identifier': SearchParameter(TOKEN, lambda r: identifier_tokens(r.identifiers.all())),
+            'url': SearchParameter(URI, lambda r: [r.url] if r.url else []),
+            'version': SearchParameter(TOKEN, lambda r: code_tokens(r.version)),
+            'status': SearchParameter(TOKEN, lambda r: code_tokens(r.status)),
+            'name': SearchParameter(STRING, lambda r: [r.name] if r.name else []),
+            'title': SearchParameter(STRING, lambda r: [r.title] if r.title else []),
+            'publisher': SearchParameter(STRING, lambda r: [r.publisher] if r.publisher else []),
+            'date': SearchParameter(DATE, lambda r: datetime_range(r.date)),
+            'effective': SearchParameter(DATE, lambda r: period_range(r.effectivePeriod)),
+        },
+    ),
+}
+
+for _, parameters in SEARCH_PLANS.values():
+    parameters.update(meta_parameters())
+
+# Reference parameters that place a resource in the compartment of their target,
+# per compartment type and member type (FHIR CompartmentDefinition). The focal
+# resource is a member of its own compartment.
+COMPARTMENTS = {
+    'Patient': {
+        'Patient': ('link',),
+        'RelatedPerson': ('patient',),
+        'Encounter': ('patient',),
+    },
+}
+
+# Indexed models keyed by FHIR resourceType
+SEARCH_MODELS = {model.__name__: model for model in SEARCH_PLANS}
+
+
+def get_parameters(resource_type):
+    """
+    Search parameters of a resource type
+
+    Raises:
+        ValueError: If the resource type is not searchable
+    """
+    model = SEARCH_MODELS.get(resource_type)
+    if model is None:
+        raise ValueError(f"Unsupported resource type: {resource_type}")
+    return SEARCH_PLANS[model][1]
+
+
+def prefetch_for_indexing(queryset):
+    """Load every relation the extractors of the queryset's resource type walk"""
+    lookups, _ = SEARCH_PLANS[queryset.model]
+    return queryset.select_related('meta').prefetch_related(*lookups)
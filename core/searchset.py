@@ -0,0 +1,176 @@
+"""
+Searchset Bundles
+Pages through core.search results with keyset pagination on the primary key:
+a page is the next _count rows after the last key of the previous one, which
+the next link carries in an opaque signed _cursor, so deep pages cost the same
+as the first instead of skipping OFFSET rows. The total is only computed when
+requested with _total; 'estimate' reads the PostgreSQL planner's row estimate
+instead of counting. A Location near search may be sorted nearest first with
+_sort=near, which keys the pages on (distance, primary key). Resources
+requested with _include and _revinclude (core.includes) are added to each
+page with search mode 'include'. Entries are rendered through core.cache.
+"""
+
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+
+from core.cache import get_cached_fhir_dicts
+from core.geo import distance_expression, distance_extension, parse_near
+from core.includes import included_resources, load_resources, parse_include, revincluded_resources
+from core.search import estimate_count, parse_query, search
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+CURSOR_SALT = 'core.searchset.cursor'
+
+TOTAL_MODES = ('none', 'estimate', 'accurate')
+
+
+def encode_cursor(last_pk, last_distance=None):
+    """Opaque cursor resuming a search after the row with primary key last_pk (at last_distance when sorted by near)"""
+    key = last_pk if last_distance is None else [last_distance, last_pk]
+    return signing.dumps(key, salt=CURSOR_SALT)
+
+
+def decode_cursor(cursor):
+    """
+    Position a cursor resumes after
+
+    Returns:
+        (distance or None, primary key)
+
+    Raises:
+        ValueError: If the cursor was not issued by encode_cursor
+    """
+    try:
+        key = signing.loads(cursor, salt=CURSOR_SALT)
+        if isinstance(key, list):
+            return float(key[0]), int(key[1])
+        return None, int(key)
+    except (signing.BadSignature, IndexError, TypeError, ValueError):
+        raise ValueError("Invalid search cursor")
+
+
+def page_size(value):
+    """Page size of a _count value, FHIR_SEARCH_PAGE_SIZE by default and capped at FHIR_SEARCH_MAX_PAGE_SIZE"""
+    if value is None:
+        return getattr(settings, 'FHIR_SEARCH_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    try:
+        size = int(value)
+    except ValueError:
+        raise ValueError(f"Invalid _count: {value}")
+    if size < 1:
+        raise ValueError(f"Invalid _count: {value}")
+    return min(size, getattr(settings, 'FHIR_SEARCH_MAX_PAGE_SIZE', MAX_PAGE_SIZE))
+
+
+def _url(base_url, path, pairs=None):
+    url = f"{base_url.rstrip('/')}/{path}" if base_url else path
+    return f"{url}?{urlencode(pairs)}" if pairs else url
+
+
+def _entries(instances, mode, base_url, trusted):
+    """Bundle entries of resources in their order, rendered with one cache batch per type"""
+    pks_by_model = defaultdict(list)
+    for instance in instances:
+        pks_by_model[type(instance)].append(instance.pk)
+    documents = {
+        (model, pk): document for model, pks in pks_by_model.items()
+        for pk, document in get_cached_fhir_dicts(model, pks, trusted=trusted).items()
+    }
+
+    entries = []
+    for instance in instances:
+        entry = {'resource': documents[(type(instance), instance.pk)], 'search': {'mode': mode}}
+        if getattr(instance, 'near_distance', None) is not None:
+            entry['search']['extension'] = [distance_extension(instance.near_distance)]
+        if base_url:
+            entry = {'fullUrl': _url(base_url, f'{type(instance).__name__}/{instance.fhir_id}'), **entry}
+        entries.append(entry)
+    return entries
+
+
+def _ids_only(queryset):
+    # Documents come from the cache, rows only give the keys and fullUrl
+    return queryset.only('fhir_id')
+
+
+def search_bundle(resource_type, query, base_url=None, trusted=None):
+    """
+    Build one page of a searchset Bundle
+
+    Args:
+        resource_type: FHIR resource type, e.g. Patient
+        query: Search parameters as accepted by core.search.parse_query, including
+            _count, _total (none, estimate or accurate), _include, _revinclude
+            the _cursor of a next link and _sort=near for a Location near search
+        base_url: Server base of the fullUrl and link URLs, defaults to FHIR_BASE_URL
+        trusted: Skip per-element validation, defaults to FHIR_TRUSTED_OUTPUT
+
+    Returns:
+        Bundle dictionary with the matches in primary-key order, or nearest
+        first with _sort=near; near matches carry their distance
+
+    Raises:
+        ValueError: If the search, _count, _total, an include or _cursor is not valid
+    """
+    if base_url is None:
+        base_url = getattr(settings, 'FHIR_BASE_URL', '')
+    pairs = [(name, value) for name, value in parse_query(query) if name != '_cursor']
+    options = dict(parse_query(query))
+    near = parse_near(options['near']) if resource_type == 'Location' and 'near' in options else None
+    if options.get('_sort') not in (None, 'near'):
+        raise ValueError("_sort only supports near, results are otherwise returned in insertion order")
+    sort_by_distance = options.get('_sort') == 'near'
+    if sort_by_distance and near is None:
+        raise ValueError("_sort=near needs a Location near search")
+    total_mode = options.get('_total', 'none')
+    if total_mode not in TOTAL_MODES:
+        raise ValueError(f"Invalid _total: {total_mode}")
+    size = page_size(options.get('_count'))
+    includes = [parse_include(value) for name, value in pairs if name == '_include']
+    revincludes = [parse_include(value) for name, value in pairs if name == '_revinclude']
+
+    queryset = search(resource_type, pairs)
+    page = queryset
+    if near is not None:
+        page = page.annotate(near_distance=distance_expression(near[0], near[1], 'position__'))
+    page = page.order_by('near_distance', 'pk') if sort_by_distance else page.order_by('pk')
+    if options.get('_cursor'):
+        last_distance, last_pk = decode_cursor(options['_cursor'])
+        if sort_by_distance != (last_distance is not None):
+            raise ValueError("Invalid search cursor")
+        if sort_by_distance:
+            page = page.filter(Q(near_distance__gt=last_distance) | Q(near_distance=last_distance, pk__gt=last_pk))
+        else:
+            page = page.filter(pk__gt=last_pk)
+    rows = list(_ids_only(page)[:size + 1])
+
+    bundle = {'resourceType': 'Bundle', 'type': 'searchset'}
+    if total_mode == 'accurate':
+        bundle['total'] = queryset.count()
+    elif total_mode == 'estimate':
+        bundle['total'] = estimate_count(queryset)
+
+    links = [{'relation': 'self', 'url': _url(base_url, resource_type, parse_query(query))}]
+    if len(rows) > size:
+        rows = rows[:size]
+        last_distance = rows[-1].near_distance if sort_by_distance else None
+        next_pairs = pairs + [('_cursor', encode_cursor(rows[-1].pk, last_distance))]
+        links.append({'relation': 'next', 'url': _url(base_url, resource_type, next_pairs)})
+    bundle['link'] = links
+
+    matches = {(type(instance), instance.pk) for instance in rows}
+    related = included_resources(resource_type, rows, includes) | revincluded_resources(resource_type, rows, revincludes)
+    included = load_resources(related - matches, _ids_only)
+
+    bundle['entry'] = (
+        _entries(rows, 'match', base_url, trusted) + _entries(included, 'include', base_url, trusted)
+    )
+    return bundle
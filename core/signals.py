@@ -0,0 +1,178 @@
+"""
+Cache invalidation, search reindexing and logical-id registry sync
+Any save or delete of a resource, or of a row in its relation graph, drops the
+cached serialization of every resource that embeds it and schedules their
+next history version (core.history), search index rebuild (core.search_index)
+and materialized document (core.materialize), and saves and deletes of
+resources update core.registry and the partOf closure tables (core.hierarchy).
+Changes to availability rows schedule the weekly availability index of their
+owner (core.availability).
+Bulk operations that bypass signals (bulk_create, QuerySet.update) must
+invalidate, record history, reindex, rematerialize, register and sync the
+hierarchy and availability explicitly.
+"""
+
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from core import availability, cache, hierarchy, history, materialize, registry, search_index
+from core.geo import encode_geohash
+from core.graph import embedding_resources, is_resource_model, is_tracked_model, referencing_resources
+from location.models import LocationPosition
+
+
+def _invalidate_all(resources):
+    for resource_model, pk in resources:
+        cache.invalidate(resource_model.__name__, pk)
+    # At commit the search index runs the pending history first, it reads meta.lastUpdated
+    history.schedule(resources)
+    search_index.schedule(resources)
+    materialize.schedule(resources)
+
+
+@receiver(pre_save)
+def remember_previous_dependents(sender, instance, raw=False, **kwargs):
+    """Record who embedded the row, and whose availability it fed, before an update moves it to another owner"""
+    tracked = is_tracked_model(sender)
+    if raw or instance._state.adding or instance.pk is None or not (tracked or availability.is_source_model(sender)):
+        return
+    # One read of the stored row serves both the serialized graph and the availability index
+    previous = sender._default_manager.filter(pk=instance.pk).first()
+    if previous is None:
+        return
+
+    if availability.is_source_model(sender):
+        instance._previous_availability_owners = availability.owners(previous)
+    if not tracked:
+        return
+
+    if is_resource_model(sender):
+        instance._fhir_id_changed = previous.fhir_id != instance.fhir_id
+        return
+
+    # Only the row's own foreign keys can change which resources embed it
+    moved = any(
+        getattr(previous, field.attname) != getattr(instance, field.attname)
+        for field in sender._meta.concrete_fields if field.is_relation
+    )
+    if moved:
+        instance._previous_fhir_dependents = embedding_resources(previous)
+
+
+@receiver(post_save)
+def invalidate_on_save(sender, instance, raw=False, **kwargs):
+    if raw or not is_tracked_model(sender):
+        return
+    dependents = embedding_resources(instance)
+    dependents |= getattr(instance, '_previous_fhir_dependents', set())
+    if getattr(instance, '_fhir_id_changed', False):
+        # Referencing resources render the old fhir_id
+        dependents |= referencing_resources(instance)
+    _invalidate_all(dependents)
+
+
+@receiver(pre_delete)
+def collect_dependents_on_delete(sender, instance, **kwargs):
+    """Resolve dependents while the row and its links still exist"""
+    if not is_tracked_model(sender):
+        return
+    dependents = embedding_resources(instance)
+    if is_resource_model(sender):
+        dependents |= referencing_resources(instance)
+    instance._deleted_fhir_dependents = dependents
+
+
+@receiver(post_delete)
+def invalidate_on_delete(sender, instance, **kwargs):
+    _invalidate_all(getattr(instance, '_deleted_fhir_dependents', ()))
+
+
+@receiver(m2m_changed)
+def invalidate_on_m2m_change(sender, instance, action, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    dependents = set()
+    if is_tracked_model(type(instance)):
+        dependents |= embedding_resources(instance)
+    if pk_set and is_resource_model(model):
+        dependents |= {(model, pk) for pk in pk_set}
+    elif pk_set and is_tracked_model(model):
+        for related in model._default_manager.filter(pk__in=pk_set):
+            dependents |= embedding_resources(related)
+    _invalidate_all(dependents)
+
+
+@receiver(pre_save)
+def check_logical_id(sender, instance, **kwargs):
+    """Refuse to save a resource under a logical id another resource holds"""
+    if not registry.is_registered_model(sender):
+        return
+    instance._registry_current = registry.check_available(instance)
+
+
+@receiver(post_save)
+def register_on_save(sender, instance, **kwargs):
+    if registry.is_registered_model(sender) and not getattr(instance, '_registry_current', False):
+        registry.sync(instance)
+
+
+@receiver(post_delete)
+def unregister_on_delete(sender, instance, **kwargs):
+    if registry.is_registered_model(sender):
+        registry.unregister(instance)
+
+
+@receiver(post_delete)
+def record_delete_history(sender, instance, **kwargs):
+    if history.is_history_model(sender):
+        history.schedule_delete(instance)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def reindex_untracked_resource(sender, instance, raw=False, **kwargs):
+    """Searchable resources outside the serialized graph are not reached by the handlers above"""
+    if not raw and search_index.is_indexed_model(sender) and not is_tracked_model(sender):
+        search_index.schedule([(sender, instance.pk)])
+
+
+@receiver(pre_save)
+def check_hierarchy(sender, instance, raw=False, **kwargs):
+    """Refuse a partOf loop before it is stored"""
+    if not raw and hierarchy.is_hierarchy_model(sender):
+        hierarchy.check_parent(instance)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def sync_hierarchy(sender, instance, raw=False, **kwargs):
+    if not raw and hierarchy.is_hierarchy_model(sender):
+        hierarchy.sync([(sender, instance.pk)])
+
+
+@receiver(pre_save, sender=LocationPosition)
+def set_geohash(sender, instance, **kwargs):
+    """Keep the near-search cell (core.geo) of a position in step with its coordinates"""
+    if instance.latitude is not None and instance.longitude is not None:
+        instance.geohash = encode_geohash(instance.latitude, instance.longitude)
+
+
+@receiver(post_save)
+def sync_availability_on_save(sender, instance, raw=False, **kwargs):
+    if not raw and availability.is_source_model(sender):
+        availability.schedule(availability.owners(instance) | getattr(instance, '_previous_availability_owners', set()))
+
+
+@receiver(pre_delete)
+def collect_availability_owners(sender, instance, **kwargs):
+    """Resolve owners while the row and its links still exist, a deleted Period is unlinked before post_delete"""
+    if availability.is_source_model(sender):
+        instance._availability_owners = availability.owners(instance)
+
+
+@receiver(post_delete)
+def sync_availability_on_delete(sender, instance, **kwargs):
+    if availability.is_source_model(sender):
+        availability.schedule(getattr(instance, '_availability_owners', ()))
+    elif availability.is_availability_model(sender):
+        availability.schedule([(sender, instance.pk)])
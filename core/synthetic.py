@@ -0,0 +1,399 @@
+"""
+Synthetic FHIR data generator
+Builds a reproducible population of FHIR resources around a number of
+Patients, with Organizations, Endpoints, Practitioners, PractitionerRoles,
+Locations, HealthcareServices, RelatedPersons and Encounters in realistic
+proportions. The same seed always yields the same resources. populate() loads
+them through the bulk importer and adds Citations, which it has no parser for.
+"""
+
+import datetime
+import random
+
+from django.db import transaction
+
+from components.models import Identifier, Period
+from citation.models import Citation, CitationClassification, CitationStatusDate, CitationSummary
+from core.concepts import intern_concept
+from core.ingest import DEFAULT_BATCH_SIZE, ingest_resources
+
+
+GIVEN_NAMES = [
+    'Ada', 'Ben', 'Clara', 'David', 'Elif', 'Farah', 'Goran', 'Hana', 'Ivan', 'Jana', 'Karim', 'Lena',
+    'Mateo', 'Nora', 'Omar', 'Petra', 'Quinn', 'Rosa', 'Sami', 'Tea', 'Uma', 'Viktor', 'Wen', 'Yara', 'Zoran',
+]
+FAMILY_NAMES = [
+    'Smith', 'Novak', 'Garcia', 'Kaya', 'Müller', 'Rossi', 'Dubois', 'Nowak', 'Horvat', 'Jensen',
+    'Popescu', 'Silva', 'Tanaka', 'Kim', 'Nguyen', 'Ahmed', 'Hoxha', 'Berisha', 'Ivanova', 'Larsen',
+]
+CITIES = [
+    ('Berlin', 'Berlin', 'DE'), ('Vienna', 'Vienna', 'AT'), ('Zurich', 'Zurich', 'CH'), ('Prishtina', 'Prishtina', 'XK'),
+    ('Oslo', 'Oslo', 'NO'), ('Lyon', 'Auvergne-Rhône-Alpes', 'FR'), ('Porto', 'Porto', 'PT'), ('Zagreb', 'Zagreb', 'HR'),
+]
+STREETS = ['Main Street', 'Station Road', 'Church Lane', 'Park Avenue', 'Mill Road', 'High Street', 'Lake View']
+
+V2 = 'http://terminology.hl7.org/CodeSystem/v2-0203'
+SNOMED = 'http://snomed.info/sct'
+ACT_CODE = 'http://terminology.hl7.org/CodeSystem/v3-ActCode'
+
+MARITAL_STATUSES = [('M', 'Married'), ('S', 'Never Married'), ('D', 'Divorced'), ('W', 'Widowed'), ('U', 'Unmarried')]
+RELATIONSHIPS = [('N', 'Next-of-Kin'), ('C', 'Emergency Contact'), ('E', 'Employer'), ('U', 'Unknown')]
+LANGUAGES = [('en', 'English'), ('de', 'German'), ('fr', 'French'), ('sq', 'Albanian'), ('es', 'Spanish')]
+SPECIALTIES = [
+    ('394814009', 'General practice'), ('394579002', 'Cardiology'), ('394585009', 'Obstetrics and gynecology'),
+    ('394537008', 'Pediatric specialty'), ('394591006', 'Neurology'), ('394582007', 'Dermatology'),
+]
+ROLES = [('doctor', 'Doctor'), ('nurse', 'Nurse'), ('pharmacist', 'Pharmacist'), ('researcher', 'Researcher')]
+ENCOUNTER_CLASSES = [('AMB', 'ambulatory'), ('EMER', 'emergency'), ('IMP', 'inpatient encounter'), ('VR', 'virtual')]
+ENCOUNTER_STATUSES = ['planned', 'in-progress', 'completed', 'completed', 'completed', 'cancelled']
+REASONS = [
+    ('386661006', 'Fever'), ('25064002', 'Headache'), ('29857009', 'Chest pain'),
+    ('49727002', 'Cough'), ('22253000', 'Pain'), ('271807003', 'Skin rash'),
+]
+
+
+def population_counts(patients, encounters_per_patient=2):
+    """
+    Number of resources of each type generated around a number of patients
+
+    Returns:
+        Dict of resourceType -> count
+    """
+    return {
+        'Organization': max(1, patients // 200),
+        'Endpoint': max(1, patients // 200),
+        'Practitioner': max(1, patients // 50),
+        'PractitionerRole': max(1, patients // 50),
+        'Location': max(1, patients // 100),
+        'HealthcareService': max(1, patients // 200),
+        'Patient': patients,
+        'RelatedPerson': patients // 5,
+        'Encounter': patients * encounters_per_patient,
+        'Citation': max(1, patients // 1000),
+    }
+
+
+def _concept(system, code, display):
+    return {'coding': [{'system': system, 'code': code, 'display': display}], 'text': display}
+
+
+def _reference(resource_type, id_prefix, index):
+    return {'reference': f'{resource_type}/{id_prefix}-{index}'}
+
+
+class SyntheticData:
+    """
+    Seeded generator of FHIR resource dictionaries
+
+    Args:
+        patients: Number of patients, the other resource types are scaled from it
+        seed: Random seed, the same seed gives the same resources
+        encounters_per_patient: Average number of encounters per patient
+    """
+
+    def __init__(self, patients, seed=0, encounters_per_patient=2):
+        self.counts = population_counts(patients, encounters_per_patient)
+        self.random = random.Random(seed)
+
+    def date(self, start_year, end_year):
+        start = datetime.date(start_year, 1, 1)
+        return start + datetime.timedelta(days=self.random.randrange((datetime.date(end_year, 1, 1) - start).days))
+
+    def moment(self, start_year=2015, end_year=2025):
+        day = self.date(start_year, end_year)
+        return datetime.datetime(
+            day.year, day.month, day.day, self.random.randrange(7, 20), self.random.randrange(60),
+            tzinfo=datetime.timezone.utc,
+        )
+
+    def period(self, hours=None):
+        start = self.moment()
+        end = start + datetime.timedelta(hours=hours or self.random.randrange(1, 24 * 365))
+        return {'start': start.isoformat(), 'end': end.isoformat()}
+
+    def pick(self, values):
+        return self.random.choice(values)
+
+    def human_name(self, family=None, use='official'):
+        given = [self.pick(GIVEN_NAMES)]
+        if self.random.random() < 0.3:
+            given.append(self.pick(GIVEN_NAMES))
+        family = family or self.pick(FAMILY_NAMES)
+        return {'use': use, 'family': family, 'given': given, 'text': f"{' '.join(given)} {family}"}
+
+    def telecom(self, count):
+        points = []
+        for rank in range(1, count + 1):
+            if self.random.random() < 0.6:
+                points.append({
+                    'system': 'phone', 'use': self.pick(['home', 'mobile', 'work']), 'rank': rank,
+                    'value': f'+49 30 {self.random.randrange(1000000, 9999999)}',
+                })
+            else:
+                points.append({
+                    'system': 'email', 'use': self.pick(['home', 'work']), 'rank': rank,
+                    'value': f'{self.pick(GIVEN_NAMES).lower()}.{self.random.randrange(10000)}@example.org',
+                })
+        return points
+
+    def address(self, use='home'):
+        city, state, country = self.pick(CITIES)
+        line = f'{self.random.randrange(1, 200)} {self.pick(STREETS)}'
+        postal_code = str(self.random.randrange(10000, 99999))
+        return {
+            'use': use, 'type': 'both', 'line': [line], 'city': city, 'state': state,
+            'postalCode': postal_code, 'country': country, 'text': f'{line}, {postal_code} {city}',
+        }
+
+    def identifier(self, system, value, type_code=None):
+        data = {'use': 'official', 'system': system, 'value': value}
+        if type_code:
+            data['type'] = _concept(V2, type_code, type_code)
+        return data
+
+    def organization(self, index):
+        counts = self.counts
+        data = {
+            'resourceType': 'Organization',
+            'id': f'org-{index}',
+            'active': True,
+            'name': f'{self.pick(CITIES)[0]} Health Center {index}',
+            'identifier': [self.identifier('http://example.org/fhir/sid/org', f'ORG{index:06d}', 'XX')],
+            'type': [_concept('http://terminology.hl7.org/CodeSystem/organization-type', 'prov', 'Healthcare Provider')],
+            'endpoint': [_reference('Endpoint', 'endpoint', index)],
+        }
+        # A few regional networks with member organizations
+        if index >= 10 and counts['Organization'] > 10:
+            data['partOf'] = _reference('Organization', 'org', index % 10)
+        return data
+
+    def endpoint(self, index):
+        return {
+            'resourceType': 'Endpoint',
+            'id': f'endpoint-{index}',
+            'status': 'active',
+            'name': f'FHIR endpoint {index}',
+            'address': f'https://fhir{index}.example.org/r5',
+            'connectionType': [_concept(
+                'http://terminology.hl7.org/CodeSystem/endpoint-connection-type', 'hl7-fhir-rest', 'HL7 FHIR'
+            )],
+            'managingOrganization': _reference('Organization', 'org', index),
+            'period': self.period(),
+        }
+
+    def practitioner(self, index):
+        language = self.pick(LANGUAGES)
+        return {
+            'resourceType': 'Practitioner',
+            'id': f'practitioner-{index}',
+            'active': True,
+            'gender': self.pick(['female', 'male']),
+            'birthDate': self.date(1955, 1995).isoformat(),
+            'identifier': [self.identifier('http://example.org/fhir/sid/npi', f'{1000000000 + index}', 'PRN')],
+            'name': [self.human_name()],
+            'telecom': self.telecom(self.random.randrange(1, 3)),
+            'address': [self.address('work')],
+            'qualification': [{
+                'code': _concept('http://terminology.hl7.org/CodeSystem/v2-0360', 'MD', 'Doctor of Medicine'),
+                'period': self.period(),
+                'issuer': _reference('Organization', 'org', self.random.randrange(self.counts['Organization'])),
+            }],
+            'communication': [{
+                'language': _concept('urn:ietf:bcp:47', *language), 'preferred': True,
+            }],
+        }
+
+    def practitioner_role(self, index):
+        counts = self.counts
+        return {
+            'resourceType': 'PractitionerRole',
+            'id': f'role-{index}',
+            'active': True,
+            'period': self.period(),
+            'practitioner': _reference('Practitioner', 'practitioner', index),
+            'organization': _reference('Organization', 'org', index % counts['Organization']),
+            'code': [_concept('http://terminology.hl7.org/CodeSystem/practitioner-role', *self.pick(ROLES))],
+            'specialty': [_concept(SNOMED, *self.pick(SPECIALTIES))],
+            'location': [_reference('Location', 'location', index % counts['Location'])],
+            'endpoint': [_reference('Endpoint', 'endpoint', index % counts['Organization'])],
+        }
+
+    def location(self, index):
+        counts = self.counts
+        data = {
+            'resourceType': 'Location',
+            'id': f'location-{index}',
+            'status': 'active',
+            'name': f'Ward {index}',
+            'mode': 'instance',
+            'identifier': [self.identifier('http://example.org/fhir/sid/location', f'LOC{index:06d}')],
+            'type': [_concept('http://terminology.hl7.org/CodeSystem/v3-RoleCode', 'HOSP', 'Hospital')],
+            'address': self.address('work'),
+            'position': {
+                'latitude': round(self.random.uniform(36.0, 60.0), 6),
+                'longitude': round(self.random.uniform(-9.0, 28.0), 6),
+            },
+            'managingOrganization': _reference('Organization', 'org', index % counts['Organization']),
+        }
+        if index >= counts['Organization']:
+            data['partOf'] = _reference('Location', 'location', index % counts['Organization'])
+        return data
+
+    def healthcare_service(self, index):
+        counts = self.counts
+        return {
+            'resourceType': 'HealthcareService',
+            'id': f'service-{index}',
+            'active': True,
+            'name': f'{self.pick(SPECIALTIES)[1]} service {index}',
+            'appointmentRequired': self.random.random() < 0.7,
+            'identifier': [self.identifier('http://example.org/fhir/sid/service', f'HS{index:06d}')],
+            'providedBy': _reference('Organization', 'org', index % counts['Organization']),
+            'category': [_concept('http://terminology.hl7.org/CodeSystem/service-category', '35', 'Hospital')],
+            'specialty': [_concept(SNOMED, *self.pick(SPECIALTIES))],
+            'location': [_reference('Location', 'location', index % counts['Location'])],
+            'endpoint': [_reference('Endpoint', 'endpoint', index % counts['Organization'])],
+        }
+
+    def patient(self, index):
+        counts = self.counts
+        family = self.pick(FAMILY_NAMES)
+        data = {
+            'resourceType': 'Patient',
+            'id': f'patient-{index}',
+            'active': True,
+            'gender': self.pick(['female', 'male', 'other', 'unknown']),
+            'birthDate': self.date(1930, 2024).isoformat(),
+            'identifier': [self.identifier('http://example.org/fhir/sid/mrn', f'MRN{index:08d}', 'MR')],
+            'name': [self.human_name(family)],
+            'telecom': self.telecom(self.random.randrange(1, 4)),
+            'address': [self.address() for _ in range(self.random.randrange(1, 3))],
+            'maritalStatus': _concept(
+                'http://terminology.hl7.org/CodeSystem/v3-MaritalStatus', *self.pick(MARITAL_STATUSES)
+            ),
+            'communication': [{'language': _concept('urn:ietf:bcp:47', *self.pick(LANGUAGES)), 'preferred': True}],
+            'managingOrganization': _reference('Organization', 'org', index % counts['Organization']),
+            'generalPractitioner': [
+                _reference('Practitioner', 'practitioner', self.random.randrange(counts['Practitioner']))
+            ],
+        }
+        if self.random.random() < 0.2:
+            data['name'].append(self.human_name(family, use='usual'))
+        contacts = []
+        for _ in range(self.random.randrange(3)):
+            contacts.append({
+                'relationship': [_concept('http://terminology.hl7.org/CodeSystem/v2-0131', *self.pick(RELATIONSHIPS))],
+                'name': self.human_name(),
+                'telecom': self.telecom(1),
+                'address': self.address(),
+                'gender': self.pick(['female', 'male']),
+            })
+        if contacts:
+            data['contact'] = contacts
+        # Some records are known duplicates of an earlier patient
+        if index and self.random.random() < 0.05:
+            data['link'] = [{'other': _reference('Patient', 'patient', self.random.randrange(index)), 'type': 'seealso'}]
+        return data
+
+    def related_person(self, index):
+        patient = self.random.randrange(self.counts['Patient'])
+        return {
+            'resourceType': 'RelatedPerson',
+            'id': f'related-{index}',
+            'active': True,
+            'patient': _reference('Patient', 'patient', patient),
+            'gender': self.pick(['female', 'male']),
+            'birthDate': self.date(1940, 2005).isoformat(),
+            'relationship': [_concept('http://terminology.hl7.org/CodeSystem/v3-RoleCode', 'FAMMEMB', 'family member')],
+            'name': [self.human_name()],
+            'telecom': self.telecom(1),
+            'address': [self.address()],
+            'period': self.period(),
+        }
+
+    def encounter(self, index):
+        counts = self.counts
+        patient = index % counts['Patient']
+        encounter_class = self.pick(ENCOUNTER_CLASSES)
+        hours = 24 * self.random.randrange(1, 10) if encounter_class[0] == 'IMP' else self.random.randrange(1, 4)
+        return {
+            'resourceType': 'Encounter',
+            'id': f'encounter-{index}',
+            'status': self.pick(ENCOUNTER_STATUSES),
+            'class': [_concept(ACT_CODE, *encounter_class)],
+            'identifier': [self.identifier('http://example.org/fhir/sid/visit', f'V{index:09d}', 'VN')],
+            'type': [_concept(SNOMED, '11429006', 'Consultation')],
+            'subject': _reference('Patient', 'patient', patient),
+            'serviceProvider': _reference('Organization', 'org', patient % counts['Organization']),
+            'participant': [{
+                'type': [_concept('http://terminology.hl7.org/CodeSystem/v3-ParticipationType', 'ATND', 'attender')],
+                'actor': _reference('Practitioner', 'practitioner', self.random.randrange(counts['Practitioner'])),
+            }],
+            'actualPeriod': self.period(hours),
+            'reason': [{'value': [{'concept': _concept(SNOMED, *self.pick(REASONS))}]}],
+            'location': [{'location': _reference('Location', 'location', self.random.randrange(counts['Location']))}],
+        }
+
+    def resources(self):
+        """
+        Yield the FHIR resources of the population, referenced resources first
+
+        Yields:
+            FHIR resource dictionaries
+        """
+        for resource_type, builder in (
+            ('Organization', self.organization),
+            ('Endpoint', self.endpoint),
+            ('Practitioner', self.practitioner),
+            ('Location', self.location),
+            ('PractitionerRole', self.practitioner_role),
+            ('HealthcareService', self.healthcare_service),
+            ('Patient', self.patient),
+            ('RelatedPerson', self.related_person),
+            ('Encounter', self.encounter),
+        ):
+            for index in range(self.counts[resource_type]):
+                yield builder(index)
+
+    def _concept_row(self, text):
+        return intern_concept(text, [{'system': 'http://example.org/fhir/citation', 'code': text, 'display': text}])
+
+    def create_citations(self):
+        """Create the Citations of the population through the ORM"""
+        for index in range(self.counts['Citation']):
+            period = self.period()
+            citation = Citation.objects.create(
+                fhir_id=f'citation-{index}', status='active', title=f'Synthetic study {index}',
+                effectivePeriod=Period.objects.create(start=period['start'], end=period['end']),
+            )
+            Identifier.objects.create(citation=citation, system='http://example.org/fhir/sid/doi', value=f'10.5555/{index}')
+            citation.current_states.add(self._concept_row('active'))
+            CitationSummary.objects.create(citation=citation, text=f'Synthetic study {index}', style=self._concept_row('vancouver'))
+            classification = CitationClassification.objects.create(citation=citation, type=self._concept_row('keyword'))
+            classification.classifiers.add(self._concept_row(self.pick(SPECIALTIES)[1]))
+            period = self.period()
+            CitationStatusDate.objects.create(
+                citation=citation, activity=self._concept_row('reviewed'),
+                period=Period.objects.create(start=period['start'], end=period['end']),
+            )
+
+
+def populate(patients, seed=0, encounters_per_patient=2, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Generate a population and write it to the database
+
+    Args:
+        patients: Number of patients, the other resource types are scaled from it
+        seed: Random seed
+        encounters_per_patient: Average number of encounters per patient
+        batch_size: Resources written per bulk import transaction
+
+    Returns:
+        Result dictionary as returned by core.ingest.ingest_resources
+    """
+    data = SyntheticData(patients, seed, encounters_per_patient)
+    result = ingest_resources(data.resources(), batch_size=batch_size)
+    with transaction.atomic():
+        data.create_citations()
+    result['created']['Citation'] = data.counts['Citation']
+    return result
@@ -0,0 +1,659 @@
+"""
+In-memory terminology service
+Loads CodeSystem and ValueSet resources from the FHIR files listed in
+FHIR_TERMINOLOGY_PATHS, and code systems bulk-loaded into CodeSystemConcept,
+into per-process indexes: a hash map per code system from code to concept
+backs $lookup and $validate-code, a set of codes per system and value set
+backs membership checks, and a trie over the words of displays and codes
+backs filtered $expand. None of them touches the database, so checking a
+Coding during ingest costs a few dictionary lookups. Token :in searches join
+against a copy of the expansion staged in ValueSetMember, which is written
+once per expansion rather than inlined into every query.
+"""
+
+import hashlib
+import re
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+
+
+# Concept of a loaded CodeSystem
+Concept = namedtuple('Concept', 'code display definition designations parents inactive')
+
+# Member of a value set expansion
+ExpansionEntry = namedtuple('ExpansionEntry', 'system version code display')
+
+# Members written per INSERT when staging a value set
+STAGE_BATCH_SIZE = 1000
+
+# Concept status values of a retired code
+INACTIVE_STATUSES = frozenset({'retired'})
+
+# ValueSet.compose filter operators supported when expanding
+FILTER_OPERATORS = ('is-a', 'descendent-of', 'is-not-a', 'in', 'not-in', 'regex', '=')
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def _words(text):
+    return WORD_PATTERN.findall(text.lower()) if text else []
+
+
+def _canonical(url):
+    """Canonical URL without its |version suffix"""
+    return url.split('|', 1)[0] if url else url
+
+
+class CodeValidation(namedtuple('CodeValidation', 'result display message')):
+    """Outcome of $validate-code"""
+
+    def parameters(self):
+        """The outcome as a FHIR Parameters resource"""
+        parameter = [{'name': 'result', 'valueBoolean': self.result}]
+        if self.message:
+            parameter.append({'name': 'message', 'valueString': self.message})
+        if self.display:
+            parameter.append({'name': 'display', 'valueString': self.display})
+        return {'resourceType': 'Parameters', 'parameter': parameter}
+
+
+class PrefixTrie:
+    """Character trie returning the values stored under every word starting with a prefix"""
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, word, values):
+        node = self.root
+        for char in word:
+            node = node.setdefault(char, {})
+        # None never collides with the one-character keys of the children
+        node.setdefault(None, []).extend(values)
+
+    def find(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for key, child in node.items():
+                if key is None:
+                    yield from child
+                else:
+                    stack.append(child)
+
+
+class CodeSystemIndex:
+    """Concepts of a CodeSystem by code, with their subsumption hierarchy"""
+
+    def __init__(self, data):
+        self.url = data['url']
+        self.version = data.get('version')
+        self.name = data.get('name') or data.get('title')
+        # Only a complete code system can tell that a code does not exist
+        self.complete = data.get('content', 'complete') == 'complete'
+        self.case_sensitive = data.get('caseSensitive', True)
+        self.concepts = {}
+        self.children = {}
+
+        stack = [(concept, None) for concept in reversed(data.get('concept', []))]
+        while stack:
+            concept, parent = stack.pop()
+            properties = concept.get('property', [])
+            parents = [parent] if parent else []
+            parents += [
+                prop['valueCode'] for prop in properties if prop.get('code') == 'parent' and prop.get('valueCode')
+            ]
+            self.concepts[concept['code']] = Concept(
+                code=concept['code'],
+                display=concept.get('display'),
+                definition=concept.get('definition'),
+                designations=tuple(
+                    designation['value'] for designation in concept.get('designation', []) if designation.get('value')
+                ),
+                parents=tuple(parents),
+                inactive=any(
+                    (prop.get('code') == 'inactive' and prop.get('valueBoolean') is True)
+                    or (prop.get('code') == 'status' and prop.get('valueCode') in INACTIVE_STATUSES)
+                    for prop in properties
+                ),
+            )
+            for code in parents:
+                self.children.setdefault(code, []).append(concept['code'])
+            stack += [(child, concept['code']) for child in reversed(concept.get('concept', []))]
+
+        if not self.case_sensitive:
+            self._folded = {code.lower(): code for code in self.concepts}
+
+    def get(self, code):
+        """Concept of a code, or None"""
+        if code is None:
+            return None
+        concept = self.concepts.get(code)
+        if concept is None and not self.case_sensitive:
+            concept = self.concepts.get(self._folded.get(code.lower()))
+        return concept
+
+    def is_active(self, code):
+        concept = self.concepts.get(code)
+        return concept is not None and not concept.inactive
+
+    def descendants(self, code):
+        """Codes subsumed by code, itself excluded"""
+        found, stack = [], list(self.children.get(code, ()))
+        seen = set()
+        while stack:
+            child = stack.pop()
+            if child not in seen:
+                seen.add(child)
+                found.append(child)
+                stack += self.children.get(child, ())
+        return found
+
+
+class ValueSetIndex:
+    """Expansion of a value set with a membership set per system"""
+
+    def __init__(self, url, version, name, entries):
+        self.url = url
+        self.version = version
+        self.name = name
+        self.entries = entries
+        self.members = {}
+        for entry in entries:
+            self.members.setdefault(entry.system, set()).add(entry.code)
+        self._trie = None
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self):
+        """Hash of the member codes, equal for equal expansions"""
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            for system in sorted(self.members, key=lambda system: system or ''):
+                for code in sorted(self.members[system]):
+                    digest.update(f'{system or ""}|{code}\n'.encode())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def contains(self, system, code):
+        if system is None:
+            return any(code in codes for codes in self.members.values())
+        return code in self.members.get(system, ())
+
+    @property
+    def trie(self):
+        # Built on the first filtered expansion, most value sets are only checked for membership
+        if self._trie is None:
+            # Each distinct word is walked into the trie once, with all its positions
+            postings = {}
+            for position, entry in enumerate(self.entries):
+                for word in set(_words(entry.display)) | {entry.code.lower()}:
+                    postings.setdefault(word, []).append(position)
+            trie = PrefixTrie()
+            for word, positions in postings.items():
+                trie.add(word, positions)
+            self._trie = trie
+        return self._trie
+
+    def match(self, text):
+        """Positions of the entries with a word starting with each word of text"""
+        positions = None
+        for word in _words(text):
+            found = set(self.trie.find(word))
+            positions = found if positions is None else positions & found
+        if positions is None:
+            return range(len(self.entries))
+        return sorted(positions)
+
+
+class Terminology:
+    """Loaded CodeSystems and ValueSets, with the $lookup, $validate-code and $expand operations"""
+
+    def __init__(self):
+        self.code_systems = {}
+        self.value_set_definitions = {}
+        self._value_sets = {}
+        self._lock = threading.Lock()
+
+    # Loading
+
+    def load_resource(self, data):
+        """
+        Index a CodeSystem or ValueSet, or those in a Bundle
+
+        Returns:
+            Number of resources loaded, other resource types are ignored
+        """
+        resource_type = data.get('resourceType')
+        if resource_type == 'Bundle':
+            return sum(self.load_resource(entry['resource']) for entry in data.get('entry', []) if entry.get('resource'))
+        if resource_type not in ('CodeSystem', 'ValueSet'):
+            return 0
+        if not data.get('url'):
+            raise ValueError(f"{resource_type}/{data.get('id')} has no url")
+
+        with self._lock:
+            if resource_type == 'CodeSystem':
+                self.code_systems[data['url']] = CodeSystemIndex(data)
+            else:
+                self.value_set_definitions[data['url']] = data
+            # Expansions may include what was just loaded
+            self._value_sets = {}
+        return 1
+
+    def load(self, paths):
+        """
+        Load the CodeSystems and ValueSets of FHIR files
+
+        Args:
+            paths: NDJSON, Bundle or single resource files; directories are
+                expanded to the .ndjson, .ndjson.gz and .json files they hold
+
+        Returns:
+            Number of resources loaded
+        """
+        from core.ingest import iter_resources
+
+        loaded = 0
+        for path in map(Path, paths):
+            if path.is_dir():
+                files = sorted(
+                    child for child in path.iterdir() if child.name.endswith(('.ndjson', '.ndjson.gz', '.json'))
+                )
+            else:
+                files = [path]
+            for file in files:
+                loaded += sum(self.load_resource(resource) for resource in iter_resources(file))
+        return loaded
+
+    def load_table(self, system):
+        """
+        Load a code system bulk-loaded into CodeSystemConcept (core.terminology_loader)
+
+        Returns:
+            Number of concepts loaded
+        """
+        from core.models import CodeSystemConcept, CodeSystemRelease
+
+        rows = CodeSystemConcept.objects.filter(system=system).order_by('code')
+        concepts = []
+        for code, display, active in rows.values_list('code', 'display', 'active').iterator():
+            concept = {'code': code, 'display': display}
+            if not active:
+                concept['property'] = [{'code': 'inactive', 'valueBoolean': True}]
+            concepts.append(concept)
+        version = CodeSystemRelease.objects.filter(system=system).values_list('version', flat=True).first()
+        self.load_resource({'resourceType': 'CodeSystem', 'url': system, 'version': version, 'concept': concepts})
+        return len(concepts)
+
+    # Value set expansion
+
+    def code_system(self, url):
+        """Loaded CodeSystem of a canonical URL, or None"""
+        return self.code_systems.get(_canonical(url))
+
+    def _required_code_system(self, url):
+        code_system = self.code_system(url)
+        if code_system is None:
+            raise ValueError(f"Unknown CodeSystem: {url}")
+        return code_system
+
+    def _filtered_codes(self, code_system, filters):
+        codes = None
+        for flt in filters:
+            op, prop, value = flt.get('op'), flt.get('property'), flt.get('value', '')
+            if op not in FILTER_OPERATORS:
+                raise ValueError(f"Unsupported ValueSet filter operator: {op}")
+            if op == 'is-a':
+                selected = [value] + code_system.descendants(value)
+            elif op == 'descendent-of':
+                selected = code_system.descendants(value)
+            elif op == 'is-not-a':
+                excluded = {value, *code_system.descendants(value)}
+                selected = [code for code in code_system.concepts if code not in excluded]
+            elif op == 'in':
+                selected = value.split(',')
+            elif op == 'not-in':
+                excluded = set(value.split(','))
+                selected = [code for code in code_system.concepts if code not in excluded]
+            elif op == 'regex':
+                pattern = re.compile(value)
+                selected = [
+                    concept.code for concept in code_system.concepts.values()
+                    if pattern.fullmatch((concept.display if prop == 'display' else concept.code) or '')
+                ]
+            elif prop in ('code', 'concept'):
+                selected = [value]
+            elif prop == 'display':
+                selected = [concept.code for concept in code_system.concepts.values() if concept.display == value]
+            else:
+                raise ValueError(f"Unsupported ValueSet filter property: {prop}")
+            selected = [code for code in selected if code_system.is_active(code)]
+            if codes is not None:
+                selected_codes = set(selected)
+                selected = [code for code in codes if code in selected_codes]
+            codes = selected
+        return codes
+
+    def _include_entries(self, include, seen):
+        """Entries selected by one ValueSet.compose include or exclude"""
+        entries = None
+        system = include.get('system')
+        if system:
+            code_system = self.code_system(system)
+            version = include.get('version') or (code_system.version if code_system else None)
+            if include.get('concept'):
+                entries = {}
+                for item in include['concept']:
+                    concept = code_system.get(item['code']) if code_system else None
+                    if concept is not None and concept.inactive:
+                        continue
+                    display = item.get('display') or (concept.display if concept else None)
+                    entries[(system, item['code'])] = ExpansionEntry(system, version, item['code'], display)
+            else:
+                code_system = self._required_code_system(system)
+                codes = (
+                    self._filtered_codes(code_system, include['filter']) if include.get('filter')
+                    else [code for code in code_system.concepts if code_system.is_active(code)]
+                )
+                entries = {
+                    (system, code): ExpansionEntry(system, version, code, code_system.concepts[code].display)
+                    for code in codes
+                }
+        for url in include.get('valueSet', []):
+            members = self._expand_definition(_canonical(url), seen)
+            if entries is None:
+                entries = {(entry.system, entry.code): entry for entry in members.entries}
+            else:
+                entries = {key: entry for key, entry in entries.items() if members.contains(*key)}
+        return entries or {}
+
+    def _expand_definition(self, url, seen):
+        if url in self._value_sets:
+            return self._value_sets[url]
+        if url in seen:
+            raise ValueError(f"ValueSet {url} includes itself")
+        seen = seen | {url}
+
+        definition = self.value_set_definitions.get(url)
+        if definition is None:
+            # The implicit value set of all the codes of a CodeSystem
+            code_system = self.code_system(url)
+            if code_system is None:
+                raise ValueError(f"Unknown ValueSet: {url}")
+            entries = [
+                ExpansionEntry(code_system.url, code_system.version, concept.code, concept.display)
+                for concept in code_system.concepts.values() if not concept.inactive
+            ]
+            value_set = ValueSetIndex(url, code_system.version, code_system.name, entries)
+        else:
+            compose = definition.get('compose')
+            if compose:
+                entries = {}
+                for include in compose.get('include', []):
+                    entries.update(self._include_entries(include, seen))
+                for exclude in compose.get('exclude', []):
+                    for key in self._include_entries(exclude, seen):
+                        entries.pop(key, None)
+                entries = list(entries.values())
+            else:
+                # A value set shipped pre-expanded
+                entries, stack = [], list(reversed(definition.get('expansion', {}).get('contains', [])))
+                while stack:
+                    item = stack.pop()
+                    if item.get('code') and not item.get('abstract'):
+                        entries.append(ExpansionEntry(item.get('system'), item.get('version'), item['code'], item.get('display')))
+                    stack += reversed(item.get('contains', []))
+            value_set = ValueSetIndex(url, definition.get('version'), definition.get('name'), entries)
+
+        self._value_sets[url] = value_set
+        return value_set
+
+    def value_set(self, url):
+        """
+        Expansion of a loaded ValueSet, or of all the codes of a loaded CodeSystem
+
+        Raises:
+            ValueError: If the value set, or a code system it draws on, is not loaded
+        """
+        url = _canonical(url)
+        value_set = self._value_sets.get(url)
+        if value_set is None:
+            with self._lock:
+                value_set = self._expand_definition(url, frozenset())
+        return value_set
+
+    def stage_value_set(self, url):
+        """
+        Store the expansion of a value set in ValueSetMember for searches to join against
+
+        Rows already staged for the same expansion are kept, a different
+        expansion replaces them.
+
+        Returns:
+            Canonical URL the members are stored under
+
+        Raises:
+            ValueError: If the value set, or a code system it draws on, is not loaded
+        """
+        from core.models import ValueSetExpansion, ValueSetMember
+
+        url = _canonical(url)
+        value_set = self.value_set(url)
+        if ValueSetExpansion.objects.filter(url=url, fingerprint=value_set.fingerprint).exists():
+            return url
+        with transaction.atomic():
+            expansion, _ = ValueSetExpansion.objects.get_or_create(url=url, defaults={'fingerprint': ''})
+            # Concurrent stagers of the value set wait here and find it staged
+            expansion = ValueSetExpansion.objects.select_for_update().get(pk=expansion.pk)
+            if expansion.fingerprint == value_set.fingerprint:
+                return url
+            stale = ValueSetMember.objects.filter(value_set=url)
+            # Members have no signals or dependents, skip the delete collector
+            stale._raw_delete(stale.db)
+            ValueSetMember.objects.bulk_create(
+                (
+                    ValueSetMember(value_set=url, system=system, code=code)
+                    for system, codes in value_set.members.items() for code in codes
+                ),
+                batch_size=STAGE_BATCH_SIZE,
+            )
+            expansion.fingerprint = value_set.fingerprint
+            expansion.save(update_fields=['fingerprint', 'staged_at'])
+        return url
+
+    # Operations
+
+    def lookup(self, system, code):
+        """
+        $lookup: details of a code
+
+        Returns:
+            FHIR Parameters resource
+
+        Raises:
+            ValueError: If the code system is not loaded or lacks the code
+        """
+        code_system = self._required_code_system(system)
+        concept = code_system.get(code)
+        if concept is None:
+            raise ValueError(f"Unknown code {code} in {system}")
+
+        parameter = [{'name': 'name', 'valueString': code_system.name or code_system.url}]
+        if code_system.version:
+            parameter.append({'name': 'version', 'valueString': code_system.version})
+        if concept.display:
+            parameter.append({'name': 'display', 'valueString': concept.display})
+        if concept.definition:
+            parameter.append({'name': 'definition', 'valueString': concept.definition})
+        for value in concept.designations:
+            parameter.append({'name': 'designation', 'part': [{'name': 'value', 'valueString': value}]})
+        parameter.append({'name': 'property', 'part': [
+            {'name': 'code', 'valueCode': 'inactive'}, {'name': 'value', 'valueBoolean': concept.inactive},
+        ]})
+        for name, codes in (('parent', concept.parents), ('child', code_system.children.get(concept.code, ()))):
+            for related in codes:
+                parameter.append({'name': 'property', 'part': [
+                    {'name': 'code', 'valueCode': name}, {'name': 'value', 'valueCode': related},
+                ]})
+        return {'resourceType': 'Parameters', 'parameter': parameter}
+
+    def validate_code(self, code, system=None, display=None, url=None):
+        """
+        $validate-code: whether a code is valid in a code system or value set
+
+        Args:
+            code: Code to check
+            system: Code system of the code, optional when url is given
+            display: Display to check against the concept's display and designations
+            url: ValueSet the code must be a member of
+
+        Returns:
+            CodeValidation
+
+        Raises:
+            ValueError: If url is not a loaded value set
+        """
+        if url is None and system is None:
+            raise ValueError("$validate-code needs a system or a value set url")
+        code_system = self.code_system(system) if system else None
+        concept = code_system.get(code) if code_system else None
+
+        if url is not None:
+            # Value sets list the code as the code system spells it
+            if not self.value_set(url).contains(system, concept.code if concept else code):
+                label = f"{system}#{code}" if system else code
+                return CodeValidation(False, None, f"{label} is not in value set {url}")
+        if code_system is None:
+            if url is None:
+                return CodeValidation(False, None, f"Unknown CodeSystem: {system}")
+            return CodeValidation(True, display, None)
+
+        if concept is None:
+            if code_system.complete:
+                return CodeValidation(False, None, f"Unknown code {code} in {system}")
+            return CodeValidation(True, display, f"{system} is only partly loaded, {code} is not in it")
+        if concept.inactive:
+            return CodeValidation(False, concept.display, f"Inactive code {code} in {system}")
+        if display and display != concept.display and display not in concept.designations:
+            return CodeValidation(False, concept.display, f"Wrong display '{display}' for {system}#{code}")
+        return CodeValidation(True, concept.display, None)
+
+    def expand(self, url, filter=None, offset=0, count=None):
+        """
+        $expand: the codes of a value set, optionally filtered
+
+        Args:
+            url: ValueSet, or CodeSystem for all its codes
+            filter: Text every word of which must start a word of the display or the code
+            offset: Entries to skip
+            count: Entries to return at most
+
+        Returns:
+            FHIR ValueSet resource with its expansion
+
+        Raises:
+            ValueError: If the value set is not loaded
+        """
+        value_set = self.value_set(url)
+        positions = value_set.match(filter) if filter else range(len(value_set.entries))
+        page = positions[offset:offset + count] if count is not None else positions[offset:]
+
+        contains = []
+        for position in page:
+            entry = value_set.entries[position]
+            item = {'system': entry.system, 'code': entry.code}
+            if entry.version:
+                item['version'] = entry.version
+            if entry.display:
+                item['display'] = entry.display
+            contains.append(item)
+        expansion = {
+            'timestamp': datetime.now(dt_timezone.utc).isoformat(),
+            'total': len(positions),
+            'offset': offset,
+            'contains': contains,
+        }
+        if filter:
+            expansion['parameter'] = [{'name': 'filter', 'valueString': filter}]
+
+        resource = {'resourceType': 'ValueSet', 'url': value_set.url, 'status': 'active', 'expansion': expansion}
+        if value_set.version:
+            resource['version'] = value_set.version
+        return resource
+
+    def display(self, system, code):
+        """Display of a code in a loaded code system, or None"""
+        code_system = self.code_system(system)
+        concept = code_system.get(code) if code_system else None
+        return concept.display if concept else None
+
+    def check_coding(self, system, code):
+        """
+        Reject a code that a completely loaded code system does not define, and inactive codes
+
+        Codes of systems that are not loaded, or only partly, are accepted.
+
+        Raises:
+            ValueError: If the code is unknown or inactive
+        """
+        code_system = self.code_system(system) if system else None
+        if code_system is None:
+            return
+        concept = code_system.get(code)
+        if concept is None and code_system.complete:
+            raise ValueError(f"Unknown code {code} in {system}")
+        if concept is not None and concept.inactive:
+            raise ValueError(f"Inactive code {code} in {system}")
+
+    def check_codings(self, data):
+        """Check every Coding (a dict with a system and a code) in a resource, see check_coding"""
+        if not self.code_systems:
+            return
+        stack = [data]
+        while stack:
+            value = stack.pop()
+            if isinstance(value, dict):
+                if isinstance(value.get('system'), str) and isinstance(value.get('code'), str):
+                    self.check_coding(value['system'], value['code'])
+                stack += value.values()
+            elif isinstance(value, list):
+                stack += value
+
+
+_terminology = None
+_terminology_lock = threading.Lock()
+
+
+def get_terminology():
+    """
+    The process-wide Terminology, loaded on first use from the files in
+    FHIR_TERMINOLOGY_PATHS and the CodeSystemConcept rows of the systems in
+    FHIR_TERMINOLOGY_TABLE_SYSTEMS
+    """
+    global _terminology
+    if _terminology is None:
+        with _terminology_lock:
+            if _terminology is None:
+                terminology = Terminology()
+                terminology.load(getattr(settings, 'FHIR_TERMINOLOGY_PATHS', []))
+                for system in getattr(settings, 'FHIR_TERMINOLOGY_TABLE_SYSTEMS', []):
+                    terminology.load_table(system)
+                _terminology = terminology
+    return _terminology
+
+
+def reset_terminology():
+    """Drop the loaded terminology, the next get_terminology() loads it again"""
+    global _terminology
+    with _terminology_lock:
+        _terminology = None
@@ -0,0 +1,182 @@
+"""
+Bulk loader for terminology releases
+Streams code system releases from disk into CodeSystemConcept: CSV files
+(generic or LOINC's Loinc.csv) and SNOMED CT RF2 concept and description files.
+Rows are read in chunks; each chunk fetches the stored rows of its codes with
+one query and writes only the new and changed concepts with one
+INSERT ... ON CONFLICT (system, code) DO UPDATE. Loading a delta release, or
+the same snapshot again, therefore only touches the concepts that changed.
+"""
+
+import csv
+import gzip
+from collections import namedtuple
+from itertools import islice
+from pathlib import Path
+
+from django.db import transaction
+
+from core.models import CodeSystemConcept, CodeSystemRelease
+
+
+DEFAULT_CHUNK_SIZE = 5000
+
+FORMATS = ('csv', 'loinc', 'rf2')
+
+# Fully specified name, the RF2 description type used as display
+SNOMED_FSN_TYPE = '900000000000003001'
+
+LOINC_INACTIVE_STATUSES = frozenset({'DEPRECATED'})
+
+# Concept read from a release file, None for what the file does not provide
+ConceptRow = namedtuple('ConceptRow', 'code display active')
+
+
+def _open(path):
+    path = Path(path)
+    if path.suffix == '.gz':
+        return gzip.open(path, 'rt', encoding='utf-8-sig', newline='')
+    return open(path, encoding='utf-8-sig', newline='')
+
+
+def _flag(value):
+    return value.strip().lower() not in ('0', 'false', 'inactive', 'no')
+
+
+def read_csv(path, code_column='code', display_column='display', active_column='active'):
+    """Concepts of a CSV file with a header row, the active column is optional"""
+    with _open(path) as source:
+        reader = csv.DictReader(source)
+        if code_column not in (reader.fieldnames or ()):
+            raise ValueError(f"{path} has no {code_column} column")
+        for record in reader:
+            active = record.get(active_column)
+            yield ConceptRow(
+                code=record[code_column],
+                display=record.get(display_column) or None,
+                active=_flag(active) if active else True,
+            )
+
+
+def read_loinc(path):
+    """Concepts of LOINC's Loinc.csv, displayed by their long common name"""
+    with _open(path) as source:
+        for record in csv.DictReader(source):
+            yield ConceptRow(
+                code=record['LOINC_NUM'],
+                display=record.get('LONG_COMMON_NAME') or None,
+                active=record.get('STATUS') not in LOINC_INACTIVE_STATUSES,
+            )
+
+
+def _read_rf2(path):
+    with _open(path) as source:
+        yield from csv.DictReader(source, delimiter='\t', quoting=csv.QUOTE_NONE)
+
+
+def read_rf2_concepts(path):
+    """Concept ids and status of an RF2 sct2_Concept file"""
+    for record in _read_rf2(path):
+        yield ConceptRow(code=record['id'], display=None, active=record['active'] == '1')
+
+
+def read_rf2_descriptions(path):
+    """Displays of an RF2 sct2_Description file: the active fully specified names"""
+    for record in _read_rf2(path):
+        if record['active'] == '1' and record['typeId'] == SNOMED_FSN_TYPE:
+            yield ConceptRow(code=record['conceptId'], display=record['term'], active=None)
+
+
+def release_files(paths, file_format):
+    """
+    Files of a release in load order, each with its reader and the fields it provides
+
+    RF2 directories are searched for concept and description files; concept
+    files come first so descriptions update concepts that already exist.
+
+    Returns:
+        List of (path, rows iterator factory, fields) tuples
+
+    Raises:
+        ValueError: If the format is unknown or a path holds no release file
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown terminology format: {file_format}")
+    if file_format != 'rf2':
+        reader = read_loinc if file_format == 'loinc' else read_csv
+        return [(Path(path), reader, ('display', 'active')) for path in paths]
+
+    concept_files, description_files = [], []
+    for path in map(Path, paths):
+        candidates = sorted(path.rglob('sct2_*')) if path.is_dir() else [path]
+        for candidate in candidates:
+            if '_Full' in candidate.name:
+                raise ValueError(f"{candidate} is a Full release file, load the Snapshot or Delta files")
+            if candidate.name.startswith('sct2_Concept_'):
+                concept_files.append((candidate, read_rf2_concepts, ('active',)))
+            elif candidate.name.startswith('sct2_Description_'):
+                description_files.append((candidate, read_rf2_descriptions, ('display',)))
+    if not concept_files and not description_files:
+        raise ValueError(f"No RF2 concept or description files in {', '.join(map(str, paths))}")
+    return concept_files + description_files
+
+
+def write_concepts(system, rows, fields, version=None):
+    """
+    Store the new and changed concepts of a chunk
+
+    Args:
+        system: Code system URL
+        rows: ConceptRows, the last row of a code wins
+        fields: ConceptRow fields the rows provide, the others are left as stored
+        version: Release version recorded on the written rows
+
+    Returns:
+        Number of concepts written
+    """
+    latest = {row.code: row for row in rows}
+    stored = {
+        code: tuple(values) for code, *values in
+        CodeSystemConcept.objects.filter(system=system, code__in=list(latest)).values_list('code', *fields)
+    }
+    changed = [
+        CodeSystemConcept(system=system, code=row.code, version=version, **{field: getattr(row, field) for field in fields})
+        for row in latest.values()
+        if stored.get(row.code) != tuple(getattr(row, field) for field in fields)
+    ]
+    if changed:
+        CodeSystemConcept.objects.bulk_create(
+            changed, update_conflicts=True, unique_fields=['system', 'code'], update_fields=[*fields, 'version'],
+        )
+    return len(changed)
+
+
+def load_release(system, paths, file_format='csv', version=None, chunk_size=DEFAULT_CHUNK_SIZE, **csv_columns):
+    """
+    Load a code system release into CodeSystemConcept
+
+    Args:
+        system: Code system URL
+        paths: Release files; RF2 also takes release directories
+        file_format: One of FORMATS
+        version: Release version recorded on the written rows and as the
+            current release of the system
+        chunk_size: Rows compared and written per transaction
+        csv_columns: code_column, display_column and active_column of a generic CSV
+
+    Returns:
+        Dict of path -> {'read': rows read, 'written': concepts inserted or changed}
+    """
+    result = {}
+    for path, reader, fields in release_files(paths, file_format):
+        rows = reader(path, **csv_columns) if reader is read_csv else reader(path)
+        counts = {'read': 0, 'written': 0}
+        while chunk := list(islice(rows, chunk_size)):
+            with transaction.atomic():
+                counts['written'] += write_concepts(system, chunk, fields, version)
+            counts['read'] += len(chunk)
+        result[str(path)] = counts
+    # Concepts only carry the release that last changed them, a delta leaves most on older ones
+    if version is not None:
+        CodeSystemRelease.objects.update_or_create(system=system, defaults={'version': version})
+    return result
@@ -1,3 +1,1018 @@
-from django.test import TestCase
+import gzip
+import json
+import math
+import random
+import tempfile
+from datetime import date, datetime, time, timezone as dt_timezone
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from components.models import (
+    Availability, AvailableTime, CodeableConcept, Coding, Extension, HumanName, NotAvailableTime, Period,
+)
+from components.reference import Reference
+from core import cache, hierarchy, history, materialize, search_index
+from core.benchmark import measure
+from core.concepts import collect_orphans, deduplicate_concepts, intern_concept
+from core.everything import iter_everything
+from core.export import export_resources
+from core.geo import EARTH_RADIUS_KM, covering_cells
+from core.ingest import ingest_files, ingest_resources
+from core.intervals import date_row_values
+from core.models import AvailabilityWindow, HierarchyClosure, ResourceHistory, ValueSetMember
+from core.parsers import RESOURCE_PARSERS
+from core.search import search
+from core.search_params import DATETIME_PRECISION
+from core.searchset import encode_cursor, search_bundle
+from core.synthetic import SyntheticData
+from core.terminology import get_terminology, reset_terminology
+from encounter.models import Encounter
+from fhir_serializers import RESOURCE_MODELS, get_fhir_dict, get_fhir_jsons, prefetch_for_serialization
+from healthcareservice.models import HealthcareService
+from location.models import Location, LocationPosition
+from organization.models import Organization
+from patient.models import Patient
+from practitioner.models import PractitionerRole
+
+
+@override_settings(FHIR_CACHE_ENABLED=True, FHIR_CACHE_ALIAS=None, FHIR_TRUSTED_OUTPUT=True)
+class SerializedResourceCacheTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.local_cache.clear()
+        self.patient = Patient.objects.create(fhir_id='pat-1', active=True)
+        self.name = HumanName.objects.create(patient=self.patient, family='Berisha', given=['Ana'])
+        self.key = cache.cache_key('Patient', self.patient.pk)
+
+    def tearDown(self):
+        cache.local_cache.clear()
+
+    def family(self):
+        return cache.get_cached_resource('Patient', 'pat-1')['name'][0]['family']
+
+    def rename(self, family):
+        self.name.family = family
+        self.name.save()
+
+    def test_second_read_is_a_hit(self):
+        first = cache.get_cached_resource('Patient', 'pat-1')
+        self.assertEqual(first['name'][0]['family'], 'Berisha')
+        # Logical id resolution and the version check, no relation graph
+        with self.assertNumQueries(2):
+            second = cache.get_cached_resource('Patient', 'pat-1')
+        self.assertEqual(second, first)
+
+    def test_human_name_edit_is_a_miss(self):
+        self.family()
+        self.assertIsNotNone(cache.local_cache.get(self.key))
+
+        self.rename('Krasniqi')
+
+        self.assertIsNone(cache.local_cache.get(self.key))
+        self.assertEqual(self.family(), 'Krasniqi')
+
+    def test_rolled_back_change_is_not_cached(self):
+        self.family()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.rename('Rolled back')
+            # The transaction reads its own change, nothing else gets to see it
+            self.assertEqual(self.family(), 'Rolled back')
+            self.assertIsNone(cache.local_cache.get(self.key))
+            raise RuntimeError
+
+        self.assertEqual(self.family(), 'Berisha')
+
+    def test_commit_drops_what_others_cached_meanwhile(self):
+        with transaction.atomic():
+            self.rename('Krasniqi')
+            # Another reader caching the committed rendering before this commit
+            cache.local_cache.set(self.key, (None, '{"resourceType":"Patient","name":[{"family":"Berisha"}]}'))
+
+        self.assertIsNone(cache.local_cache.get(self.key))
+        self.assertEqual(self.family(), 'Krasniqi')
+        self.assertIsNotNone(cache.local_cache.get(self.key))
+
+    def test_renderings_are_cached_per_mode(self):
+        cache.local_cache.set(self.key, (None, '{"resourceType":"Patient","id":"unvalidated"}'))
+
+        self.assertEqual(cache.get_cached_resource('Patient', 'pat-1', trusted=False)['id'], 'pat-1')
+        self.assertIsNotNone(cache.local_cache.get(cache.cache_key('Patient', self.patient.pk, trusted=False)))
+        self.assertEqual(cache.get_cached_resource('Patient', 'pat-1')['id'], 'unvalidated')
+
+        self.rename('Krasniqi')
+        self.assertIsNone(cache.local_cache.get(self.key))
+        self.assertIsNone(cache.local_cache.get(cache.cache_key('Patient', self.patient.pk, trusted=False)))
+
+    def test_missing_resource(self):
+        self.assertIsNone(cache.get_cached_resource('Patient', 'nobody'))
+
+    def test_searchset_entries_come_from_the_cache(self):
+        self.family()
+        cache.local_cache.set(self.key, (None, '{"resourceType":"Patient","id":"cached"}'))
+
+        bundle = search_bundle('Patient', '_id=pat-1')
+
+        self.assertEqual([entry['resource']['id'] for entry in bundle['entry']], ['cached'])
+
+    def test_disabled_cache_renders(self):
+        cache.local_cache.set(self.key, (None, '{"id":"stale"}'))
+        with override_settings(FHIR_CACHE_ENABLED=False):
+            self.assertEqual(cache.get_cached_resource('Patient', 'pat-1')['id'], 'pat-1')
+
+ENCOUNTER_TYPE = 'http://example.org/CodeSystem/encounter-type'
+
+
+@override_settings(FHIR_MATERIALIZED_JSON=True, FHIR_CACHE_ENABLED=False, FHIR_TRUSTED_OUTPUT=True)
+class MaterializedDocumentTests(TransactionTestCase):
+
+    def setUp(self):
+        self.ana = Patient.objects.create(fhir_id='pat-ana', gender='female')
+        self.ben = Patient.objects.create(fhir_id='pat-ben', gender='male')
+
+    def stored(self, patient):
+        return Patient.objects.values_list('fhir_json', flat=True).get(pk=patient.pk)
+
+    def rendered(self, patient):
+        return get_fhir_dict(prefetch_for_serialization(Patient.objects.filter(pk=patient.pk))[0], trusted=False)
+
+    def test_saves_store_the_document(self):
+        self.assertEqual(self.stored(self.ana), self.rendered(self.ana))
+
+        HumanName.objects.create(patient=self.ana, family='Berisha', given=['Ana'])
+
+        self.assertEqual(self.stored(self.ana)['name'], [{'family': 'Berisha', 'given': ['Ana']}])
+
+    def test_cleared_in_the_transaction_and_rendered_on_commit(self):
+        with transaction.atomic():
+            HumanName.objects.create(patient=self.ana, family='Berisha', given=['Ana'])
+            self.assertIsNone(self.stored(self.ana))
+            self.assertEqual(json.loads(get_fhir_jsons(Patient, [self.ana.pk])[self.ana.pk]), self.rendered(self.ana))
+            self.assertIsNotNone(self.stored(self.ben))
+
+        self.assertEqual(self.stored(self.ana), self.rendered(self.ana))
+        self.assertEqual(self.stored(self.ana)['name'][0]['family'], 'Berisha')
+
+    def test_rollback_keeps_the_previous_document(self):
+        before = self.stored(self.ana)
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            HumanName.objects.create(patient=self.ana, family='Berisha', given=['Ana'])
+            raise RuntimeError
+
+        self.assertEqual(self.stored(self.ana), before)
+        # The next transaction schedules anew instead of reusing the dropped callback
+        with transaction.atomic():
+            self.ana.gender = 'other'
+            self.ana.save()
+        self.assertEqual(self.stored(self.ana)['gender'], 'other')
+
+    def test_get_fhir_jsons_renders_only_missing_documents(self):
+        pks = [self.ana.pk, self.ben.pk]
+        expected = {
+            patient.pk: json.dumps(self.rendered(patient), separators=(',', ':')) for patient in (self.ana, self.ben)
+        }
+        with CaptureQueriesContext(connection) as rendering_all:
+            with override_settings(FHIR_MATERIALIZED_JSON=False):
+                self.assertEqual(get_fhir_jsons(Patient, pks), expected)
+
+        # One (pk, fhir_json) query when every document is stored
+        with self.assertNumQueries(1):
+            self.assertEqual(get_fhir_jsons(Patient, pks), expected)
+
+        # A stored document is served as is
+        Patient.objects.filter(pk=self.ben.pk).update(fhir_json={'resourceType': 'Patient', 'id': 'stored'})
+        materialize.clear([(Patient, self.ana.pk)])
+        with self.assertNumQueries(len(rendering_all) + 1):
+            documents = get_fhir_jsons(Patient, pks)
+        self.assertEqual(documents[self.ana.pk], expected[self.ana.pk])
+        self.assertEqual(json.loads(documents[self.ben.pk]), {'resourceType': 'Patient', 'id': 'stored'})
+
+
+
+class ConceptPoolTests(TestCase):
+
+    def copy(self, code, text=None):
+        """A per-owner concept as stored before pooling"""
+        concept = CodeableConcept.objects.create(text=text)
+        Coding.objects.create(codeable_concept=concept, system=ENCOUNTER_TYPE, code=code)
+        return concept
+
+    def encounter(self, fhir_id, class_field):
+        return Encounter.objects.create(fhir_id=fhir_id, status='completed', class_field=class_field)
+
+    def codes(self, concepts):
+        return sorted(coding['code'] for concept in concepts for coding in concept['coding'])
+
+    def test_foreign_keys_move_to_the_oldest_copy(self):
+        first, second = self.copy('AMB'), self.copy('AMB')
+        encounters = [self.encounter('enc-1', first), self.encounter('enc-2', second)]
+
+        result = deduplicate_concepts()
+
+        self.assertEqual((result['hashed'], result['merged']), (2, 1))
+        self.assertEqual({Encounter.objects.get(pk=e.pk).class_field_id for e in encounters}, {first.pk})
+        self.assertFalse(CodeableConcept.objects.filter(pk=second.pk).exists())
+        self.assertEqual(Coding.objects.filter(code='AMB').count(), 1)
+        rendered = get_fhir_dict(Encounter.objects.get(pk=encounters[1].pk), trusted=True)
+        self.assertEqual(self.codes(rendered['class']), ['AMB'])
+
+    def test_many_to_many_links_move_and_owner_duplicates_fold(self):
+        first, second = self.encounter('enc-1', self.copy('AMB')), self.encounter('enc-2', self.copy('IMP'))
+        first.type.add(self.copy('checkup'), self.copy('checkup'), self.copy('consult'))
+        second.type.add(self.copy('checkup'))
+        self.assertEqual(self.codes(get_fhir_dict(first, trusted=True)['type']), ['checkup', 'checkup', 'consult'])
+
+        deduplicate_concepts()
+
+        # The equal copies enc-1 listed become one concept, listed once
+        self.assertEqual(self.codes(get_fhir_dict(Encounter.objects.get(pk=first.pk), trusted=True)['type']),
+                         ['checkup', 'consult'])
+        self.assertLessEqual(set(second.type.values_list('pk', flat=True)), set(first.type.values_list('pk', flat=True)))
+        self.assertEqual(Coding.objects.filter(code='checkup').count(), 1)
+
+    def test_concepts_with_extensions_are_kept(self):
+        plain, extended = self.copy('AMB'), self.copy('AMB')
+        Extension.objects.create(url='http://example.org/source', value_string='legacy', content_object=extended)
+        coded = self.copy('AMB')
+        Extension.objects.create(url='http://example.org/source', value_string='legacy',
+                                 content_object=coded.codings.get())
+        for index, concept in enumerate((plain, extended, coded)):
+            self.encounter(f'enc-{index}', concept)
+
+        self.assertEqual(deduplicate_concepts()['merged'], 0)
+        self.assertEqual(CodeableConcept.objects.filter(codings__code='AMB').count(), 3)
+        self.assertIsNone(CodeableConcept.objects.get(pk=extended.pk).content_hash)
+
+    def test_collect_orphans_keeps_referenced_and_unpooled_concepts(self):
+        used = intern_concept(codings=[{'system': ENCOUNTER_TYPE, 'code': 'AMB'}])
+        listed = intern_concept(codings=[{'system': ENCOUNTER_TYPE, 'code': 'checkup'}])
+        orphan = intern_concept(codings=[{'system': ENCOUNTER_TYPE, 'code': 'IMP'}])
+        unpooled = self.copy('EMER')
+        self.encounter('enc-1', used).type.add(listed)
+
+        self.assertEqual(collect_orphans(), 1)
+
+        self.assertEqual(set(CodeableConcept.objects.values_list('pk', flat=True)), {used.pk, listed.pk, unpooled.pk})
+        self.assertFalse(Coding.objects.filter(code='IMP').exists())
+        self.assertEqual(intern_concept(codings=[{'system': ENCOUNTER_TYPE, 'code': 'AMB'}]), used)
+        self.assertFalse(CodeableConcept.objects.filter(pk=orphan.pk).exists())
+
+
+class IngestTests(TransactionTestCase):
+
+    def setUp(self):
+        self.directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+
+    def export(self, name):
+        output = self.directory / name
+        export_resources(output, resource_types=list(RESOURCE_PARSERS))
+        # Resources held back for a forward reference get later pks, so compare documents and not their order
+        return {
+            path.name: sorted(gzip.decompress(path.read_bytes()).splitlines())
+            for path in sorted(output.glob('*.ndjson.gz'))
+        }
+
+    def write_ndjson(self, name, resources):
+        path = self.directory / name
+        path.write_text(''.join(json.dumps(resource) + '\n' for resource in resources))
+        return path
+
+    def test_export_import_round_trip(self):
+        data = SyntheticData(20, seed=3)
+        data.counts = {resource_type: max(count, 3) for resource_type, count in data.counts.items()}
+        ingest_resources(data.resources())
+        exported = self.export('before')
+        self.assertTrue(all(exported.values()))
+
+        for options in ([], ['--copy']):
+            with self.subTest(options=options):
+                call_command('flush', interactive=False, verbosity=0)
+                ContentType.objects.clear_cache()
+                # Small batches leave references to resources of later batches and files
+                call_command('import_fhir', str(self.directory / 'before'), '--batch-size', '7', *options,
+                             stdout=StringIO(), stderr=StringIO())
+
+                self.assertEqual(self.export('after' + ''.join(options)), exported)
+
+    def test_reference_to_a_later_file(self):
+        patients = self.write_ndjson('1-patients.ndjson', [
+            {'resourceType': 'Patient', 'id': 'pat-1', 'managingOrganization': {'reference': 'Organization/org-1'}},
+        ])
+        organizations = self.write_ndjson('2-organizations.ndjson', [
+            {'resourceType': 'Organization', 'id': 'org-1', 'name': 'General Hospital'},
+        ])
+
+        result = ingest_files([patients, organizations])
+
+        self.assertEqual(result['created'], {'Patient': 1, 'Organization': 1})
+        self.assertEqual(result['unresolved'], [])
+        self.assertEqual(Patient.objects.get(fhir_id='pat-1').managingOrganization.fhir_id, 'org-1')
+
+    def test_duplicate_and_existing_ids_are_skipped(self):
+        path = self.write_ndjson('patients.ndjson', [
+            {'resourceType': 'Patient', 'id': 'pat-1', 'gender': 'female'},
+            {'resourceType': 'Patient', 'id': 'pat-1', 'gender': 'male'},
+        ])
+
+        result = ingest_files([path])
+        self.assertEqual((result['created'], result['skipped']), ({'Patient': 1}, {'Patient': 1}))
+        self.assertEqual(list(Patient.objects.values_list('gender', flat=True)), ['female'])
+
+        result = ingest_files([path])
+        self.assertEqual((result['created'], result['skipped']), ({}, {'Patient': 2}))
+        self.assertEqual(Patient.objects.count(), 1)
+
+
+class SearchFixture:
+    """Two organizations, one part of the other, and three patients; commits run the signals' deferred work"""
+
+    def setUp(self):
+        self.hospital = Organization.objects.create(fhir_id='org-hospital', name='General Hospital')
+        self.clinic = Organization.objects.create(fhir_id='org-clinic', name='Riverside Clinic', partOf=self.hospital)
+        self.ana = Patient.objects.create(
+            fhir_id='pat-ana', gender='female', birthDate=date(1985, 3, 2), managingOrganization=self.hospital
+        )
+        self.ben = Patient.objects.create(
+            fhir_id='pat-ben', gender='male', birthDate=date(1979, 12, 31), managingOrganization=self.clinic
+        )
+        self.cai = Patient.objects.create(fhir_id='pat-cai', gender='other')
+        HumanName.objects.create(patient=self.ana, family='Berisha', given=['Ana'])
+        HumanName.objects.create(patient=self.ben, family='Krasniqi', given=['Ben'])
+
+    def ids(self, resource_type, query):
+        return sorted(search(resource_type, query).values_list('fhir_id', flat=True))
+
+
+class SearchTests(SearchFixture, TransactionTestCase):
+
+    def test_string_matches_the_start_of_a_name(self):
+        self.assertEqual(self.ids('Patient', 'name=beri'), ['pat-ana'])
+        self.assertEqual(self.ids('Patient', 'family:exact=Krasniqi'), ['pat-ben'])
+
+    def test_not_includes_resources_without_the_value(self):
+        self.assertEqual(self.ids('Patient', 'gender:not=male'), ['pat-ana', 'pat-cai'])
+
+    def test_comma_ors_and_repeats_and(self):
+        self.assertEqual(self.ids('Patient', 'gender=female,male'), ['pat-ana', 'pat-ben'])
+        self.assertEqual(self.ids('Patient', 'gender=female,male&name=ben'), ['pat-ben'])
+
+    def test_date_prefixes(self):
+        self.assertEqual(self.ids('Patient', 'birthdate=1985'), ['pat-ana'])
+        self.assertEqual(self.ids('Patient', 'birthdate=ge1980'), ['pat-ana'])
+        self.assertEqual(self.ids('Patient', 'birthdate=lt1980'), ['pat-ben'])
+        self.assertEqual(self.ids('Patient', 'birthdate=ge1979-12-31&birthdate=le1985-03-02'), ['pat-ana', 'pat-ben'])
+        self.assertEqual(self.ids('Patient', 'birthdate=ne1985-03-02'), ['pat-ben'])
+
+    def test_inverted_period_matches_its_start_only(self):
+        period = Period.objects.create(
+            start=datetime(2020, 6, 1, tzinfo=dt_timezone.utc), end=datetime(2020, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        PractitionerRole.objects.create(fhir_id='role-inverted', period=period)
+
+        self.assertEqual(date_row_values(period.start, period.end)[:2], (period.start, period.start + DATETIME_PRECISION))
+        for query in ('date=2019', 'date=eb2019', 'date=sa2021', 'date=2020-01'):
+            self.assertEqual(self.ids('PractitionerRole', query), [])
+        for query in ('date=2020', 'date=2020-06-01', 'date=ap2020-06-01'):
+            self.assertEqual(self.ids('PractitionerRole', query), ['role-inverted'])
+
+    def test_chained_parameter(self):
+        self.assertEqual(self.ids('Patient', 'organization.name=riverside'), ['pat-ben'])
+        self.assertEqual(self.ids('Patient', 'organization:Organization.name=general'), ['pat-ana'])
+
+    def test_reverse_chained_parameter(self):
+        self.assertEqual(self.ids('Organization', '_has:Patient:organization:gender=female'), ['org-hospital'])
+        self.assertEqual(self.ids('Organization', '_has:Patient:organization:birthdate=lt1980'), ['org-clinic'])
+
+    def test_search_follows_an_edit(self):
+        self.cai.gender = 'female'
+        self.cai.save()
+
+        self.assertEqual(self.ids('Patient', 'gender=female'), ['pat-ana', 'pat-cai'])
+
+    def test_unsupported_parameters_are_refused(self):
+        for query in ('shoe-size=42', 'gender:contains=fe', 'birthdate=xx1980', '_has:Patient:name:gender=male'):
+            with self.subTest(query=query), self.assertRaises(ValueError):
+                search('Patient', query)
+
+
+def next_cursor(bundle):
+    """_cursor of a Bundle's next link, None on the last page"""
+    for link in bundle['link']:
+        if link['relation'] == 'next':
+            return parse_qs(urlsplit(link['url']).query)['_cursor'][0]
+    return None
+
+
+class AvailabilityTests(SearchFixture, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.day_service = HealthcareService.objects.create(fhir_id='hs-day')
+        self.day_availability = Availability.objects.create(healthcare_service=self.day_service)
+        AvailableTime.objects.create(
+            availability=self.day_availability, daysOfWeek=['mon', 'tue', 'wed', 'thu', 'fri'],
+            availableStartTime=time(9), availableEndTime=time(17),
+        )
+        self.night_service = HealthcareService.objects.create(fhir_id='hs-night')
+        AvailableTime.objects.create(
+            availability=Availability.objects.create(healthcare_service=self.night_service), daysOfWeek=['fri'],
+            availableStartTime=time(22), availableEndTime=time(2),
+        )
+
+    def available(self, value):
+        return self.ids('HealthcareService', f'available={value}')
+
+    def close_day_service(self, start, end):
+        period = Period.objects.create(
+            start=datetime(*start, tzinfo=dt_timezone.utc), end=datetime(*end, tzinfo=dt_timezone.utc),
+        )
+        NotAvailableTime.objects.create(availability=self.day_availability, description='Renovation', during=period)
+        return period
+
+    def test_same_day_hours(self):
+        self.assertEqual(self.available('tue|09:00'), ['hs-day'])
+        self.assertEqual(self.available('tue|16:59'), ['hs-day'])
+        self.assertEqual(self.available('tue|17:00'), [])
+        self.assertEqual(self.available('tue|08:59'), [])
+        self.assertEqual(self.available('sat|10:00'), [])
+        # Wednesday 2026-10-14
+        self.assertEqual(self.available('2026-10-14T10:00:00Z'), ['hs-day'])
+
+    def test_hours_past_midnight(self):
+        self.assertEqual(self.available('fri|23:30'), ['hs-night'])
+        self.assertEqual(self.available('sat|01:59'), ['hs-night'])
+        self.assertEqual(self.available('sat|02:00'), [])
+        self.assertEqual(self.available('fri|01:00'), [])
+        self.assertEqual(self.available('fri|21:59'), [])
+        # Saturday 2026-10-17
+        self.assertEqual(self.available('2026-10-17T01:30:00Z'), ['hs-night'])
+
+    def test_not_available_time(self):
+        self.close_day_service((2026, 10, 12), (2026, 10, 16, 23, 59))
+
+        self.assertEqual(self.available('2026-10-14T10:00:00Z'), [])
+        self.assertEqual(self.available('2026-10-21T10:00:00Z'), ['hs-day'])
+        # Weekly hours ignore the exceptions
+        self.assertEqual(self.available('wed|10:00'), ['hs-day'])
+
+    def test_moving_an_exception(self):
+        period = self.close_day_service((2026, 10, 12), (2026, 10, 16, 23, 59))
+
+        with transaction.atomic():
+            period.start = datetime(2026, 10, 19, tzinfo=dt_timezone.utc)
+            period.end = datetime(2026, 10, 23, 23, 59, tzinfo=dt_timezone.utc)
+            period.save()
+            # Rebuilt when the transaction commits
+            self.assertEqual(self.available('2026-10-21T10:00:00Z'), ['hs-day'])
+
+        self.assertEqual(self.available('2026-10-14T10:00:00Z'), ['hs-day'])
+        self.assertEqual(self.available('2026-10-21T10:00:00Z'), [])
+
+    def test_moving_hours_to_another_service(self):
+        available_time = AvailableTime.objects.get(availability=self.day_availability)
+        available_time.availability = Availability.objects.get(healthcare_service=self.night_service)
+        available_time.save()
+
+        self.assertEqual(self.available('tue|10:00'), ['hs-night'])
+
+    def test_queryset_delete(self):
+        with transaction.atomic():
+            AvailableTime.objects.filter(availability__healthcare_service__in=[self.day_service, self.night_service]).delete()
+
+        self.assertEqual(self.available('tue|10:00'), [])
+        self.assertEqual(self.available('fri|23:30'), [])
+        self.assertFalse(AvailabilityWindow.objects.exists())
+
+
+class SearchsetPagingTests(SearchFixture, TransactionTestCase):
+
+    def page_ids(self, bundle):
+        return [entry['resource']['id'] for entry in bundle['entry']]
+
+    def test_pages_follow_the_next_link(self):
+        first = search_bundle('Patient', '_count=2&_total=accurate')
+        self.assertEqual(first['total'], 3)
+        self.assertEqual(self.page_ids(first), ['pat-ana', 'pat-ben'])
+
+        last = search_bundle('Patient', [('_count', '2'), ('_cursor', next_cursor(first))])
+        self.assertEqual(self.page_ids(last), ['pat-cai'])
+        self.assertIsNone(next_cursor(last))
+
+    def test_next_link_keeps_the_search(self):
+        first = search_bundle('Patient', 'gender:not=male&_count=1')
+        second = search_bundle('Patient', [('gender:not', 'male'), ('_count', '1'), ('_cursor', next_cursor(first))])
+        self.assertEqual(self.page_ids(first) + self.page_ids(second), ['pat-ana', 'pat-cai'])
+
+    def test_a_page_stays_in_place_when_earlier_rows_go(self):
+        first = search_bundle('Patient', 'gender:not=male&_count=1')
+        self.assertEqual(self.page_ids(first), ['pat-ana'])
+        self.ana.gender = 'male'
+        self.ana.save()
+
+        # Keyset paging resumes after the last row seen, where an offset would now skip pat-cai
+        second = search_bundle('Patient', [('gender:not', 'male'), ('_count', '1'), ('_cursor', next_cursor(first))])
+        self.assertEqual(self.page_ids(second), ['pat-cai'])
+
+    def test_tampered_cursor_is_refused(self):
+        cursor = next_cursor(search_bundle('Patient', '_count=1'))
+        forged = cursor[:-1] + ('A' if cursor[-1] != 'A' else 'B')
+        for bad in (forged, 'not-a-cursor', encode_cursor(self.ben.pk, 1.5)):
+            with self.subTest(cursor=bad), self.assertRaises(ValueError):
+                search_bundle('Patient', [('_count', '1'), ('_cursor', bad)])
+
+    def test_invalid_count_is_refused(self):
+        for count in ('0', '-1', 'ten'):
+            with self.subTest(count=count), self.assertRaises(ValueError):
+                search_bundle('Patient', [('_count', count)])
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    latitude1, longitude1, latitude2, longitude2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+    half_chord = (
+        math.sin((latitude2 - latitude1) / 2) ** 2
+        + math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(math.sqrt(half_chord), 1.0))
+
+
+class NearSearchTests(TestCase):
+    # Two centres sit on the antimeridian, one of them next to a point on the other side
+    CENTRES = [(0.0, 0.0), (45.5, 7.3), (-33.9, 151.2), (64.8, -147.7), (-17.7, 179.95), (10.0, -179.99)]
+    RADII_KM = [0.5, 5, 50, 500, 3000]
+
+    @classmethod
+    def setUpTestData(cls):
+        generator = random.Random(11)
+        coordinates = [(-17.7, -179.97), (10.0, 179.98)]
+        while len(coordinates) < 300:
+            latitude, longitude = generator.choice(cls.CENTRES)
+            spread = generator.choice([0.005, 0.05, 0.5, 5, 30])
+            latitude = min(max(latitude + generator.uniform(-spread, spread), -89.0), 89.0)
+            longitude += generator.uniform(-spread, spread) / math.cos(math.radians(latitude))
+            coordinates.append((round(latitude, 7), round((longitude + 180.0) % 360.0 - 180.0, 7)))
+        ingest_resources(
+            {'resourceType': 'Location', 'id': f'loc-{index}', 'position': {'latitude': latitude, 'longitude': longitude}}
+            for index, (latitude, longitude) in enumerate(coordinates)
+        )
+        cls.positions = {
+            fhir_id: (float(latitude), float(longitude), geohash)
+            for fhir_id, latitude, longitude, geohash in LocationPosition.objects.values_list(
+                'location__fhir_id', 'latitude', 'longitude', 'geohash',
+            )
+        }
+
+    def within(self, latitude, longitude, radius_km):
+        """Brute-force near search, ids by distance"""
+        distances = {
+            fhir_id: haversine_km(latitude, longitude, position[0], position[1])
+            for fhir_id, position in self.positions.items()
+        }
+        return sorted((fhir_id for fhir_id, distance in distances.items() if distance <= radius_km), key=distances.get)
+
+    def test_covering_cells_hold_every_point_of_the_circle(self):
+        for latitude, longitude in self.CENTRES:
+            for radius_km in self.RADII_KM:
+                cells = covering_cells(latitude, longitude, radius_km)
+                if radius_km <= 500:
+                    self.assertIsNotNone(cells)
+                if cells is None:
+                    continue
+                with self.subTest(centre=(latitude, longitude), radius_km=radius_km):
+                    outside = [
+                        fhir_id for fhir_id in self.within(latitude, longitude, radius_km)
+                        if not self.positions[fhir_id][2].startswith(tuple(cells))
+                    ]
+                    self.assertEqual(outside, [])
+
+    def test_near_matches_the_haversine_distance(self):
+        matched = 0
+        for latitude, longitude in self.CENTRES:
+            for radius_km in self.RADII_KM:
+                with self.subTest(centre=(latitude, longitude), radius_km=radius_km):
+                    expected = sorted(self.within(latitude, longitude, radius_km))
+                    found = sorted(search('Location', f'near={latitude}|{longitude}|{radius_km}|km').values_list(
+                        'fhir_id', flat=True,
+                    ))
+                    self.assertEqual(found, expected)
+                    matched += len(found)
+        self.assertGreater(matched, 300)
+        # Across the antimeridian
+        self.assertIn('loc-0', self.within(-17.7, 179.95, 50))
+        self.assertIn('loc-1', self.within(10.0, -179.99, 50))
+
+    def test_sort_near_pages_nearest_first(self):
+        latitude, longitude = self.CENTRES[1]
+        query = f'near={latitude}|{longitude}|3000|km&_sort=near&_count=7'
+        found, distances, cursor = [], [], None
+        while True:
+            bundle = search_bundle('Location', query + (f'&_cursor={cursor}' if cursor else ''))
+            found += [entry['resource']['id'] for entry in bundle['entry']]
+            distances += [entry['search']['extension'][0]['valueDistance']['value'] for entry in bundle['entry']]
+            cursor = next_cursor(bundle)
+            if cursor is None:
+                break
+
+        self.assertEqual(found, self.within(latitude, longitude, 3000))
+        self.assertGreater(len(found), 14)
+        self.assertEqual(distances, sorted(distances))
+
+    def test_distance_cursor_breaks_ties_on_the_primary_key(self):
+        ingest_resources(
+            {'resourceType': 'Location', 'id': f'loc-twin-{index}', 'position': {'latitude': 45.5, 'longitude': 7.3}}
+            for index in range(3)
+        )
+        query = 'near=45.5|7.3|0.5|km&_sort=near&_count=1'
+        first = search_bundle('Location', query)
+        self.assertEqual(first['entry'][0]['search']['extension'][0]['valueDistance']['value'], 0)
+
+        found, cursor = [first['entry'][0]['resource']['id']], next_cursor(first)
+        while cursor is not None:
+            bundle = search_bundle('Location', f'{query}&_cursor={cursor}')
+            found += [entry['resource']['id'] for entry in bundle['entry']]
+            cursor = next_cursor(bundle)
+        self.assertEqual(found, ['loc-twin-0', 'loc-twin-1', 'loc-twin-2'] + self.within(45.5, 7.3, 0.5))
+
+        twin = Location.objects.get(fhir_id='loc-twin-0')
+        bundle = search_bundle('Location', f'{query}&_cursor={encode_cursor(twin.pk, 0.0)}')
+        self.assertEqual(bundle['entry'][0]['resource']['id'], 'loc-twin-1')
+        # A primary-key cursor does not resume a distance-sorted search
+        with self.assertRaises(ValueError):
+            search_bundle('Location', f'{query}&_cursor={encode_cursor(twin.pk)}')
+
+
+class IncludeTests(SearchFixture, TransactionTestCase):
+
+    def entries(self, bundle):
+        return [(entry['resource']['id'], entry['search']['mode']) for entry in bundle['entry']]
+
+    def test_include(self):
+        bundle = search_bundle('Patient', 'gender=female,male&_include=Patient:organization')
+        self.assertEqual(self.entries(bundle), [
+            ('pat-ana', 'match'), ('pat-ben', 'match'), ('org-hospital', 'include'), ('org-clinic', 'include'),
+        ])
+
+    def test_include_of_a_match_is_not_repeated(self):
+        bundle = search_bundle('Organization', '_include=Organization:partof')
+        self.assertEqual(self.entries(bundle), [('org-hospital', 'match'), ('org-clinic', 'match')])
+
+    def test_revinclude(self):
+        bundle = search_bundle('Organization', '_id=org-clinic&_revinclude=Patient:organization')
+        self.assertEqual(self.entries(bundle), [('org-clinic', 'match'), ('pat-ben', 'include')])
+
+    def test_includes_only_follow_the_page(self):
+        bundle = search_bundle('Patient', '_count=1&_include=Patient:organization')
+        self.assertEqual(self.entries(bundle), [('pat-ana', 'match'), ('org-hospital', 'include')])
+
+    def test_target_type_and_wildcard(self):
+        self.assertEqual(self.entries(search_bundle('Patient', '_id=pat-ana&_include=Patient:*:Practitioner')),
+                         [('pat-ana', 'match')])
+        self.assertEqual(self.entries(search_bundle('Patient', '_id=pat-ana&_include=Patient:*')),
+                         [('pat-ana', 'match'), ('org-hospital', 'include')])
+
+    def test_unknown_include_is_refused(self):
+        for value in ('Patient:name', 'Patient', 'Nothing:*'):
+            with self.subTest(include=value), self.assertRaises(ValueError):
+                search_bundle('Patient', [('_include', value)])
+
+
+class EverythingTests(SearchFixture, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        ambulatory = intern_concept(codings=[{'system': 'http://terminology.hl7.org/CodeSystem/v3-ActCode', 'code': 'AMB'}])
+        for fhir_id, patient in (('enc-ana', 'Patient/pat-ana'), ('enc-ben', 'Patient/pat-ben')):
+            Encounter.objects.create(
+                fhir_id=fhir_id, status='completed', class_field=ambulatory,
+                subject=Reference.objects.create(reference=patient),
+            )
+
+    def entries(self, patient_id, **kwargs):
+        bundle = json.loads(''.join(iter_everything(patient_id, **kwargs)))
+        return [(entry['resource']['resourceType'], entry['resource']['id'], entry['search']['mode'])
+                for entry in bundle['entry']]
+
+    def test_compartment_and_references(self):
+        self.assertEqual(self.entries('pat-ana'), [
+            ('Encounter', 'enc-ana', 'match'), ('Patient', 'pat-ana', 'match'), ('Organization', 'org-hospital', 'include'),
+        ])
+
+    def test_type_filter(self):
+        # The patient is no member then, only referenced by its encounter
+        self.assertEqual(self.entries('pat-ana', resource_types=['Encounter']), [
+            ('Encounter', 'enc-ana', 'match'), ('Patient', 'pat-ana', 'include'),
+        ])
+
+    def test_compartment_follows_a_changed_subject(self):
+        subject = Encounter.objects.get(fhir_id='enc-ben').subject
+        subject.reference = 'Patient/pat-ana'
+        subject.save()
+
+        self.assertEqual([entry[1] for entry in self.entries('pat-ana', resource_types=['Encounter'])],
+                         ['enc-ana', 'enc-ben', 'pat-ana'])
+        self.assertEqual(self.entries('pat-ben', resource_types=['Encounter']), [])
+
+    def test_unknown_patient(self):
+        with self.assertRaises(ValueError):
+            list(iter_everything('nobody'))
+
+ENCOUNTER_CLASS = 'http://example.org/CodeSystem/encounter-class'
+
+OUTPATIENT = 'http://example.org/ValueSet/outpatient'
+
+
+@override_settings(FHIR_TERMINOLOGY_PATHS=[], FHIR_TERMINOLOGY_TABLE_SYSTEMS=[])
+class TerminologyTests(TransactionTestCase):
+
+    def setUp(self):
+        reset_terminology()
+        self.terminology = get_terminology()
+        self.terminology.load_resource({
+            'resourceType': 'CodeSystem', 'url': ENCOUNTER_CLASS, 'version': '1', 'content': 'complete',
+            'concept': [
+                {'code': 'AMB', 'display': 'ambulatory'},
+                {'code': 'EMER', 'display': 'emergency'},
+                {'code': 'IMP', 'display': 'inpatient encounter', 'concept': [
+                    {'code': 'ACUTE', 'display': 'inpatient acute', 'designation': [{'value': 'acute stay'}]},
+                ]},
+                {'code': 'FLD', 'display': 'field', 'property': [{'code': 'status', 'valueCode': 'retired'}]},
+            ],
+        })
+        self.load_outpatient(['AMB', 'EMER', 'FLD'])
+        for code in ('AMB', 'EMER', 'ACUTE'):
+            Encounter.objects.create(
+                fhir_id=f'enc-{code.lower()}', status='completed',
+                class_field=intern_concept(codings=[{'system': ENCOUNTER_CLASS, 'code': code}]),
+            )
+
+    def tearDown(self):
+        reset_terminology()
+
+    def load_outpatient(self, codes):
+        self.terminology.load_resource({
+            'resourceType': 'ValueSet', 'url': OUTPATIENT,
+            'compose': {'include': [{'system': ENCOUNTER_CLASS, 'concept': [{'code': code} for code in codes]}]},
+        })
+
+    def ids(self, query):
+        return sorted(search('Encounter', query).values_list('fhir_id', flat=True))
+
+    def test_expansion_skips_inactive_codes(self):
+        expansion = self.terminology.expand(OUTPATIENT)['expansion']
+        self.assertEqual([item['code'] for item in expansion['contains']], ['AMB', 'EMER'])
+        self.assertEqual(self.terminology.expand(ENCOUNTER_CLASS, filter='inpat')['expansion']['total'], 2)
+
+    def test_validate_code(self):
+        self.assertTrue(self.terminology.validate_code('ACUTE', ENCOUNTER_CLASS, 'acute stay').result)
+        for code, display, url in (('NOPE', None, None), ('FLD', None, None), ('AMB', 'walk-in', None),
+                                   ('ACUTE', None, OUTPATIENT)):
+            with self.subTest(code=code, display=display, url=url):
+                self.assertFalse(self.terminology.validate_code(code, ENCOUNTER_CLASS, display, url).result)
+
+    def test_check_coding(self):
+        self.terminology.check_coding('http://example.org/unloaded', 'anything')
+        for code in ('NOPE', 'FLD'):
+            with self.subTest(code=code), self.assertRaises(ValueError):
+                self.terminology.check_coding(ENCOUNTER_CLASS, code)
+
+    def test_in_and_not_in(self):
+        self.assertEqual(self.ids(f'class:in={OUTPATIENT}'), ['enc-amb', 'enc-emer'])
+        self.assertEqual(self.ids(f'class:not-in={OUTPATIENT}'), ['enc-acute'])
+        self.assertEqual(self.ids(f'class:in={ENCOUNTER_CLASS}'), ['enc-acute', 'enc-amb', 'enc-emer'])
+
+    def test_in_restages_a_changed_expansion(self):
+        self.assertEqual(self.ids(f'class:in={OUTPATIENT}'), ['enc-amb', 'enc-emer'])
+        self.load_outpatient(['AMB'])
+
+        self.assertEqual(self.ids(f'class:in={OUTPATIENT}'), ['enc-amb'])
+        self.assertEqual(list(ValueSetMember.objects.filter(value_set=OUTPATIENT).values_list('code', flat=True)), ['AMB'])
+
+    def test_in_unknown_value_set(self):
+        with self.assertRaises(ValueError):
+            search('Encounter', 'class:in=http://example.org/ValueSet/unknown')
+
+
+class HierarchyTests(SearchFixture, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # org-hospital > org-clinic > org-ward
+        self.ward = Organization.objects.create(fhir_id='org-ward', name='Ward 3', partOf=self.clinic)
+
+    def fhir_ids(self, queryset):
+        return sorted(queryset.values_list('fhir_id', flat=True))
+
+    def test_closure(self):
+        self.assertEqual(self.fhir_ids(hierarchy.descendants(Organization, self.hospital.pk)), ['org-clinic', 'org-ward'])
+        self.assertEqual(self.fhir_ids(hierarchy.descendants(Organization, self.hospital.pk, max_depth=1)), ['org-clinic'])
+        self.assertEqual(hierarchy.ancestor_pks(Organization, self.ward.pk), [self.clinic.pk, self.hospital.pk])
+        self.assertEqual(hierarchy.depth(Organization, self.ward.pk), 2)
+
+    def test_loop_is_refused(self):
+        for parent in (self.hospital, self.ward):
+            self.hospital.partOf = parent
+            with self.subTest(parent=parent.fhir_id), self.assertRaises(ValueError):
+                self.hospital.save()
+        self.assertIsNone(Organization.objects.get(pk=self.hospital.pk).partOf_id)
+        self.assertEqual(hierarchy.depth(Organization, self.hospital.pk), 0)
+
+    def test_save_moves_the_subtree(self):
+        self.clinic.partOf = None
+        self.clinic.save()
+
+        self.assertEqual(self.fhir_ids(hierarchy.descendants(Organization, self.hospital.pk)), [])
+        self.assertEqual(hierarchy.ancestor_pks(Organization, self.ward.pk), [self.clinic.pk])
+
+        self.clinic.partOf = self.hospital
+        self.clinic.save()
+        self.assertEqual(hierarchy.ancestor_pks(Organization, self.ward.pk), [self.clinic.pk, self.hospital.pk])
+
+    def test_move(self):
+        self.assertFalse(hierarchy.move(Organization, self.clinic.pk, self.ward.pk))
+        self.assertEqual(hierarchy.depth(Organization, self.ward.pk), 2)
+
+        self.assertTrue(hierarchy.move(Organization, self.ward.pk, self.hospital.pk))
+        self.assertEqual(hierarchy.ancestor_pks(Organization, self.ward.pk), [self.hospital.pk])
+        self.assertTrue(hierarchy.move(Organization, self.clinic.pk, None))
+        self.assertEqual(hierarchy.depth(Organization, self.clinic.pk), 0)
+
+    def test_rebuild_matches_the_synced_rows(self):
+        synced = set(HierarchyClosure.objects.values_list('resource_type', 'ancestor_id', 'descendant_id', 'depth'))
+        hierarchy.rebuild_hierarchy(Organization)
+        rebuilt = set(HierarchyClosure.objects.values_list('resource_type', 'ancestor_id', 'descendant_id', 'depth'))
+        self.assertEqual(rebuilt, synced)
+
+    def test_below_and_above(self):
+        Patient.objects.create(fhir_id='pat-dea', managingOrganization=self.ward)
+
+        self.assertEqual(self.ids('Patient', 'organization:below=Organization/org-clinic'), ['pat-ben', 'pat-dea'])
+        self.assertEqual(self.ids('Patient', 'organization:below=org-hospital'), ['pat-ana', 'pat-ben', 'pat-dea'])
+        self.assertEqual(self.ids('Patient', 'organization:above=Organization/org-clinic'), ['pat-ana', 'pat-ben'])
+        self.assertEqual(self.ids('Organization', 'partof:below=org-clinic'), ['org-ward'])
+        with self.assertRaises(ValueError):
+            self.ids('Patient', 'organization:below=Patient/pat-ana')
+
+
+class ConverterQueryTests(TestCase):
+    """A prefetch plan converts any number of rows in the same number of queries"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Scaled from 40 patients most types would have a single row, whose half is all of it
+        data = SyntheticData(40, seed=7)
+        data.counts = {resource_type: max(count, 6) for resource_type, count in data.counts.items()}
+        ingest_resources(data.resources())
+        data.create_citations()
+
+    def convert(self, model, pks):
+        for instance in prefetch_for_serialization(model.objects.filter(pk__in=pks).order_by('pk')):
+            get_fhir_dict(instance, trusted=True)
+
+    def test_queries_do_not_grow_with_rows(self):
+        for resource_type, model in RESOURCE_MODELS.items():
+            pks = list(model.objects.order_by('pk').values_list('pk', flat=True))
+            with self.subTest(resource_type=resource_type):
+                self.assertGreaterEqual(len(pks), 2)
+                # Half the rows already hold every relation, an empty one would skip its prefetch query
+                with CaptureQueriesContext(connection) as half:
+                    self.convert(model, pks[:max(1, len(pks) // 2)])
+                with self.assertNumQueries(len(half)):
+                    self.convert(model, pks)
+
+    def test_benchmark_counts_the_queries_run(self):
+        model = RESOURCE_MODELS['Encounter']
+        pks = list(model.objects.values_list('pk', flat=True))
+        with CaptureQueriesContext(connection) as plan:
+            self.convert(model, pks)
+
+        result = measure(lambda: self.convert(model, pks), len(pks))
+        self.assertEqual(result['queries'], len(plan))
+        self.assertEqual(result['count'], len(pks))
+
+
+@override_settings(FHIR_RESOURCE_HISTORY=True)
+class ResourceHistoryTests(TransactionTestCase):
+
+    def setUp(self):
+        self.location = Location.objects.create(fhir_id='loc-1', name='Ward A')
+
+    def versions(self):
+        return list(ResourceHistory.objects.filter(fhir_id='loc-1').order_by('version').values_list('version', 'method'))
+
+    def rename(self, *names):
+        for name in names:
+            self.location.name = name
+            self.location.save()
+
+    def test_every_committed_change_is_a_version(self):
+        self.rename('Ward B', 'Ward C')
+
+        self.assertEqual(self.versions(), [(1, 'POST'), (2, 'PUT'), (3, 'PUT')])
+        first = history.vread('Location', 'loc-1', 1)
+        self.assertEqual(first.resource['name'], 'Ward A')
+        self.assertEqual(first.resource['meta']['versionId'], '1')
+        self.assertEqual(history.vread('Location', 'loc-1', '3').resource['name'], 'Ward C')
+        self.assertIsNone(history.vread('Location', 'loc-1', 4))
+        self.assertIsNone(history.vread('Location', 'loc-1', 'latest'))
+
+    def test_a_transaction_is_one_version(self):
+        with transaction.atomic():
+            self.rename('Ward B', 'Ward C')
+
+        self.assertEqual(self.versions(), [(1, 'POST'), (2, 'PUT')])
+        self.assertEqual(history.vread('Location', 'loc-1', 2).resource['name'], 'Ward C')
+
+    def test_rolled_back_change_is_no_version(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.rename('Ward B')
+            raise RuntimeError
+
+        self.assertEqual(self.versions(), [(1, 'POST')])
+
+    def test_delete_is_a_version_without_content(self):
+        with transaction.atomic():
+            history.schedule_delete(self.location)
+            # What the delete collector ends with, without its signals
+            deleted = Location.objects.filter(pk=self.location.pk)
+            deleted._raw_delete(deleted.db)
+
+        self.assertEqual(self.versions(), [(1, 'POST'), (2, 'DELETE')])
+        self.assertIsNone(history.vread('Location', 'loc-1', 2).resource)
+
+    def test_record_missing(self):
+        Location.objects.bulk_create([Location(fhir_id='loc-2', name='Ward B')])
+
+        self.assertEqual(history.record_missing(Location), 1)
+        self.assertEqual(history.record_missing(Location), 0)
+
+    def test_history_pages(self):
+        self.rename('Ward B', 'Ward C')
+        first = history.history_bundle('Location', 'loc-1', '_count=2', base_url='http://fhir.example')
+        self.assertEqual([entry['response']['etag'] for entry in first['entry']], ['W/"3"', 'W/"2"'])
+        self.assertEqual(first['entry'][0]['request'], {'method': 'PUT', 'url': 'Location/loc-1'})
+
+        last = history.history_bundle('Location', 'loc-1', [('_count', '2'), ('_cursor', next_cursor(first))])
+        self.assertEqual([entry['resource']['name'] for entry in last['entry']], ['Ward A'])
+        self.assertEqual(last['entry'][0]['request'], {'method': 'POST', 'url': 'Location'})
+        self.assertIsNone(next_cursor(last))
+
+    def test_type_and_system_history(self):
+        Location.objects.create(fhir_id='loc-2', name='Ward B')
+        self.rename('Ward C')
+
+        names = [entry['resource']['name'] for entry in history.history_bundle('Location')['entry']]
+        self.assertEqual(names, ['Ward C', 'Ward B', 'Ward A'])
+        first = history.history_bundle(query='_count=1')
+        second = history.history_bundle(query=[('_count', '1'), ('_cursor', next_cursor(first))])
+        self.assertEqual([entry['resource']['name'] for entry in first['entry'] + second['entry']], ['Ward C', 'Ward B'])
+
+    def test_since(self):
+        since = timezone.now()
+        self.rename('Ward B')
+
+        bundle = history.history_bundle('Location', 'loc-1', [('_since', since.isoformat())])
+        self.assertEqual([entry['resource']['name'] for entry in bundle['entry']], ['Ward B'])
+
+    def test_invalid_history_queries_are_refused(self):
+        self.rename('Ward B')
+        cursor = next_cursor(history.history_bundle('Location', 'loc-1', '_count=1'))
+        forged = cursor[:-1] + ('A' if cursor[-1] != 'A' else 'B')
+        # A searchset cursor is signed for another purpose
+        for query in ([('_cursor', forged)], [('_cursor', encode_cursor(1))], '_sort=-_lastUpdated', '_count=0'):
+            with self.subTest(query=query), self.assertRaises(ValueError):
+                history.history_bundle('Location', 'loc-1', query)
+
+    def test_version_taken_concurrently_is_retried(self):
+        latest_versions = history._latest_versions
+        reads = []
+
+        def stale_first(resource_type, fhir_ids):
+            reads.append(fhir_ids)
+            # The first read misses the version another transaction has just recorded
+            return {} if len(reads) == 1 else latest_versions(resource_type, fhir_ids)
+
+        with mock.patch.object(history, '_latest_versions', stale_first):
+            self.assertEqual(history.record([(Location, self.location.pk)]), 1)
+
+        self.assertEqual(len(reads), 2)
+        self.assertEqual(self.versions(), [(1, 'POST'), (2, 'PUT')])
+
+    def test_history_is_recorded_before_the_reindex(self):
+        calls = []
+        resources = [(Location, self.location.pk)]
+        with mock.patch.object(history, 'record', lambda resources, deleted: calls.append('history')), \
+                mock.patch.object(search_index, 'index_resources', lambda resources: calls.append('index')):
+            with transaction.atomic():
+                # Registered after the reindex callback, still run ahead of it, once
+                search_index.schedule(resources)
+                history.schedule(resources)
+
+        self.assertEqual(calls, ['history', 'index'])
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('components', '0022_concept_pool'),
+        ('encounter', '0002_encounter_fhir_json'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='encounter',
+            name='class_field',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='encounter_classes', to='components.codeableconcept'),
+        ),
+    ]
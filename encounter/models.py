@@ -113,7 +113,7 @@ class Encounter(DomainResource):
     ])
     
     # Concepts representing classification of patient encounter (1..1 CodeableConcept) - Required
-    class_field = models.ForeignKey('components.CodeableConcept', on_delete=models.CASCADE, related_name='encounter_classes')
+    class_field = models.ForeignKey('components.CodeableConcept', on_delete=models.PROTECT, related_name='encounter_classes')
     
     # Indicates the urgency of the encounter (0..1 CodeableConcept)
     priority = models.ForeignKey('components.CodeableConcept', null=True, blank=True, on_delete=models.SET_NULL, related_name='encounter_priorities')
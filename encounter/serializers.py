@@ -0,0 +1,280 @@
+from django.db.models import Prefetch
+from fhir.resources import encounter
+from components.serializers import (
+    convert_identifier, convert_codeable_concept, convert_period, convert_duration,
+    convert_reference, convert_reference_element, build_fhir_element,
+    codeable_concept_prefetch, identifier_prefetch, reference_prefetch, reference_element_prefetch
+)
+from . import models
+
+
+def convert_codeable_concepts(manager):
+    """Convert the CodeableConcepts of a to-many relation"""
+    concepts = []
+    for concept in manager.all():
+        fhir_concept = convert_codeable_concept(concept)
+        if fhir_concept:
+            concepts.append(fhir_concept)
+    return concepts
+
+
+def convert_reference_elements(manager):
+    """Convert the components.Reference rows of a to-many relation"""
+    references = []
+    for django_reference in manager.all():
+        fhir_reference = convert_reference_element(django_reference)
+        if fhir_reference:
+            references.append(fhir_reference)
+    return references
+
+
+def convert_encounter_participant(django_participant):
+    """Convert Django EncounterParticipant to FHIR Encounter.participant"""
+    if not django_participant:
+        return None
+    
+    data = {}
+    
+    types = convert_codeable_concepts(django_participant.type)
+    if types:
+        data['type'] = types
+    if django_participant.period:
+        data['period'] = convert_period(django_participant.period)
+    if django_participant.actor:
+        data['actor'] = convert_reference_element(django_participant.actor)
+    
+    return build_fhir_element(encounter.EncounterParticipant, data)
+
+
+def convert_encounter_reason(django_reason):
+    """Convert Django EncounterReason to FHIR Encounter.reason"""
+    if not django_reason:
+        return None
+    
+    data = {}
+    
+    uses = convert_codeable_concepts(django_reason.use)
+    if uses:
+        data['use'] = uses
+    # R5 CodeableReference, the stored reasons are concepts
+    values = [{'concept': concept} for concept in convert_codeable_concepts(django_reason.value)]
+    if values:
+        data['value'] = values
+    
+    return build_fhir_element(encounter.EncounterReason, data)
+
+
+def convert_encounter_diagnosis(django_diagnosis):
+    """Convert Django EncounterDiagnosis to FHIR Encounter.diagnosis"""
+    if not django_diagnosis:
+        return None
+    
+    data = {}
+    
+    # R5 CodeableReference, the stored condition is a reference
+    if django_diagnosis.condition:
+        data['condition'] = [{'reference': convert_reference_element(django_diagnosis.condition)}]
+    uses = convert_codeable_concepts(django_diagnosis.use)
+    if uses:
+        data['use'] = uses
+    
+    return build_fhir_element(encounter.EncounterDiagnosis, data)
+
+
+def convert_encounter_admission(django_admission):
+    """Convert Django EncounterAdmission to FHIR Encounter.admission"""
+    if not django_admission:
+        return None
+    
+    data = {}
+    
+    if django_admission.preAdmissionIdentifier:
+        data['preAdmissionIdentifier'] = convert_identifier(django_admission.preAdmissionIdentifier)
+    if django_admission.origin:
+        data['origin'] = convert_reference_element(django_admission.origin)
+    if django_admission.admitSource:
+        data['admitSource'] = convert_codeable_concept(django_admission.admitSource)
+    if django_admission.reAdmission:
+        data['reAdmission'] = convert_codeable_concept(django_admission.reAdmission)
+    if django_admission.destination:
+        data['destination'] = convert_reference_element(django_admission.destination)
+    if django_admission.dischargeDisposition:
+        data['dischargeDisposition'] = convert_codeable_concept(django_admission.dischargeDisposition)
+    
+    return build_fhir_element(encounter.EncounterAdmission, data)
+
+
+def convert_encounter_location(django_location):
+    """Convert Django EncounterLocation to FHIR Encounter.location"""
+    if not django_location:
+        return None
+    
+    data = {
+        'location': convert_reference_element(django_location.location)
+    }
+    
+    if django_location.status:
+        data['status'] = django_location.status
+    if django_location.form:
+        data['form'] = convert_codeable_concept(django_location.form)
+    if django_location.period:
+        data['period'] = convert_period(django_location.period)
+    
+    return build_fhir_element(encounter.EncounterLocation, data)
+
+
+def convert_encounter(django_encounter):
+    """Convert Django Encounter to FHIR Encounter"""
+    if not django_encounter:
+        return None
+    
+    data = {
+        'resourceType': 'Encounter',
+        'id': django_encounter.fhir_id,
+        'status': django_encounter.status,
+        'class': [convert_codeable_concept(django_encounter.class_field)]
+    }
+    
+    # Identifiers
+    identifiers = []
+    for identifier in django_encounter.identifiers.all():
+        fhir_identifier = convert_identifier(identifier)
+        if fhir_identifier:
+            identifiers.append(fhir_identifier)
+    if identifiers:
+        data['identifier'] = identifiers
+    
+    # Classification
+    if django_encounter.priority:
+        data['priority'] = convert_codeable_concept(django_encounter.priority)
+    types = convert_codeable_concepts(django_encounter.type)
+    if types:
+        data['type'] = types
+    service_types = [{'concept': concept} for concept in convert_codeable_concepts(django_encounter.serviceType)]
+    if service_types:
+        data['serviceType'] = service_types
+    
+    # Subject
+    if django_encounter.subject:
+        data['subject'] = convert_reference_element(django_encounter.subject)
+    if django_encounter.subjectStatus:
+        data['subjectStatus'] = convert_codeable_concept(django_encounter.subjectStatus)
+    
+    # References
+    for element in ('episodeOfCare', 'basedOn', 'careTeam', 'appointment', 'account'):
+        references = convert_reference_elements(getattr(django_encounter, element))
+        if references:
+            data[element] = references
+    if django_encounter.partOf_id:
+        data['partOf'] = convert_reference(django_encounter, 'partOf')
+    if django_encounter.serviceProvider:
+        data['serviceProvider'] = convert_reference_element(django_encounter.serviceProvider)
+    
+    # Participants
+    participants = [convert_encounter_participant(participant) for participant in django_encounter.participants.all()]
+    if participants:
+        data['participant'] = participants
+    
+    # Timing, an R4 period is stored separately and stands in for actualPeriod
+    actual_period = django_encounter.actualPeriod or django_encounter.period
+    if actual_period:
+        data['actualPeriod'] = convert_period(actual_period)
+    if django_encounter.plannedStartDate:
+        data['plannedStartDate'] = django_encounter.plannedStartDate.isoformat()
+    if django_encounter.plannedEndDate:
+        data['plannedEndDate'] = django_encounter.plannedEndDate.isoformat()
+    if django_encounter.length:
+        data['length'] = convert_duration(django_encounter.length)
+    
+    # Reasons and diagnoses
+    reasons = [convert_encounter_reason(reason) for reason in django_encounter.reasons.all()]
+    if reasons:
+        data['reason'] = reasons
+    diagnoses = [convert_encounter_diagnosis(diagnosis) for diagnosis in django_encounter.diagnoses.all()]
+    if diagnoses:
+        data['diagnosis'] = diagnoses
+    
+    # Admission, R5 keeps its diet and courtesy elements on the Encounter itself
+    admission = getattr(django_encounter, 'admission', None)
+    if admission:
+        data['admission'] = convert_encounter_admission(admission)
+    for element in ('dietPreference', 'specialArrangement', 'specialCourtesy'):
+        concepts = convert_codeable_concepts(getattr(django_encounter, element))
+        if admission:
+            concepts += convert_codeable_concepts(getattr(admission, element))
+        if concepts:
+            data[element] = concepts
+    
+    # Locations
+    locations = [convert_encounter_location(location) for location in django_encounter.locations.all()]
+    if locations:
+        data['location'] = locations
+    
+    return build_fhir_element(encounter.Encounter, data)
+
+
+def prefetch_encounter_queryset(queryset):
+    """Load every relation convert_encounter walks in a fixed number of queries"""
+    return queryset.select_related(
+        'actualPeriod', 'period', 'length'
+    ).prefetch_related(
+        codeable_concept_prefetch('class_field'),
+        codeable_concept_prefetch('priority'),
+        codeable_concept_prefetch('subjectStatus'),
+        identifier_prefetch('identifiers'),
+        codeable_concept_prefetch('type'),
+        codeable_concept_prefetch('serviceType'),
+        codeable_concept_prefetch('dietPreference'),
+        codeable_concept_prefetch('specialArrangement'),
+        codeable_concept_prefetch('specialCourtesy'),
+        reference_element_prefetch('subject'),
+        reference_element_prefetch('serviceProvider'),
+        reference_element_prefetch('episodeOfCare'),
+        reference_element_prefetch('basedOn'),
+        reference_element_prefetch('careTeam'),
+        reference_element_prefetch('appointment'),
+        reference_element_prefetch('account'),
+        reference_prefetch(models.Encounter, 'partOf'),
+        Prefetch(
+            'participants',
+            queryset=models.EncounterParticipant.objects.select_related('period').prefetch_related(
+                codeable_concept_prefetch('type'),
+                reference_element_prefetch('actor'),
+            )
+        ),
+        Prefetch(
+            'reasons',
+            queryset=models.EncounterReason.objects.prefetch_related(
+                codeable_concept_prefetch('use'),
+                codeable_concept_prefetch('value'),
+            )
+        ),
+        Prefetch(
+            'diagnoses',
+            queryset=models.EncounterDiagnosis.objects.prefetch_related(
+                reference_element_prefetch('condition'),
+                codeable_concept_prefetch('use'),
+            )
+        ),
+        Prefetch(
+            'locations',
+            queryset=models.EncounterLocation.objects.select_related('period').prefetch_related(
+                reference_element_prefetch('location'),
+                codeable_concept_prefetch('form'),
+            )
+        ),
+        Prefetch(
+            'admission',
+            queryset=models.EncounterAdmission.objects.prefetch_related(
+                identifier_prefetch('preAdmissionIdentifier'),
+                reference_element_prefetch('origin'),
+                reference_element_prefetch('destination'),
+                codeable_concept_prefetch('admitSource'),
+                codeable_concept_prefetch('reAdmission'),
+                codeable_concept_prefetch('dischargeDisposition'),
+                codeable_concept_prefetch('dietPreference'),
+                codeable_concept_prefetch('specialArrangement'),
+                codeable_concept_prefetch('specialCourtesy'),
+            )
+        ),
+    )
@@ -8,7 +8,7 @@ class EndpointPayload(BackboneElement):
     # Endpoint this payload belongs to
     endpoint = models.ForeignKey('Endpoint', on_delete=models.CASCADE, related_name='payloads', null=True, blank=True)
     # The type of content that may be used at this endpoint (0..* CodeableConcept)
-    # Note: CodeableConcept has reverse FK to EndpointPayload as 'payload_types'
+    payload_types = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='endpoint_payload_types')
     # Mimetype to send (0..* code)
     mimeType = models.JSONField(null=True, blank=True)  # Array of mime type codes
     
@@ -33,7 +33,7 @@ class Endpoint(DomainResource):
     ])
     
     # Protocol/Profile/Standard to be used with this endpoint connection (1..* CodeableConcept)
-    # Note: CodeableConcept has reverse FK to Endpoint as 'connection_types'
+    connection_types = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='endpoint_connection_types')
     
     # A name that this endpoint can be identified by (0..1 string)
     name = models.CharField(max_length=256, null=True, blank=True)
@@ -42,7 +42,7 @@ class Endpoint(DomainResource):
     description = models.TextField(null=True, blank=True)
     
     # The type of environment(s) exposed at this endpoint (0..* CodeableConcept)
-    # Note: CodeableConcept has reverse FK to Endpoint as 'environment_types'
+    environment_types = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='endpoint_environment_types')
     
     # Organization that manages this endpoint (0..1 Reference(Organization))
     managingOrganization = models.ForeignKey('organization.Organization', null=True, blank=True, on_delete=models.SET_NULL, related_name='managed_endpoints')
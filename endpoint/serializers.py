@@ -1,7 +1,10 @@
+from django.db.models import Prefetch
 from fhir.resources import endpoint
+from components.models import ContactDetail
 from components.serializers import (
     convert_identifier, convert_codeable_concept, convert_contact_point,
-    convert_period
+    convert_period, codeable_concept_prefetch, identifier_prefetch,
+    contact_point_prefetch, reference_prefetch, convert_reference, build_fhir_element
 )
 from . import models
 
@@ -78,8 +81,8 @@ def convert_endpoint(django_endpoint):
         data['environmentType'] = env_types
     
     # Managing organization
-    if django_endpoint.managingOrganization:
-        data['managingOrganization'] = {'reference': f'Organization/{django_endpoint.managingOrganization.fhir_id}'}
+    if django_endpoint.managingOrganization_id:
+        data['managingOrganization'] = convert_reference(django_endpoint, 'managingOrganization')
     
     # Contacts
     contacts = []
@@ -115,4 +118,24 @@ def convert_endpoint(django_endpoint):
     if payloads:
         data['payload'] = payloads
     
-    return endpoint.Endpoint(**data)
\ No newline at end of file
+    return build_fhir_element(endpoint.Endpoint, data)
+
+
+def prefetch_endpoint_queryset(queryset):
+    """Load every relation convert_endpoint walks in a fixed number of queries"""
+    return queryset.select_related('period').prefetch_related(
+        reference_prefetch(models.Endpoint, 'managingOrganization'),
+        identifier_prefetch('identifiers'),
+        codeable_concept_prefetch('connection_types'),
+        codeable_concept_prefetch('environment_types'),
+        Prefetch(
+            'contacts',
+            queryset=ContactDetail.objects.prefetch_related(contact_point_prefetch('telecom_points'))
+        ),
+        Prefetch(
+            'payloads',
+            queryset=models.EndpointPayload.objects.prefetch_related(
+                codeable_concept_prefetch('payload_types')
+            )
+        ),
+    )
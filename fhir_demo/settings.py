@@ -137,5 +137,37 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# FHIR serialization
+# Build plain FHIR dicts/JSON without per-element fhir.resources validation
+FHIR_TRUSTED_OUTPUT = False
+# Fraction (0.0 - 1.0) of trusted output that is still validated in full
+FHIR_VALIDATION_SAMPLE_RATE = 0.0
+
+# Serialized resource cache (core.cache)
+FHIR_CACHE_ENABLED = True
+# In-process LRU tier: max entries and seconds before an entry is re-checked
+FHIR_CACHE_LOCAL_SIZE = 1024
+FHIR_CACHE_LOCAL_TIMEOUT = 30
+# Alias in CACHES of the optional shared tier (e.g. Redis/Memcached), None to disable
+FHIR_CACHE_ALIAS = None
+
+# Keep a pre-rendered FHIR document in each resource row (core.materialize)
+FHIR_MATERIALIZED_JSON = False
+
+# Append a version to ResourceHistory on every change, for vread and _history (core.history)
+FHIR_RESOURCE_HISTORY = False
+
+# CodeSystem and ValueSet files (or directories of them) loaded by core.terminology
+FHIR_TERMINOLOGY_PATHS = []
+# Code systems bulk-loaded into CodeSystemConcept (load_terminology) to index in memory as well
+FHIR_TERMINOLOGY_TABLE_SYSTEMS = []
+
+# FHIR search (core.searchset)
+# Base URL of fullUrl and paging links, e.g. https://fhir.example.org/fhir
+FHIR_BASE_URL = ''
+# Page size when the search has no _count, and the largest _count honoured
+FHIR_SEARCH_PAGE_SIZE = 50
+FHIR_SEARCH_MAX_PAGE_SIZE = 1000
+
 # Custom user model
 # AUTH_USER_MODEL = 'authentication.User'
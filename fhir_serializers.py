@@ -3,13 +3,28 @@ Central FHIR serialization module
 Converts Django models to FHIR resources using fhir.resources library
 """
 
-from organization.serializers import convert_organization
-from endpoint.serializers import convert_endpoint
-from practitioner.serializers import convert_practitioner, convert_practitioner_role
-from healthcareservice.serializers import convert_healthcare_service
-from location.serializers import convert_location
-from patient.serializers import convert_patient, convert_related_person
-from citation.serializers import convert_citation
+import json
+import random
+
+from django.conf import settings
+from django.db.models import QuerySet
+from fhir.resources import construct_fhir_element
+
+from components.serializers import trusted_output
+from organization.serializers import convert_organization, prefetch_organization_queryset
+from endpoint.serializers import convert_endpoint, prefetch_endpoint_queryset
+from practitioner.serializers import (
+    convert_practitioner, convert_practitioner_role,
+    prefetch_practitioner_queryset, prefetch_practitioner_role_queryset
+)
+from healthcareservice.serializers import convert_healthcare_service, prefetch_healthcare_service_queryset
+from location.serializers import convert_location, prefetch_location_queryset
+from patient.serializers import (
+    convert_patient, convert_related_person,
+    prefetch_patient_queryset, prefetch_related_person_queryset
+)
+from citation.serializers import convert_citation, prefetch_citation_queryset
+from encounter.serializers import convert_encounter, prefetch_encounter_queryset
 
 # Import models for type checking
 from organization.models import Organization
@@ -19,6 +34,25 @@ from healthcareservice.models import HealthcareService
 from location.models import Location
 from patient.models import Patient, RelatedPerson
 from citation.models import Citation
+from encounter.models import Encounter
+
+
+# Relation graph of each resource type, applied to querysets before bulk serialization
+PREFETCH_PLANS = {
+    Organization: prefetch_organization_queryset,
+    Endpoint: prefetch_endpoint_queryset,
+    Practitioner: prefetch_practitioner_queryset,
+    PractitionerRole: prefetch_practitioner_role_queryset,
+    HealthcareService: prefetch_healthcare_service_queryset,
+    Location: prefetch_location_queryset,
+    Patient: prefetch_patient_queryset,
+    RelatedPerson: prefetch_related_person_queryset,
+    Citation: prefetch_citation_queryset,
+    Encounter: prefetch_encounter_queryset,
+}
+
+# Supported models keyed by FHIR resourceType
+RESOURCE_MODELS = {model.__name__: model for model in PREFETCH_PLANS}
 
 
 def serialize_to_fhir(django_instance):
@@ -53,47 +87,187 @@ def serialize_to_fhir(django_instance):
         return convert_related_person(django_instance)
     elif isinstance(django_instance, Citation):
         return convert_citation(django_instance)
+    elif isinstance(django_instance, Encounter):
+        return convert_encounter(django_instance)
     else:
         raise ValueError(f"Unsupported model type: {type(django_instance)}")
 
 
-def serialize_queryset_to_fhir(queryset):
+def prefetch_for_serialization(queryset):
+    """
+    Apply the select_related/prefetch_related plan of the queryset's resource type
+    
+    The plan covers every relation the converter walks, down to nested Coding
+    and Period rows, so serializing the queryset costs a fixed number of
+    queries regardless of how many resources it holds.
+    
+    Args:
+        queryset: Django queryset of a supported resource model
+        
+    Returns:
+        Queryset with the relation graph attached
+        
+    Raises:
+        ValueError: If the model type is not supported
+    """
+    plan = PREFETCH_PLANS.get(queryset.model)
+    if plan is None:
+        raise ValueError(f"Unsupported model type: {queryset.model}")
+    return plan(queryset)
+
+
+def serialize_queryset_to_fhir(queryset, prefetch=True):
     """
     Convert a Django queryset to a list of FHIR resources
     
     Args:
         queryset: Django queryset
+        prefetch: Load the resource type's relation graph up front (bulk mode)
         
     Returns:
         List of FHIR resource objects
     """
+    if prefetch and isinstance(queryset, QuerySet):
+        queryset = prefetch_for_serialization(queryset)
     return [serialize_to_fhir(instance) for instance in queryset]
 
 
-def get_fhir_json(django_instance):
+def use_trusted_output(trusted):
+    """Resolve the trusted flag against the FHIR_TRUSTED_OUTPUT setting"""
+    if trusted is None:
+        return getattr(settings, 'FHIR_TRUSTED_OUTPUT', False)
+    return trusted
+
+
+def validate_fhir_dict(data):
+    """
+    Run full fhir.resources validation over a plain FHIR dictionary
+    
+    Args:
+        data: FHIR dictionary with a resourceType key
+        
+    Returns:
+        FHIR resource object from fhir.resources library
+        
+    Raises:
+        pydantic.ValidationError: If the dictionary is not a valid resource
+    """
+    return construct_fhir_element(data['resourceType'], data)
+
+
+def serialize_to_fhir_dict(django_instance):
+    """
+    Convert a Django FHIR model instance straight to a plain FHIR dictionary
+    
+    Skips the per-element fhir.resources models. A FHIR_VALIDATION_SAMPLE_RATE
+    fraction of the results is still validated in full, once, at the top level.
+    
+    Args:
+        django_instance: Django model instance
+        
+    Returns:
+        JSON-compatible dictionary of the FHIR resource
+        
+    Raises:
+        ValueError: If the model type is not supported
+    """
+    with trusted_output():
+        data = serialize_to_fhir(django_instance)
+    
+    sample_rate = getattr(settings, 'FHIR_VALIDATION_SAMPLE_RATE', 0.0)
+    if sample_rate and random.random() < sample_rate:
+        validate_fhir_dict(data)
+    return data
+
+
+def _materialized_or_render(django_instance):
+    """Stored document of the resource (core.materialize) when there is one, else a fresh rendering"""
+    document = getattr(django_instance, 'fhir_json', None)
+    if document is not None and getattr(settings, 'FHIR_MATERIALIZED_JSON', False):
+        return document
+    return serialize_to_fhir_dict(django_instance)
+
+
+def serialize_queryset_to_fhir_dicts(queryset, prefetch=True, trusted=None):
+    """
+    Convert a Django queryset to a list of plain FHIR dictionaries
+    
+    Args:
+        queryset: Django queryset
+        prefetch: Load the resource type's relation graph up front (bulk mode)
+        trusted: Skip per-element validation, defaults to FHIR_TRUSTED_OUTPUT
+        
+    Returns:
+        List of FHIR dictionaries
+    """
+    if prefetch and isinstance(queryset, QuerySet):
+        queryset = prefetch_for_serialization(queryset)
+    return [get_fhir_dict(instance, trusted=trusted) for instance in queryset]
+
+
+def get_fhir_json(django_instance, trusted=None):
     """
     Get FHIR JSON representation of a Django model instance
     
     Args:
         django_instance: Django model instance
+        trusted: Skip per-element validation, defaults to FHIR_TRUSTED_OUTPUT
         
     Returns:
         JSON string of FHIR resource
     """
+    if use_trusted_output(trusted):
+        return json.dumps(_materialized_or_render(django_instance), separators=(',', ':'))
     fhir_resource = serialize_to_fhir(django_instance)
     return fhir_resource.json()
 
 
-def get_fhir_dict(django_instance):
+def get_fhir_jsons(model, pks, trusted=None):
+    """
+    Get FHIR JSON of resources of one model by primary key
+    
+    With trusted output and FHIR_MATERIALIZED_JSON on, the stored documents
+    (core.materialize) are read with one (pk, fhir_json) query and the
+    relation graph is prefetched only for the resources without one.
+    
+    Args:
+        model: Supported resource model
+        pks: Primary keys, those of resources that do not exist are skipped
+        trusted: Skip per-element validation, defaults to FHIR_TRUSTED_OUTPUT
+        
+    Returns:
+        Dict of primary key -> JSON string of the FHIR resource
+    """
+    queryset = model._default_manager.filter(pk__in=list(pks))
+    documents = {}
+    if use_trusted_output(trusted) and getattr(settings, 'FHIR_MATERIALIZED_JSON', False):
+        missing = []
+        for pk, document in queryset.values_list('pk', 'fhir_json'):
+            if document is None:
+                missing.append(pk)
+            else:
+                documents[pk] = json.dumps(document, separators=(',', ':'))
+        if not missing:
+            return documents
+        queryset = model._default_manager.filter(pk__in=missing)
+    for instance in prefetch_for_serialization(queryset):
+        documents[instance.pk] = get_fhir_json(instance, trusted=trusted)
+    return documents
+
+
+def get_fhir_dict(django_instance, trusted=None):
     """
     Get FHIR dictionary representation of a Django model instance
     
     Args:
         django_instance: Django model instance
+        trusted: Skip per-element validation, defaults to FHIR_TRUSTED_OUTPUT
         
     Returns:
         Dictionary representation of FHIR resource
     """
+    if use_trusted_output(trusted):
+        return _materialized_or_render(django_instance)
     fhir_resource = serialize_to_fhir(django_instance)
     return fhir_resource.dict()
 
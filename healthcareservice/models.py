@@ -55,6 +55,30 @@ class HealthcareService(DomainResource):
     # Practitioner roles that provide this healthcare service (0..* Reference(PractitionerRole))
     practitioner_roles = models.ManyToManyField('practitioner.PractitionerRole', blank=True, related_name='healthcare_services')
     
+    # Broad category of service being performed or delivered (0..* CodeableConcept)
+    categories = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='healthcare_service_categories')
+    
+    # Type of service that may be delivered or performed (0..* CodeableConcept)
+    types = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='healthcare_service_types')
+    
+    # Specialties handled by the HealthcareService (0..* CodeableConcept)
+    specialties = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='healthcare_service_specialties')
+    
+    # Conditions under which service is available/offered (0..* CodeableConcept)
+    service_provision_codes = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='healthcare_service_provision_codes')
+    
+    # Programs that this service is applicable to (0..* CodeableConcept)
+    programs = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='healthcare_service_programs')
+    
+    # Collection of characteristics (attributes) (0..* CodeableConcept)
+    characteristics = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='healthcare_service_characteristics')
+    
+    # The language that this service is offered in (0..* CodeableConcept)
+    communications = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='healthcare_service_communications')
+    
+    # Ways that the service accepts referrals (0..* CodeableConcept)
+    referral_methods = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='healthcare_service_referral_methods')
+    
     class Meta:
         db_table = 'healthcare_service'
         indexes = [
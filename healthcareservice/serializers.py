@@ -1,6 +1,9 @@
+from django.db.models import Prefetch
 from fhir.resources import healthcareservice
 from components.serializers import (
-    convert_identifier, convert_codeable_concept, convert_attachment
+    convert_identifier, convert_codeable_concept, convert_attachment,
+    codeable_concept_prefetch, identifier_prefetch, reference_prefetch,
+    convert_reference, convert_references, build_fhir_element
 )
 from . import models
 
@@ -42,8 +45,8 @@ def convert_healthcare_service(django_service):
         data['appointmentRequired'] = django_service.appointmentRequired
     
     # References
-    if django_service.providedBy:
-        data['providedBy'] = {'reference': f'Organization/{django_service.providedBy.fhir_id}'}
+    if django_service.providedBy_id:
+        data['providedBy'] = convert_reference(django_service, 'providedBy')
     
     # Identifiers
     identifiers = []
@@ -82,16 +85,12 @@ def convert_healthcare_service(django_service):
         data['specialty'] = specialties
     
     # Locations
-    locations = []
-    for location in django_service.location.all():
-        locations.append({'reference': f'Location/{location.fhir_id}'})
+    locations = convert_references(django_service.location)
     if locations:
         data['location'] = locations
     
     # Coverage areas
-    coverage_areas = []
-    for area in django_service.coverageArea.all():
-        coverage_areas.append({'reference': f'Location/{area.fhir_id}'})
+    coverage_areas = convert_references(django_service.coverageArea)
     if coverage_areas:
         data['coverageArea'] = coverage_areas
     
@@ -154,17 +153,39 @@ def convert_healthcare_service(django_service):
         data['eligibility'] = eligibilities
     
     # Endpoints
-    endpoints = []
-    for endpoint in django_service.endpoint.all():
-        endpoints.append({'reference': f'Endpoint/{endpoint.fhir_id}'})
+    endpoints = convert_references(django_service.endpoint)
     if endpoints:
         data['endpoint'] = endpoints
     
     # Offered in (self-references)
-    offered_in = []
-    for service in django_service.offeredIn.all():
-        offered_in.append({'reference': f'HealthcareService/{service.fhir_id}'})
+    offered_in = convert_references(django_service.offeredIn)
     if offered_in:
         data['offeredIn'] = offered_in
     
-    return healthcareservice.HealthcareService(**data)
\ No newline at end of file
+    return build_fhir_element(healthcareservice.HealthcareService, data)
+
+
+def prefetch_healthcare_service_queryset(queryset):
+    """Load every relation convert_healthcare_service walks in a fixed number of queries"""
+    return queryset.select_related('photo').prefetch_related(
+        reference_prefetch(models.HealthcareService, 'providedBy'),
+        identifier_prefetch('identifiers'),
+        codeable_concept_prefetch('categories'),
+        codeable_concept_prefetch('types'),
+        codeable_concept_prefetch('specialties'),
+        codeable_concept_prefetch('service_provision_codes'),
+        codeable_concept_prefetch('programs'),
+        codeable_concept_prefetch('characteristics'),
+        codeable_concept_prefetch('communications'),
+        codeable_concept_prefetch('referral_methods'),
+        Prefetch(
+            'eligibilities',
+            queryset=models.HealthcareServiceEligibility.objects.prefetch_related(
+                codeable_concept_prefetch('code')
+            )
+        ),
+        reference_prefetch(models.HealthcareService, 'location'),
+        reference_prefetch(models.HealthcareService, 'coverageArea'),
+        reference_prefetch(models.HealthcareService, 'endpoint'),
+        reference_prefetch(models.HealthcareService, 'offeredIn'),
+    )
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-17 05:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='fhir_json',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.3 on 2026-10-17 06:12
+
+from django.db import migrations, models
+
+
+# Frozen copy of core.geo.encode_geohash as of this migration, later changes there must not alter it
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+BATCH_SIZE = 1000
+
+
+def encode_geohash(latitude, longitude):
+    latitude, longitude = float(latitude), float(longitude)
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < GEOHASH_PRECISION:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def fill_geohash(apps, schema_editor):
+    LocationPosition = apps.get_model('location', 'LocationPosition')
+    positions = LocationPosition.objects.only('latitude', 'longitude').order_by('pk')
+    batch = []
+    for position in positions.iterator(chunk_size=BATCH_SIZE):
+        position.geohash = encode_geohash(position.latitude, position.longitude)
+        batch.append(position)
+        if len(batch) >= BATCH_SIZE:
+            LocationPosition.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    LocationPosition.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0003_location_characteristics_location_forms_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='locationposition',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.RunPython(fill_geohash, migrations.RunPython.noop),
+    ]
@@ -13,6 +13,8 @@ class LocationPosition(BackboneElement):
     latitude = models.DecimalField(max_digits=10, decimal_places=7)
     # Altitude with WGS84 datum (0..1 decimal)
     altitude = models.DecimalField(max_digits=10, decimal_places=3, null=True, blank=True)
+    # Geohash of latitude/longitude for near searches (core.geo), set on save
+    geohash = models.CharField(max_length=12, null=True, blank=True, db_index=True, editable=False)
     
     class Meta:
         db_table = 'location_position'
@@ -43,6 +45,15 @@ class Location(DomainResource):
         ('instance', 'Instance'), ('kind', 'Kind')
     ])
     
+    # Type of function performed (0..* CodeableConcept)
+    types = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='location_types')
+    
+    # Physical form of the location (0..* CodeableConcept)
+    forms = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='location_forms')
+    
+    # Collection of characteristics (attributes) (0..* CodeableConcept)
+    characteristics = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='location_characteristics')
+    
     # Physical location (0..1 Address)
     address = models.ForeignKey('components.Address', null=True, blank=True, on_delete=models.SET_NULL, related_name='locations')
     
@@ -1,6 +1,8 @@
 from fhir.resources import location
 from components.serializers import (
-    convert_identifier, convert_codeable_concept, convert_address
+    convert_identifier, convert_codeable_concept, convert_address,
+    codeable_concept_prefetch, identifier_prefetch, reference_prefetch,
+    convert_reference, convert_references, build_fhir_element
 )
 from . import models
 
@@ -101,18 +103,31 @@ def convert_location(django_location):
         data['position'] = convert_location_position(django_location.position)
     
     # Managing organization
-    if django_location.managingOrganization:
-        data['managingOrganization'] = {'reference': f'Organization/{django_location.managingOrganization.fhir_id}'}
+    if django_location.managingOrganization_id:
+        data['managingOrganization'] = convert_reference(django_location, 'managingOrganization')
     
     # Part of
-    if django_location.partOf:
-        data['partOf'] = {'reference': f'Location/{django_location.partOf.fhir_id}'}
+    if django_location.partOf_id:
+        data['partOf'] = convert_reference(django_location, 'partOf')
     
     # Endpoints
-    endpoints = []
-    for endpoint in django_location.endpoint.all():
-        endpoints.append({'reference': f'Endpoint/{endpoint.fhir_id}'})
+    endpoints = convert_references(django_location.endpoint)
     if endpoints:
         data['endpoint'] = endpoints
     
-    return location.Location(**data)
\ No newline at end of file
+    return build_fhir_element(location.Location, data)
+
+
+def prefetch_location_queryset(queryset):
+    """Load every relation convert_location walks in a fixed number of queries"""
+    return queryset.select_related(
+        'operationalStatus', 'address__period', 'position'
+    ).prefetch_related(
+        reference_prefetch(models.Location, 'managingOrganization'),
+        reference_prefetch(models.Location, 'partOf'),
+        identifier_prefetch('identifiers'),
+        codeable_concept_prefetch('types'),
+        codeable_concept_prefetch('forms'),
+        codeable_concept_prefetch('characteristics'),
+        reference_prefetch(models.Location, 'endpoint'),
+    )
@@ -10,7 +10,7 @@ class OrganizationQualification(BackboneElement):
     # An identifier for this qualification for the organization (0..* Identifier)
     # Note: Use reverse FK from Identifier model
     # Coded representation of the qualification (1..1 CodeableConcept)
-    code = models.ForeignKey('components.CodeableConcept', on_delete=models.CASCADE, related_name='organization_qualifications')
+    code = models.ForeignKey('components.CodeableConcept', on_delete=models.PROTECT, related_name='organization_qualifications')
     # Period during which the qualification is valid (0..1 Period)
     period = models.ForeignKey('components.Period', null=True, blank=True, on_delete=models.SET_NULL, related_name='organization_qualifications')
     # Organization that regulates and issues the qualification (0..1 Reference(Organization))
@@ -28,7 +28,7 @@ class Organization(DomainResource):
     # Whether the organization's record is still in active use (0..1 boolean)
     active = models.BooleanField(null=True, blank=True)
     # Kind of organization (0..* CodeableConcept)
-    # Note: CodeableConcept has reverse FK to Organization as 'org_types'
+    org_types = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='organization_types')
     # Name used for the organization (0..1 string)
     name = models.CharField(max_length=256, null=True, blank=True)
     # A list of alternate names (0..* string)
@@ -1,7 +1,12 @@
+from django.db.models import Prefetch
 from fhir.resources import organization
+from components.models import ContactDetail, ExtendedContactDetail
 from components.serializers import (
     convert_identifier, convert_codeable_concept, convert_contact_point,
-    convert_address, convert_period, convert_human_name
+    convert_address, convert_period, convert_human_name,
+    codeable_concept_prefetch, identifier_prefetch, contact_point_prefetch,
+    human_name_prefetch, reference_prefetch, convert_reference, convert_references,
+    build_fhir_element
 )
 from . import models
 
@@ -16,8 +21,8 @@ def convert_organization_qualification(django_qual):
         data['code'] = convert_codeable_concept(django_qual.code)
     if django_qual.period:
         data['period'] = convert_period(django_qual.period)
-    if django_qual.issuer:
-        data['issuer'] = {'reference': f'Organization/{django_qual.issuer.fhir_id}'}
+    if django_qual.issuer_id:
+        data['issuer'] = convert_reference(django_qual, 'issuer')
     
     # Get identifiers for this qualification
     identifiers = []
@@ -98,8 +103,8 @@ def convert_organization(django_org):
             ext_data['purpose'] = convert_codeable_concept(ext_contact.purpose)
         if ext_contact.address:
             ext_data['address'] = convert_address(ext_contact.address)
-        if ext_contact.organization:
-            ext_data['organization'] = {'reference': f'Organization/{ext_contact.organization.fhir_id}'}
+        if ext_contact.organization_id:
+            ext_data['organization'] = convert_reference(ext_contact, 'organization')
         if ext_contact.period:
             ext_data['period'] = convert_period(ext_contact.period)
         
@@ -135,14 +140,45 @@ def convert_organization(django_org):
         data['qualification'] = qualifications
     
     # Part of
-    if django_org.partOf:
-        data['partOf'] = {'reference': f'Organization/{django_org.partOf.fhir_id}'}
+    if django_org.partOf_id:
+        data['partOf'] = convert_reference(django_org, 'partOf')
     
     # Endpoints
-    endpoints = []
-    for endpoint in django_org.endpoints.all():
-        endpoints.append({'reference': f'Endpoint/{endpoint.fhir_id}'})
+    endpoints = convert_references(django_org.endpoints)
     if endpoints:
         data['endpoint'] = endpoints
     
-    return organization.Organization(**data)
\ No newline at end of file
+    return build_fhir_element(organization.Organization, data)
+
+
+def prefetch_organization_queryset(queryset):
+    """Load every relation convert_organization walks in a fixed number of queries"""
+    return queryset.prefetch_related(
+        reference_prefetch(models.Organization, 'partOf'),
+        identifier_prefetch('identifiers'),
+        codeable_concept_prefetch('org_types'),
+        Prefetch(
+            'contacts',
+            queryset=ContactDetail.objects.prefetch_related(contact_point_prefetch('telecom_points'))
+        ),
+        Prefetch(
+            'extended_contact_details',
+            queryset=ExtendedContactDetail.objects.select_related(
+                'address__period', 'period'
+            ).prefetch_related(
+                reference_prefetch(ExtendedContactDetail, 'organization'),
+                codeable_concept_prefetch('purpose'),
+                human_name_prefetch('names'),
+                contact_point_prefetch('telecom_points'),
+            )
+        ),
+        Prefetch(
+            'qualifications',
+            queryset=models.OrganizationQualification.objects.select_related('period').prefetch_related(
+                reference_prefetch(models.OrganizationQualification, 'issuer'),
+                codeable_concept_prefetch('code'),
+                identifier_prefetch('identifiers'),
+            )
+        ),
+        reference_prefetch(models.Organization, 'endpoints'),
+    )
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('components', '0022_concept_pool'),
+        ('patient', '0003_patientcontact_relationships_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='patientcommunication',
+            name='language',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='patient_communications', to='components.codeableconcept'),
+        ),
+        migrations.AlterField(
+            model_name='relatedpersoncommunication',
+            name='language',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='related_person_communications', to='components.codeableconcept'),
+        ),
+    ]
@@ -7,6 +7,8 @@ class PatientContact(BackboneElement):
     """A contact party for the patient"""
     # Patient this contact belongs to
     patient = models.ForeignKey('Patient', on_delete=models.CASCADE, related_name='contacts', null=True, blank=True)
+    # The kind of relationship (0..* CodeableConcept)
+    relationships = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='patient_contact_relationships')
     # A name associated with the contact person (0..1 HumanName)
     name = models.ForeignKey('components.HumanName', null=True, blank=True, on_delete=models.SET_NULL, related_name='patient_contacts')
     # Address for the contact person (0..1 Address)
@@ -36,7 +38,7 @@ class PatientCommunication(BackboneElement):
     # Patient this communication belongs to
     patient = models.ForeignKey('Patient', on_delete=models.CASCADE, related_name='communications', null=True, blank=True)
     # The language which can be used to communicate (1..1 CodeableConcept)
-    language = models.ForeignKey('components.CodeableConcept', on_delete=models.CASCADE, related_name='patient_communications')
+    language = models.ForeignKey('components.CodeableConcept', on_delete=models.PROTECT, related_name='patient_communications')
     # Language preference indicator (0..1 boolean)
     preferred = models.BooleanField(null=True, blank=True)
     
@@ -128,7 +130,7 @@ class RelatedPersonCommunication(BackboneElement):
     # RelatedPerson this communication belongs to
     related_person = models.ForeignKey('RelatedPerson', on_delete=models.CASCADE, related_name='communications', null=True, blank=True)
     # The language which can be used to communicate (1..1 CodeableConcept)
-    language = models.ForeignKey('components.CodeableConcept', on_delete=models.CASCADE, related_name='related_person_communications')
+    language = models.ForeignKey('components.CodeableConcept', on_delete=models.PROTECT, related_name='related_person_communications')
     # Language preference indicator (0..1 boolean)
     preferred = models.BooleanField(null=True, blank=True)
     
@@ -145,6 +147,9 @@ class RelatedPerson(DomainResource):
     # The patient this person is related to (1..1 Reference(Patient))
     patient = models.ForeignKey('Patient', on_delete=models.CASCADE, related_name='related_persons')
     
+    # The nature of the relationship (0..* CodeableConcept)
+    relationships = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='related_person_relationships')
+    
     # male | female | other | unknown (0..1 code)
     gender = models.CharField(max_length=16, null=True, blank=True, choices=[
         ('male', 'Male'), ('female', 'Female'), ('other', 'Other'), ('unknown', 'Unknown')
@@ -1,7 +1,11 @@
+from django.db.models import Prefetch
 from fhir.resources import patient, relatedperson
 from components.serializers import (
     convert_identifier, convert_codeable_concept, convert_contact_point,
-    convert_human_name, convert_address, convert_attachment, convert_period
+    convert_human_name, convert_address, convert_attachment, convert_period,
+    codeable_concept_prefetch, identifier_prefetch, contact_point_prefetch,
+    human_name_prefetch, address_prefetch, reference_prefetch, convert_reference,
+    convert_references, build_fhir_element
 )
 from . import models
 
@@ -44,8 +48,8 @@ def convert_patient_contact(django_contact):
         data['gender'] = django_contact.gender
     
     # Organization
-    if django_contact.organization:
-        data['organization'] = {'reference': f'Organization/{django_contact.organization.fhir_id}'}
+    if django_contact.organization_id:
+        data['organization'] = convert_reference(django_contact, 'organization')
     
     # Period
     if django_contact.period:
@@ -78,10 +82,10 @@ def convert_patient_link(django_link):
     }
     
     # Other reference (choice type)
-    if django_link.other_patient:
-        data['other'] = {'reference': f'Patient/{django_link.other_patient.fhir_id}'}
-    elif django_link.other_related_person:
-        data['other'] = {'reference': f'RelatedPerson/{django_link.other_related_person.fhir_id}'}
+    if django_link.other_patient_id:
+        data['other'] = convert_reference(django_link, 'other_patient')
+    elif django_link.other_related_person_id:
+        data['other'] = convert_reference(django_link, 'other_related_person')
     
     return data
 
@@ -121,8 +125,8 @@ def convert_patient(django_patient):
         data['maritalStatus'] = convert_codeable_concept(django_patient.maritalStatus)
     
     # Managing organization
-    if django_patient.managingOrganization:
-        data['managingOrganization'] = {'reference': f'Organization/{django_patient.managingOrganization.fhir_id}'}
+    if django_patient.managingOrganization_id:
+        data['managingOrganization'] = convert_reference(django_patient, 'managingOrganization')
     
     # Identifiers
     identifiers = []
@@ -188,13 +192,11 @@ def convert_patient(django_patient):
         data['communication'] = communications
     
     # General practitioners
-    general_practitioners = []
-    for gp in django_patient.generalPractitioner.all():
-        general_practitioners.append({'reference': f'Practitioner/{gp.fhir_id}'})
-    for gp_role in django_patient.generalPractitionerRole.all():
-        general_practitioners.append({'reference': f'PractitionerRole/{gp_role.fhir_id}'})
-    for gp_org in django_patient.generalPractitionerOrg.all():
-        general_practitioners.append({'reference': f'Organization/{gp_org.fhir_id}'})
+    general_practitioners = (
+        convert_references(django_patient.generalPractitioner)
+        + convert_references(django_patient.generalPractitionerRole)
+        + convert_references(django_patient.generalPractitionerOrg)
+    )
     if general_practitioners:
         data['generalPractitioner'] = general_practitioners
     
@@ -207,7 +209,7 @@ def convert_patient(django_patient):
     if links:
         data['link'] = links
     
-    return patient.Patient(**data)
+    return build_fhir_element(patient.Patient, data)
 
 
 def convert_related_person_communication(django_comm):
@@ -243,7 +245,7 @@ def convert_related_person(django_related_person):
         data['birthDate'] = django_related_person.birthDate.isoformat()
     
     # Required patient reference
-    data['patient'] = {'reference': f'Patient/{django_related_person.patient.fhir_id}'}
+    data['patient'] = convert_reference(django_related_person, 'patient')
     
     # Period
     if django_related_person.period:
@@ -312,4 +314,62 @@ def convert_related_person(django_related_person):
     if communications:
         data['communication'] = communications
     
-    return relatedperson.RelatedPerson(**data)
\ No newline at end of file
+    return build_fhir_element(relatedperson.RelatedPerson, data)
+
+
+def prefetch_patient_queryset(queryset):
+    """Load every relation convert_patient walks in a fixed number of queries"""
+    return queryset.prefetch_related(
+        reference_prefetch(models.Patient, 'managingOrganization'),
+        codeable_concept_prefetch('maritalStatus'),
+        identifier_prefetch('identifiers'),
+        human_name_prefetch('names'),
+        contact_point_prefetch('telecom_points'),
+        address_prefetch('addresses'),
+        'photos',
+        Prefetch(
+            'contacts',
+            queryset=models.PatientContact.objects.select_related(
+                'name__period', 'address__period', 'period'
+            ).prefetch_related(
+                reference_prefetch(models.PatientContact, 'organization'),
+                codeable_concept_prefetch('relationships'),
+                contact_point_prefetch('telecom_points'),
+            )
+        ),
+        Prefetch(
+            'communications',
+            queryset=models.PatientCommunication.objects.prefetch_related(
+                codeable_concept_prefetch('language')
+            )
+        ),
+        reference_prefetch(models.Patient, 'generalPractitioner'),
+        reference_prefetch(models.Patient, 'generalPractitionerRole'),
+        reference_prefetch(models.Patient, 'generalPractitionerOrg'),
+        Prefetch(
+            'links',
+            queryset=models.PatientLink.objects.prefetch_related(
+                reference_prefetch(models.PatientLink, 'other_patient'),
+                reference_prefetch(models.PatientLink, 'other_related_person'),
+            )
+        ),
+    )
+
+
+def prefetch_related_person_queryset(queryset):
+    """Load every relation convert_related_person walks in a fixed number of queries"""
+    return queryset.select_related('period').prefetch_related(
+        reference_prefetch(models.RelatedPerson, 'patient'),
+        identifier_prefetch('identifiers'),
+        codeable_concept_prefetch('relationships'),
+        human_name_prefetch('names'),
+        contact_point_prefetch('telecom_points'),
+        address_prefetch('addresses'),
+        'photos',
+        Prefetch(
+            'communications',
+            queryset=models.RelatedPersonCommunication.objects.prefetch_related(
+                codeable_concept_prefetch('language')
+            )
+        ),
+    )
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-17 05:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('practitioner', '0005_practitionerrole_endpoint_practitionerrole_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='practitioner',
+            name='fhir_json',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='practitionerrole',
+            name='fhir_json',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('components', '0022_concept_pool'),
+        ('practitioner', '0007_practitionerrole_characteristics_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='practitionercommunication',
+            name='language',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='practitioner_communications', to='components.codeableconcept'),
+        ),
+        migrations.AlterField(
+            model_name='practitionerqualification',
+            name='code',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='practitioner_qualifications', to='components.codeableconcept'),
+        ),
+    ]
@@ -8,7 +8,7 @@ class PractitionerQualification(BackboneElement):
     # Practitioner this qualification belongs to
     practitioner = models.ForeignKey('Practitioner', on_delete=models.CASCADE, related_name='qualifications', null=True, blank=True)
     # Coded representation of the qualification (1..1 CodeableConcept)
-    code = models.ForeignKey('components.CodeableConcept', on_delete=models.CASCADE, related_name='practitioner_qualifications')
+    code = models.ForeignKey('components.CodeableConcept', on_delete=models.PROTECT, related_name='practitioner_qualifications')
     # Period during which the qualification is valid (0..1 Period)
     period = models.ForeignKey('components.Period', null=True, blank=True, on_delete=models.SET_NULL, related_name='practitioner_qualifications')
     # Organization that regulates and issues the qualification (0..1 Reference(Organization))
@@ -23,7 +23,7 @@ class PractitionerCommunication(BackboneElement):
     # Practitioner this communication belongs to
     practitioner = models.ForeignKey('Practitioner', on_delete=models.CASCADE, related_name='communications', null=True, blank=True)
     # The language code used to communicate with the practitioner (1..1 CodeableConcept)
-    language = models.ForeignKey('components.CodeableConcept', on_delete=models.CASCADE, related_name='practitioner_communications')
+    language = models.ForeignKey('components.CodeableConcept', on_delete=models.PROTECT, related_name='practitioner_communications')
     # Language preference indicator (0..1 boolean)
     preferred = models.BooleanField(null=True, blank=True)
     
@@ -94,12 +94,20 @@ class PractitionerRole(DomainResource):
     # Endpoints for interacting with the practitioner in this role (0..* Reference(Endpoint))
     endpoint = models.ManyToManyField('endpoint.Endpoint', blank=True, related_name='practitioner_roles')
     
+    # Roles which this practitioner may perform (0..* CodeableConcept)
+    codes = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='practitioner_role_codes')
+    
+    # Specific specialty of the practitioner (0..* CodeableConcept)
+    specialties = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='practitioner_role_specialties')
+    
+    # Collection of characteristics (attributes) (0..* CodeableConcept)
+    characteristics = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='practitioner_role_characteristics')
+    
+    # A language the practitioner can use in patient communication (0..* CodeableConcept)
+    communications = models.ManyToManyField('components.CodeableConcept', blank=True, related_name='practitioner_role_communications')
+    
     # Note: Other fields implemented via reverse FK relationships:
     # - identifiers (0..* Identifier) via Identifier.practitioner_role
-    # - codes (0..* CodeableConcept) via CodeableConcept.practitioner_role_code  
-    # - specialties (0..* CodeableConcept) via CodeableConcept.practitioner_role_specialty
-    # - characteristics (0..* CodeableConcept) via CodeableConcept.practitioner_role_characteristic
-    # - communications (0..* CodeableConcept) via CodeableConcept.practitioner_role_communication
     # - contacts (0..* ExtendedContactDetail) via ExtendedContactDetail.practitioner_role
     # - healthcareServices (0..* Reference(HealthcareService)) via HealthcareService.practitioner_roles
     # - availabilities (0..* Availability) via Availability.practitioner_role
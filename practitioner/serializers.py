@@ -1,7 +1,11 @@
+from django.db.models import Prefetch
 from fhir.resources import practitioner, practitionerrole
 from components.serializers import (
     convert_identifier, convert_codeable_concept, convert_contact_point,
-    convert_human_name, convert_address, convert_period, convert_attachment
+    convert_human_name, convert_address, convert_period, convert_attachment,
+    codeable_concept_prefetch, identifier_prefetch, contact_point_prefetch,
+    human_name_prefetch, address_prefetch, reference_prefetch, convert_reference,
+    convert_references, build_fhir_element
 )
 from . import models
 
@@ -16,8 +20,8 @@ def convert_practitioner_qualification(django_qual):
         data['code'] = convert_codeable_concept(django_qual.code)
     if django_qual.period:
         data['period'] = convert_period(django_qual.period)
-    if django_qual.issuer:
-        data['issuer'] = {'reference': f'Organization/{django_qual.issuer.fhir_id}'}
+    if django_qual.issuer_id:
+        data['issuer'] = convert_reference(django_qual, 'issuer')
     
     # Get identifiers for this qualification
     identifiers = []
@@ -133,7 +137,7 @@ def convert_practitioner(django_practitioner):
     if communications:
         data['communication'] = communications
     
-    return practitioner.Practitioner(**data)
+    return build_fhir_element(practitioner.Practitioner, data)
 
 
 def convert_practitioner_role(django_role):
@@ -153,10 +157,10 @@ def convert_practitioner_role(django_role):
         data['period'] = convert_period(django_role.period)
     
     # References
-    if django_role.practitioner:
-        data['practitioner'] = {'reference': f'Practitioner/{django_role.practitioner.fhir_id}'}
-    if django_role.organization:
-        data['organization'] = {'reference': f'Organization/{django_role.organization.fhir_id}'}
+    if django_role.practitioner_id:
+        data['practitioner'] = convert_reference(django_role, 'practitioner')
+    if django_role.organization_id:
+        data['organization'] = convert_reference(django_role, 'organization')
     
     # Identifiers
     identifiers = []
@@ -186,24 +190,56 @@ def convert_practitioner_role(django_role):
         data['specialty'] = specialties
     
     # Locations
-    locations = []
-    for location in django_role.location.all():
-        locations.append({'reference': f'Location/{location.fhir_id}'})
+    locations = convert_references(django_role.location)
     if locations:
         data['location'] = locations
     
     # Healthcare services
-    healthcare_services = []
-    for service in django_role.healthcare_services.all():
-        healthcare_services.append({'reference': f'HealthcareService/{service.fhir_id}'})
+    healthcare_services = convert_references(django_role.healthcare_services)
     if healthcare_services:
         data['healthcareService'] = healthcare_services
     
     # Endpoints
-    endpoints = []
-    for endpoint in django_role.endpoint.all():
-        endpoints.append({'reference': f'Endpoint/{endpoint.fhir_id}'})
+    endpoints = convert_references(django_role.endpoint)
     if endpoints:
         data['endpoint'] = endpoints
     
-    return practitionerrole.PractitionerRole(**data)
\ No newline at end of file
+    return build_fhir_element(practitionerrole.PractitionerRole, data)
+
+
+def prefetch_practitioner_queryset(queryset):
+    """Load every relation convert_practitioner walks in a fixed number of queries"""
+    return queryset.prefetch_related(
+        identifier_prefetch('identifiers'),
+        human_name_prefetch('names'),
+        contact_point_prefetch('telecom_points'),
+        address_prefetch('addresses'),
+        Prefetch(
+            'qualifications',
+            queryset=models.PractitionerQualification.objects.select_related('period').prefetch_related(
+                reference_prefetch(models.PractitionerQualification, 'issuer'),
+                codeable_concept_prefetch('code'),
+                identifier_prefetch('identifiers'),
+            )
+        ),
+        Prefetch(
+            'communications',
+            queryset=models.PractitionerCommunication.objects.prefetch_related(
+                codeable_concept_prefetch('language')
+            )
+        ),
+    )
+
+
+def prefetch_practitioner_role_queryset(queryset):
+    """Load every relation convert_practitioner_role walks in a fixed number of queries"""
+    return queryset.select_related('period').prefetch_related(
+        reference_prefetch(models.PractitionerRole, 'practitioner'),
+        reference_prefetch(models.PractitionerRole, 'organization'),
+        identifier_prefetch('identifiers'),
+        codeable_concept_prefetch('codes'),
+        codeable_concept_prefetch('specialties'),
+        reference_prefetch(models.PractitionerRole, 'location'),
+        reference_prefetch(models.PractitionerRole, 'healthcare_services'),
+        reference_prefetch(models.PractitionerRole, 'endpoint'),
+    )